@@ -0,0 +1,184 @@
+"""
+Извлечение текста DXF по участкам чертежа (P&ID, генпланы)
+
+Текст берется из TEXT/MTEXT и из атрибутов вставок блоков INSERT (номера
+позиций на P&ID обычно хранятся именно в них), в пространстве модели и на
+листах. Надписи группируются по сетке участков отдельно для каждого листа:
+один чанк на участок, с bbox надписей участка в координатах чертежа.
+
+Крупные ASCII DXF читаются потоком через ezdxf.addons.iterdxf (только
+пространство модели, без загрузки всего документа), остальные - целиком
+через ezdxf.readfile.
+"""
+
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Tuple
+
+try:
+    import ezdxf
+    from ezdxf.addons import iterdxf
+    EZDXF_AVAILABLE = True
+except ImportError:
+    EZDXF_AVAILABLE = False
+    logging.warning("ezdxf не установлен, DXF файлы не будут обрабатываться")
+
+logger = logging.getLogger(__name__)
+
+# Файлы больше этого размера читаются потоком, МБ
+STREAM_THRESHOLD_MB = int(os.getenv("DXF_STREAM_THRESHOLD_MB", "20"))
+
+# Сетка участков подбирается так, чтобы на участок приходилось около стольких надписей
+TARGET_ITEMS_PER_TILE = 60
+
+# Максимум участков по каждой оси
+MAX_TILE_GRID = 32
+
+MODEL_LAYOUT = "Model"
+
+
+@dataclass
+class TextItem:
+    """Надпись чертежа с точкой вставки"""
+    layout: str
+    layer: str
+    text: str
+    x: float
+    y: float
+
+
+def extract_dxf_tiles(file_path: str, key_prefix: str = "dxf") -> Dict[str, Any]:
+    """
+    Чанки участков чертежа
+
+    Args:
+        file_path: Путь к файлу DXF
+        key_prefix: Префикс chunk_id, отличающий документ (chunk_id = префикс:лист:участок)
+
+    Returns:
+        {"tiles": чанки участков, "layouts": листы с текстом, "layers": слои с текстом,
+         "extraction_method": "iterdxf" или "readfile"}
+    """
+    if _should_stream(file_path):
+        method = "iterdxf"
+        items = list(_iter_streamed_items(file_path))
+    else:
+        method = "readfile"
+        items = list(_iter_document_items(file_path))
+
+    return {
+        "tiles": build_tiles(items, key_prefix),
+        "layouts": sorted({item.layout for item in items}),
+        "layers": sorted({item.layer for item in items}),
+        "extraction_method": method
+    }
+
+
+def build_tiles(items: List[TextItem], key_prefix: str = "dxf") -> List[Dict[str, Any]]:
+    """Группировка надписей по листам и участкам сетки, надписи участка - в порядке чтения по слоям"""
+    by_layout: Dict[str, List[TextItem]] = {}
+    for item in items:
+        by_layout.setdefault(item.layout, []).append(item)
+
+    chunks = []
+    for layout, layout_items in by_layout.items():
+        min_x = min(item.x for item in layout_items)
+        min_y = min(item.y for item in layout_items)
+        max_x = max(item.x for item in layout_items)
+        max_y = max(item.y for item in layout_items)
+
+        grid = min(MAX_TILE_GRID, max(1, math.ceil(math.sqrt(len(layout_items) / TARGET_ITEMS_PER_TILE))))
+        tile_width = (max_x - min_x) / grid or 1.0
+        tile_height = (max_y - min_y) / grid or 1.0
+
+        tiles: Dict[Tuple[int, int], List[TextItem]] = {}
+        for item in layout_items:
+            column = min(grid - 1, int((item.x - min_x) / tile_width))
+            # Участки нумеруются сверху вниз, как читается лист
+            row = min(grid - 1, int((max_y - item.y) / tile_height))
+            tiles.setdefault((row, column), []).append(item)
+
+        for (row, column), tile_items in sorted(tiles.items()):
+            tile_items.sort(key=lambda item: (-item.y, item.x))
+
+            by_layer: Dict[str, List[str]] = {}
+            for item in tile_items:
+                by_layer.setdefault(item.layer, []).append(item.text)
+
+            lines = [f"Лист {layout}, участок {row + 1}-{column + 1}"]
+            lines.extend(f"{layer}: {'; '.join(texts)}" for layer, texts in by_layer.items())
+
+            chunks.append({
+                "chunk_id": f"{key_prefix}:{layout}:{row}_{column}",
+                "chunk_type": "text",
+                "content": "\n".join(lines),
+                "layout": layout,
+                "layers": list(by_layer),
+                "tile": [row, column],
+                "bbox": [
+                    min(item.x for item in tile_items),
+                    min(item.y for item in tile_items),
+                    max(item.x for item in tile_items),
+                    max(item.y for item in tile_items)
+                ]
+            })
+
+    return chunks
+
+
+def _should_stream(file_path: str) -> bool:
+    if os.path.getsize(file_path) < STREAM_THRESHOLD_MB * 1024 * 1024:
+        return False
+    # iterdxf читает только ASCII DXF
+    with open(file_path, "rb") as f:
+        return not f.read(22).startswith(b"AutoCAD Binary DXF")
+
+
+def _iter_streamed_items(file_path: str) -> Iterator[TextItem]:
+    """Надписи пространства модели без загрузки документа"""
+    doc = iterdxf.opendxf(file_path)
+    try:
+        for entity in doc.modelspace():
+            yield from _entity_items(entity, MODEL_LAYOUT)
+    finally:
+        doc.close()
+
+
+def _iter_document_items(file_path: str) -> Iterator[TextItem]:
+    """Надписи пространства модели и всех листов; у вставок учитываются и постоянные атрибуты блока"""
+    doc = ezdxf.readfile(file_path)
+
+    for layout in [doc.modelspace()] + [doc.layouts.get(name) for name in doc.layouts.names_in_taborder() if name != MODEL_LAYOUT]:
+        for entity in layout:
+            yield from _entity_items(entity, layout.name, doc.blocks)
+
+
+def _entity_items(entity, layout: str, blocks=None) -> Iterator[TextItem]:
+    entity_type = entity.dxftype()
+
+    if entity_type in ("TEXT", "MTEXT"):
+        text = " ".join(entity.plain_text().split())
+        if text:
+            insert = entity.dxf.insert
+            yield TextItem(layout, entity.dxf.layer, text, insert.x, insert.y)
+
+    elif entity_type == "INSERT":
+        attributes = {
+            attrib.dxf.tag: attrib.dxf.text.strip()
+            for attrib in entity.attribs
+            if attrib.dxf.text and attrib.dxf.text.strip()
+        }
+        block = blocks.get(entity.dxf.name) if blocks is not None else None
+        if block is not None:
+            for attdef in block.query("ATTDEF"):
+                if attdef.is_const and attdef.dxf.text and attdef.dxf.text.strip():
+                    attributes.setdefault(attdef.dxf.tag, attdef.dxf.text.strip())
+        values = [f"{tag}={value}" for tag, value in attributes.items()]
+        if values:
+            insert = entity.dxf.insert
+            name = entity.dxf.name
+            # Анонимные блоки (*U12) ничего не говорят о символе
+            label = "; ".join(values) if name.startswith("*") else f"{name}: {'; '.join(values)}"
+            yield TextItem(layout, entity.dxf.layer, label, insert.x, insert.y)
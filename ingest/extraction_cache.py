@@ -0,0 +1,497 @@
+"""
+Общий кэш результатов извлечения текста по содержимому файла
+
+Результат разбора документа сохраняется по SHA-256 его байтов, поэтому один
+и тот же PDF, пришедший в чат, в архив, в ingest или на исходящий контроль,
+разбирается (и, главное, распознается OCR) один раз. Хранилище — локальный
+каталог (общий том) или bucket MinIO, размер ограничен: при превышении
+удаляются самые давно использованные записи.
+
+Запись PDF (вид "pdf") накапливается разными сервисами:
+    pages        — [[номер страницы, текст]] текстового слоя
+    page_count   — количество страниц
+    page_sizes   — [[ширина, высота]] страниц в пунктах
+    text_method  — "pdfplumber", "pypdf2" или "none"
+    metadata     — title/author/creator
+    tables       — [{"page", "table", "data", "bbox"}], нет ключа — таблицы не извлекались
+    ocr_pages    — [[номер страницы, текст]] OCR, нет ключа — OCR не выполнялся
+
+Настройки окружения:
+    EXTRACTION_CACHE_BACKEND — disk (по умолчанию), minio или none
+    EXTRACTION_CACHE_DIR     — каталог кэша на диске
+    EXTRACTION_CACHE_BUCKET  — bucket MinIO (по умолчанию extraction-cache)
+    EXTRACTION_CACHE_MAX_MB  — предельный размер кэша (по умолчанию 2048)
+
+Потребители получают документ постранично через iter_pdf_pages: для
+распознанных страниц текст берется из OCR, для остальных — из текстового слоя.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Меняется при несовместимом изменении формата записей
+EXTRACTION_CACHE_VERSION = 2
+
+# После превышения лимита кэш очищается до этой доли от него
+EVICTION_TARGET_RATIO = 0.9
+
+@dataclass
+class PDFPage:
+    """Страница PDF: текст, таблицы и геометрия"""
+    page_number: int
+    text: str
+    tables: List[Dict[str, Any]] = field(default_factory=list)
+    bbox: Optional[List[float]] = None  # [x0, top, x1, bottom] страницы в пунктах
+    ocr: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def sha256_bytes(data: bytes) -> str:
+    """SHA-256 содержимого"""
+    return hashlib.sha256(data).hexdigest()
+
+def sha256_file(path: Union[str, Path], chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 файла, читаемого частями"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def render_pages(pages: Iterable[Tuple[int, str]], page_header: str) -> str:
+    """Текст страниц с заголовками вида page_header.format(page=номер)"""
+    return "".join(page_header.format(page=page_number) + text for page_number, text in pages)
+
+def render_pdf_pages(pages: Iterable[PDFPage], page_header: str, ocr_page_header: str) -> str:
+    """Текст страниц PDF одним join, распознанные OCR страницы — со своим заголовком"""
+    return "".join(
+        (ocr_page_header if page.ocr else page_header).format(page=page.page_number) + page.text
+        for page in pages
+        if page.text
+    )
+
+def iter_pdf_pages(record: Dict[str, Any]) -> Iterator[PDFPage]:
+    """
+    Ленивый обход страниц записи PDF по порядку
+
+    Текст распознанной OCR страницы берется из OCR (распознаются только
+    страницы без полноценного текстового слоя), остальных — из текстового
+    слоя. Страницы без текста и таблиц пропускаются.
+    """
+    text_pages = {page_number: text for page_number, text in record.get("pages", [])}
+    ocr_pages = {page_number: text for page_number, text in record.get("ocr_pages", [])}
+    page_sizes = record.get("page_sizes") or []
+    page_tables: Dict[int, List[Dict[str, Any]]] = {}
+    for table in record.get("tables") or []:
+        page_tables.setdefault(table["page"], []).append(table)
+
+    page_count = max([record.get("page_count", 0), *text_pages, *ocr_pages, *page_tables])
+    for page_number in range(1, page_count + 1):
+        ocr = page_number in ocr_pages
+        text = ocr_pages[page_number] if ocr else text_pages.get(page_number)
+        tables = page_tables.get(page_number, [])
+        if not text and not tables:
+            continue
+
+        bbox = None
+        if page_number <= len(page_sizes):
+            width, height = page_sizes[page_number - 1]
+            bbox = [0.0, 0.0, width, height]
+        yield PDFPage(page_number=page_number, text=text or "", tables=tables, bbox=bbox, ocr=ocr)
+
+def extract_pdf_layers(source: Union[str, bytes], with_tables: bool = False) -> Dict[str, Any]:
+    """
+    Текстовый слой, таблицы и метаданные PDF без OCR
+
+    Текст извлекается pdfplumber, если он ничего не дал — PyPDF2. Функция
+    уровня модуля, чтобы ее можно было выполнять в пуле процессов.
+
+    Args:
+        source: Путь к PDF или его содержимое
+        with_tables: Извлекать таблицы pdfplumber
+
+    Returns:
+        Поля записи PDF: pages, page_count, page_sizes, text_method, metadata и tables (если with_tables)
+    """
+    import pdfplumber
+    import PyPDF2
+
+    def open_source():
+        return io.BytesIO(source) if isinstance(source, bytes) else source
+
+    pages: List[Tuple[int, str]] = []
+    tables: List[Dict[str, Any]] = []
+    page_sizes: List[List[float]] = []
+    page_count = 0
+    text_method = "none"
+    metadata = {"title": "", "author": "", "creator": ""}
+
+    try:
+        with pdfplumber.open(open_source()) as pdf:
+            page_count = len(pdf.pages)
+            for page_number, page in enumerate(pdf.pages, start=1):
+                page_sizes.append([float(page.width), float(page.height)])
+                page_text = page.extract_text()
+                if page_text and page_text.strip():
+                    pages.append((page_number, page_text))
+                if with_tables:
+                    for table_number, table in enumerate(page.find_tables(), start=1):
+                        data = table.extract()
+                        if data:
+                            tables.append({
+                                "page": page_number,
+                                "table": table_number,
+                                "data": data,
+                                "bbox": [float(value) for value in table.bbox]
+                            })
+                page.flush_cache()
+        if pages:
+            text_method = "pdfplumber"
+    except Exception as e:
+        logger.warning(f"pdfplumber не смог извлечь текст: {e}, используем PyPDF2")
+        pages = []
+
+    try:
+        reader = PyPDF2.PdfReader(open_source())
+        page_count = page_count or len(reader.pages)
+        if reader.metadata:
+            metadata = {
+                "title": reader.metadata.get("/Title", "") or "",
+                "author": reader.metadata.get("/Author", "") or "",
+                "creator": reader.metadata.get("/Creator", "") or "",
+            }
+
+        if not pages:
+            page_sizes = []
+            for page_number, page in enumerate(reader.pages, start=1):
+                page_sizes.append([float(page.mediabox.width), float(page.mediabox.height)])
+                try:
+                    page_text = page.extract_text()
+                except Exception as e:
+                    logger.warning(f"PyPDF2 не смог извлечь текст страницы {page_number}: {e}")
+                    continue
+                if page_text and page_text.strip():
+                    pages.append((page_number, page_text))
+            if pages:
+                text_method = "pypdf2"
+    except Exception as e:
+        logger.warning(f"PyPDF2 не смог прочитать PDF: {e}")
+
+    result = {
+        "pages": [list(page) for page in pages],
+        "page_count": page_count,
+        "page_sizes": page_sizes,
+        "text_method": text_method,
+        "metadata": metadata,
+    }
+    if with_tables:
+        result["tables"] = tables
+    return result
+
+class CacheBackend:
+    """
+    Хранилище записей с ограничением размера
+
+    Размер отслеживается приблизительно: точный пересчитывается
+    сканированием при первой записи и при превышении лимита, поэтому
+    несколько процессов могут делить одно хранилище.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+        self._size_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _write(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """Записи хранилища: (время последнего использования, размер, ключ)"""
+        raise NotImplementedError
+
+    def _remove(self, key: str):
+        raise NotImplementedError
+
+    def put(self, key: str, data: bytes):
+        self._write(key, data)
+        with self._size_lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Удаление самых давно использованных записей до EVICTION_TARGET_RATIO лимита"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        removed = 0
+
+        for _, size, key in entries:
+            if total <= target:
+                break
+            try:
+                self._remove(key)
+                removed += 1
+            except Exception as e:
+                logger.warning(f"Не удалось удалить запись кэша извлечения {key}: {e}")
+                continue
+            total -= size
+
+        self._size = total
+        if removed:
+            logger.info(f"🧹 Кэш извлечения: удалено {removed} записей, размер {total / (1024 * 1024):.1f}MB")
+
+class DiskCacheBackend(CacheBackend):
+    """Записи в локальном каталоге, время использования — mtime файла"""
+
+    def __init__(self, root: Union[str, Path], max_bytes: int):
+        super().__init__(max_bytes)
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.root / key
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, key: str, data: bytes):
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Атомарная замена: параллельные читатели не увидят недописанный файл
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.relpath(path, self.root)))
+        return entries
+
+    def _remove(self, key: str):
+        try:
+            os.unlink(self.root / key)
+        except FileNotFoundError:
+            pass
+
+class MinIOCacheBackend(CacheBackend):
+    """
+    Записи в bucket MinIO
+
+    Чтение не обновляет время объекта, поэтому вытесняются записи,
+    сохраненные раньше остальных.
+    """
+
+    def __init__(self, client: Any, bucket: str, max_bytes: int):
+        super().__init__(max_bytes)
+        self.client = client
+        self.bucket = bucket
+        if not self.client.bucket_exists(self.bucket):
+            self.client.make_bucket(self.bucket)
+
+    def get(self, key: str) -> Optional[bytes]:
+        from minio.error import S3Error
+
+        try:
+            response = self.client.get_object(self.bucket, key)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def _write(self, key: str, data: bytes):
+        self.client.put_object(self.bucket, key, io.BytesIO(data), len(data), content_type="application/gzip")
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        return [
+            (obj.last_modified.timestamp() if obj.last_modified else 0.0, obj.size or 0, obj.object_name)
+            for obj in self.client.list_objects(self.bucket, recursive=True)
+        ]
+
+    def _remove(self, key: str):
+        self.client.remove_object(self.bucket, key)
+
+class ExtractionCache:
+    """
+    Кэш результатов извлечения по SHA-256 содержимого
+
+    Ошибки хранилища не прерывают разбор: запись считается отсутствующей,
+    в лог пишется предупреждение. Без хранилища кэш отключен.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None):
+        self.backend = backend
+        self._update_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ExtractionCache":
+        """Кэш с хранилищем из переменных окружения EXTRACTION_CACHE_*"""
+        backend_name = os.getenv("EXTRACTION_CACHE_BACKEND", "disk").lower()
+        max_bytes = int(float(os.getenv("EXTRACTION_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+        if backend_name == "none":
+            return cls()
+
+        if backend_name == "minio":
+            try:
+                from minio import Minio
+
+                client = Minio(
+                    os.getenv("MINIO_ENDPOINT", "localhost:9000"),
+                    access_key=os.getenv("MINIO_ACCESS_KEY", "minioadmin"),
+                    secret_key=os.getenv("MINIO_SECRET_KEY", "minioadmin123"),
+                    secure=os.getenv("MINIO_SECURE", "false").lower() == "true"
+                )
+                bucket = os.getenv("EXTRACTION_CACHE_BUCKET", "extraction-cache")
+                return cls(MinIOCacheBackend(client, bucket, max_bytes))
+            except Exception as e:
+                logger.warning(f"MinIO для кэша извлечения недоступен ({e}), используем локальный каталог")
+
+        root = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "extraction_cache"))
+        try:
+            return cls(DiskCacheBackend(root, max_bytes))
+        except OSError as e:
+            logger.warning(f"Каталог кэша извлечения {root} недоступен ({e}), кэш отключен")
+            return cls()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def _key(content_hash: str, kind: str) -> str:
+        return f"{kind}/v{EXTRACTION_CACHE_VERSION}/{content_hash[:2]}/{content_hash}.json.gz"
+
+    async def get(self, content_hash: str, kind: str = "pdf") -> Optional[Dict[str, Any]]:
+        """Запись для содержимого или None"""
+        if self.backend is None:
+            return None
+
+        def load():
+            data = self.backend.get(self._key(content_hash, kind))
+            return None if data is None else json.loads(gzip.decompress(data))
+
+        try:
+            return await asyncio.to_thread(load)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша извлечения {content_hash[:12]}: {e}")
+            return None
+
+    async def put(self, content_hash: str, record: Dict[str, Any], kind: str = "pdf"):
+        """Сохранение (замена) записи для содержимого"""
+        if self.backend is None:
+            return
+
+        def store():
+            self.backend.put(self._key(content_hash, kind), _encode_record(record))
+
+        try:
+            await asyncio.to_thread(store)
+        except Exception as e:
+            logger.warning(f"Ошибка записи кэша извлечения {content_hash[:12]}: {e}")
+
+    async def update(self, content_hash: str, fields: Dict[str, Any], kind: str = "pdf"):
+        """
+        Дополнение записи полями
+
+        Запись перечитывается непосредственно перед сохранением, поэтому поля,
+        добавленные за это время другим сервисом (таблицы, ocr_pages), не теряются.
+        """
+        if self.backend is None:
+            return
+
+        def store():
+            key = self._key(content_hash, kind)
+            with self._update_lock:
+                data = self.backend.get(key)
+                record = {} if data is None else json.loads(gzip.decompress(data))
+                record.update(fields)
+                self.backend.put(key, _encode_record(record))
+
+        try:
+            await asyncio.to_thread(store)
+        except Exception as e:
+            logger.warning(f"Ошибка записи кэша извлечения {content_hash[:12]}: {e}")
+
+    async def load_pdf(
+        self,
+        content_hash: str,
+        source: Union[str, bytes],
+        with_tables: bool = False,
+        runner: Optional[Callable[..., Awaitable[Any]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Запись PDF с текстовым слоем (и таблицами), извлекаемым при промахе
+
+        OCR здесь не выполняется: поле ocr_pages дополняют сервисы, которые
+        умеют распознавать, через update.
+
+        Args:
+            content_hash: SHA-256 содержимого PDF
+            source: Путь к PDF или его содержимое
+            with_tables: Нужны таблицы (при их отсутствии в записи PDF разбирается заново)
+            runner: Исполнитель вида runner(func, *args) (по умолчанию поток)
+
+        Returns:
+            Запись PDF
+        """
+        record = await self.get(content_hash) or {}
+        if "pages" in record and (not with_tables or "tables" in record):
+            logger.info(f"♻️ Текст PDF {content_hash[:12]} взят из кэша извлечения")
+            return record
+
+        if runner is None:
+            layers = await asyncio.to_thread(extract_pdf_layers, source, with_tables)
+        else:
+            layers = await runner(extract_pdf_layers, source, with_tables)
+        record.update(layers)
+        await self.update(content_hash, layers)
+        return record
+
+def _encode_record(record: Dict[str, Any]) -> bytes:
+    return gzip.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"), compresslevel=6)
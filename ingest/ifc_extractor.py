@@ -0,0 +1,230 @@
+"""
+Потоковое извлечение объектов IFC (модели установок 1-3 ГБ)
+
+Свойства объектов берутся из обратного индекса, построенного за один проход
+по IfcRelDefinesByProperties и IfcRelDefinesByType, а не обходом IsDefinedBy
+у каждого объекта. Наборы свойств, общие для многих объектов (свойства
+типов), разбираются один раз.
+
+ifcopenshell загружает модель в память целиком, поэтому разбор идет в
+отдельном процессе с ограничением памяти (RLIMIT_AS): модель, не
+помещающаяся в лимит, завершается ошибкой этого файла, а не всего пода.
+Объекты передаются в вызывающий процесс пакетами через очередь
+ограниченного размера, по одному чанку на объект.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import ifcopenshell
+    IFC_AVAILABLE = True
+except ImportError:
+    IFC_AVAILABLE = False
+    logging.warning("ifcopenshell не установлен, IFC файлы не будут обрабатываться")
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Объектов в одном пакете
+DEFAULT_BATCH_SIZE = 500
+
+# Предел памяти процесса разбора, МБ
+DEFAULT_MEMORY_LIMIT_MB = int(os.getenv("IFC_MEMORY_LIMIT_MB", "8192"))
+
+# Пакетов в очереди между процессом разбора и вызывающим
+QUEUE_SIZE = 4
+
+# Наборов свойств в кэше разобранных значений
+PSET_CACHE_SIZE = 8192
+
+# Свойств одного объекта в тексте чанка
+MAX_CONTENT_PROPERTIES = 100
+
+SCHEMA_PATTERN = re.compile(r"FILE_SCHEMA\s*\(\s*\(\s*'([^']+)'", re.IGNORECASE)
+
+
+def read_ifc_schema(file_path: str) -> Optional[str]:
+    """Схема IFC (IFC2X3, IFC4) из заголовка файла без загрузки модели"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            match = SCHEMA_PATTERN.search(line)
+            if match:
+                return match.group(1)
+            if line.strip().upper().startswith("DATA;"):
+                break
+    return None
+
+
+def iter_ifc_elements(file_path: str, key_prefix: str = "ifc", batch_size: int = DEFAULT_BATCH_SIZE,
+                      memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Пакеты чанков объектов IFC (IfcProduct), по одному чанку на объект
+
+    Args:
+        file_path: Путь к файлу IFC
+        key_prefix: Префикс chunk_id, отличающий документ (chunk_id = префикс:GlobalId)
+        batch_size: Объектов в пакете
+        memory_limit_mb: Предел памяти процесса разбора (0 - без ограничения)
+
+    Returns:
+        Итератор пакетов чанков с ifc_type, ifc_guid, name и properties
+    """
+    if not IFC_AVAILABLE:
+        logger.warning(f"ifcopenshell недоступен, пропускаем IFC: {file_path}")
+        return
+
+    context = multiprocessing.get_context("spawn")
+    batches = context.Queue(maxsize=QUEUE_SIZE)
+    process = context.Process(
+        target=_extract_worker,
+        args=(file_path, key_prefix, batch_size, memory_limit_mb, batches),
+        name="ifc-extractor"
+    )
+    process.start()
+
+    try:
+        while True:
+            try:
+                item = batches.get(timeout=5)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Разбор IFC {file_path} прерван (код завершения {process.exitcode})")
+                continue
+
+            if item is None:
+                break
+            if isinstance(item, str):
+                raise RuntimeError(f"Ошибка разбора IFC {file_path}: {item}")
+            yield item
+    finally:
+        # Вызывающий прекратил чтение или разбор завершился: процесс не должен пережить генератор
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        batches.close()
+
+
+def _extract_worker(file_path: str, key_prefix: str, batch_size: int, memory_limit_mb: int, batches):
+    """Разбор модели в отдельном процессе: пакеты чанков, затем None; при ошибке - текст ошибки"""
+    if memory_limit_mb and RESOURCE_AVAILABLE:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    try:
+        model = ifcopenshell.open(file_path)
+        pending = []
+        for chunk in _iter_element_chunks(model, key_prefix):
+            pending.append(chunk)
+            if len(pending) >= batch_size:
+                batches.put(pending)
+                pending = []
+        if pending:
+            batches.put(pending)
+        batches.put(None)
+    except MemoryError:
+        batches.put(f"модель не помещается в {memory_limit_mb} МБ")
+    except Exception as e:
+        batches.put(str(e) or type(e).__name__)
+
+
+def _iter_element_chunks(model, key_prefix: str) -> Iterator[Dict[str, Any]]:
+    property_sets = build_property_index(model)
+
+    @lru_cache(maxsize=PSET_CACHE_SIZE)
+    def pset_properties(pset_id: int) -> Dict[str, Any]:
+        return _read_property_set(model.by_id(pset_id))
+
+    for element in model.by_type("IfcProduct"):
+        properties: Dict[str, Any] = {}
+        for pset_id in property_sets.get(element.id(), ()):
+            properties.update(pset_properties(pset_id))
+
+        ifc_type = element.is_a()
+        name = element.Name or ""
+        lines = [f"Тип: {ifc_type}"]
+        if name:
+            lines.append(f"Имя: {name}")
+        if getattr(element, "ObjectType", None):
+            lines.append(f"Тип объекта: {element.ObjectType}")
+        if element.Description:
+            lines.append(f"Описание: {element.Description}")
+        lines.extend(
+            f"{key}: {value}"
+            for key, value in list(properties.items())[:MAX_CONTENT_PROPERTIES]
+        )
+
+        yield {
+            "chunk_id": f"{key_prefix}:{element.GlobalId}",
+            "chunk_type": "ifc",
+            "content": "\n".join(lines),
+            "ifc_type": ifc_type,
+            "ifc_guid": element.GlobalId,
+            "name": name,
+            "properties": properties
+        }
+
+
+def build_property_index(model) -> Dict[int, List[int]]:
+    """
+    Обратный индекс: id объекта -> id его наборов свойств
+
+    Один проход по связям IfcRelDefinesByProperties (свойства объекта)
+    и IfcRelDefinesByType (свойства типа объекта, общие для всех
+    экземпляров). Свойства типа идут первыми, чтобы собственные свойства
+    объекта их перекрывали.
+    """
+    index: Dict[int, List[int]] = {}
+
+    for rel in model.by_type("IfcRelDefinesByType"):
+        type_psets = [pset.id() for pset in (rel.RelatingType.HasPropertySets or ())]
+        if type_psets:
+            for element in rel.RelatedObjects:
+                index.setdefault(element.id(), []).extend(type_psets)
+
+    for rel in model.by_type("IfcRelDefinesByProperties"):
+        definition = rel.RelatingPropertyDefinition
+        # В IFC4 definition может быть набором (IfcPropertySetDefinitionSet)
+        pset_ids = [pset.id() for pset in definition] if isinstance(definition, tuple) else [definition.id()]
+        for element in rel.RelatedObjects:
+            index.setdefault(element.id(), []).extend(pset_ids)
+
+    return index
+
+
+def _read_property_set(pset) -> Dict[str, Any]:
+    """Значения набора свойств или количеств с ключами "Набор.Свойство" """
+    properties: Dict[str, Any] = {}
+    prefix = pset.Name or pset.is_a()
+
+    if pset.is_a("IfcPropertySet"):
+        for prop in pset.HasProperties:
+            value = _property_value(prop)
+            if value is not None:
+                properties[f"{prefix}.{prop.Name}"] = value
+    elif pset.is_a("IfcElementQuantity"):
+        for quantity in pset.Quantities:
+            # У IfcPhysicalSimpleQuantity значение - четвертый атрибут (LengthValue, AreaValue, ...)
+            if quantity.is_a("IfcPhysicalSimpleQuantity") and quantity[3] is not None:
+                properties[f"{prefix}.{quantity.Name}"] = quantity[3]
+
+    return properties
+
+
+def _property_value(prop) -> Any:
+    if prop.is_a("IfcPropertySingleValue"):
+        return prop.NominalValue.wrappedValue if prop.NominalValue else None
+    if prop.is_a("IfcPropertyEnumeratedValue"):
+        values = [value.wrappedValue for value in (prop.EnumerationValues or ())]
+        return ", ".join(str(value) for value in values) or None
+    return None
@@ -12,8 +12,10 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent))
 
 from pipeline.parser import DocumentParser
+from text_chunker import TextChunker
 from pipeline.vectorizer import DocumentVectorizer
 from rag.service.hybrid_search import HybridSearchService
+from model_registry import warm_up
 
 # Настройка логирования
 logging.basicConfig(
@@ -28,14 +30,19 @@ async def main():
     
     logger.info("🚀 Запуск ingest системы...")
     
+    parser = None
     try:
         # Инициализация компонентов
         logger.info("Инициализация компонентов...")
         
         parser = DocumentParser()
+        chunker = TextChunker()
         vectorizer = DocumentVectorizer()
         search_service = HybridSearchService()
         
+        # BGE-M3 у векторизатора и поиска общий; модели грузятся в фоне, пока создаются коллекции
+        warm_up()
+        
         # Создание коллекций в Qdrant
         logger.info("Создание коллекций в Qdrant...")
         await vectorizer.ensure_collections_exist()
@@ -81,13 +88,60 @@ async def main():
         # Векторизация
         logger.info("Векторизация документов...")
         for doc in parsed_documents:
-            chunks = [{
-                "chunk_id": f"chunk_{doc['file_path']}",
-                "content": doc["content"],
-                **doc["metadata"]
-            }]
+            # Чертежи DXF режутся по участкам листа, bbox участка попадает в payload
+            if doc.get("tiles"):
+                chunks = [
+                    {
+                        "chunk_id": tile["chunk_id"],
+                        "content": tile["content"],
+                        "section": tile["layout"],
+                        "bbox": tile["bbox"],
+                        "source_hash": doc.get("file_hash", ""),
+                        **doc["metadata"]
+                    }
+                    for tile in doc["tiles"]
+                ]
+            else:
+                # Распознанные страницы режутся по одной, номер страницы попадает в payload
+                if doc.get("pages"):
+                    chunk_iter = chunker.iter_page_chunks(
+                        ((page["page_number"], page["text"]) for page in doc["pages"] if page["text"]),
+                        doc["file_hash"]
+                    )
+                else:
+                    chunk_iter = chunker.iter_chunks(doc["content"], doc.get("file_hash"))
+                
+                chunks = [
+                    {
+                        "chunk_id": chunk.chunk_id,
+                        "content": chunk.text,
+                        "section": chunk.section,
+                        "page": chunk.page,
+                        "source_hash": doc.get("file_hash", ""),
+                        **doc["metadata"]
+                    }
+                    for chunk in chunk_iter
+                ]
+            
+            await vectorizer.sync_document_chunks(chunks, "ae_text_m3", doc["file_path"])
+            
+            # Строки таблиц читаются потоком и попадают в ae_tables по одной на чанк
+            if doc.get("sheets"):
+                row_chunks = (
+                    {**chunk, "source_hash": doc.get("file_hash", ""), **doc["metadata"], "chunk_type": "table"}
+                    for batch in parser.iter_table_chunks(doc["file_path"])
+                    for chunk in batch
+                )
+                await vectorizer.sync_document_chunks(row_chunks, "ae_tables", doc["file_path"])
             
-            await vectorizer.vectorize_chunks(chunks, "ae_text_m3")
+            # Объекты IFC читаются потоком и попадают в ae_ifc по одному на чанк
+            if doc.get("ifc_schema"):
+                element_chunks = (
+                    {**chunk, "source_hash": doc.get("file_hash", ""), **doc["metadata"], "chunk_type": "ifc"}
+                    for batch in parser.iter_ifc_chunks(doc["file_path"])
+                    for chunk in batch
+                )
+                await vectorizer.sync_document_chunks(element_chunks, "ae_ifc", doc["file_path"])
             logger.info(f"Векторизован документ: {doc['file_path']}")
         
         # Тестирование поиска
@@ -135,6 +189,9 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Ошибка в ingest системе: {str(e)}")
         raise
+    finally:
+        if parser is not None:
+            parser.shutdown()
 
 
 if __name__ == "__main__":
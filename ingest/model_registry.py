@@ -0,0 +1,233 @@
+"""
+Общий реестр моделей процесса (эмбеддинги, реранкеры, CLIP)
+
+Модель загружается при первом обращении и одна на процесс: DocumentVectorizer
+и HybridSearchService получают один и тот же экземпляр BGE-M3. Каждая ссылка
+SharedModel держит модель; когда все ссылки освобождены (release() или сборка
+мусора владельца), модель выгружается. warm_up() загружает модели в фоновом
+потоке, сервис при этом сразу отвечает на /health.
+
+Вариант модели задается MODEL_VARIANT: "fp32" (по умолчанию), "int8" -
+динамическое квантование линейных слоев torch или "onnx" - ONNX Runtime с
+int8 квантованием (onnx_backend; без onnxruntime модель грузится в torch).
+"""
+
+import gc
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "fp32")
+
+MODEL_VARIANTS = ("fp32", "int8", "onnx")
+
+# Через сколько секунд после неудачной загрузки модель загружается повторно
+MODEL_RETRY_SECONDS = float(os.getenv("MODEL_RETRY_SECONDS", "60"))
+
+
+class _Entry:
+    """Модель реестра и число ссылок на нее"""
+
+    def __init__(self, loader: Callable[[], Any]):
+        self.loader = loader
+        self.refs = 0
+        self.model = None
+        self.state = "pending"  # pending, loading, loaded, failed
+        self.error: Optional[str] = None
+        self.failed_at = 0.0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Модели процесса по ключу с подсчетом ссылок"""
+
+    def __init__(self, retry_seconds: float = MODEL_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+
+    def acquire(self, key: str, loader: Callable[[], Any]) -> "SharedModel":
+        """Ссылка на модель; сама модель загружается при первом обращении"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(loader)
+            entry.refs += 1
+        return SharedModel(self, key)
+
+    def load(self, key: str) -> Any:
+        """Модель по ключу, загружает ее при необходимости (после ошибки - не чаще retry_seconds)"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            raise KeyError(f"Модель {key} не зарегистрирована")
+        if entry.state == "loaded":
+            return entry.model
+
+        with entry.lock:
+            if entry.state == "failed" and time.monotonic() - entry.failed_at < self.retry_seconds:
+                raise RuntimeError(f"Модель {key} не загружена: {entry.error}")
+            if entry.state != "loaded":
+                entry.state = "loading"
+                started = time.monotonic()
+                try:
+                    entry.model = entry.loader()
+                except Exception as e:
+                    entry.state = "failed"
+                    entry.error = str(e) or type(e).__name__
+                    entry.failed_at = time.monotonic()
+                    logger.error(f"Не удалось загрузить модель {key}: {entry.error}")
+                    raise
+                entry.state = "loaded"
+                logger.info(f"Модель {key} загружена за {time.monotonic() - started:.1f} с")
+        return entry.model
+
+    def release(self, key: str):
+        """Освобождает ссылку; модель без ссылок выгружается"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._entries[key]
+
+        if entry.model is not None:
+            entry.model = None
+            gc.collect()
+            logger.info(f"Модель {key} выгружена")
+
+    def status(self) -> Dict[str, str]:
+        """Состояние моделей: pending, loading, loaded или failed"""
+        with self._lock:
+            return {key: entry.state for key, entry in self._entries.items()}
+
+    def warm_up(self, keys: Optional[Iterable[str]] = None) -> threading.Thread:
+        """Загружает модели (по умолчанию все незагруженные) в фоновом потоке"""
+        keys = list(keys) if keys is not None else [
+            key for key, state in self.status().items() if state == "pending"
+        ]
+
+        def run():
+            for key in keys:
+                try:
+                    self.load(key)
+                except Exception:
+                    # Ошибка уже записана в журнал и в состояние модели
+                    pass
+
+        thread = threading.Thread(target=run, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+class SharedModel:
+    """
+    Ссылка на модель реестра
+
+    Обращения к атрибутам передаются модели (model.encode(...)), первое
+    обращение ее загружает.
+    """
+
+    def __init__(self, registry: ModelRegistry, key: str):
+        self.key = key
+        self._registry = registry
+        self._finalizer = weakref.finalize(self, registry.release, key)
+
+    def get(self) -> Any:
+        """Загруженная модель"""
+        if not self._finalizer.alive:
+            raise RuntimeError(f"Ссылка на модель {self.key} освобождена")
+        return self._registry.load(self.key)
+
+    @property
+    def loaded(self) -> bool:
+        return self._registry.status().get(self.key) == "loaded"
+
+    def release(self):
+        """Освобождает ссылку (повторный вызов ничего не делает)"""
+        self._finalizer()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self) -> str:
+        return f"SharedModel({self.key!r})"
+
+
+registry = ModelRegistry()
+
+
+def sentence_transformer(name: str, variant: str = MODEL_VARIANT) -> SharedModel:
+    """Общая модель SentenceTransformer"""
+    def load():
+        if variant == "onnx" and _onnx_available(name):
+            from onnx_backend import OnnxSentenceEncoder
+            return OnnxSentenceEncoder(name)
+        from sentence_transformers import SentenceTransformer
+        return _apply_variant(SentenceTransformer(name), variant)
+
+    return registry.acquire(f"sentence-transformer:{name}:{_check_variant(variant)}", load)
+
+
+def cross_encoder(name: str, variant: str = MODEL_VARIANT) -> SharedModel:
+    """Общий реранкер CrossEncoder"""
+    def load():
+        if variant == "onnx" and _onnx_available(name):
+            from onnx_backend import OnnxCrossEncoder
+            return OnnxCrossEncoder(name)
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(name)
+        model.model = _apply_variant(model.model, variant)
+        return model
+
+    return registry.acquire(f"cross-encoder:{name}:{_check_variant(variant)}", load)
+
+
+def clip_model(name: str = "ViT-L-14", pretrained: str = "openai") -> SharedModel:
+    """Общая модель CLIP (open_clip), загруженное значение - пара (модель, предобработка)"""
+    def load():
+        import open_clip
+        model, _, preprocess = open_clip.create_model_and_transforms(name, pretrained=pretrained, device="cpu")
+        model.eval()
+        return model, preprocess
+
+    return registry.acquire(f"clip:{name}:{pretrained}", load)
+
+
+def warm_up() -> threading.Thread:
+    """Фоновая загрузка всех моделей, на которые уже взяты ссылки"""
+    return registry.warm_up()
+
+
+def model_status() -> Dict[str, str]:
+    """Состояние моделей процесса для /health"""
+    return registry.status()
+
+
+def _check_variant(variant: str) -> str:
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Неизвестный вариант модели: {variant}")
+    return variant
+
+
+def _onnx_available(name: str) -> bool:
+    from onnx_backend import ONNX_AVAILABLE
+    if not ONNX_AVAILABLE:
+        logger.warning(f"ONNX Runtime недоступен, модель {name} загружается в torch")
+    return ONNX_AVAILABLE
+
+
+def _apply_variant(model, variant: str):
+    if variant == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
@@ -5,48 +5,33 @@
 """
 
 import os
-import io
 import logging
 import asyncio
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, Iterator, List, Any, Optional, Union
 from pathlib import Path
 import aiofiles
 import hashlib
 from datetime import datetime
+from importlib.util import find_spec
 
 # PDF обработка
-import pdfplumber
-import PyPDF2
-from pdf2image import convert_from_bytes
-import pytesseract
 from PIL import Image
 
 # Офисные документы
 from docx import Document as DocxDocument
-import openpyxl
-import pandas as pd
 
 # CAD/IFC (опционально)
-try:
-    import ezdxf
-    EZDXF_AVAILABLE = True
-except ImportError:
-    logging.warning("ezdxf не установлен, DXF файлы не будут обрабатываться")
-    EZDXF_AVAILABLE = False
+# OCR выполняется в воркерах StreamingOCR, здесь только проверяется наличие библиотек
+OCR_AVAILABLE = all(find_spec(name) is not None for name in ("pdf2image", "pytesseract"))
+if not OCR_AVAILABLE:
+    logging.warning("OCR библиотеки не установлены")
 
-try:
-    import ifcopenshell
-    IFCOPENSHELL_AVAILABLE = True
-except ImportError:
-    logging.warning("ifcopenshell не установлен, IFC файлы не будут обрабатываться")
-    IFCOPENSHELL_AVAILABLE = False
+from streaming_ocr import StreamingOCR
 
-# OCR
-try:
-    OCR_AVAILABLE = True
-except ImportError:
-    logging.warning("OCR библиотеки не установлены")
-    OCR_AVAILABLE = False
+from extraction_cache import ExtractionCache, iter_pdf_pages, render_pdf_pages
+from table_reader import iter_row_chunks, read_sheet_headers, reader_name
+from dxf_extractor import EZDXF_AVAILABLE, extract_dxf_tiles
+from ifc_extractor import IFC_AVAILABLE as IFCOPENSHELL_AVAILABLE, iter_ifc_elements, read_ifc_schema
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +55,17 @@ class DocumentParser:
             'image/vnd.dxf': self._parse_dxf,
             'application/x-ifc': self._parse_ifc,
         }
+        
+        # Потоковый OCR: страницы растеризуются по одной в пуле процессов
+        self.ocr = StreamingOCR() if OCR_AVAILABLE else None
+        
+        # Общий с сервисами кэш извлечения PDF по SHA-256 (текстовый слой, таблицы, OCR)
+        self.extraction_cache = ExtractionCache.from_env()
+
+    def shutdown(self):
+        """Остановка пула процессов OCR"""
+        if self.ocr is not None:
+            self.ocr.shutdown()
 
     async def parse_document(self, file_path: str, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
         """
@@ -117,8 +113,11 @@ class DocumentParser:
                     "extraction_method": "none"
                 }
             
-            # Выполняем парсинг
-            result = await parser_func(file_path)
+            # Выполняем парсинг (PDF сначала ищется в кэше извлечения по хешу)
+            if mime_type == 'application/pdf':
+                result = await parser_func(file_path, file_hash)
+            else:
+                result = await parser_func(file_path)
             
             return {
                 **base_metadata,
@@ -138,141 +137,78 @@ class DocumentParser:
                 "extraction_method": "failed"
             }
 
-    async def _parse_pdf(self, file_path: str) -> Dict[str, Any]:
-        """Парсинг PDF с множественными fallback методами"""
-        text = ""
-        tables = []
-        page_count = 0
-        extraction_method = "failed"
+    async def _parse_pdf(self, file_path: str, file_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Парсинг PDF с множественными fallback методами
         
+        Результат содержит постраничные записи pages (текст, таблицы, bbox
+        страницы) и полный текст, собранный из них одним join.
+        """
         try:
-            # Метод 1: pdfplumber (лучший для текста и таблиц)
-            try:
-                with pdfplumber.open(file_path) as pdf:
-                    page_count = len(pdf.pages)
-                    for page_num, page in enumerate(pdf.pages):
-                        # Извлекаем текст
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += f"\n--- Page {page_num + 1} ---\n" + page_text
-                        
-                        # Извлекаем таблицы
-                        page_tables = page.extract_tables()
-                        if page_tables:
-                            for table_num, table in enumerate(page_tables):
-                                tables.append({
-                                    "page": page_num + 1,
-                                    "table": table_num + 1,
-                                    "data": table,
-                                    "type": "pdfplumber"
-                                })
-                
-                if text.strip():
-                    extraction_method = "pdfplumber"
-                    logger.info(f"PDF успешно обработан с pdfplumber: {file_path}")
-                    return {
-                        "text": text.strip(),
-                        "tables": tables,
-                        "page_count": page_count,
-                        "extraction_method": extraction_method
-                    }
-                else:
-                    logger.warning(f"pdfplumber не извлек текст из: {file_path}")
-                    
-            except Exception as e:
-                logger.warning(f"pdfplumber failed для {file_path}: {e}")
-
-            # Метод 2: PyPDF2 fallback
-            try:
-                async with aiofiles.open(file_path, 'rb') as file:
-                    content = await file.read()
-                    pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-                    page_count = len(pdf_reader.pages)
-                    
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += f"\n--- Page {page_num + 1} ---\n" + page_text
-                
-                if text.strip():
-                    extraction_method = "pypdf2"
-                    logger.info(f"PDF обработан с PyPDF2: {file_path}")
-                    return {
-                        "text": text.strip(),
-                        "tables": tables,
-                        "page_count": page_count,
-                        "extraction_method": extraction_method
-                    }
-                else:
-                    logger.warning(f"PyPDF2 не извлек текст из: {file_path}")
-                    
-            except Exception as e:
-                logger.warning(f"PyPDF2 failed для {file_path}: {e}")
-
-            # Метод 3: OCR fallback
-            if OCR_AVAILABLE:
-                try:
-                    ocr_text = await self._extract_text_with_ocr(file_path)
-                    if ocr_text.strip():
-                        extraction_method = "ocr_tesseract"
-                        logger.info(f"PDF обработан с OCR: {file_path}")
-                        return {
-                            "text": ocr_text.strip(),
-                            "tables": tables,
-                            "page_count": page_count,
-                            "extraction_method": extraction_method
-                        }
-                    else:
-                        logger.warning(f"OCR не извлек текст из: {file_path}")
-                        
-                except Exception as e:
-                    logger.warning(f"OCR failed для {file_path}: {e}")
+            # Методы 1-2: pdfplumber (текст и таблицы), затем PyPDF2 — или готовая запись кэша
+            file_hash = file_hash or await self._calculate_file_hash(file_path)
+            record = await self.extraction_cache.load_pdf(file_hash, file_path, with_tables=True)
+            for table in record["tables"]:
+                table["type"] = "pdfplumber"
+            
+            if record["pages"]:
+                extraction_method = record["text_method"]
+                logger.info(f"PDF обработан с {extraction_method}: {file_path}")
             else:
-                logger.warning("OCR недоступен")
-
-            logger.error(f"Все методы парсинга PDF failed для: {file_path}")
+                logger.warning(f"pdfplumber и PyPDF2 не извлекли текст из: {file_path}")
+                extraction_method = await self._ocr_pdf_record(file_path, file_hash, record)
+            
+            pages = list(iter_pdf_pages(record))
             return {
-                "text": "",
-                "tables": [],
-                "page_count": page_count,
-                "extraction_method": "failed"
+                "text": render_pdf_pages(pages, "\n--- Page {page} ---\n", "\n--- Page {page} (OCR) ---\n").strip(),
+                "tables": record["tables"],
+                "pages": [page.to_dict() for page in pages],
+                "page_count": record["page_count"],
+                "extraction_method": extraction_method
             }
 
         except Exception as e:
             logger.error(f"Критическая ошибка парсинга PDF {file_path}: {e}")
             raise
 
-    async def _extract_text_with_ocr(self, file_path: str) -> str:
-        """OCR извлечение текста из PDF"""
+    async def _ocr_pdf_record(self, file_path: str, file_hash: str, record: Dict[str, Any]) -> str:
+        """Метод 3: OCR fallback, результат дописывается в запись кэша; возвращает метод извлечения"""
+        ocr_pages = record.get("ocr_pages")
+        if ocr_pages is None and OCR_AVAILABLE:
+            try:
+                ocr_pages = await self._extract_text_with_ocr(file_path)
+                if ocr_pages:
+                    record["ocr_pages"] = ocr_pages
+                    await self.extraction_cache.update(file_hash, {"ocr_pages": ocr_pages})
+                else:
+                    logger.warning(f"OCR не извлек текст из: {file_path}")
+            except Exception as e:
+                logger.warning(f"OCR failed для {file_path}: {e}")
+        elif ocr_pages is None:
+            logger.warning("OCR недоступен")
+        
+        if ocr_pages:
+            logger.info(f"PDF обработан с OCR: {file_path}")
+            return "ocr_tesseract"
+        
+        logger.error(f"Все методы парсинга PDF failed для: {file_path}")
+        return "failed"
+
+    async def _extract_text_with_ocr(self, file_path: str) -> List[List[Any]]:
+        """OCR извлечение текста из PDF: [[номер страницы, текст]]"""
         if not OCR_AVAILABLE:
             raise ImportError("OCR библиотеки недоступны")
         
-        extracted_text = ""
         try:
-            async with aiofiles.open(file_path, 'rb') as file:
-                pdf_content = await file.read()
-            
-            # Конвертируем PDF в изображения
-            images = convert_from_bytes(pdf_content, dpi=300)
-            
-            for page_num, image in enumerate(images):
-                try:
-                    # OCR с поддержкой русского и английского
-                    custom_config = r'--oem 3 --psm 6 -l rus+eng'
-                    page_text = pytesseract.image_to_string(image, config=custom_config)
-                    
-                    if page_text.strip():
-                        extracted_text += f"\n--- Page {page_num + 1} (OCR) ---\n" + page_text
-                        
-                except Exception as page_error:
-                    logger.warning(f"OCR failed для страницы {page_num + 1}: {page_error}")
-                    continue
+            return [
+                [page.page_number, page.text]
+                async for page in self.ocr.iter_pages(file_path)
+                if page.text.strip()
+            ]
                     
         except Exception as e:
             logger.error(f"OCR ошибка для {file_path}: {e}")
             raise
-            
-        return extracted_text
 
     async def _parse_docx(self, file_path: str) -> Dict[str, Any]:
         """Парсинг DOCX документов"""
@@ -312,82 +248,47 @@ class DocumentParser:
             raise
 
     async def _parse_xlsx(self, file_path: str) -> Dict[str, Any]:
-        """Парсинг XLSX документов"""
-        text = ""
-        tables = []
-        
+        """Парсинг XLSX документов: заголовки листов, строки читаются потоком через iter_table_chunks"""
+        return await self._parse_spreadsheet(file_path)
+
+    async def _parse_xls(self, file_path: str) -> Dict[str, Any]:
+        """Парсинг XLS документов: заголовки листов, строки читаются потоком через iter_table_chunks"""
+        return await self._parse_spreadsheet(file_path)
+
+    async def _parse_spreadsheet(self, file_path: str) -> Dict[str, Any]:
         try:
-            workbook = openpyxl.load_workbook(file_path, data_only=True)
+            sheets = await asyncio.to_thread(read_sheet_headers, file_path)
             
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                sheet_data = []
-                
-                # Извлекаем данные из листа
-                for row in sheet.iter_rows(values_only=True):
-                    row_data = [str(cell) if cell is not None else "" for cell in row]
-                    sheet_data.append(row_data)
-                
-                if sheet_data:
-                    tables.append({
-                        "sheet_name": sheet_name,
-                        "data": sheet_data,
-                        "type": "xlsx_sheet"
-                    })
-                    
-                    # Добавляем в текст для поиска
-                    text += f"\n--- Sheet: {sheet_name} ---\n"
-                    for row_data in sheet_data:
-                        text += "\t".join(row_data) + "\n"
+            # В текст для поиска попадают только листы и заголовки, строки идут в ae_tables
+            text = "\n".join(
+                f"--- Sheet: {sheet['sheet_name']} ---\n" + "\t".join(sheet["header"])
+                for sheet in sheets
+            )
             
-            logger.info(f"XLSX успешно обработан: {file_path}")
+            logger.info(f"Таблица успешно обработана: {file_path}, листов {len(sheets)}")
             return {
-                "text": text.strip(),
-                "tables": tables,
-                "extraction_method": "openpyxl"
+                "text": text,
+                "tables": [],
+                "sheets": sheets,
+                "extraction_method": reader_name(file_path)
             }
             
         except Exception as e:
-            logger.error(f"Ошибка парсинга XLSX {file_path}: {e}")
+            logger.error(f"Ошибка парсинга таблицы {file_path}: {e}")
             raise
 
-    async def _parse_xls(self, file_path: str) -> Dict[str, Any]:
-        """Парсинг XLS документов через pandas"""
-        text = ""
-        tables = []
+    def iter_table_chunks(self, file_path: str, batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Пакеты чанков строк XLSX/XLS для ae_tables (по одному чанку на строку)
         
-        try:
-            # Читаем все листы
-            excel_file = pd.ExcelFile(file_path)
-            
-            for sheet_name in excel_file.sheet_names:
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-                
-                # Конвертируем в список списков
-                sheet_data = df.fillna("").astype(str).values.tolist()
-                
-                if sheet_data:
-                    tables.append({
-                        "sheet_name": sheet_name,
-                        "data": sheet_data,
-                        "type": "xls_sheet"
-                    })
-                    
-                    # Добавляем в текст
-                    text += f"\n--- Sheet: {sheet_name} ---\n"
-                    for row_data in sheet_data:
-                        text += "\t".join(row_data) + "\n"
-            
-            logger.info(f"XLS успешно обработан: {file_path}")
-            return {
-                "text": text.strip(),
-                "tables": tables,
-                "extraction_method": "pandas"
-            }
+        Args:
+            file_path: Путь к книге
+            batch_size: Строк в пакете
             
-        except Exception as e:
-            logger.error(f"Ошибка парсинга XLS {file_path}: {e}")
-            raise
+        Returns:
+            Итератор пакетов чанков с row_data, row_hash и числовыми столбцами в numeric
+        """
+        return iter_row_chunks(file_path, batch_size, key_prefix=f"table:{file_path}")
 
     async def _parse_txt(self, file_path: str) -> Dict[str, Any]:
         """Парсинг текстовых файлов"""
@@ -407,7 +308,7 @@ class DocumentParser:
             raise
 
     async def _parse_dxf(self, file_path: str) -> Dict[str, Any]:
-        """Парсинг DXF файлов"""
+        """Парсинг DXF файлов: надписи и атрибуты блоков по участкам листов"""
         if not EZDXF_AVAILABLE:
             logger.warning(f"ezdxf недоступен, пропускаем DXF: {file_path}")
             return {
@@ -416,25 +317,17 @@ class DocumentParser:
                 "extraction_method": "unsupported"
             }
         
-        text_content = []
         try:
-            doc = ezdxf.readfile(file_path)
-            msp = doc.modelspace()
-            
-            # Извлекаем текстовые объекты
-            for entity in msp:
-                if entity.dxftype() in ['TEXT', 'MTEXT']:
-                    text_content.append(entity.dxf.text)
-                elif entity.dxftype() in ['ATTRIB', 'ATTDEF']:
-                    text_content.append(entity.dxf.text)
+            drawing = await asyncio.to_thread(extract_dxf_tiles, file_path, f"dxf:{file_path}")
             
-            extracted_text = "\n".join(filter(None, text_content))
-            
-            logger.info(f"DXF успешно обработан: {file_path}")
+            logger.info(f"DXF успешно обработан: {file_path}, участков {len(drawing['tiles'])}")
             return {
-                "text": extracted_text.strip(),
+                "text": "\n\n".join(tile["content"] for tile in drawing["tiles"]),
                 "tables": [],
-                "extraction_method": "ezdxf"
+                "tiles": drawing["tiles"],
+                "layouts": drawing["layouts"],
+                "layers": drawing["layers"],
+                "extraction_method": f"ezdxf_{drawing['extraction_method']}"
             }
             
         except Exception as e:
@@ -442,7 +335,7 @@ class DocumentParser:
             raise
 
     async def _parse_ifc(self, file_path: str) -> Dict[str, Any]:
-        """Парсинг IFC файлов"""
+        """Парсинг IFC файлов: только схема, объекты читаются потоком через iter_ifc_chunks"""
         if not IFCOPENSHELL_AVAILABLE:
             logger.warning(f"ifcopenshell недоступен, пропускаем IFC: {file_path}")
             return {
@@ -451,30 +344,14 @@ class DocumentParser:
                 "extraction_method": "unsupported"
             }
         
-        text_content = []
         try:
-            model = ifcopenshell.open(file_path)
-            
-            # Извлекаем информацию об объектах
-            for entity in model.by_type('IfcRoot'):
-                if hasattr(entity, 'Name') and entity.Name:
-                    text_content.append(f"Entity: {entity.Name} ({entity.GlobalId})")
-                
-                # Извлекаем свойства
-                for p in entity.IsDefinedBy:
-                    if p.is_a('IfcRelDefinesByProperties'):
-                        if p.RelatingPropertyDefinition.is_a('IfcPropertySet'):
-                            for prop in p.RelatingPropertyDefinition.HasProperties:
-                                if prop.is_a('IfcPropertySingleValue'):
-                                    value = prop.NominalValue.wrappedValue if prop.NominalValue else 'N/A'
-                                    text_content.append(f"  Property: {prop.Name} = {value}")
-            
-            extracted_text = "\n".join(filter(None, text_content))
+            schema = await asyncio.to_thread(read_ifc_schema, file_path)
             
-            logger.info(f"IFC успешно обработан: {file_path}")
+            logger.info(f"IFC успешно обработан: {file_path}, схема {schema}")
             return {
-                "text": extracted_text.strip(),
+                "text": "",
                 "tables": [],
+                "ifc_schema": schema or "unknown",
                 "extraction_method": "ifcopenshell"
             }
             
@@ -482,6 +359,21 @@ class DocumentParser:
             logger.error(f"Ошибка парсинга IFC {file_path}: {e}")
             raise
 
+    def iter_ifc_chunks(self, file_path: str, batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Пакеты чанков объектов IFC для ae_ifc (по одному чанку на объект)
+        
+        Модель разбирается в отдельном процессе с лимитом памяти IFC_MEMORY_LIMIT_MB.
+        
+        Args:
+            file_path: Путь к файлу IFC
+            batch_size: Объектов в пакете
+            
+        Returns:
+            Итератор пакетов чанков с ifc_type, ifc_guid и properties
+        """
+        return iter_ifc_elements(file_path, f"ifc:{file_path}", batch_size)
+
     def _get_mime_type_from_path(self, file_path: str) -> str:
         """Определяет MIME тип по расширению файла"""
         ext = os.path.splitext(file_path)[1].lower()
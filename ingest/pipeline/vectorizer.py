@@ -8,27 +8,23 @@ import os
 import logging
 import asyncio
 import numpy as np
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, Iterable, List, Any, Optional, Set, Union
 from pathlib import Path
 import json
 from datetime import datetime
 
 # Векторизация
-from sentence_transformers import SentenceTransformer
-import torch
+from model_registry import clip_model, sentence_transformer
 
 # Qdrant
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, PointIdsList
+)
 from qdrant_client.http import models
 
-# CLIP для изображений (опционально)
-try:
-    import clip
-    CLIP_AVAILABLE = True
-except ImportError:
-    logging.warning("CLIP не установлен, изображения не будут векторизованы")
-    CLIP_AVAILABLE = False
+from clip_encoder import CLIP_AVAILABLE, encode_images, encode_texts
+from text_chunker import document_hash, make_point_id
 
 logger = logging.getLogger(__name__)
 
@@ -43,10 +39,9 @@ class DocumentVectorizer:
         self.qdrant_client = None
         self._qdrant_available = False
         
-        # Модели для эмбеддингов
+        # Модели для эмбеддингов (общие для процесса, загружаются при первом обращении)
         self.text_model = None
-        self.clip_model = None
-        self.clip_preprocess = None
+        self._clip = None
         
         # Конфигурация коллекций
         self.collections = {
@@ -76,6 +71,11 @@ class DocumentVectorizer:
             }
         }
         
+        # Размер страницы scroll, пакета удаления и пакета эмбеддингов при синхронизации документа
+        self.scroll_batch_size = 1000
+        self.delete_batch_size = 1000
+        self.embed_batch_size = 256
+        
         self._initialize_models()
 
     def _get_qdrant_client(self):
@@ -93,29 +93,36 @@ class DocumentVectorizer:
         return self.qdrant_client if self._qdrant_available else None
 
     def _initialize_models(self):
-        """Инициализирует модели для эмбеддингов"""
-        try:
-            # Загружаем BGE-M3 для текста
-            logger.info("Загружаем BGE-M3 модель...")
-            self.text_model = SentenceTransformer('BAAI/bge-m3')
-            logger.info("BGE-M3 модель загружена успешно")
-            
-            # Загружаем CLIP для изображений (если доступен)
-            if CLIP_AVAILABLE:
-                try:
-                    logger.info("Загружаем CLIP модель...")
-                    self.clip_model, self.clip_preprocess = clip.load("ViT-L/14", device="cpu")
-                    logger.info("CLIP модель загружена успешно")
-                except Exception as e:
-                    logger.warning(f"Не удалось загрузить CLIP: {e}")
-                    self.clip_model = None
-            else:
-                logger.warning("CLIP недоступен, изображения не будут векторизованы")
-                self.clip_model = None
+        """Берет ссылки на модели из общего реестра процесса"""
+        # BGE-M3 для текста
+        self.text_model = sentence_transformer('BAAI/bge-m3')
         
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации моделей: {str(e)}")
-            raise
+        # CLIP для изображений (если доступен)
+        if CLIP_AVAILABLE:
+            self._clip = clip_model("ViT-L-14")
+        else:
+            logger.warning("CLIP недоступен, изображения не будут векторизованы")
+
+    @property
+    def clip_model(self):
+        """Модель CLIP или None, если CLIP недоступен"""
+        clip = self._load_clip()
+        return clip[0] if clip else None
+
+    @property
+    def clip_preprocess(self):
+        """Предобработка изображений CLIP или None"""
+        clip = self._load_clip()
+        return clip[1] if clip else None
+
+    def _load_clip(self):
+        if self._clip is None:
+            return None
+        try:
+            return self._clip.get()
+        except Exception:
+            # Ошибка загрузки записана реестром
+            return None
 
     async def ensure_collections_exist(self):
         """Создает коллекции в Qdrant если они не существуют"""
@@ -166,9 +173,10 @@ class DocumentVectorizer:
             embeddings = await self._generate_embeddings(chunks, collection_name)
             
             # Создаем точки для Qdrant
+            model = self.collections[collection_name]["model"]
             points = []
             for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                point_id = f"{chunk.get('chunk_id', f'chunk_{i}')}_{i}"
+                point_id = self._point_id(chunk, i, model)
                 
                 # Создаем payload
                 payload = self._create_payload(chunk)
@@ -203,6 +211,117 @@ class DocumentVectorizer:
             logger.error(f"Ошибка при векторизации: {str(e)}")
             raise
 
+    async def sync_document_chunks(self, chunks: Iterable[Dict[str, Any]], collection_name: str,
+                                   source_path: str) -> Dict[str, Any]:
+        """
+        Идемпотентная загрузка чанков документа
+        
+        ID точек детерминированы, поэтому повторная загрузка того же документа
+        не создает дубликатов: эмбеддинги считаются только для новых чанков,
+        а точки, которых больше нет в документе, удаляются пакетно.
+        Чанки читаются потоком и векторизуются пакетами по embed_batch_size,
+        поэтому большие таблицы не собираются в памяти целиком.
+        
+        Args:
+            chunks: Все чанки документа (список или итератор)
+            collection_name: Имя коллекции в Qdrant
+            source_path: Путь к исходному файлу (ключ документа в payload)
+            
+        Returns:
+            Результат синхронизации
+        """
+        if collection_name not in self.collections:
+            raise ValueError(f"Неизвестная коллекция: {collection_name}")
+        
+        client = self._get_qdrant_client()
+        if not client:
+            raise ValueError("Qdrant недоступен")
+        
+        model = self.collections[collection_name]["model"]
+        existing_ids = self._get_source_point_ids(collection_name, source_path)
+        seen_ids: Set[str] = set()
+        pending: List[Dict[str, Any]] = []
+        total = 0
+        new_points = 0
+        
+        for index, chunk in enumerate(chunks):
+            chunk = {**chunk, "source_path": source_path}
+            # Номер чанка фиксируется до разбиения на пакеты
+            chunk["chunk_id"] = chunk.get("chunk_id") or self._chunk_key(chunk, index)
+            point_id = self._point_id(chunk, index, model)
+            total += 1
+            if point_id in seen_ids:
+                continue
+            seen_ids.add(point_id)
+            if point_id in existing_ids:
+                continue
+            
+            pending.append(chunk)
+            if len(pending) >= self.embed_batch_size:
+                await self.vectorize_chunks(pending, collection_name)
+                new_points += len(pending)
+                pending = []
+        
+        if pending:
+            await self.vectorize_chunks(pending, collection_name)
+            new_points += len(pending)
+        
+        stale_ids = list(existing_ids - seen_ids)
+        for start in range(0, len(stale_ids), self.delete_batch_size):
+            client.delete(
+                collection_name=collection_name,
+                points_selector=PointIdsList(points=stale_ids[start:start + self.delete_batch_size])
+            )
+        
+        logger.info(
+            f"Документ {source_path}: новых чанков {new_points}, "
+            f"без изменений {total - new_points}, удалено {len(stale_ids)}"
+        )
+        
+        return {
+            "collection_name": collection_name,
+            "points_count": total,
+            "new_points": new_points,
+            "unchanged_points": total - new_points,
+            "deleted_points": len(stale_ids),
+            "model": model,
+            "status": "completed"
+        }
+
+    def _chunk_key(self, chunk: Dict[str, Any], index: int) -> str:
+        """Ключ чанка без chunk_id: хеш источника и номер"""
+        source_hash = chunk.get("source_hash") or document_hash(chunk.get("content", ""))
+        return f"{source_hash}:{index}"
+
+    def _point_id(self, chunk: Dict[str, Any], index: int, model: str) -> str:
+        """Детерминированный ID точки: ID чанка (или хеш источника и номер) и модель"""
+        chunk_key = chunk.get("chunk_id") or self._chunk_key(chunk, index)
+        return make_point_id(chunk_key, model)
+
+    def _get_source_point_ids(self, collection_name: str, source_path: str) -> Set[str]:
+        """ID всех точек документа в коллекции (постранично, без payload и векторов)"""
+        client = self._get_qdrant_client()
+        scroll_filter = Filter(
+            must=[FieldCondition(key="source_path", match=MatchValue(value=source_path))]
+        )
+        point_ids: Set[str] = set()
+        offset = None
+        
+        while True:
+            points, offset = client.scroll(
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                limit=self.scroll_batch_size,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            point_ids.update(str(point.id) for point in points)
+            if offset is None:
+                break
+        
+        return point_ids
+
     async def _generate_embeddings(self, chunks: List[Dict[str, Any]], collection_name: str) -> List[np.ndarray]:
         """Генерирует эмбеддинги для чанков"""
         embeddings = []
@@ -223,37 +342,28 @@ class DocumentVectorizer:
                 embeddings = []
                 
         elif collection_name == "ae_drawings_clip":
-            # CLIP эмбеддинги для изображений
+            # CLIP эмбеддинги: изображения фрагментов (байты "image" или файл "image_path"), иначе текст
             if self.clip_model is None:
-                logger.warning("CLIP модель недоступна, используем текстовые эмбеддинги")
-                # Fallback на текстовые эмбеддинги
-                texts = []
-                for chunk in chunks:
-                    content = chunk.get('content', '')
-                    if content:
-                        texts.append(content)
-                    else:
-                        texts.append("")
-                
-                if texts:
-                    embeddings = self.text_model.encode(texts, convert_to_tensor=False)
-                else:
-                    embeddings = []
-            else:
-                # Реальная CLIP векторизация (требует изображения)
-                logger.warning("CLIP векторизация изображений не реализована, используем текстовые эмбеддинги")
-                texts = []
-                for chunk in chunks:
-                    content = chunk.get('content', '')
-                    if content:
-                        texts.append(content)
-                    else:
-                        texts.append("")
-                
-                if texts:
-                    embeddings = self.text_model.encode(texts, convert_to_tensor=False)
-                else:
-                    embeddings = []
+                # Векторы BGE-M3 другой размерности в коллекцию CLIP не подходят
+                logger.warning("CLIP модель недоступна, чертежи не векторизуются")
+                return []
+            
+            embeddings = [None] * len(chunks)
+            images = [(i, chunk.get('image') or chunk.get('image_path')) for i, chunk in enumerate(chunks)]
+            images = [(i, image) for i, image in images if image]
+            image_indexes = {i for i, _ in images}
+            texts = [(i, chunk.get('content', '')) for i, chunk in enumerate(chunks) if i not in image_indexes]
+            
+            if images:
+                encoded = await asyncio.to_thread(
+                    encode_images, self.clip_model, self.clip_preprocess, [image for _, image in images]
+                )
+                for (i, _), embedding in zip(images, encoded):
+                    embeddings[i] = embedding
+            if texts:
+                encoded = await asyncio.to_thread(encode_texts, self.clip_model, [text for _, text in texts])
+                for (i, _), embedding in zip(texts, encoded):
+                    embeddings[i] = embedding
         
         return embeddings
 
@@ -288,6 +398,8 @@ class DocumentVectorizer:
             payload["row_data"] = chunk["row_data"]
         if "row_hash" in chunk:
             payload["row_hash"] = chunk["row_hash"]
+        if "row_number" in chunk:
+            payload["row_number"] = chunk["row_number"]
         
         if "ifc_type" in chunk:
             payload["ifc_type"] = chunk["ifc_type"]
@@ -298,6 +410,8 @@ class DocumentVectorizer:
         
         if "preview_path" in chunk:
             payload["preview_path"] = chunk["preview_path"]
+        if "bbox" in chunk:
+            payload["bbox"] = chunk["bbox"]
         
         return payload
 
@@ -317,8 +431,13 @@ class DocumentVectorizer:
             Список похожих документов
         """
         try:
-            # Генерируем эмбеддинг для запроса
-            query_embedding = self.text_model.encode([query], convert_to_tensor=False)[0]
+            # Генерируем эмбеддинг для запроса (для чертежей - в пространстве CLIP)
+            if collection_name == "ae_drawings_clip":
+                if self.clip_model is None:
+                    raise ValueError("CLIP модель не доступна")
+                query_embedding = encode_texts(self.clip_model, [query])[0]
+            else:
+                query_embedding = self.text_model.encode([query], convert_to_tensor=False)[0]
             
             # Создаем фильтры
             qdrant_filters = None
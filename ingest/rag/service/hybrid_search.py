@@ -10,6 +10,7 @@ import asyncio
 import json
 from typing import Dict, List, Any, Optional, Union
 from datetime import datetime
+from importlib.util import find_spec
 import numpy as np
 
 # HTTP клиенты
@@ -17,15 +18,12 @@ import httpx
 import aiohttp
 
 # Векторизация
-from sentence_transformers import SentenceTransformer
+from model_registry import cross_encoder, sentence_transformer
 
-# Реранкинг
-try:
-    from sentence_transformers import CrossEncoder
-    RERANKER_AVAILABLE = True
-except ImportError:
+# Реранкинг: CrossEncoder загружается реестром моделей, здесь только проверяется наличие библиотеки
+RERANKER_AVAILABLE = find_spec("sentence_transformers") is not None
+if not RERANKER_AVAILABLE:
     logging.warning("CrossEncoder не установлен, реранкинг недоступен")
-    RERANKER_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
@@ -60,29 +58,16 @@ class HybridSearchService:
         self._initialize_models()
 
     def _initialize_models(self):
-        """Инициализирует модели для поиска и реранкинга"""
-        try:
-            # Загружаем BGE-M3 для dense поиска
-            logger.info("Загружаем BGE-M3 модель...")
-            self.text_model = SentenceTransformer('BAAI/bge-m3')
-            logger.info("BGE-M3 модель загружена")
-            
-            # Загружаем реранкер
-            if RERANKER_AVAILABLE:
-                try:
-                    logger.info(f"Загружаем реранкер {self.rerank_model}...")
-                    self.reranker = CrossEncoder(self.rerank_model)
-                    logger.info("Реранкер загружен")
-                except Exception as e:
-                    logger.warning(f"Не удалось загрузить реранкер: {e}")
-                    self.reranker = None
-            else:
-                logger.warning("Реранкер недоступен")
-                self.reranker = None
-                
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации моделей: {str(e)}")
-            raise
+        """Берет ссылки на модели поиска и реранкинга из общего реестра процесса"""
+        # BGE-M3 для dense поиска (тот же экземпляр, что у DocumentVectorizer)
+        self.text_model = sentence_transformer('BAAI/bge-m3')
+        
+        # Реранкер
+        if RERANKER_AVAILABLE:
+            self.reranker = cross_encoder(self.rerank_model)
+        else:
+            logger.warning("Реранкер недоступен")
+            self.reranker = None
 
     async def hybrid_search(self, 
                           query: str,
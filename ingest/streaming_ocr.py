@@ -0,0 +1,212 @@
+"""
+Потоковый постраничный OCR для PDF
+
+Страницы растеризуются по одной (first_page/last_page) небольшими
+диапазонами в пуле процессов, распознаются и сразу освобождаются, поэтому
+память не зависит от количества страниц в документе. DPI подбирается по
+размеру страницы, страницы с текстовым слоем пропускаются.
+"""
+
+import asyncio
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from extraction_pool import ExtractionPool
+
+logger = logging.getLogger(__name__)
+
+POINTS_PER_INCH = 72.0
+
+@dataclass
+class OCRPage:
+    """Результат OCR одной страницы"""
+    page_number: int
+    text: str
+    dpi: int
+
+def choose_dpi(width_pt: float, height_pt: float, min_dpi: int, max_dpi: int, max_pixels: int) -> int:
+    """
+    Выбор DPI растеризации по размеру страницы
+
+    A4 растеризуется с max_dpi, крупные форматы (A1, A0) — с меньшим DPI,
+    чтобы изображение страницы не превышало max_pixels.
+    """
+    area_sq_in = (width_pt / POINTS_PER_INCH) * (height_pt / POINTS_PER_INCH)
+    if area_sq_in <= 0:
+        return max_dpi
+    dpi = int(math.sqrt(max_pixels / area_sq_in))
+    return max(min_dpi, min(max_dpi, dpi))
+
+def _scan_pdf_pages(pdf_path: str) -> List[Tuple[float, float, int]]:
+    """Размеры страниц (pt) и количество символов текстового слоя без растеризации"""
+    import pdfplumber
+
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            pages.append((float(page.width), float(page.height), len(page.chars)))
+            page.flush_cache()
+    return pages
+
+def _ocr_page_range(pdf_path: str, pages: List[Tuple[int, int]], lang: str, config: str) -> List[Tuple[int, str, int]]:
+    """
+    Растеризация и OCR диапазона страниц в воркере
+
+    Каждая страница растеризуется отдельно и освобождается сразу после
+    распознавания, так что в памяти воркера одновременно одно изображение.
+    """
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    results = []
+    for page_number, dpi in pages:
+        images = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=page_number,
+            last_page=page_number,
+            grayscale=True
+        )
+        try:
+            text = "".join(pytesseract.image_to_string(image, lang=lang, config=config) for image in images)
+        finally:
+            for image in images:
+                image.close()
+            del images
+        results.append((page_number, text, dpi))
+    return results
+
+class StreamingOCR:
+    """Потоковый OCR PDF с ограниченным потреблением памяти"""
+
+    def __init__(
+        self,
+        lang: str = "rus+eng",
+        tesseract_config: str = "--oem 3 --psm 6",
+        max_workers: Optional[int] = None,
+        pages_per_task: int = 2,
+        min_dpi: int = 150,
+        max_dpi: int = 300,
+        max_pixels: int = 10_000_000,
+        min_text_layer_chars: int = 50,
+        page_timeout: float = 120.0,
+        runner: Optional[Callable[..., Awaitable[Any]]] = None
+    ):
+        """
+        Args:
+            lang: Языки Tesseract
+            tesseract_config: Дополнительные параметры Tesseract
+            max_workers: Количество процессов (по умолчанию CPU - 1)
+            pages_per_task: Количество страниц, растеризуемых одной задачей
+            min_dpi: Минимальный DPI для крупных форматов
+            max_dpi: DPI для страниц формата A4 и меньше
+            max_pixels: Предельный размер изображения страницы в пикселях
+            min_text_layer_chars: Страницы с таким числом символов текстового слоя не распознаются
+            page_timeout: Таймаут OCR одной страницы в секундах
+            runner: Внешний исполнитель вида runner(func, *args, timeout=...) для встраивания в пул сервиса
+        """
+        self.lang = lang
+        self.tesseract_config = tesseract_config
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.pages_per_task = max(1, pages_per_task)
+        self.min_dpi = min_dpi
+        self.max_dpi = max_dpi
+        self.max_pixels = max_pixels
+        self.min_text_layer_chars = min_text_layer_chars
+        self.page_timeout = page_timeout
+        self._runner = runner
+        self._pool = ExtractionPool(max_workers=self.max_workers, name="OCR") if runner is None else None
+
+    async def _run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        if self._runner is not None:
+            return await self._runner(func, *args, timeout=timeout)
+        return await self._pool.run(func, *args, timeout=timeout)
+
+    async def plan_pages(self, pdf_path: str, skip_pages: Optional[Iterable[int]] = None) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        План OCR: страницы без текстового слоя и DPI для каждой
+
+        Returns:
+            Пара (список (номер страницы, dpi), общее количество страниц)
+        """
+        skip = set(skip_pages or ())
+        scanned = await self._run(_scan_pdf_pages, pdf_path, timeout=self.page_timeout)
+
+        plan = []
+        for index, (width, height, chars) in enumerate(scanned, start=1):
+            if index in skip or chars >= self.min_text_layer_chars:
+                continue
+            plan.append((index, choose_dpi(width, height, self.min_dpi, self.max_dpi, self.max_pixels)))
+
+        skipped = len(scanned) - len(plan)
+        if skipped:
+            logger.info(f"OCR: пропущено {skipped} из {len(scanned)} страниц с текстовым слоем")
+        return plan, len(scanned)
+
+    async def iter_pages(self, pdf_path: str, skip_pages: Optional[Iterable[int]] = None) -> AsyncIterator[OCRPage]:
+        """
+        Постраничный OCR PDF
+
+        Диапазоны страниц распознаются параллельно (не больше одного на
+        воркер), результаты отдаются по порядку страниц по мере готовности.
+        Закрытие генератора отменяет еще не начатые диапазоны.
+
+        Args:
+            pdf_path: Путь к PDF
+            skip_pages: Номера страниц (с 1), которые не нужно распознавать
+
+        Yields:
+            OCRPage для каждой распознанной страницы
+        """
+        plan, _ = await self.plan_pages(pdf_path, skip_pages)
+        batches = [plan[i:i + self.pages_per_task] for i in range(0, len(plan), self.pages_per_task)]
+        pending: Dict[int, asyncio.Task] = {}
+        next_to_schedule = 0
+
+        try:
+            for index in range(len(batches)):
+                while next_to_schedule < len(batches) and len(pending) < self.max_workers:
+                    batch = batches[next_to_schedule]
+                    pending[next_to_schedule] = asyncio.create_task(self._run(
+                        _ocr_page_range,
+                        pdf_path,
+                        batch,
+                        self.lang,
+                        self.tesseract_config,
+                        timeout=self.page_timeout * len(batch)
+                    ))
+                    next_to_schedule += 1
+
+                try:
+                    results = await pending.pop(index)
+                except Exception as e:
+                    pages = ", ".join(str(page) for page, _ in batches[index])
+                    logger.warning(f"OCR failed для страниц {pages}: {e}")
+                    continue
+
+                for page_number, text, dpi in results:
+                    yield OCRPage(page_number=page_number, text=text, dpi=dpi)
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+    async def extract_text(
+        self,
+        pdf_path: str,
+        page_header: str = "\n--- Page {page} (OCR) ---\n",
+        skip_pages: Optional[Iterable[int]] = None
+    ) -> str:
+        """Полный текст OCR с заголовками страниц, собранный одним join"""
+        parts = []
+        async for page in self.iter_pages(pdf_path, skip_pages):
+            if page.text.strip():
+                parts.append(page_header.format(page=page.page_number) + page.text)
+        return "".join(parts)
+
+    def shutdown(self):
+        """Остановка собственного пула процессов"""
+        if self._pool is not None:
+            self._pool.shutdown()
@@ -0,0 +1,82 @@
+"""
+Кодирование изображений и текста моделью CLIP на CPU (open_clip)
+
+Предобработка изображений (декодирование, масштабирование, нормализация)
+идет в пуле потоков, модель кодирует пакетами; вычисления внутри пакета
+torch распараллеливает сам. Векторы нормализуются (косинусное расстояние
+в Qdrant). Текст кодируется текстовой частью той же модели, поэтому
+чанки чертежей без изображения остаются в пространстве векторов CLIP.
+"""
+
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Union
+
+import numpy as np
+from PIL import Image
+
+try:
+    import torch
+    import open_clip
+    CLIP_AVAILABLE = True
+except ImportError:
+    CLIP_AVAILABLE = False
+    logging.warning("CLIP не установлен, изображения не будут векторизованы")
+
+logger = logging.getLogger(__name__)
+
+# Изображений в одном пакете модели
+DEFAULT_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "32"))
+
+# Потоков предобработки изображений
+PREPROCESS_THREADS = int(os.getenv("CLIP_PREPROCESS_THREADS", "4"))
+
+
+def encode_images(model, preprocess, images: Sequence[Union[bytes, str]],
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """
+    Векторы изображений
+
+    Args:
+        model: Модель CLIP (open_clip.create_model_and_transforms)
+        preprocess: Предобработка изображений той же модели
+        images: Изображения (байты PNG/JPEG или пути к файлам)
+        batch_size: Изображений в пакете модели
+
+    Returns:
+        Матрица нормализованных векторов (по строке на изображение)
+    """
+    def prepare(image: Union[bytes, str]):
+        source = io.BytesIO(image) if isinstance(image, bytes) else image
+        with Image.open(source) as opened:
+            return preprocess(opened.convert("RGB"))
+
+    batches: List[np.ndarray] = []
+    with ThreadPoolExecutor(max_workers=PREPROCESS_THREADS) as pool:
+        for start in range(0, len(images), batch_size):
+            tensors = list(pool.map(prepare, images[start:start + batch_size]))
+            with torch.no_grad():
+                features = model.encode_image(torch.stack(tensors))
+            batches.append(_normalize(features))
+
+    return np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+
+def encode_texts(model, texts: Sequence[str], batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """Векторы текстов в пространстве изображений CLIP (длинный текст обрезается до 77 токенов)"""
+    batches: List[np.ndarray] = []
+    for start in range(0, len(texts), batch_size):
+        tokens = open_clip.tokenize(list(texts[start:start + batch_size]))
+        with torch.no_grad():
+            features = model.encode_text(tokens)
+        batches.append(_normalize(features))
+
+    return np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+
+def _normalize(features) -> np.ndarray:
+    features = features.float()
+    features = features / features.norm(dim=-1, keepdim=True)
+    return features.cpu().numpy()
@@ -2,21 +2,26 @@
 Основной файл приложения Archive Service
 """
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import logging
+from datetime import datetime
+from typing import Optional
 from contextlib import asynccontextmanager
 
 from schemas.archive import (
     ArchiveUploadRequest, ProcessingJob, SearchRequest, SearchResult,
     AnalogSearchRequest, AnalogResult
 )
+from model_registry import model_status, warm_up
 from models.database import init_db
 from services.archive_service import ArchiveService
 from services.minio_service import MinIOService
 from services.document_parser import DocumentParser
 from services.vectorization_service import VectorizationService
 from services.search_service import SearchService
+from services.ingestion_engine import IngestionEngine
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -27,6 +32,7 @@ minio_service = None
 document_parser = None
 vectorization_service = None
 search_service = None
+ingestion_engine = None
 
 def get_archive_service():
     """Ленивое получение ArchiveService"""
@@ -44,7 +50,7 @@ def get_archive_service():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Инициализация и очистка ресурсов"""
-    global minio_service, archive_service, document_parser, vectorization_service, search_service
+    global minio_service, archive_service, document_parser, vectorization_service, search_service, ingestion_engine
     
     # Инициализация сервисов
     try:
@@ -57,8 +63,17 @@ async def lifespan(app: FastAPI):
         vectorization_service = VectorizationService()
         search_service = SearchService(vectorization_service)
         
+        # Модели загружаются в фоне, сервис отвечает на /health сразу
+        warm_up()
+        
         # ArchiveService будет создаваться лениво при необходимости
         
+        # Движок загрузки архивов продолжает задания, прерванные перезапуском
+        ingestion_engine = IngestionEngine(get_archive_service(), vectorization_service)
+        resumed = await ingestion_engine.resume_pending_jobs()
+        if resumed:
+            logger.info(f"Продолжено заданий: {len(resumed)}")
+        
         logger.info("Archive Service инициализирован")
         
     except Exception as e:
@@ -68,6 +83,8 @@ async def lifespan(app: FastAPI):
     yield
     
     # Очистка ресурсов
+    if ingestion_engine is not None:
+        await ingestion_engine.shutdown()
     logger.info("Archive Service завершает работу")
 
 
@@ -91,20 +108,16 @@ app.add_middleware(
 @app.get("/health")
 async def health_check():
     """Проверка здоровья сервиса"""
-    return {"status": "healthy", "service": "archive-service"}
+    return {"status": "healthy", "service": "archive-service", "models": model_status()}
 
 
 @app.post("/archives/upload", response_model=dict)
-async def upload_archive(
-    request: ArchiveUploadRequest,
-    background_tasks: BackgroundTasks
-):
+async def upload_archive(request: ArchiveUploadRequest):
     """
     Загружает архив проекта для обработки
     
     Args:
         request: Запрос на загрузку архива
-        background_tasks: Фоновые задачи
         
     Returns:
         ID задания на обработку
@@ -114,7 +127,7 @@ async def upload_archive(
         job_id = await archive_service.upload_archive(request)
         
         # Запускаем обработку в фоне
-        background_tasks.add_task(archive_service.process_archive, job_id)
+        ingestion_engine.submit(job_id)
         
         return {
             "job_id": job_id,
@@ -139,19 +152,58 @@ async def get_processing_job(job_id: str):
         Информация о задании
     """
     try:
-        # Здесь должна быть логика получения задания из БД
-        # Пока возвращаем заглушку
-        return ProcessingJob(
-            job_id=job_id,
-            project_id="test_project",
-            object_id="test_object",
-            status="processing",
-            created_at="2025-10-11T10:00:00Z"
-        )
+        job = await get_archive_service().get_processing_job(job_id)
         
     except Exception as e:
         logger.error(f"Ошибка при получении задания {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return ProcessingJob(**job)
+
+
+@app.get("/jobs/{job_id}/progress")
+async def watch_processing_job(
+    job_id: str,
+    request: Request,
+    since: Optional[datetime] = None,
+    timeout: float = Query(default=25.0, ge=0, le=60)
+):
+    """
+    Прогресс задания: SSE-поток (Accept: text/event-stream) или long-poll
+    
+    Args:
+        job_id: ID задания
+        since: updated_at из предыдущего ответа; long-poll ждет более нового состояния
+        timeout: Максимальное время ожидания long-poll в секундах
+        
+    Returns:
+        Информация о задании со скоростью обработки и очередями в поле progress
+    """
+    archive_service = get_archive_service()
+    job = await archive_service.wait_for_job_update(job_id, since, timeout)
+    if job is None:
         raise HTTPException(status_code=404, detail="Задание не найдено")
+    
+    if "text/event-stream" not in request.headers.get("accept", ""):
+        return ProcessingJob(**job)
+    
+    async def generate_events():
+        current = job
+        while True:
+            yield f"data: {ProcessingJob(**current).model_dump_json()}\n\n"
+            if current["status"] not in ("pending", "processing") or await request.is_disconnected():
+                return
+            current = await archive_service.wait_for_job_update(job_id, current["updated_at"], timeout=15.0)
+            if current is None:
+                return
+    
+    return StreamingResponse(
+        generate_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
 
 
 @app.get("/jobs", response_model=list[ProcessingJob])
@@ -172,9 +224,8 @@ async def list_processing_jobs(
         Список заданий
     """
     try:
-        # Здесь должна быть логика получения заданий из БД
-        # Пока возвращаем заглушку
-        return []
+        jobs = await get_archive_service().list_processing_jobs(project_id, status, limit)
+        return [ProcessingJob(**job) for job in jobs]
         
     except Exception as e:
         logger.error(f"Ошибка при получении списка заданий: {str(e)}")
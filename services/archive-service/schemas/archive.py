@@ -103,14 +103,21 @@ class ProcessingJob(BaseModel):
     total_files: int = 0
     processed_files: int = 0
     failed_files: int = 0
+    skipped_files: int = 0
     total_chunks: int = 0
     total_vectors: int = 0
+    
+    # Прогресс выполняющегося задания
+    updated_at: Optional[datetime] = None
+    progress: Dict[str, Any] = Field(default_factory=dict)
 
 
 class DocumentMetadata(BaseModel):
     """Метаданные документа"""
     doc_no: str = Field(..., description="Номер документа")
     rev: str = Field(..., description="Ревизия")
+    project_id: Optional[str] = None
+    object_id: Optional[str] = None
     page: Optional[int] = None
     section: Optional[str] = None
     discipline: Discipline
@@ -166,6 +173,7 @@ class TextChunk(BaseModel):
     chunk_type: str = "text"
     token_count: int
     overlap: int = 0
+    bbox: Optional[List[float]] = None  # [x0, y0, x1, y1] участка чертежа DXF
 
 
 class TableChunk(BaseModel):
@@ -176,6 +184,8 @@ class TableChunk(BaseModel):
     chunk_type: str = "table"
     row_data: Dict[str, Any]
     row_hash: str
+    row_number: Optional[int] = None  # Номер строки в таблице или листе
+    bbox: Optional[List[float]] = None  # [x0, top, x1, bottom] таблицы на странице
 
 
 class DrawingChunk(BaseModel):
@@ -186,6 +196,10 @@ class DrawingChunk(BaseModel):
     chunk_type: str = "drawing"
     preview_path: Optional[str] = None
     extracted_text: Optional[str] = None
+    page_hash: Optional[str] = None  # SHA-256 растра листа
+    tile: Optional[List[int]] = None  # [x0, y0, x1, y1] фрагмента в пикселях листа, None - лист целиком
+    image: Optional[bytes] = Field(default=None, exclude=True)  # PNG фрагмента для CLIP
+    thumbnail: Optional[bytes] = Field(default=None, exclude=True)  # JPEG миниатюры листа (у обзорного фрагмента)
 
 
 class IFCChunk(BaseModel):
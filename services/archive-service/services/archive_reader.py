@@ -0,0 +1,162 @@
+"""
+Потоковое чтение ZIP-архивов из MinIO без скачивания и распаковки
+
+zipfile работает с RangedObjectReader как с обычным файлом с произвольным
+доступом: центральный каталог и файлы архива читаются ranged GET-запросами,
+а BufferedReader объединяет мелкие чтения zipfile в блоки. Файл архива
+распаковывается потоком и хешируется за тот же проход.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import zipfile
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+try:
+    from minio import Minio
+    MINIO_AVAILABLE = True
+except ImportError:
+    MINIO_AVAILABLE = False
+    logging.warning("minio не установлен, архивы читаются только из локальной папки")
+
+logger = logging.getLogger(__name__)
+
+# Размер блока ranged GET (и буфера BufferedReader)
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Размер порции при потоковой распаковке файла архива
+MEMBER_READ_SIZE = 1024 * 1024
+
+
+class RangedObjectReader(io.RawIOBase):
+    """Файл с произвольным доступом поверх объекта MinIO, каждое чтение - ranged GET"""
+
+    def __init__(self, client: "Minio", bucket_name: str, object_name: str, size: Optional[int] = None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.size = size if size is not None else client.stat_object(bucket_name, object_name).size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Недопустимое значение whence: {whence}")
+
+        if position < 0:
+            raise ValueError(f"Отрицательная позиция в {self.object_name}: {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.size:
+            return 0
+
+        length = min(len(buffer), self.size - self._position)
+        response = self.client.get_object(self.bucket_name, self.object_name, offset=self._position, length=length)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class MinIOObjectSource:
+    """Открытие объектов MinIO на чтение; передается в процессы разбора (клиент создается заново)"""
+
+    def __init__(self, endpoint: str, access_key: str, secret_key: str, secure: bool, bucket_name: str,
+                 block_size: int = DEFAULT_BLOCK_SIZE):
+        self.endpoint = endpoint
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.secure = secure
+        self.bucket_name = bucket_name
+        self.block_size = block_size
+        self._client = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_client"] = None
+        return state
+
+    def _get_client(self) -> "Minio":
+        if not MINIO_AVAILABLE:
+            raise RuntimeError("minio не установлен")
+        if self._client is None:
+            self._client = Minio(
+                endpoint=self.endpoint,
+                access_key=self.access_key,
+                secret_key=self.secret_key,
+                secure=self.secure
+            )
+        return self._client
+
+    def open(self, object_name: str) -> io.BufferedReader:
+        reader = RangedObjectReader(self._get_client(), self.bucket_name, object_name)
+        return io.BufferedReader(reader, buffer_size=self.block_size)
+
+
+class LocalObjectSource:
+    """Архивы из локальной папки (разработка без MinIO)"""
+
+    def __init__(self, root: str = ""):
+        self.root = root
+
+    def open(self, object_name: str) -> io.BufferedReader:
+        return open(os.path.join(self.root, object_name), "rb")
+
+
+def stream_member(
+    archive: zipfile.ZipFile,
+    info: zipfile.ZipInfo,
+    spool_dir: Optional[str] = None
+) -> Tuple[str, Union[bytes, str]]:
+    """
+    Распаковка файла архива с SHA-256 за один проход
+
+    Args:
+        archive: Открытый архив
+        info: Файл архива
+        spool_dir: Папка для файла на диске (для парсеров, читающих только с диска);
+            без нее содержимое возвращается в памяти
+
+    Returns:
+        (SHA-256, содержимое) или (SHA-256, путь к файлу в spool_dir)
+    """
+    digest = hashlib.sha256()
+
+    with archive.open(info) as member:
+        if spool_dir is None:
+            content = bytearray()
+            for block in iter(lambda: member.read(MEMBER_READ_SIZE), b""):
+                digest.update(block)
+                content += block
+            return digest.hexdigest(), bytes(content)
+
+        spool_path = os.path.join(spool_dir, Path(info.filename).name)
+        with open(spool_path, "wb") as spool:
+            for block in iter(lambda: member.read(MEMBER_READ_SIZE), b""):
+                digest.update(block)
+                spool.write(block)
+        return digest.hexdigest(), spool_path
@@ -2,26 +2,24 @@
 Сервис для работы с архивами проектов
 """
 
+import asyncio
 import os
-import zipfile
 import json
-import hashlib
-import tempfile
+import time
+import uuid
 from typing import List, Dict, Any, Optional
 from pathlib import Path
-import aiofiles
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 
-from minio import Minio
-from minio.error import S3Error
-
-from schemas.archive import Manifest, ArchiveUploadRequest, ProcessingStatus
-from models.database import Archive, Document, SessionLocal, Project, ProcessingJob
+from schemas.archive import Manifest, ArchiveUploadRequest, ProcessingStatus, Discipline
+from models.database import Archive, SessionLocal, Project, ProcessingJob
 from services.minio_service import MinIOService
 
 logger = logging.getLogger(__name__)
 
+ACTIVE_JOB_STATUSES = (ProcessingStatus.PENDING.value, ProcessingStatus.PROCESSING.value)
+
 
 class ArchiveService:
     """Сервис для работы с архивами проектов"""
@@ -42,96 +40,58 @@ class ArchiveService:
             ID задания на обработку
         """
         try:
+            job_id = await asyncio.to_thread(self._create_job_records, request)
+            logger.info(f"Создано задание на обработку архива: {job_id}")
+            return job_id
+            
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке архива: {str(e)}")
+            raise
+    
+    def _create_job_records(self, request: ArchiveUploadRequest) -> str:
+        """Сохраняет проект, архив и задание одной транзакцией"""
+        manifest_data = request.manifest.model_dump(mode="json")
+        
+        with SessionLocal() as db:
             # Создаем или получаем проект
-            project = await self._get_or_create_project(request.manifest)
+            project = self._get_or_create_project(db, request.manifest)
             
             # Создаем запись архива
-            archive = Archive(
+            db.add(Archive(
                 project_id=project.id,
                 archive_path=request.archive_path,
                 archive_size=request.archive_size,
                 archive_hash=request.archive_hash,
-                manifest=request.manifest.dict(),
-                status=ProcessingStatus.PENDING
-            )
+                manifest=manifest_data,
+                status=ProcessingStatus.PENDING.value
+            ))
             
             # Создаем задание на обработку
-            job_id = f"archive_{request.manifest.project_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
-            job = ProcessingJob(
+            # Суффикс uuid: одновременные загрузки одного проекта не совпадают по времени
+            job_id = f"archive_{request.manifest.project_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+            db.add(ProcessingJob(
                 job_id=job_id,
                 project_id=request.manifest.project_id,
                 object_id=request.manifest.object_id,
                 job_type="archive_ingest",
-                status=ProcessingStatus.PENDING,
+                status=ProcessingStatus.PENDING.value,
                 parameters={
                     "archive_path": request.archive_path,
-                    "manifest": request.manifest.dict()
+                    "manifest": manifest_data
                 }
-            )
-            
-            logger.info(f"Создано задание на обработку архива: {job_id}")
+            ))
+            db.commit()
             return job_id
-            
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке архива: {str(e)}")
-            raise
-    
-    async def process_archive(self, job_id: str) -> Dict[str, Any]:
-        """
-        Обрабатывает архив: извлекает, парсит документы, создает чанки
-        
-        Args:
-            job_id: ID задания на обработку
-            
-        Returns:
-            Результат обработки
-        """
-        try:
-            # Получаем задание
-            job = await self._get_processing_job(job_id)
-            if not job:
-                raise ValueError(f"Задание {job_id} не найдено")
-            
-            # Обновляем статус
-            job.status = ProcessingStatus.PROCESSING
-            job.started_at = datetime.utcnow()
-            
-            # Скачиваем архив из MinIO
-            archive_path = job.parameters["archive_path"]
-            local_archive_path = await self._download_archive(archive_path)
-            
-            # Извлекаем архив
-            extract_path = await self._extract_archive(local_archive_path)
-            
-            # Читаем манифест
-            manifest = await self._read_manifest(extract_path)
-            
-            # Обрабатываем документы
-            result = await self._process_documents(extract_path, manifest, job)
-            
-            # Обновляем статус задания
-            job.status = ProcessingStatus.COMPLETED
-            job.completed_at = datetime.utcnow()
-            job.result = result
-            
-            # Очищаем временные файлы
-            await self._cleanup_temp_files(local_archive_path, extract_path)
-            
-            logger.info(f"Архив {job_id} успешно обработан")
-            return result
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обработке архива {job_id}: {str(e)}")
-            # Обновляем статус на ошибку
-            job.status = ProcessingStatus.FAILED
-            job.error_message = str(e)
-            job.completed_at = datetime.utcnow()
-            raise
     
-    async def _get_or_create_project(self, manifest: Manifest) -> Project:
+    def _get_or_create_project(self, db, manifest: Manifest) -> Project:
         """Создает или получает проект"""
-        # Здесь должна быть логика работы с БД
-        # Пока возвращаем заглушку
+        project = db.query(Project).filter(
+            Project.project_id == manifest.project_id,
+            Project.object_id == manifest.object_id
+        ).first()
+        if project is not None:
+            return project
+        
         project = Project(
             project_id=manifest.project_id,
             object_id=manifest.object_id,
@@ -142,88 +102,27 @@ class ArchiveService:
             confidentiality=manifest.confidentiality.value,
             default_discipline=manifest.default_discipline.value
         )
+        db.add(project)
+        db.flush()
         return project
     
-    async def _download_archive(self, archive_path: str) -> str:
-        """Скачивает архив из MinIO во временную папку"""
-        local_path = os.path.join(self.temp_dir, f"archive_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip")
-        
-        # Скачиваем файл из MinIO
-        await self.minio_service.download_file(archive_path, local_path)
-        
-        return local_path
-    
-    async def _extract_archive(self, archive_path: str) -> str:
-        """Извлекает архив"""
-        extract_path = archive_path.replace('.zip', '_extracted')
-        os.makedirs(extract_path, exist_ok=True)
-        
-        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_path)
-        
-        return extract_path
-    
-    async def _read_manifest(self, extract_path: str) -> Manifest:
-        """Читает манифест из архива"""
-        manifest_path = os.path.join(extract_path, "manifest.json")
-        
-        if not os.path.exists(manifest_path):
-            raise ValueError("manifest.json не найден в архиве")
-        
-        async with aiofiles.open(manifest_path, 'r', encoding='utf-8') as f:
-            content = await f.read()
-            manifest_data = json.loads(content)
-        
-        return Manifest(**manifest_data)
+    def parse_manifest(self, data: bytes) -> Manifest:
+        """Разбирает manifest.json архива"""
+        return Manifest(**json.loads(data.decode('utf-8')))
     
-    async def _process_documents(self, extract_path: str, manifest: Manifest, job: ProcessingJob) -> Dict[str, Any]:
-        """Обрабатывает документы в архиве"""
-        result = {
-            "total_files": 0,
-            "processed_files": 0,
-            "failed_files": 0,
-            "total_chunks": 0,
-            "documents": []
+    def describe_file(self, relative_path: str, manifest: Manifest) -> Dict[str, Any]:
+        """Метаданные файла архива для DocumentMetadata (без хеша, он считается при разборе)"""
+        return {
+            "doc_no": self._extract_doc_number(relative_path),
+            "rev": "A",  # По умолчанию
+            "doc_type": self._determine_document_type(relative_path),
+            "discipline": Discipline(self._determine_discipline(relative_path, manifest.default_discipline)).value,
+            "language": manifest.language[0] if manifest.language else "ru",
+            "source_path": relative_path,
+            "confidentiality": manifest.confidentiality.value,
+            "project_id": manifest.project_id,
+            "object_id": manifest.object_id
         }
-        
-        # Сканируем структуру архива
-        for root, dirs, files in os.walk(extract_path):
-            for file in files:
-                if file == "manifest.json":
-                    continue
-                
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, extract_path)
-                
-                result["total_files"] += 1
-                
-                try:
-                    # Определяем тип документа по папке
-                    doc_type = self._determine_document_type(relative_path)
-                    discipline = self._determine_discipline(relative_path, manifest.default_discipline)
-                    
-                    # Создаем запись документа
-                    document = await self._create_document_record(
-                        file_path, relative_path, doc_type, discipline, manifest
-                    )
-                    
-                    # Парсим документ
-                    chunks = await self._parse_document(file_path, document)
-                    
-                    result["processed_files"] += 1
-                    result["total_chunks"] += len(chunks)
-                    result["documents"].append({
-                        "path": relative_path,
-                        "type": doc_type,
-                        "discipline": discipline,
-                        "chunks": len(chunks)
-                    })
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке файла {relative_path}: {str(e)}")
-                    result["failed_files"] += 1
-        
-        return result
     
     def _determine_document_type(self, file_path: str) -> str:
         """Определяет тип документа по пути"""
@@ -269,46 +168,6 @@ class ArchiveService:
         else:
             return default_discipline
     
-    async def _create_document_record(self, file_path: str, relative_path: str, 
-                                    doc_type: str, discipline: str, manifest: Manifest) -> Document:
-        """Создает запись документа в БД"""
-        # Вычисляем хеш файла
-        file_hash = await self._calculate_file_hash(file_path)
-        
-        # Получаем размер файла
-        file_size = os.path.getsize(file_path)
-        
-        # Определяем MIME тип
-        mime_type = self._get_mime_type(file_path)
-        
-        # Извлекаем номер документа из имени файла
-        doc_no = self._extract_doc_number(relative_path)
-        
-        document = Document(
-            project_id=None,  # Будет установлено при сохранении
-            archive_id=None,  # Будет установлено при сохранении
-            doc_no=doc_no,
-            rev="A",  # По умолчанию
-            doc_type=doc_type,
-            discipline=discipline,
-            language=manifest.language[0] if manifest.language else "ru",
-            source_path=relative_path,
-            source_hash=file_hash,
-            file_size=file_size,
-            mime_type=mime_type,
-            status="pending"
-        )
-        
-        return document
-    
-    async def _calculate_file_hash(self, file_path: str) -> str:
-        """Вычисляет SHA-256 хеш файла"""
-        hash_sha256 = hashlib.sha256()
-        async with aiofiles.open(file_path, 'rb') as f:
-            while chunk := await f.read(8192):
-                hash_sha256.update(chunk)
-        return hash_sha256.hexdigest()
-    
     def _get_mime_type(self, file_path: str) -> str:
         """Определяет MIME тип файла"""
         ext = Path(file_path).suffix.lower()
@@ -333,49 +192,76 @@ class ArchiveService:
         # В реальном проекте это может быть более сложная логика
         return filename
     
-    async def _parse_document(self, file_path: str, document: Document) -> List[Dict[str, Any]]:
-        """Парсит документ и создает чанки"""
-        # Здесь будет логика парсинга документов
-        # Пока возвращаем заглушку
-        chunks = []
-        
-        # В зависимости от типа документа вызываем соответствующий парсер
-        if document.mime_type == 'application/pdf':
-            chunks = await self._parse_pdf(file_path, document)
-        elif document.mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword']:
-            chunks = await self._parse_docx(file_path, document)
-        elif document.mime_type in ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.ms-excel']:
-            chunks = await self._parse_xlsx(file_path, document)
-        elif document.mime_type == 'application/ifc':
-            chunks = await self._parse_ifc(file_path, document)
-        
-        return chunks
-    
-    async def _parse_pdf(self, file_path: str, document: Document) -> List[Dict[str, Any]]:
-        """Парсит PDF документ"""
-        # Заглушка - здесь будет реальная логика парсинга PDF
-        return [{"chunk_id": f"pdf_chunk_1", "content": "PDF content", "type": "text"}]
-    
-    async def _parse_docx(self, file_path: str, document: Document) -> List[Dict[str, Any]]:
-        """Парсит DOCX документ"""
-        # Заглушка - здесь будет реальная логика парсинга DOCX
-        return [{"chunk_id": f"docx_chunk_1", "content": "DOCX content", "type": "text"}]
+    async def get_processing_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Получает задание на обработку"""
+        jobs = await asyncio.to_thread(self._query_jobs, job_id=job_id, limit=1)
+        return jobs[0] if jobs else None
     
-    async def _parse_xlsx(self, file_path: str, document: Document) -> List[Dict[str, Any]]:
-        """Парсит XLSX документ"""
-        # Заглушка - здесь будет реальная логика парсинга XLSX
-        return [{"chunk_id": f"xlsx_chunk_1", "content": "XLSX content", "type": "table"}]
+    async def list_processing_jobs(self, project_id: Optional[str] = None, status: Optional[str] = None,
+                                   limit: int = 10) -> List[Dict[str, Any]]:
+        """Получает список заданий на обработку, новые первыми"""
+        return await asyncio.to_thread(self._query_jobs, project_id=project_id, status=status, limit=limit)
     
-    async def _parse_ifc(self, file_path: str, document: Document) -> List[Dict[str, Any]]:
-        """Парсит IFC документ"""
-        # Заглушка - здесь будет реальная логика парсинга IFC
-        return [{"chunk_id": f"ifc_chunk_1", "content": "IFC content", "type": "ifc"}]
+    async def wait_for_job_update(self, job_id: str, since: Optional[datetime] = None,
+                                  timeout: float = 25.0, poll_interval: float = 1.0) -> Optional[Dict[str, Any]]:
+        """
+        Ожидает обновления задания (long-poll)
+        
+        Args:
+            job_id: ID задания
+            since: Время последнего известного клиенту обновления (updated_at)
+            timeout: Максимальное время ожидания в секундах
+            poll_interval: Период опроса БД
+            
+        Returns:
+            Задание сразу, если оно обновлено после since или завершено, иначе по таймауту
+        """
+        if since is not None and since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get_processing_job(job_id)
+            if job is None or since is None or job["status"] not in ACTIVE_JOB_STATUSES:
+                return job
+            if job["updated_at"] is not None and job["updated_at"] > since:
+                return job
+            if time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
     
-    async def _get_processing_job(self, job_id: str) -> Optional[ProcessingJob]:
-        """Получает задание на обработку"""
-        # Здесь должна быть логика работы с БД
-        # Пока возвращаем заглушку
-        return None
+    def _query_jobs(self, job_id: Optional[str] = None, project_id: Optional[str] = None,
+                    status: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        with SessionLocal() as db:
+            query = db.query(ProcessingJob)
+            if job_id:
+                query = query.filter(ProcessingJob.job_id == job_id)
+            if project_id:
+                query = query.filter(ProcessingJob.project_id == project_id)
+            if status:
+                query = query.filter(ProcessingJob.status == status)
+            
+            return [
+                {
+                    "job_id": job.job_id,
+                    "project_id": job.project_id,
+                    "object_id": job.object_id,
+                    "status": job.status,
+                    "created_at": job.created_at,
+                    "started_at": job.started_at,
+                    "completed_at": job.completed_at,
+                    "error_message": job.error_message,
+                    "total_files": job.total_files or 0,
+                    "processed_files": job.processed_files or 0,
+                    "failed_files": job.failed_files or 0,
+                    "skipped_files": job.skipped_files or 0,
+                    "total_chunks": job.total_chunks or 0,
+                    "total_vectors": job.total_vectors or 0,
+                    "updated_at": job.updated_at,
+                    "progress": job.progress or {}
+                }
+                for job in query.order_by(ProcessingJob.created_at.desc()).limit(limit).all()
+            ]
     
     async def _cleanup_temp_files(self, *paths: str):
         """Очищает временные файлы"""
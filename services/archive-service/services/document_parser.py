@@ -5,41 +5,32 @@
 import os
 import io
 import logging
-from typing import List, Dict, Any, Optional, Union
+from typing import AsyncIterator, List, Dict, Any, Iterable, Iterator, Optional, Union
 from pathlib import Path
 import aiofiles
 
 # PDF обработка
-import pdfplumber
-import PyPDF2
 from pdf2image import convert_from_bytes
 import pytesseract
 from PIL import Image
 
 # Офисные документы
 from docx import Document as DocxDocument
-import openpyxl
 import pandas as pd
 
-# САПР файлы
-try:
-    import ifcopenshell
-    IFC_AVAILABLE = True
-except ImportError:
-    IFC_AVAILABLE = False
-    logging.warning("ifcopenshell не установлен, IFC файлы не будут обрабатываться")
-
-try:
-    import ezdxf
-    DXF_AVAILABLE = True
-except ImportError:
-    DXF_AVAILABLE = False
-    logging.warning("ezdxf не установлен, DXF файлы не будут обрабатываться")
-
-from schemas.archive import DocumentMetadata, TextChunk, TableChunk, DrawingChunk, IFCChunk
+from schemas.archive import DocumentMetadata, DocumentType, TextChunk, TableChunk, DrawingChunk, IFCChunk
+from services.drawing_renderer import DRAWING_DPI, DrawingPage, iter_pdf_drawing_pages, render_dxf_page
+from text_chunker import TextChunker
+from extraction_cache import ExtractionCache, iter_pdf_pages
+from table_reader import iter_row_chunks, table_row_chunks
+from ifc_extractor import IFC_AVAILABLE, iter_ifc_elements
+from dxf_extractor import EZDXF_AVAILABLE as DXF_AVAILABLE, extract_dxf_tiles
 
 logger = logging.getLogger(__name__)
 
+# Типы документов, листы которых растеризуются для поиска похожих чертежей
+DRAWING_DOC_TYPES = {DocumentType.PFD, DocumentType.PID, DocumentType.DRAWING}
+
 
 class DocumentParser:
     """Парсер документов различных форматов"""
@@ -55,14 +46,39 @@ class DocumentParser:
             'application/dxf': self._parse_dxf,
             'text/plain': self._parse_txt
         }
+        
+        # Форматы, которые разбираются из байтов без файла на диске (IFC и DXF читаются только с диска)
+        self.in_memory_formats = {
+            'application/pdf',
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            'application/msword',
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            'application/vnd.ms-excel',
+            'text/plain'
+        }
+        
+        # Разбиение по заголовкам, абзацам и предложениям, размер в словах
+        self.text_chunker = TextChunker(max_tokens=800, overlap_tokens=100)
+        
+        # Общий с другими сервисами кэш извлечения PDF по SHA-256 (текстовый слой, таблицы, OCR)
+        self.extraction_cache = ExtractionCache.from_env()
+        
+        # Форматы, чанки которых выдаются пакетами по мере разбора (iter_document_batches)
+        self.streaming_formats = {
+            'application/pdf': self._iter_pdf_batches,
+            'application/ifc': self._iter_ifc_batches,
+            'application/dxf': self._iter_dxf_batches,
+        }
     
-    async def parse_document(self, file_path: str, metadata: DocumentMetadata) -> List[Union[TextChunk, TableChunk, DrawingChunk, IFCChunk]]:
+    async def parse_document(self, file_path: str, metadata: DocumentMetadata,
+                             content: Optional[bytes] = None) -> List[Union[TextChunk, TableChunk, DrawingChunk, IFCChunk]]:
         """
         Парсит документ и возвращает чанки
         
         Args:
-            file_path: Путь к файлу
+            file_path: Путь к файлу (для content - имя файла в архиве)
             metadata: Метаданные документа
+            content: Содержимое файла, если он уже прочитан в память (только in_memory_formats)
             
         Returns:
             Список чанков
@@ -74,7 +90,12 @@ class DocumentParser:
                 raise ValueError(f"Неподдерживаемый формат файла: {mime_type}")
             
             parser = self.supported_formats[mime_type]
-            chunks = await parser(file_path, metadata)
+            if content is None:
+                chunks = await parser(file_path, metadata)
+            elif mime_type in self.in_memory_formats:
+                chunks = await parser(file_path, metadata, content=content)
+            else:
+                raise ValueError(f"Формат {mime_type} разбирается только из файла")
             
             logger.info(f"Документ {file_path} успешно обработан, создано {len(chunks)} чанков")
             return chunks
@@ -83,69 +104,98 @@ class DocumentParser:
             logger.error(f"Ошибка при парсинге документа {file_path}: {str(e)}")
             raise
     
-    async def _parse_pdf(self, file_path: str, metadata: DocumentMetadata) -> List[Union[TextChunk, TableChunk, DrawingChunk]]:
+    async def iter_document_batches(self, file_path: str, metadata: DocumentMetadata,
+                                    content: Optional[bytes] = None) -> AsyncIterator[List[Union[TextChunk, TableChunk, DrawingChunk, IFCChunk]]]:
+        """
+        Чанки документа пакетами
+        
+        Форматы из streaming_formats выдаются пакетами по мере разбора, поэтому
+        чанки крупной модели не находятся в памяти одновременно; остальные
+        форматы - одним пакетом, как parse_document.
+        """
+        mime_type = self._get_mime_type(file_path)
+        streaming = self.streaming_formats.get(mime_type)
+        if streaming is None or (content is not None and mime_type not in self.in_memory_formats):
+            yield await self.parse_document(file_path, metadata, content=content)
+            return
+        
+        count = 0
+        batches = streaming(file_path, metadata) if content is None else streaming(file_path, metadata, content=content)
+        async for batch in batches:
+            count += len(batch)
+            yield batch
+        logger.info(f"Документ {file_path} успешно обработан, создано {count} чанков")
+    
+    async def _parse_pdf(self, file_path: str, metadata: DocumentMetadata,
+                         content: Optional[bytes] = None) -> List[Union[TextChunk, TableChunk, DrawingChunk]]:
         """Парсит PDF документ"""
-        chunks = []
+        return [chunk async for batch in self._iter_pdf_batches(file_path, metadata, content) for chunk in batch]
+    
+    async def _iter_pdf_batches(self, file_path: str, metadata: DocumentMetadata,
+                                content: Optional[bytes] = None) -> AsyncIterator[List[Union[TextChunk, TableChunk, DrawingChunk]]]:
+        """Пакеты чанков PDF: текст и таблицы, затем фрагменты листов чертежа по листу в пакете"""
+        found = False
         
         try:
-            # Метод 1: pdfplumber для текстовых PDF
-            text_chunks = await self._parse_pdf_with_pdfplumber(file_path, metadata)
-            chunks.extend(text_chunks)
+            # Метод 1: текстовый слой и таблицы (pdfplumber, затем PyPDF2) или готовая запись кэша
+            source = content if content is not None else file_path
+            record = await self.extraction_cache.load_pdf(metadata.source_hash, source, with_tables=True)
+            chunks = self._create_pdf_chunks(record, metadata)
             
             # Если текст не извлечен, пробуем OCR
-            if not text_chunks:
-                ocr_chunks = await self._parse_pdf_with_ocr(file_path, metadata)
-                chunks.extend(ocr_chunks)
+            if not chunks and "ocr_pages" not in record:
+                ocr_pages = await self._parse_pdf_with_ocr(file_path, content)
+                if ocr_pages:
+                    record["ocr_pages"] = ocr_pages
+                    await self.extraction_cache.update(metadata.source_hash, {"ocr_pages": ocr_pages})
+                    chunks = self._create_pdf_chunks(record, metadata)
+            
+            if chunks:
+                found = True
+                yield chunks
             
-            # Если все еще нет чанков, создаем чанк для чертежа
-            if not chunks:
-                drawing_chunk = await self._create_drawing_chunk(file_path, metadata)
-                chunks.append(drawing_chunk)
+            # Листы чертежей (и PDF без текста) растеризуются, фрагменты векторизуются CLIP
+            if DRAWING_DPI and (metadata.doc_type in DRAWING_DOC_TYPES or not found):
+                for page_chunks in self._iter_drawing_batches(iter_pdf_drawing_pages(source), metadata, file_path):
+                    found = True
+                    yield page_chunks
             
         except Exception as e:
             logger.warning(f"Ошибка при парсинге PDF {file_path}: {str(e)}")
             # Создаем чанк для чертежа как fallback
-            drawing_chunk = await self._create_drawing_chunk(file_path, metadata)
-            chunks.append(drawing_chunk)
+            found = False
         
-        return chunks
+        # Если нет чанков, создаем чанк для чертежа
+        if not found:
+            yield [await self._create_drawing_chunk(file_path, metadata)]
     
-    async def _parse_pdf_with_pdfplumber(self, file_path: str, metadata: DocumentMetadata) -> List[Union[TextChunk, TableChunk]]:
-        """Парсит PDF с помощью pdfplumber"""
+    def _create_pdf_chunks(self, record: Dict[str, Any], metadata: DocumentMetadata) -> List[Union[TextChunk, TableChunk]]:
+        """Текстовые чанки и чанки таблиц, страницы обходятся лениво по порядку"""
         chunks = []
         
-        with pdfplumber.open(file_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                # Извлекаем текст
-                page_text = page.extract_text()
-                if page_text and page_text.strip():
-                    # Нормализуем текст
-                    normalized_text = self._normalize_text(page_text)
-                    
-                    # Создаем текстовые чанки
-                    text_chunks = self._create_text_chunks(
-                        normalized_text, metadata, page_num + 1
-                    )
-                    chunks.extend(text_chunks)
-                
-                # Извлекаем таблицы
-                tables = page.extract_tables()
-                for table_num, table in enumerate(tables):
-                    if table:
-                        table_chunk = self._create_table_chunk(
-                            table, metadata, page_num + 1, table_num + 1
-                        )
-                        chunks.append(table_chunk)
+        for page in iter_pdf_pages(record):
+            if page.text.strip():
+                # Нормализуем текст и создаем текстовые чанки
+                normalized_text = self._normalize_text(page.text)
+                chunks.extend(self._create_text_chunks(normalized_text, metadata, page.page_number))
+            
+            for table in page.tables:
+                chunks.extend(self._create_table_chunks(
+                    table["data"], metadata, page.page_number, table["table"], table.get("bbox")
+                ))
         
         return chunks
     
-    async def _parse_pdf_with_ocr(self, file_path: str, metadata: DocumentMetadata) -> List[TextChunk]:
-        """Парсит PDF с помощью OCR"""
-        chunks = []
+    async def _parse_pdf_with_ocr(self, file_path: str, content: Optional[bytes] = None) -> List[List[Any]]:
+        """Распознает PDF с помощью OCR, возвращает [[номер страницы, текст]]"""
+        pages = []
         
         try:
             # Конвертируем PDF в изображения
-            images = convert_from_bytes(open(file_path, 'rb').read(), dpi=300)
+            if content is None:
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+            images = convert_from_bytes(content, dpi=300)
             
             for page_num, image in enumerate(images):
                 # Настраиваем Tesseract для русского и английского языков
@@ -155,19 +205,44 @@ class DocumentParser:
                 page_text = pytesseract.image_to_string(image, config=custom_config)
                 
                 if page_text and page_text.strip():
-                    # Нормализуем текст
-                    normalized_text = self._normalize_text(page_text)
-                    
-                    # Создаем текстовые чанки
-                    text_chunks = self._create_text_chunks(
-                        normalized_text, metadata, page_num + 1
-                    )
-                    chunks.extend(text_chunks)
+                    pages.append([page_num + 1, page_text])
         
         except Exception as e:
             logger.warning(f"Ошибка OCR для {file_path}: {str(e)}")
         
-        return chunks
+        return pages
+    
+    def _iter_drawing_batches(self, pages: Iterable[DrawingPage], metadata: DocumentMetadata,
+                              file_path: str) -> Iterator[List[DrawingChunk]]:
+        """Чанки фрагментов растеризованных листов по листу в пакете; миниатюра листа передается с обзорным фрагментом"""
+        filename = Path(file_path).stem
+        
+        try:
+            for page in pages:
+                page_metadata = metadata.model_copy(update={"page": page.page_number})
+                chunks = []
+                for tile in page.tiles:
+                    # ID зависит от растра листа: неизменившийся лист новой ревизии не кодируется повторно
+                    tile_key = "page" if tile.box is None else f"{tile.box[0]}_{tile.box[1]}"
+                    content = f"Чертеж: {filename}, лист {page.page_number}"
+                    if tile.box is not None:
+                        content += f", фрагмент {tile.box}"
+                    
+                    chunks.append(DrawingChunk(
+                        chunk_id=f"drawing_{metadata.doc_no}_{page.page_hash[:32]}_{tile_key}",
+                        content=content,
+                        metadata=page_metadata,
+                        chunk_type="drawing",
+                        preview_path=f"previews/{page.page_hash}.jpg",
+                        page_hash=page.page_hash,
+                        tile=tile.box,
+                        image=tile.image,
+                        thumbnail=page.thumbnail if tile.box is None else None
+                    ))
+                yield chunks
+        
+        except Exception as e:
+            logger.warning(f"Ошибка при растеризации чертежа {file_path}: {str(e)}")
     
     async def _create_drawing_chunk(self, file_path: str, metadata: DocumentMetadata) -> DrawingChunk:
         """Создает чанк для чертежа"""
@@ -186,12 +261,13 @@ class DocumentParser:
             extracted_text=None
         )
     
-    async def _parse_docx(self, file_path: str, metadata: DocumentMetadata) -> List[TextChunk]:
+    async def _parse_docx(self, file_path: str, metadata: DocumentMetadata,
+                          content: Optional[bytes] = None) -> List[Union[TextChunk, TableChunk]]:
         """Парсит DOCX документ"""
         chunks = []
         
         try:
-            doc = DocxDocument(file_path)
+            doc = DocxDocument(io.BytesIO(content) if content is not None else file_path)
             full_text = []
             
             # Извлекаем текст из параграфов
@@ -199,15 +275,23 @@ class DocumentParser:
                 if paragraph.text.strip():
                     full_text.append(paragraph.text)
             
-            # Извлекаем текст из таблиц
-            for table in doc.tables:
+            # Извлекаем текст из таблиц, строки таблиц дополнительно идут в ae_tables
+            for table_num, table in enumerate(doc.tables, 1):
+                rows = []
                 for row in table.rows:
+                    cells = row.cells
                     row_text = []
-                    for cell in row.cells:
+                    for cell in cells:
                         if cell.text.strip():
                             row_text.append(cell.text.strip())
                     if row_text:
                         full_text.append(" | ".join(row_text))
+                    # Объединенная по горизонтали ячейка повторяется в row.cells, оставляем первую
+                    rows.append([
+                        cell.text if index == 0 or cell._tc is not cells[index - 1]._tc else None
+                        for index, cell in enumerate(cells)
+                    ])
+                chunks.extend(self._create_table_chunks(rows, metadata, None, table_num))
             
             if full_text:
                 combined_text = "\n".join(full_text)
@@ -222,38 +306,15 @@ class DocumentParser:
         
         return chunks
     
-    async def _parse_xlsx(self, file_path: str, metadata: DocumentMetadata) -> List[TableChunk]:
-        """Парсит XLSX документ"""
+    async def _parse_xlsx(self, file_path: str, metadata: DocumentMetadata,
+                          content: Optional[bytes] = None) -> List[TableChunk]:
+        """Парсит XLSX/XLS документ: строки читаются потоком, по чанку на строку"""
         chunks = []
         
         try:
-            workbook = openpyxl.load_workbook(file_path, data_only=True)
-            
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                
-                # Извлекаем данные из листа
-                for row_num, row in enumerate(sheet.iter_rows(values_only=True), 1):
-                    if any(cell is not None for cell in row):
-                        # Создаем чанк для строки таблицы
-                        row_data = {f"col_{i}": str(cell) if cell is not None else "" 
-                                   for i, cell in enumerate(row)}
-                        
-                        # Создаем текстовое представление строки
-                        row_text = " | ".join(str(cell) if cell is not None else "" for cell in row)
-                        
-                        chunk_id = f"table_{metadata.doc_no}_{sheet_name}_row_{row_num}"
-                        row_hash = self._calculate_row_hash(row_data)
-                        
-                        table_chunk = TableChunk(
-                            chunk_id=chunk_id,
-                            content=row_text,
-                            metadata=metadata,
-                            chunk_type="table",
-                            row_data=row_data,
-                            row_hash=row_hash
-                        )
-                        chunks.append(table_chunk)
+            key_prefix = f"table_{metadata.doc_no}_{metadata.rev}"
+            for batch in iter_row_chunks(file_path, key_prefix=key_prefix, content=content):
+                chunks.extend(self._to_table_chunk(row, metadata) for row in batch)
         
         except Exception as e:
             logger.error(f"Ошибка при парсинге XLSX {file_path}: {str(e)}")
@@ -261,109 +322,85 @@ class DocumentParser:
         return chunks
     
     async def _parse_ifc(self, file_path: str, metadata: DocumentMetadata) -> List[IFCChunk]:
-        """Парсит IFC документ"""
-        chunks = []
-        
+        """Парсит IFC документ: по чанку на объект, модель разбирается в отдельном процессе с лимитом памяти"""
+        return [chunk async for batch in self._iter_ifc_batches(file_path, metadata) for chunk in batch]
+    
+    async def _iter_ifc_batches(self, file_path: str, metadata: DocumentMetadata) -> AsyncIterator[List[IFCChunk]]:
+        """Пакеты чанков IFC по мере разбора модели"""
         if not IFC_AVAILABLE:
             logger.warning("IFC парсинг недоступен, ifcopenshell не установлен")
-            return chunks
+            return
         
         try:
-            ifc_file = ifcopenshell.open(file_path)
-            
-            # Извлекаем объекты по типам
-            object_types = {}
-            for entity in ifc_file:
-                entity_type = entity.is_a()
-                if entity_type not in object_types:
-                    object_types[entity_type] = []
-                object_types[entity_type].append(entity)
-            
-            # Создаем чанки для каждого типа объектов
-            for entity_type, entities in object_types.items():
-                if len(entities) > 0:
-                    # Создаем описательный текст для типа объектов
-                    content = f"Тип объекта: {entity_type}\nКоличество: {len(entities)}"
-                    
-                    # Извлекаем свойства первого объекта как пример
-                    if entities:
-                        sample_entity = entities[0]
-                        properties = self._extract_ifc_properties(sample_entity)
-                        content += f"\nПример свойств: {properties}"
-                    
-                    chunk_id = f"ifc_{metadata.doc_no}_{entity_type}"
-                    
-                    ifc_chunk = IFCChunk(
-                        chunk_id=chunk_id,
-                        content=content,
+            key_prefix = f"ifc_{metadata.doc_no}_{metadata.rev}"
+            for batch in iter_ifc_elements(file_path, key_prefix):
+                yield [
+                    IFCChunk(
+                        chunk_id=element["chunk_id"],
+                        content=element["content"],
                         metadata=metadata,
                         chunk_type="ifc",
-                        ifc_type=entity_type,
-                        ifc_guid=sample_entity.GlobalId if entities else "",
-                        properties=properties
+                        ifc_type=element["ifc_type"],
+                        ifc_guid=element["ifc_guid"],
+                        properties=element["properties"]
                     )
-                    chunks.append(ifc_chunk)
+                    for element in batch
+                ]
         
         except Exception as e:
+            # Модель, не поместившаяся в лимит памяти, - ошибка файла, а не пустой результат
             logger.error(f"Ошибка при парсинге IFC {file_path}: {str(e)}")
-        
-        return chunks
+            raise
     
-    async def _parse_dxf(self, file_path: str, metadata: DocumentMetadata) -> List[DrawingChunk]:
-        """Парсит DXF документ"""
-        chunks = []
-        
+    async def _parse_dxf(self, file_path: str, metadata: DocumentMetadata) -> List[Union[TextChunk, DrawingChunk]]:
+        """Парсит DXF документ: надписи и атрибуты блоков по участкам листа с bbox, растр пространства модели"""
+        return [chunk async for batch in self._iter_dxf_batches(file_path, metadata) for chunk in batch]
+    
+    async def _iter_dxf_batches(self, file_path: str, metadata: DocumentMetadata) -> AsyncIterator[List[Union[TextChunk, DrawingChunk]]]:
+        """Пакеты чанков DXF: надписи участков листа, затем фрагменты растра"""
         if not DXF_AVAILABLE:
             logger.warning("DXF парсинг недоступен, ezdxf не установлен")
-            return chunks
+            return
         
         try:
-            doc = ezdxf.readfile(file_path)
-            msp = doc.modelspace()
-            
-            # Извлекаем информацию о слоях
-            layers = {}
-            for entity in msp:
-                layer_name = entity.dxf.layer
-                if layer_name not in layers:
-                    layers[layer_name] = []
-                layers[layer_name].append(entity.dxftype())
+            drawing = extract_dxf_tiles(file_path, f"dxf_{metadata.doc_no}_{metadata.rev}")
             
-            # Создаем чанк с информацией о слоях
-            content = f"DXF файл: {Path(file_path).name}\n"
-            content += f"Количество слоев: {len(layers)}\n"
-            content += "Слои:\n"
-            
-            for layer_name, entity_types in layers.items():
-                content += f"- {layer_name}: {', '.join(set(entity_types))}\n"
-            
-            chunk_id = f"dxf_{metadata.doc_no}_{metadata.rev}"
+            yield [
+                TextChunk(
+                    chunk_id=tile["chunk_id"],
+                    content=tile["content"],
+                    metadata=metadata.model_copy(update={"section": tile["layout"]}),
+                    chunk_type="text",
+                    token_count=len(tile["content"].split()),
+                    bbox=tile["bbox"]
+                )
+                for tile in drawing["tiles"]
+            ]
             
-            drawing_chunk = DrawingChunk(
-                chunk_id=chunk_id,
-                content=content,
-                metadata=metadata,
-                chunk_type="drawing",
-                preview_path=None,
-                extracted_text=content
-            )
-            chunks.append(drawing_chunk)
+            # Крупные DXF читаются потоком и не растеризуются (полная загрузка занимает минуты)
+            if DRAWING_DPI and drawing["extraction_method"] == "readfile":
+                for page_chunks in self._iter_drawing_batches(
+                    filter(None, [render_dxf_page(file_path)]), metadata, file_path
+                ):
+                    yield page_chunks
         
         except Exception as e:
             logger.error(f"Ошибка при парсинге DXF {file_path}: {str(e)}")
-        
-        return chunks
     
-    async def _parse_txt(self, file_path: str, metadata: DocumentMetadata) -> List[TextChunk]:
+    async def _parse_txt(self, file_path: str, metadata: DocumentMetadata,
+                         content: Optional[bytes] = None) -> List[TextChunk]:
         """Парсит текстовый файл"""
         chunks = []
         
         try:
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
+            if content is not None:
+                text = content.decode('utf-8')
+            else:
+                async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+                    text = await f.read()
             
-            if content.strip():
-                normalized_text = self._normalize_text(content)
+            if text.strip():
+                normalized_text = self._normalize_text(text)
                 text_chunks = self._create_text_chunks(normalized_text, metadata)
                 chunks.extend(text_chunks)
         
@@ -435,109 +472,50 @@ class DocumentParser:
     
     def _create_text_chunks(self, text: str, metadata: DocumentMetadata, page: Optional[int] = None) -> List[TextChunk]:
         """Создает текстовые чанки"""
-        chunks = []
-        
-        # Разбиваем текст на чанки по заголовкам или по размеру
-        chunk_size = 800  # токенов
-        overlap = 100     # токенов
-        
-        # Простое разбиение по размеру (в реальном проекте нужно учитывать заголовки)
-        words = text.split()
-        current_chunk = []
-        current_size = 0
-        
-        for i, word in enumerate(words):
-            current_chunk.append(word)
-            current_size += 1
-            
-            if current_size >= chunk_size or i == len(words) - 1:
-                chunk_text = " ".join(current_chunk)
-                
-                chunk_id = f"text_{metadata.doc_no}_{metadata.rev}_{page or 1}_{len(chunks) + 1}"
-                
-                chunk = TextChunk(
-                    chunk_id=chunk_id,
-                    content=chunk_text,
-                    metadata=metadata,
-                    chunk_type="text",
-                    token_count=current_size,
-                    overlap=overlap if len(chunks) > 0 else 0
-                )
-                chunks.append(chunk)
-                
-                # Начинаем новый чанк с перекрытием
-                if i < len(words) - 1:
-                    current_chunk = current_chunk[-overlap:] if overlap > 0 else []
-                    current_size = len(current_chunk)
-        
-        return chunks
+        # ID чанков зависят от файла, страницы и смещений, поэтому стабильны между загрузками
+        doc_hash = f"{metadata.source_hash}:{page or 1}" if metadata.source_hash else None
+        if page is not None:
+            metadata = metadata.model_copy(update={"page": page})
+        
+        return [
+            TextChunk(
+                chunk_id=chunk.chunk_id,
+                content=chunk.text,
+                metadata=metadata.model_copy(update={"section": chunk.section}) if chunk.section else metadata,
+                chunk_type="text",
+                token_count=chunk.token_count,
+                overlap=self.text_chunker.overlap_tokens if chunk.index > 0 else 0
+            )
+            for chunk in self.text_chunker.iter_chunks(text, doc_hash)
+        ]
     
-    def _create_table_chunk(self, table: List[List[str]], metadata: DocumentMetadata, 
-                          page: int, table_num: int) -> TableChunk:
-        """Создает чанк таблицы"""
-        # Преобразуем таблицу в текстовое представление
-        table_text = []
-        for row in table:
-            if row:
-                table_text.append(" | ".join(str(cell) if cell else "" for cell in row))
-        
-        content = "\n".join(table_text)
-        
-        # Создаем данные строки (берем первую строку как пример)
-        row_data = {}
-        if table and table[0]:
-            for i, cell in enumerate(table[0]):
-                row_data[f"col_{i}"] = str(cell) if cell else ""
-        
-        chunk_id = f"table_{metadata.doc_no}_{metadata.rev}_{page}_{table_num}"
-        row_hash = self._calculate_row_hash(row_data)
+    def _create_table_chunks(self, table: List[List[Any]], metadata: DocumentMetadata,
+                             page: Optional[int], table_num: int, bbox: Optional[List[float]] = None) -> List[TableChunk]:
+        """Создает чанки строк таблицы: шапка определяется автоматически и подставляется в каждую строку"""
+        key_prefix = f"table_{metadata.doc_no}_{metadata.rev}_{page or 0}_{table_num}"
+        if page is not None:
+            metadata = metadata.model_copy(update={"page": page})
+        
+        return [self._to_table_chunk(row, metadata, bbox) for row in table_row_chunks(table, key_prefix=key_prefix)]
+    
+    def _to_table_chunk(self, row: Dict[str, Any], metadata: DocumentMetadata,
+                        bbox: Optional[List[float]] = None) -> TableChunk:
+        """TableChunk из чанка строки table_reader; числовые столбцы попадают в metadata.numeric"""
+        update = {"numeric": {**metadata.numeric, **{name: item["value"] for name, item in row["numeric"].items()}}}
+        if row["section"]:
+            update["section"] = row["section"]
         
         return TableChunk(
-            chunk_id=chunk_id,
-            content=content,
-            metadata=metadata,
+            chunk_id=row["chunk_id"],
+            content=row["content"],
+            metadata=metadata.model_copy(update=update),
             chunk_type="table",
-            row_data=row_data,
-            row_hash=row_hash
+            row_data=row["row_data"],
+            row_hash=row["row_hash"],
+            row_number=row["row_number"],
+            bbox=bbox
         )
     
-    def _calculate_row_hash(self, row_data: Dict[str, Any]) -> str:
-        """Вычисляет хеш строки таблицы"""
-        import hashlib
-        import json
-        
-        # Сортируем ключи для консистентности
-        sorted_data = json.dumps(row_data, sort_keys=True)
-        return hashlib.md5(sorted_data.encode()).hexdigest()
-    
-    def _extract_ifc_properties(self, entity) -> Dict[str, Any]:
-        """Извлекает свойства IFC объекта"""
-        properties = {}
-        
-        try:
-            # Базовые свойства
-            if hasattr(entity, 'GlobalId'):
-                properties['GlobalId'] = entity.GlobalId
-            if hasattr(entity, 'Name'):
-                properties['Name'] = entity.Name
-            if hasattr(entity, 'Description'):
-                properties['Description'] = entity.Description
-            
-            # Дополнительные свойства из Pset
-            if hasattr(entity, 'IsDefinedBy'):
-                for rel in entity.IsDefinedBy:
-                    if hasattr(rel, 'RelatingPropertyDefinition'):
-                        pset = rel.RelatingPropertyDefinition
-                        if hasattr(pset, 'HasProperties'):
-                            for prop in pset.HasProperties:
-                                if hasattr(prop, 'Name') and hasattr(prop, 'NominalValue'):
-                                    properties[prop.Name] = prop.NominalValue
-        
-        except Exception as e:
-            logger.warning(f"Ошибка при извлечении свойств IFC: {str(e)}")
-        
-        return properties
-    
     def _get_mime_type(self, file_path: str) -> str:
         """Определяет MIME тип файла"""
         ext = Path(file_path).suffix.lower()
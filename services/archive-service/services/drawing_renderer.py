@@ -0,0 +1,149 @@
+"""
+Растеризация чертежей (PDF, DXF) и нарезка листов на фрагменты для CLIP
+
+Каждый лист растеризуется с разрешением DRAWING_DPI и дает:
+- обзорный фрагмент (лист целиком, уменьшенный),
+- фрагменты сетки DRAWING_TILE_SIZE x DRAWING_TILE_SIZE пикселей (пустые
+  фрагменты без линий пропускаются),
+- миниатюру для предпросмотра.
+
+Хеш листа считается по пикселям растра: неизменившийся лист новой
+ревизии получает тот же хеш, и его фрагменты не кодируются повторно.
+PDF растеризуется по одной странице, весь документ в памяти не держится.
+"""
+
+import hashlib
+import io
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple, Union
+
+from PIL import Image
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes, pdfinfo_from_path
+
+try:
+    import ezdxf
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from ezdxf.addons.drawing import Frontend, RenderContext
+    from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
+    DXF_RASTER_AVAILABLE = True
+except ImportError:
+    DXF_RASTER_AVAILABLE = False
+    logging.warning("ezdxf или matplotlib не установлены, DXF не будут растеризоваться")
+
+logger = logging.getLogger(__name__)
+
+# Разрешение растеризации, 0 - растеризация отключена
+DRAWING_DPI = int(os.getenv("DRAWING_DPI", "150"))
+
+# Размер фрагмента сетки в пикселях растра
+DRAWING_TILE_SIZE = int(os.getenv("DRAWING_TILE_SIZE", "1024"))
+
+# Фрагменты хранятся уменьшенными: CLIP все равно работает с 224 x 224
+TILE_IMAGE_SIZE = 448
+
+# Размер миниатюры листа
+THUMBNAIL_SIZE = 512
+
+# Фрагмент, все пиксели которого светлее этого порога, считается пустым
+BLANK_THRESHOLD = 245
+
+# Ширина растра DXF в дюймах (высота - по пропорциям чертежа)
+DXF_FIGURE_WIDTH = 24
+
+
+@dataclass
+class DrawingTile:
+    """Фрагмент листа"""
+    image: bytes  # PNG
+    box: Optional[List[int]] = None  # [x0, y0, x1, y1] в пикселях листа, None - лист целиком
+
+
+@dataclass
+class DrawingPage:
+    """Растеризованный лист"""
+    page_number: int
+    page_hash: str
+    size: Tuple[int, int]
+    thumbnail: bytes  # JPEG
+    tiles: List[DrawingTile] = field(default_factory=list)
+
+
+def iter_pdf_drawing_pages(source: Union[str, bytes], dpi: int = DRAWING_DPI,
+                           tile_size: int = DRAWING_TILE_SIZE) -> Iterator[DrawingPage]:
+    """Листы PDF по одному (файл или содержимое)"""
+    info = pdfinfo_from_bytes(source) if isinstance(source, bytes) else pdfinfo_from_path(source)
+
+    for page_number in range(1, int(info.get("Pages", 0)) + 1):
+        if isinstance(source, bytes):
+            images = convert_from_bytes(source, dpi=dpi, first_page=page_number, last_page=page_number)
+        else:
+            images = convert_from_path(source, dpi=dpi, first_page=page_number, last_page=page_number)
+        if images:
+            yield split_page(page_number, images[0], tile_size)
+
+
+def render_dxf_page(file_path: str, dpi: int = DRAWING_DPI,
+                    tile_size: int = DRAWING_TILE_SIZE) -> Optional[DrawingPage]:
+    """Пространство модели DXF одним листом"""
+    if not DXF_RASTER_AVAILABLE:
+        return None
+
+    doc = ezdxf.readfile(file_path)
+    figure = plt.figure()
+    try:
+        axes = figure.add_axes([0, 0, 1, 1])
+        Frontend(RenderContext(doc), MatplotlibBackend(axes)).draw_layout(doc.modelspace(), finalize=True)
+        x0, x1 = axes.get_xlim()
+        y0, y1 = axes.get_ylim()
+        aspect = abs(y1 - y0) / abs(x1 - x0) if x1 != x0 else 1.0
+        figure.set_size_inches(DXF_FIGURE_WIDTH, max(1.0, DXF_FIGURE_WIDTH * aspect))
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, dpi=dpi, format="png", facecolor="white")
+    finally:
+        plt.close(figure)
+
+    buffer.seek(0)
+    with Image.open(buffer) as image:
+        return split_page(1, image.convert("RGB"), tile_size)
+
+
+def split_page(page_number: int, image: Image.Image, tile_size: int = DRAWING_TILE_SIZE) -> DrawingPage:
+    """Хеш, миниатюра, обзорный фрагмент и непустые фрагменты сетки листа"""
+    image = image.convert("RGB")
+    width, height = image.size
+    page_hash = hashlib.sha256(f"{width}x{height}".encode() + image.tobytes()).hexdigest()
+
+    page = DrawingPage(
+        page_number=page_number,
+        page_hash=page_hash,
+        size=(width, height),
+        thumbnail=_encode(image, THUMBNAIL_SIZE, "JPEG"),
+        tiles=[DrawingTile(image=_encode(image, TILE_IMAGE_SIZE))]
+    )
+
+    # Лист не больше одного фрагмента представлен только обзорным фрагментом
+    if width <= tile_size and height <= tile_size:
+        return page
+
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            box = [left, top, min(left + tile_size, width), min(top + tile_size, height)]
+            tile = image.crop(box)
+            if tile.convert("L").getextrema()[0] > BLANK_THRESHOLD:
+                continue
+            page.tiles.append(DrawingTile(image=_encode(tile, TILE_IMAGE_SIZE), box=box))
+
+    return page
+
+
+def _encode(image: Image.Image, max_size: int, image_format: str = "PNG") -> bytes:
+    image = image.copy()
+    image.thumbnail((max_size, max_size))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **({"quality": 85} if image_format == "JPEG" else {}))
+    return buffer.getvalue()
@@ -0,0 +1,797 @@
+"""
+Параллельная возобновляемая загрузка архивов проектов
+
+Архив не скачивается и не распаковывается: список файлов берется из
+центрального каталога ZIP (ranged GET в MinIO), а каждый воркер читает
+свой файл архива потоком. Файлы проходят конвейер:
+1. очередь файлов, крупные первыми; одновременно в разборе не больше
+   max_inflight_bytes и не больше двух файлов на воркер;
+2. распаковка с хешированием за один проход и разбор DocumentParser
+   в пуле процессов (небольшие файлы - из памяти, остальные и форматы,
+   читаемые только с диска, - через временный файл на время разбора);
+   чанки пишутся пакетами в файл в каталоге файла, который движок удаляет
+   после векторизации или остановки воркера;
+3. эмбеддинги и upsert в Qdrant по пакетам, не больше embed_concurrency
+   файлов сразу.
+
+Результат каждого файла - строка archive_file_checkpoints. Строки, счетчики
+и скорость обработки (файлов/с, чанков/с, очередь векторизации) пишутся в
+Postgres пакетами, одной транзакцией вместе с продлением аренды задания. Задание,
+прерванное падением или перезапуском пода, подхватывается при старте
+сервиса (или другим экземпляром после истечения аренды) и обрабатывает
+только файлы без чекпоинта.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import time
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+
+from models.database import FileCheckpoint, ProcessingJob, SessionLocal
+from schemas.archive import DocumentMetadata, ProcessingStatus, VectorizationRequest
+from services.archive_reader import stream_member
+from services.document_parser import DocumentParser
+
+logger = logging.getLogger(__name__)
+
+# Коллекция Qdrant для каждого типа чанка
+COLLECTION_BY_CHUNK_TYPE = {
+    "text": "ae_text_m3",
+    "table": "ae_tables",
+    "drawing": "ae_drawings_clip",
+    "ifc": "ae_ifc",
+}
+
+ACTIVE_JOB_STATUSES = (ProcessingStatus.PENDING.value, ProcessingStatus.PROCESSING.value)
+
+# Окно, по которому считается текущая скорость обработки
+RATE_WINDOW_SECONDS = 60.0
+
+# === Разбор в пуле процессов ===
+
+# Сколько архивов держит открытыми воркер (центральный каталог читается один раз)
+WORKER_OPEN_ARCHIVES = 2
+
+_worker_parser: Optional[DocumentParser] = None
+_worker_source: Any = None
+_worker_archives: "OrderedDict[str, Tuple[zipfile.ZipFile, Any]]" = OrderedDict()
+
+def _init_parse_worker(archive_source: Any):
+    """Парсер и источник архивов создаются один раз на процесс"""
+    global _worker_parser, _worker_source
+    _worker_parser = DocumentParser()
+    _worker_source = archive_source
+
+def _open_worker_archive(object_name: str) -> zipfile.ZipFile:
+    opened = _worker_archives.get(object_name)
+    if opened is not None:
+        _worker_archives.move_to_end(object_name)
+        return opened[0]
+
+    stream = _worker_source.open(object_name)
+    archive = zipfile.ZipFile(stream)
+    _worker_archives[object_name] = (archive, stream)
+    while len(_worker_archives) > WORKER_OPEN_ARCHIVES:
+        _, (old_archive, old_stream) = _worker_archives.popitem(last=False)
+        old_archive.close()
+        old_stream.close()
+    return archive
+
+def _parse_member(
+    object_name: str,
+    member_name: str,
+    metadata: Dict[str, Any],
+    memory_limit: int,
+    task_dir: str
+) -> Tuple[str, str, int]:
+    """
+    Распаковка, хеширование и разбор файла архива в воркере
+
+    Чанки не возвращаются через пул целиком: пакеты DocumentParser по мере
+    разбора пишутся в файл в task_dir, поэтому ни воркер, ни движок не
+    держат в памяти все чанки крупной модели. Каталог task_dir создает и
+    удаляет движок, в том числе когда воркер завершен при зависании или падении.
+
+    Returns:
+        (SHA-256, файл пакетов чанков, количество чанков)
+    """
+    archive = _open_worker_archive(object_name)
+    info = archive.getinfo(member_name)
+    batches_path = os.path.join(task_dir, "batches.chunks")
+
+    if info.file_size <= memory_limit and _worker_parser._get_mime_type(member_name) in _worker_parser.in_memory_formats:
+        file_hash, content = stream_member(archive, info)
+        document_metadata = DocumentMetadata(**metadata, source_hash=file_hash)
+        batches = _worker_parser.iter_document_batches(member_name, document_metadata, content=content)
+        return file_hash, batches_path, asyncio.run(_write_batches(batches, batches_path))
+
+    # Крупный файл или формат, читаемый только с диска: временный файл на время разбора
+    spool_dir = os.path.join(task_dir, "member")
+    os.makedirs(spool_dir)
+    try:
+        file_hash, spool_path = stream_member(archive, info, spool_dir)
+        document_metadata = DocumentMetadata(**metadata, source_hash=file_hash)
+        batches = _worker_parser.iter_document_batches(spool_path, document_metadata)
+        return file_hash, batches_path, asyncio.run(_write_batches(batches, batches_path))
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+async def _write_batches(batches: AsyncIterator[List[Any]], path: str) -> int:
+    count = 0
+    with open(path, "wb") as f:
+        async for batch in batches:
+            pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+            count += len(batch)
+    return count
+
+def _read_batches(path: str) -> Iterator[List[Any]]:
+    """Пакеты чанков из файла, записанного _parse_member, по одному"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+@dataclass
+class FileTask:
+    """Файл архива в очереди обработки"""
+    relative_path: str
+    size: int
+    mime_type: str
+    metadata: Dict[str, Any]
+
+class ByteBudget:
+    """Ограничение суммарного размера файлов, находящихся в разборе"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        # Файл больше лимита разбирается один
+        size = min(size, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size: int):
+        async with self._condition:
+            self.used -= min(size, self.limit)
+            self._condition.notify_all()
+
+class JobProgress:
+    """Прогресс выполняющегося задания: несохраненные чекпоинты, очереди и скорость"""
+
+    def __init__(self, total_files: int, checkpoints: Dict[str, Tuple[str, int]], batch_size: int):
+        self.total_files = total_files
+        self.batch_size = batch_size
+        self.attempts = {path: attempts for path, (_, attempts) in checkpoints.items()}
+        self.writes: List[Dict[str, Any]] = []
+        self.flush_needed = asyncio.Event()
+
+        # Очереди конвейера
+        self.queued_files = 0
+        self.parsing_files = 0
+        self.embed_queue = 0
+        self.embedding_files = 0
+
+        # Обработано в этом запуске
+        self.files_completed = 0
+        self.chunks_completed = 0
+        self.last_file_at: Optional[datetime] = None
+        self._started = time.monotonic()
+        self._samples: deque = deque([(self._started, 0, 0)])
+
+    def record(self, task: FileTask, status: str, file_hash: Optional[str] = None,
+               chunks: int = 0, vectors: int = 0, error: Optional[str] = None):
+        """Результат файла; записывается в БД со следующим пакетом"""
+        attempts = self.attempts.get(task.relative_path, 0) + (0 if status == "skipped" else 1)
+        self.attempts[task.relative_path] = attempts
+        self.writes.append({
+            "relative_path": task.relative_path,
+            "status": status,
+            "file_hash": file_hash,
+            "file_size": task.size,
+            "doc_type": task.metadata["doc_type"],
+            "discipline": task.metadata["discipline"],
+            "chunks": chunks,
+            "vectors": vectors,
+            "attempts": attempts,
+            "error": error
+        })
+
+        if status != "skipped":
+            self.files_completed += 1
+            self.chunks_completed += chunks
+            self.last_file_at = datetime.utcnow()
+        if len(self.writes) >= self.batch_size:
+            self.flush_needed.set()
+
+    def take_writes(self) -> List[Dict[str, Any]]:
+        writes, self.writes = self.writes, []
+        return writes
+
+    def restore_writes(self, writes: List[Dict[str, Any]]):
+        """Возврат пакета после неудачной записи (повторится со следующим)"""
+        self.writes = writes + self.writes
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущая скорость за RATE_WINDOW_SECONDS и глубина очередей"""
+        now = time.monotonic()
+        self._samples.append((now, self.files_completed, self.chunks_completed))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW_SECONDS:
+            self._samples.popleft()
+
+        since, files, chunks = self._samples[0]
+        elapsed = max(now - since, 1e-6)
+        return {
+            "files_per_second": round((self.files_completed - files) / elapsed, 3),
+            "chunks_per_second": round((self.chunks_completed - chunks) / elapsed, 3),
+            "queued_files": self.queued_files,
+            "parse_inflight": self.parsing_files,
+            "embed_queue_depth": self.embed_queue,
+            "embed_inflight": self.embedding_files,
+            "files_this_run": self.files_completed,
+            "run_seconds": round(now - self._started, 1),
+            "last_file_at": self.last_file_at.isoformat() if self.last_file_at else None
+        }
+
+class IngestionEngine:
+    """Движок загрузки архивов с пулом разбора и чекпоинтами в Postgres"""
+
+    def __init__(
+        self,
+        archive_service: Any,
+        vectorization_service: Any,
+        parse_workers: Optional[int] = None,
+        embed_concurrency: int = 2,
+        embed_batch_size: int = 64,
+        table_embed_batch_size: int = 256,
+        max_inflight_bytes: int = 512 * 1024 * 1024,
+        member_memory_limit: Optional[int] = None,
+        parse_timeout: float = 900.0,
+        max_file_attempts: int = 3,
+        lease_seconds: float = 120.0,
+        flush_interval: float = 2.0,
+        checkpoint_batch_size: int = 100
+    ):
+        """
+        Args:
+            archive_service: ArchiveService (скачивание архива, манифест, метаданные файлов)
+            vectorization_service: VectorizationService
+            parse_workers: Количество процессов разбора (по умолчанию ARCHIVE_PARSE_WORKERS или CPU - 1)
+            embed_concurrency: Сколько файлов одновременно векторизуется
+            embed_batch_size: Чанков в одном запросе векторизации
+            table_embed_batch_size: Строк таблиц в одном запросе векторизации (строки короткие)
+            max_inflight_bytes: Предельный суммарный размер файлов в разборе
+            member_memory_limit: Файлы до этого размера разбираются из памяти, без временного
+                файла (по умолчанию ARCHIVE_MEMBER_MEMORY_MB, 64 МБ)
+            parse_timeout: Таймаут разбора одного файла в секундах
+            max_file_attempts: После стольких неудач файл больше не повторяется
+            lease_seconds: Срок аренды задания без продления
+            flush_interval: Период записи прогресса и продления аренды в секундах
+            checkpoint_batch_size: Столько чекпоинтов записывается досрочно одним пакетом
+        """
+        self.archive_service = archive_service
+        self.vectorization_service = vectorization_service
+        self.parse_workers = parse_workers or int(os.getenv("ARCHIVE_PARSE_WORKERS", "0")) or max(1, (os.cpu_count() or 2) - 1)
+        self.embed_concurrency = embed_concurrency
+        self.embed_batch_size = embed_batch_size
+        self.table_embed_batch_size = table_embed_batch_size
+        self.max_inflight_bytes = max_inflight_bytes
+        self.member_memory_limit = member_memory_limit or int(os.getenv("ARCHIVE_MEMBER_MEMORY_MB", "64")) * 1024 * 1024
+        self.spool_dir = os.getenv("ARCHIVE_SPOOL_DIR", os.path.join(archive_service.temp_dir, "spool"))
+        self._clear_spool()
+        self.archive_source = archive_service.minio_service.object_source()
+        self.parse_timeout = parse_timeout
+        self.max_file_attempts = max_file_attempts
+        self.lease_seconds = lease_seconds
+        self.flush_interval = min(flush_interval, lease_seconds / 3)
+        self.checkpoint_batch_size = checkpoint_batch_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.supported_mime_types = set(DocumentParser().supported_formats)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, asyncio.Task] = {}
+
+    def _clear_spool(self):
+        """Удаление временных файлов разбора, оставшихся от прерванного процесса"""
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # spawn: воркеры не наследуют загруженные модели и потоки torch
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_parse_worker,
+                initargs=(self.archive_source,)
+            )
+        return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        """
+        Пул с упавшим или зависшим воркером заменяется новым
+
+        Процессы старого пула останавливаются: зависший воркер не занимает
+        место в пуле, а файлы, разбиравшиеся в нем, получают BrokenProcessPool
+        и ставятся в очередь заново.
+        """
+        if self._pool is pool:
+            self._pool = None
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    # === Управление заданиями ===
+
+    def submit(self, job_id: str):
+        """Запуск задания в фоне (повторный вызов для выполняющегося задания ничего не делает)"""
+        running = self._jobs.get(job_id)
+        if running is not None and not running.done():
+            return
+        task = asyncio.create_task(self.run_job(job_id))
+        self._jobs[job_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(job_id, None) if self._jobs.get(job_id) is task else None)
+
+    async def resume_pending_jobs(self) -> List[str]:
+        """Подхват незавершенных заданий без действующей аренды"""
+        job_ids = await asyncio.to_thread(self._find_resumable_jobs)
+        for job_id in job_ids:
+            logger.info(f"♻️ Продолжаем задание {job_id}")
+            self.submit(job_id)
+        return job_ids
+
+    async def shutdown(self):
+        """Остановка: задания прерываются, аренда освобождается для другого экземпляра"""
+        tasks = list(self._jobs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._discard_pool(self._pool)
+
+    async def run_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Обработка (или продолжение) задания загрузки архива
+
+        Returns:
+            Итог задания или None, если задание занято другим обработчиком или уже завершено
+        """
+        job = await asyncio.to_thread(self._claim_job, job_id)
+        if job is None:
+            logger.info(f"Задание {job_id} завершено или обрабатывается другим экземпляром")
+            return None
+
+        archive_path = job["parameters"]["archive_path"]
+        job_task = asyncio.current_task()
+        progress: Optional[JobProgress] = None
+        flusher: Optional[asyncio.Task] = None
+        try:
+            tasks = await asyncio.to_thread(self._list_archive, archive_path)
+            checkpoints = await asyncio.to_thread(self._load_checkpoints, job_id)
+            progress = JobProgress(len(tasks), checkpoints, self.checkpoint_batch_size)
+            flusher = asyncio.create_task(self._keep_progress(job_id, progress, job_task))
+
+            pending = []
+            skipped = 0
+            for task in tasks:
+                status, attempts = checkpoints.get(task.relative_path, (None, 0))
+                if status in ("done", "skipped") or (status == "failed" and attempts >= self.max_file_attempts):
+                    continue
+                if task.mime_type not in self.supported_mime_types:
+                    progress.record(task, "skipped", error=f"Неподдерживаемый формат: {task.mime_type}")
+                    skipped += 1
+                else:
+                    pending.append(task)
+
+            logger.info(
+                f"📦 Задание {job_id}: файлов {len(tasks)}, к обработке {len(pending)}, "
+                f"уже обработано {len(tasks) - len(pending) - skipped}"
+            )
+
+            await self._run_pipeline(archive_path, pending, progress)
+
+            flusher.cancel()
+            _, result = await asyncio.to_thread(self._flush, job_id, progress.take_writes(), progress.snapshot(), len(tasks))
+            result["total_files"] = len(tasks)
+            status = ProcessingStatus.COMPLETED if result["failed_files"] == 0 else ProcessingStatus.PARTIAL
+            await asyncio.to_thread(self._finish_job, job_id, status, result, None)
+
+            logger.info(f"✅ Архив {job_id} обработан: {result}")
+            return result
+
+        except asyncio.CancelledError:
+            await self._save_progress(job_id, progress)
+            await asyncio.to_thread(self._release_lease, job_id)
+            logger.info(f"⏸️ Задание {job_id} прервано, будет продолжено с чекпоинтов")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка при обработке архива {job_id}: {str(e)}")
+            await self._save_progress(job_id, progress)
+            await asyncio.to_thread(self._finish_job, job_id, ProcessingStatus.FAILED, None, str(e))
+            return None
+        finally:
+            if flusher is not None:
+                flusher.cancel()
+
+    # === Конвейер ===
+
+    async def _run_pipeline(self, archive_path: str, tasks: List[FileTask], progress: JobProgress):
+        loop = asyncio.get_running_loop()
+        budget = ByteBudget(self.max_inflight_bytes)
+        parse_slots = asyncio.Semaphore(self.parse_workers * 2)
+        embed_slots = asyncio.Semaphore(self.embed_concurrency)
+        running = set()
+        progress.queued_files = len(tasks)
+
+        async def parse(task: FileTask) -> Tuple[str, str, str, int]:
+            """(каталог файла, SHA-256, файл пакетов, количество чанков); каталог удаляет вызывающий"""
+            # Падение пула - не ошибка файла: он разбирается заново в новом пуле без учета попытки
+            for restart in range(self.max_file_attempts + 1):
+                pool = self._get_pool()
+                task_dir = tempfile.mkdtemp(dir=self.spool_dir)
+                try:
+                    file_hash, batches_path, chunk_count = await asyncio.wait_for(
+                        loop.run_in_executor(
+                            pool, _parse_member, archive_path, task.relative_path, task.metadata,
+                            self.member_memory_limit, task_dir
+                        ),
+                        timeout=self.parse_timeout
+                    )
+                    return task_dir, file_hash, batches_path, chunk_count
+                except BaseException as e:
+                    # Остановленный воркер свои временные файлы не удаляет
+                    if isinstance(e, (asyncio.TimeoutError, BrokenProcessPool)):
+                        self._discard_pool(pool)
+                    shutil.rmtree(task_dir, ignore_errors=True)
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise TimeoutError(f"Разбор дольше {self.parse_timeout:.0f} с")
+                    if not isinstance(e, BrokenProcessPool) or restart == self.max_file_attempts:
+                        raise
+                    logger.warning(f"Пул разбора перезапущен, файл {task.relative_path} поставлен в очередь заново")
+
+        async def process(task: FileTask):
+            try:
+                progress.queued_files -= 1
+                progress.parsing_files += 1
+                try:
+                    task_dir, file_hash, batches_path, chunk_count = await parse(task)
+                finally:
+                    progress.parsing_files -= 1
+                    parse_slots.release()
+                    await budget.release(task.size)
+
+                waiting = True
+                progress.embed_queue += 1
+                try:
+                    async with embed_slots:
+                        waiting = False
+                        progress.embed_queue -= 1
+                        progress.embedding_files += 1
+                        try:
+                            vectors = await self._vectorize_batches(batches_path)
+                        finally:
+                            progress.embedding_files -= 1
+                finally:
+                    if waiting:
+                        progress.embed_queue -= 1
+                    shutil.rmtree(task_dir, ignore_errors=True)
+
+                progress.record(task, "done", file_hash, chunk_count, vectors)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                logger.error(f"Ошибка при обработке файла {task.relative_path}: {error}")
+                progress.record(task, "failed", error=error)
+
+        try:
+            for task in tasks:
+                await parse_slots.acquire()
+                await budget.acquire(task.size)
+                running_task = asyncio.create_task(process(task))
+                running.add(running_task)
+                running_task.add_done_callback(running.discard)
+
+            if running:
+                await asyncio.gather(*running)
+        finally:
+            for running_task in running:
+                running_task.cancel()
+
+    async def _vectorize_batches(self, batches_path: str) -> int:
+        """Векторизация файла по пакетам чанков, в памяти только текущий пакет"""
+        batches = _read_batches(batches_path)
+        vectors = 0
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    return vectors
+                vectors += await self._vectorize(batch)
+        finally:
+            batches.close()
+
+    async def _vectorize(self, chunks: List[Any]) -> int:
+        """Векторизация чанков файла по коллекциям, возвращает количество точек"""
+        by_collection: Dict[str, List[Any]] = {}
+        for chunk in chunks:
+            collection = COLLECTION_BY_CHUNK_TYPE.get(chunk.chunk_type)
+            if collection is not None:
+                by_collection.setdefault(collection, []).append(chunk)
+
+        # Без CLIP листы чертежей не векторизуются (первое обращение загружает модель, вне цикла событий)
+        if "ae_drawings_clip" in by_collection:
+            if await asyncio.to_thread(getattr, self.vectorization_service, "clip_model") is None:
+                del by_collection["ae_drawings_clip"]
+
+        vectors = 0
+        if "ae_drawings_clip" in by_collection:
+            by_collection["ae_drawings_clip"], vectors = await self._prepare_drawings(by_collection["ae_drawings_clip"])
+
+        for collection, items in by_collection.items():
+            batch_size = self.table_embed_batch_size if collection == "ae_tables" else self.embed_batch_size
+            model_name = "clip" if collection == "ae_drawings_clip" else "bge-m3"
+            for start in range(0, len(items), batch_size):
+                result = await self.vectorization_service.vectorize_chunks(VectorizationRequest(
+                    chunks=items[start:start + batch_size],
+                    collection_name=collection,
+                    model_name=model_name
+                ))
+                vectors += result["points_count"]
+        return vectors
+
+    async def _prepare_drawings(self, chunks: List[Any]) -> Tuple[List[Any], int]:
+        """
+        Фрагменты листов, которые нужно кодировать CLIP
+
+        chunk_id фрагмента включает хеш растра листа: фрагменты неизменившихся
+        листов уже есть в коллекции, у них обновляются только поля документа.
+        Миниатюры новых листов загружаются в MinIO.
+
+        Returns:
+            (новые фрагменты, количество обновленных без кодирования)
+        """
+        request = VectorizationRequest(chunks=chunks, collection_name="ae_drawings_clip", model_name="clip")
+        existing = await self.vectorization_service.existing_chunk_ids(request)
+
+        unchanged = [chunk for chunk in chunks if chunk.chunk_id in existing]
+        if unchanged:
+            await self.vectorization_service.refresh_payload(VectorizationRequest(
+                chunks=unchanged, collection_name="ae_drawings_clip", model_name="clip"
+            ))
+
+        new_chunks = [chunk for chunk in chunks if chunk.chunk_id not in existing]
+        for chunk in new_chunks:
+            if chunk.thumbnail and chunk.preview_path:
+                try:
+                    await self.archive_service.minio_service.upload_bytes(chunk.preview_path, chunk.thumbnail, "image/jpeg")
+                except Exception as e:
+                    logger.warning(f"Не удалось загрузить миниатюру {chunk.preview_path}: {e}")
+
+        return new_chunks, len(unchanged)
+
+    async def _keep_progress(self, job_id: str, progress: JobProgress, job_task: asyncio.Task):
+        """Пакетная запись чекпоинтов и прогресса с продлением аренды"""
+        while True:
+            try:
+                await asyncio.wait_for(progress.flush_needed.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            progress.flush_needed.clear()
+
+            writes = progress.take_writes()
+            try:
+                renewed, _ = await asyncio.to_thread(self._flush, job_id, writes, progress.snapshot(), progress.total_files)
+            except Exception as e:
+                progress.restore_writes(writes)
+                logger.warning(f"Не удалось записать прогресс задания {job_id}: {e}")
+                continue
+
+            if not renewed:
+                logger.warning(f"⚠️ Аренда задания {job_id} перехвачена другим экземпляром, останавливаемся")
+                job_task.cancel()
+                return
+
+    async def _save_progress(self, job_id: str, progress: Optional[JobProgress]):
+        """Запись накопленных чекпоинтов перед остановкой задания"""
+        if progress is None:
+            return
+        try:
+            await asyncio.to_thread(self._flush, job_id, progress.take_writes(), progress.snapshot(), progress.total_files)
+        except Exception as e:
+            logger.warning(f"Не удалось записать прогресс задания {job_id}: {e}")
+
+    # === Файлы ===
+
+    def _list_archive(self, archive_path: str) -> List[FileTask]:
+        """Манифест и файлы архива по центральному каталогу ZIP, крупные файлы первыми"""
+        with self.archive_source.open(archive_path) as stream, zipfile.ZipFile(stream) as archive:
+            try:
+                manifest = self.archive_service.parse_manifest(archive.read("manifest.json"))
+            except KeyError:
+                raise ValueError("manifest.json не найден в архиве")
+
+            tasks = [
+                FileTask(
+                    relative_path=info.filename,
+                    size=info.file_size,
+                    mime_type=self.archive_service._get_mime_type(info.filename),
+                    metadata=self.archive_service.describe_file(info.filename, manifest)
+                )
+                for info in archive.infolist()
+                if not info.is_dir() and Path(info.filename).name != "manifest.json"
+            ]
+
+        tasks.sort(key=lambda task: task.size, reverse=True)
+        return tasks
+
+    # === Postgres ===
+
+    def _claim_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Захват аренды задания одним UPDATE"""
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            claimed = db.query(ProcessingJob).filter(
+                ProcessingJob.job_id == job_id,
+                ProcessingJob.status.in_(ACTIVE_JOB_STATUSES),
+                or_(
+                    ProcessingJob.lease_expires_at.is_(None),
+                    ProcessingJob.lease_expires_at < now,
+                    ProcessingJob.lease_owner == self.worker_id
+                )
+            ).update({
+                ProcessingJob.status: ProcessingStatus.PROCESSING.value,
+                ProcessingJob.lease_owner: self.worker_id,
+                ProcessingJob.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+                ProcessingJob.started_at: func.coalesce(ProcessingJob.started_at, now)
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+
+            job = db.query(ProcessingJob).filter(ProcessingJob.job_id == job_id).one()
+            return {"job_id": job.job_id, "parameters": job.parameters or {}}
+
+    def _flush(
+        self,
+        job_id: str,
+        writes: List[Dict[str, Any]],
+        snapshot: Dict[str, Any],
+        total_files: int
+    ) -> Tuple[bool, Dict[str, int]]:
+        """
+        Пакет чекпоинтов, счетчики, прогресс и продление аренды одной транзакцией
+
+        Returns:
+            (аренда продлена, итоги задания по чекпоинтам)
+        """
+        with SessionLocal() as db:
+            if writes:
+                existing = {
+                    checkpoint.relative_path: checkpoint
+                    for checkpoint in db.query(FileCheckpoint).filter(
+                        FileCheckpoint.job_id == job_id,
+                        FileCheckpoint.relative_path.in_([write["relative_path"] for write in writes])
+                    )
+                }
+                for write in writes:
+                    checkpoint = existing.get(write["relative_path"])
+                    if checkpoint is None:
+                        checkpoint = FileCheckpoint(job_id=job_id, relative_path=write["relative_path"])
+                        db.add(checkpoint)
+                        existing[write["relative_path"]] = checkpoint
+                    for name, value in write.items():
+                        if name == "file_hash" and value is None:
+                            continue
+                        setattr(checkpoint, name, value)
+                db.flush()
+
+            totals = self._job_totals(db, job_id)
+            renewed = db.query(ProcessingJob).filter(
+                ProcessingJob.job_id == job_id,
+                ProcessingJob.lease_owner == self.worker_id
+            ).update({
+                ProcessingJob.lease_expires_at: datetime.utcnow() + timedelta(seconds=self.lease_seconds),
+                ProcessingJob.total_files: total_files,
+                ProcessingJob.processed_files: totals["processed_files"],
+                ProcessingJob.failed_files: totals["failed_files"],
+                ProcessingJob.skipped_files: totals["skipped_files"],
+                ProcessingJob.total_chunks: totals["total_chunks"],
+                ProcessingJob.total_vectors: totals["total_vectors"],
+                ProcessingJob.progress: snapshot
+            }, synchronize_session=False)
+            db.commit()
+            return bool(renewed), totals
+
+    def _release_lease(self, job_id: str):
+        with SessionLocal() as db:
+            db.query(ProcessingJob).filter(
+                ProcessingJob.job_id == job_id,
+                ProcessingJob.lease_owner == self.worker_id
+            ).update({ProcessingJob.lease_owner: None, ProcessingJob.lease_expires_at: None}, synchronize_session=False)
+            db.commit()
+
+    def _update_job(self, job_id: str, **fields):
+        with SessionLocal() as db:
+            db.query(ProcessingJob).filter(ProcessingJob.job_id == job_id).update(
+                {getattr(ProcessingJob, name): value for name, value in fields.items()},
+                synchronize_session=False
+            )
+            db.commit()
+
+    def _finish_job(self, job_id: str, status: ProcessingStatus, result: Optional[Dict[str, Any]], error_message: Optional[str]):
+        fields = {
+            "status": status.value,
+            "error_message": error_message,
+            "completed_at": datetime.utcnow(),
+            "lease_owner": None,
+            "lease_expires_at": None
+        }
+        if result is not None:
+            fields.update(
+                result=result,
+                processed_files=result["processed_files"],
+                failed_files=result["failed_files"],
+                skipped_files=result["skipped_files"],
+                total_chunks=result["total_chunks"],
+                total_vectors=result["total_vectors"]
+            )
+        self._update_job(job_id, **fields)
+
+    def _find_resumable_jobs(self) -> List[str]:
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            rows = db.query(ProcessingJob.job_id).filter(
+                ProcessingJob.job_type == "archive_ingest",
+                ProcessingJob.status.in_(ACTIVE_JOB_STATUSES),
+                or_(ProcessingJob.lease_expires_at.is_(None), ProcessingJob.lease_expires_at < now)
+            ).order_by(ProcessingJob.created_at).all()
+            return [row.job_id for row in rows]
+
+    def _load_checkpoints(self, job_id: str) -> Dict[str, Tuple[str, int]]:
+        """Чекпоинты задания: путь файла -> (статус, число попыток)"""
+        with SessionLocal() as db:
+            rows = db.query(FileCheckpoint.relative_path, FileCheckpoint.status, FileCheckpoint.attempts).filter(
+                FileCheckpoint.job_id == job_id
+            ).all()
+            return {row.relative_path: (row.status, row.attempts or 0) for row in rows}
+
+    def _job_totals(self, db, job_id: str) -> Dict[str, int]:
+        """Итоги задания по чекпоинтам (учитывают и файлы, обработанные до перезапуска)"""
+        rows = db.query(
+            FileCheckpoint.status,
+            func.count(FileCheckpoint.id),
+            func.coalesce(func.sum(FileCheckpoint.chunks), 0),
+            func.coalesce(func.sum(FileCheckpoint.vectors), 0)
+        ).filter(FileCheckpoint.job_id == job_id).group_by(FileCheckpoint.status).all()
+
+        by_status = {status: (count, chunks, vectors) for status, count, chunks, vectors in rows}
+        done = by_status.get("done", (0, 0, 0))
+        return {
+            "processed_files": done[0],
+            "failed_files": by_status.get("failed", (0, 0, 0))[0],
+            "skipped_files": by_status.get("skipped", (0, 0, 0))[0],
+            "total_chunks": int(done[1]),
+            "total_vectors": int(done[2])
+        }
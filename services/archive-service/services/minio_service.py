@@ -2,6 +2,7 @@
 Сервис для работы с MinIO (S3-совместимое хранилище)
 """
 
+import io
 import os
 import tempfile
 from typing import Optional, List
@@ -10,6 +11,8 @@ from minio.error import S3Error
 import logging
 from datetime import timedelta
 
+from services.archive_reader import MinIOObjectSource
+
 logger = logging.getLogger(__name__)
 
 
@@ -51,6 +54,16 @@ class MinIOService:
             logger.warning(f"Не удалось подключиться к MinIO: {str(e)}")
             # Не поднимаем исключение, чтобы сервис мог работать без MinIO
     
+    def object_source(self) -> MinIOObjectSource:
+        """Источник объектов для потокового чтения (ranged GET), передаваемый в процессы разбора"""
+        return MinIOObjectSource(
+            endpoint=self.endpoint,
+            access_key=self.access_key,
+            secret_key=self.secret_key,
+            secure=self.secure,
+            bucket_name=self.bucket_name
+        )
+    
     async def upload_file(self, file_path: str, object_name: str) -> str:
         """
         Загружает файл в MinIO
@@ -76,6 +89,33 @@ class MinIOService:
             logger.error(f"Ошибка при загрузке файла {object_name}: {str(e)}")
             raise
     
+    async def upload_bytes(self, object_name: str, data: bytes, content_type: str = "application/octet-stream") -> str:
+        """
+        Загружает содержимое из памяти в MinIO (миниатюры листов и т.п.)
+        
+        Args:
+            object_name: Имя объекта в MinIO
+            data: Содержимое
+            content_type: MIME тип
+            
+        Returns:
+            Путь к загруженному объекту
+        """
+        try:
+            self._ensure_bucket_exists()
+            client = self._get_client()
+            client.put_object(
+                bucket_name=self.bucket_name,
+                object_name=object_name,
+                data=io.BytesIO(data),
+                length=len(data),
+                content_type=content_type
+            )
+            return f"{self.bucket_name}/{object_name}"
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке объекта {object_name}: {str(e)}")
+            raise
+    
     async def download_file(self, object_name: str, local_path: str):
         """
         Скачивает файл из MinIO
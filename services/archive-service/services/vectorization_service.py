@@ -2,16 +2,19 @@
 Сервис для векторизации и работы с Qdrant
 """
 
+import asyncio
+import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import torch
 
 from qdrant_client import QdrantClient
 from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
 from qdrant_client.http import models
 
+from clip_encoder import CLIP_AVAILABLE, encode_images, encode_texts
+from model_registry import clip_model, sentence_transformer
+from text_chunker import make_point_id
 from schemas.archive import (
     TextChunk, TableChunk, DrawingChunk, IFCChunk, ChunkPayload,
     VectorizationRequest
@@ -28,9 +31,9 @@ class VectorizationService:
         self.qdrant_client = None
         self._qdrant_available = False
         
-        # Модели для эмбеддингов
+        # Модели для эмбеддингов (общие для процесса, загружаются при первом обращении)
         self.text_model = None
-        self.clip_model = None
+        self._clip = None
         
         # Коллекции
         self.collections = {
@@ -73,24 +76,36 @@ class VectorizationService:
         return self.qdrant_client if self._qdrant_available else None
     
     def _initialize_models(self):
-        """Инициализирует модели для эмбеддингов"""
-        try:
-            # Загружаем BGE-M3 для текста
-            self.text_model = SentenceTransformer('BAAI/bge-m3')
-            logger.info("BGE-M3 модель загружена")
-            
-            # Загружаем CLIP для изображений (если доступен)
-            try:
-                import clip
-                self.clip_model, self.clip_preprocess = clip.load("ViT-L/14", device="cpu")
-                logger.info("CLIP модель загружена")
-            except ImportError:
-                logger.warning("CLIP не доступен, изображения не будут векторизованы")
-                self.clip_model = None
+        """Берет ссылки на модели из общего реестра процесса"""
+        # BGE-M3 для текста
+        self.text_model = sentence_transformer('BAAI/bge-m3')
         
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации моделей: {str(e)}")
-            raise
+        # CLIP для изображений (если доступен)
+        if CLIP_AVAILABLE:
+            self._clip = clip_model("ViT-L-14")
+        else:
+            logger.warning("CLIP не доступен, изображения не будут векторизованы")
+    
+    @property
+    def clip_model(self):
+        """Модель CLIP или None, если CLIP недоступен"""
+        clip = self._load_clip()
+        return clip[0] if clip else None
+    
+    @property
+    def clip_preprocess(self):
+        """Предобработка изображений CLIP или None"""
+        clip = self._load_clip()
+        return clip[1] if clip else None
+    
+    def _load_clip(self):
+        if self._clip is None:
+            return None
+        try:
+            return self._clip.get()
+        except Exception:
+            # Ошибка загрузки записана реестром
+            return None
     
     def _ensure_collections_exist(self):
         """Создает коллекции в Qdrant если они не существуют"""
@@ -142,8 +157,9 @@ class VectorizationService:
             
             # Создаем точки для Qdrant
             points = []
-            for i, (chunk, embedding) in enumerate(zip(request.chunks, embeddings)):
-                point_id = f"{chunk.chunk_id}_{i}"
+            for chunk, embedding in zip(request.chunks, embeddings):
+                # Детерминированный UUID: повторная векторизация перезаписывает точку
+                point_id = make_point_id(chunk.chunk_id, request.model_name)
                 
                 # Создаем payload
                 payload = self._create_payload(chunk)
@@ -159,10 +175,7 @@ class VectorizationService:
             client = self._get_qdrant_client()
             if not client:
                 raise ValueError("Qdrant недоступен")
-            client.upsert(
-                collection_name=collection_name,
-                points=points
-            )
+            await asyncio.to_thread(client.upsert, collection_name=collection_name, points=points)
             
             logger.info(f"Векторизовано {len(points)} чанков в коллекцию {collection_name}")
             
@@ -181,25 +194,40 @@ class VectorizationService:
         """Генерирует эмбеддинги для чанков"""
         embeddings = []
         
-        if collection_name in ["ae_text_m3", "ae_tables", "ae_ifc"]:
+        if collection_name == "ae_tables":
+            # Строки таблиц короткие и часто повторяются (одинаковые позиции BoM): каждая уникальная строка кодируется один раз
+            texts = [chunk.content for chunk in chunks]
+            unique_texts = list(dict.fromkeys(texts))
+            encoded = await asyncio.to_thread(self.text_model.encode, unique_texts, convert_to_tensor=False)
+            by_text = dict(zip(unique_texts, encoded))
+            embeddings = [by_text[text] for text in texts]
+            
+        elif collection_name in ["ae_text_m3", "ae_ifc"]:
             # Текстовые эмбеддинги
             texts = [chunk.content for chunk in chunks]
-            embeddings = self.text_model.encode(texts, convert_to_tensor=False)
+            embeddings = await asyncio.to_thread(self.text_model.encode, texts, convert_to_tensor=False)
             
         elif collection_name == "ae_drawings_clip":
             # CLIP эмбеддинги для изображений
             if self.clip_model is None:
                 raise ValueError("CLIP модель не доступна")
             
-            # Для чертежей пока используем текстовые эмбеддинги извлеченного текста
-            texts = []
-            for chunk in chunks:
-                if hasattr(chunk, 'extracted_text') and chunk.extracted_text:
-                    texts.append(chunk.extracted_text)
-                else:
-                    texts.append(chunk.content)
+            # Фрагменты листов кодируются как изображения, чанки без изображения - текстовой частью CLIP
+            embeddings = [None] * len(chunks)
+            image_indexes = [i for i, chunk in enumerate(chunks) if getattr(chunk, 'image', None)]
+            text_indexes = [i for i, chunk in enumerate(chunks) if not getattr(chunk, 'image', None)]
             
-            embeddings = self.text_model.encode(texts, convert_to_tensor=False)
+            if image_indexes:
+                images = [chunks[i].image for i in image_indexes]
+                encoded = await asyncio.to_thread(encode_images, self.clip_model, self.clip_preprocess, images)
+                for i, embedding in zip(image_indexes, encoded):
+                    embeddings[i] = embedding
+            
+            if text_indexes:
+                texts = [getattr(chunks[i], 'extracted_text', None) or chunks[i].content for i in text_indexes]
+                encoded = await asyncio.to_thread(encode_texts, self.clip_model, texts)
+                for i, embedding in zip(text_indexes, encoded):
+                    embeddings[i] = embedding
         
         return embeddings
     
@@ -232,6 +260,12 @@ class VectorizationService:
         if hasattr(chunk, 'row_data'):
             payload["row_data"] = chunk.row_data
             payload["row_hash"] = chunk.row_hash
+            payload["row_number"] = chunk.row_number
+            if chunk.bbox:
+                payload["bbox"] = chunk.bbox
+        
+        if isinstance(chunk, TextChunk) and chunk.bbox:
+            payload["bbox"] = chunk.bbox
         
         if hasattr(chunk, 'ifc_type'):
             payload["ifc_type"] = chunk.ifc_type
@@ -240,9 +274,62 @@ class VectorizationService:
         
         if hasattr(chunk, 'preview_path'):
             payload["preview_path"] = chunk.preview_path
+            if chunk.page_hash:
+                payload["page_hash"] = chunk.page_hash
+            if chunk.tile:
+                payload["tile"] = chunk.tile
         
         return payload
     
+    async def existing_chunk_ids(self, request: VectorizationRequest) -> Set[str]:
+        """chunk_id чанков запроса, точки которых уже есть в коллекции"""
+        client = self._get_qdrant_client()
+        if not client or not request.chunks:
+            return set()
+        
+        by_point_id = {make_point_id(chunk.chunk_id, request.model_name): chunk.chunk_id for chunk in request.chunks}
+        points = await asyncio.to_thread(
+            client.retrieve,
+            collection_name=request.collection_name,
+            ids=list(by_point_id),
+            with_payload=False,
+            with_vectors=False
+        )
+        return {by_point_id[str(point.id)] for point in points if str(point.id) in by_point_id}
+    
+    async def refresh_payload(self, request: VectorizationRequest) -> int:
+        """
+        Обновляет поля документа (ревизия, источник, доступ) у существующих точек без перекодирования
+        
+        Returns:
+            Количество обновленных точек
+        """
+        client = self._get_qdrant_client()
+        if not client:
+            raise ValueError("Qdrant недоступен")
+        
+        # Точки с одинаковыми полями (фрагменты одного листа) обновляются одним запросом
+        groups: Dict[str, Tuple[Dict[str, Any], List[str]]] = {}
+        for chunk in request.chunks:
+            payload = self._create_payload(chunk)
+            fields = {
+                key: payload[key]
+                for key in ("project_id", "object_id", "rev", "page", "source_path", "source_hash",
+                            "issued_at", "confidentiality", "permissions")
+            }
+            group_key = json.dumps(fields, sort_keys=True, default=str)
+            groups.setdefault(group_key, (fields, []))[1].append(make_point_id(chunk.chunk_id, request.model_name))
+        
+        for fields, point_ids in groups.values():
+            await asyncio.to_thread(
+                client.set_payload,
+                collection_name=request.collection_name,
+                payload=fields,
+                points=point_ids
+            )
+        
+        return len(request.chunks)
+    
     async def search_similar(self, query: str, collection_name: str, 
                            filters: Optional[Dict[str, Any]] = None,
                            limit: int = 10) -> List[Dict[str, Any]]:
@@ -259,8 +346,13 @@ class VectorizationService:
             Список похожих документов
         """
         try:
-            # Генерируем эмбеддинг для запроса
-            query_embedding = self.text_model.encode([query], convert_to_tensor=False)[0]
+            # Генерируем эмбеддинг для запроса (для чертежей - в пространстве CLIP)
+            if collection_name == "ae_drawings_clip":
+                if self.clip_model is None:
+                    raise ValueError("CLIP модель не доступна")
+                query_embedding = encode_texts(self.clip_model, [query])[0]
+            else:
+                query_embedding = self.text_model.encode([query], convert_to_tensor=False)[0]
             
             # Создаем фильтры
             qdrant_filters = None
@@ -0,0 +1,361 @@
+"""
+Потоковое чтение таблиц XLSX/XLS (BoM, BoQ, перечни оборудования)
+
+Листы читаются построчно (calamine или openpyxl в режиме read_only), ячейки
+всей книги в памяти не создаются. Строки отдаются пакетами, уже
+типизированными по столбцам: тип столбца определяется по первому пакету
+листа, и числовой столбец остается числовым, даже если часть количеств
+записана в книге текстом ("1 200,5").
+
+Каждая строка превращается в чанк таблицы: заголовки подставляются в текст
+строки, row_hash считается по содержимому строки. Таблицы, уже извлеченные
+в память (PDF, DOCX), режутся так же; шапка таблицы (в том числе
+многоуровневая, с объединенными ячейками) определяется по первым строкам.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import openpyxl
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+    logging.warning("python-calamine не установлен, XLSX читается openpyxl (read_only), XLS - pandas")
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном пакете
+DEFAULT_BATCH_SIZE = 1000
+
+# Максимум строк в шапке таблицы
+MAX_HEADER_ROWS = 3
+
+# Число с пробелами-разделителями тысяч и десятичной запятой или точкой
+NUMBER_PATTERN = re.compile(r"^[+-]?(?:\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+)(?:[.,]\d+)?$")
+
+
+@dataclass
+class RowBatch:
+    """Пакет строк листа"""
+    sheet_name: str
+    header: List[str]
+    column_types: List[str]  # number, text, date, bool
+    rows: List[Tuple[int, List[Any]]]  # (номер строки в листе, значения по столбцам)
+
+
+def reader_name(file_path: str) -> str:
+    """Чем будет прочитана книга"""
+    if CALAMINE_AVAILABLE:
+        return "calamine"
+    return "openpyxl_read_only" if Path(file_path).suffix.lower() != ".xls" else "pandas"
+
+
+def iter_sheet_rows(file_path: str,
+                    content: Optional[bytes] = None) -> Iterator[Tuple[str, Iterator[Tuple[int, List[Any]]]]]:
+    """Листы книги: (имя листа, итератор (номер строки, значения)); content - книга, уже прочитанная в память"""
+    source = io.BytesIO(content) if content is not None else file_path
+    if CALAMINE_AVAILABLE:
+        workbook = CalamineWorkbook.from_filelike(source) if content is not None else CalamineWorkbook.from_path(file_path)
+        for sheet_name in workbook.sheet_names:
+            yield sheet_name, _iter_calamine_rows(workbook.get_sheet_by_name(sheet_name))
+        return
+
+    if Path(file_path).suffix.lower() == ".xls":
+        # xlrd не читает потоком: книга открывается один раз для всех листов
+        sheets = pd.read_excel(source, sheet_name=None, header=None, dtype=object)
+        for sheet_name, frame in sheets.items():
+            frame = frame.astype(object).where(frame.notna(), None)
+            yield sheet_name, ((index + 1, list(row)) for index, row in enumerate(frame.itertuples(index=False)))
+        return
+
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, (
+                (row_number, list(values))
+                for row_number, values in enumerate(sheet.iter_rows(values_only=True), 1)
+            )
+    finally:
+        workbook.close()
+
+
+def _iter_calamine_rows(sheet) -> Iterator[Tuple[int, List[Any]]]:
+    start_row = (getattr(sheet, "start", None) or (0, 0))[0]
+    rows = sheet.iter_rows() if hasattr(sheet, "iter_rows") else sheet.to_python()
+    for index, values in enumerate(rows):
+        yield start_row + index + 1, list(values)
+
+
+def read_sheet_headers(file_path: str, content: Optional[bytes] = None) -> List[Dict[str, Any]]:
+    """Заголовки листов (первая непустая строка) без чтения остальных строк"""
+    sheets = []
+    for sheet_name, rows in iter_sheet_rows(file_path, content):
+        header = None
+        for _, values in rows:
+            values = _trim(values)
+            if values:
+                header = _make_header(values)
+                break
+        sheets.append({"sheet_name": sheet_name, "header": header or []})
+    return sheets
+
+
+def iter_row_batches(file_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                     content: Optional[bytes] = None) -> Iterator[RowBatch]:
+    """
+    Пакеты типизированных строк всех листов
+
+    Первая непустая строка листа считается заголовком.
+    """
+    for sheet_name, rows in iter_sheet_rows(file_path, content):
+        header: Optional[List[str]] = None
+        column_types: Optional[List[str]] = None
+        pending: List[Tuple[int, List[Any]]] = []
+
+        for row_number, values in rows:
+            values = _trim(values)
+            if not values:
+                continue
+            if header is None:
+                header = _make_header(values)
+                continue
+
+            pending.append((row_number, values))
+            if len(pending) >= batch_size:
+                column_types = column_types or _infer_column_types(pending, header)
+                yield _typed_batch(sheet_name, header, column_types, pending)
+                pending = []
+
+        if pending:
+            column_types = column_types or _infer_column_types(pending, header)
+            yield _typed_batch(sheet_name, header, column_types, pending)
+
+
+def iter_row_chunks(file_path: str, batch_size: int = DEFAULT_BATCH_SIZE, key_prefix: str = "table",
+                    content: Optional[bytes] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Пакеты чанков строк таблиц: заголовки в тексте строки, row_hash, числовые столбцы в numeric
+
+    Args:
+        file_path: Путь к книге (для content - имя файла)
+        batch_size: Строк в пакете
+        key_prefix: Префикс chunk_id, отличающий документ (chunk_id = префикс:лист:row_hash[:номер повтора])
+        content: Книга, уже прочитанная в память
+    """
+    # Повторы одинаковых строк считаются по листу целиком, а не по пакету
+    occurrences: Dict[str, Dict[str, int]] = {}
+    for batch in iter_row_batches(file_path, batch_size, content):
+        chunks = _batch_chunks(batch, f"{key_prefix}:{batch.sheet_name}",
+                               occurrences.setdefault(batch.sheet_name, {}))
+        if chunks:
+            yield chunks
+
+
+def table_row_chunks(table: List[List[Any]], section: Optional[str] = None,
+                     key_prefix: str = "table") -> List[Dict[str, Any]]:
+    """
+    Чанки строк таблицы, извлеченной в память (PDF, DOCX)
+
+    Шапка определяется detect_header_rows, многоуровневая шапка склеивается
+    в имена столбцов вида "Характеристики / Q, м3/ч".
+
+    Args:
+        table: Строки таблицы
+        section: Раздел документа (попадает в section чанка)
+        key_prefix: Префикс chunk_id, отличающий таблицу (chunk_id = префикс:row_hash[:номер повтора])
+    """
+    rows = [_clean(list(values)) for values in table if values]
+    if not rows:
+        return []
+
+    header_count = detect_header_rows(rows)
+    width = max(len(values) for values in rows)
+    header = _merge_header_rows(rows[:header_count], width)
+
+    data = [(row_number, _trim(values)) for row_number, values in enumerate(rows, 1) if row_number > header_count]
+    data = [(row_number, values) for row_number, values in data if values]
+    if not data:
+        return []
+
+    column_types = _infer_column_types(data, header)
+    return _batch_chunks(_typed_batch(section or "", header, column_types, data), key_prefix)
+
+
+def detect_header_rows(rows: List[List[Any]], max_header_rows: int = MAX_HEADER_ROWS) -> int:
+    """
+    Число строк шапки таблицы
+
+    Шапка - текстовые строки без чисел в начале таблицы. Следующая строка
+    относится к шапке, только если в предыдущей есть пустые (объединенные)
+    ячейки. Если числа есть уже в первой строке, шапки нет.
+    """
+    count = 0
+    for values in rows[:max_header_rows]:
+        filled = [value for value in values if value is not None]
+        if not filled or any(_parse_number(value) is not None for value in filled):
+            break
+        if count and None not in rows[count - 1]:
+            break
+        count += 1
+    # Таблица из одной текстовой шапки: данными считается все, кроме первой строки
+    return min(count, 1) if count >= len(rows) else count
+
+
+def _merge_header_rows(header_rows: List[List[Any]], width: int) -> List[str]:
+    """Имена столбцов из строк шапки; пустая ячейка верхних строк наследует объединенную ячейку слева"""
+    names = []
+    for column in range(width):
+        parts: List[str] = []
+        for level, values in enumerate(header_rows):
+            value = values[column] if column < len(values) else None
+            if value is None and level < len(header_rows) - 1:
+                value = next((cell for cell in reversed(values[:column]) if cell is not None), None)
+            if value is None:
+                continue
+            name = " ".join(str(value).split())
+            if not parts or parts[-1] != name:
+                parts.append(name)
+        names.append(" / ".join(parts) if parts else None)
+    return _make_header(names)
+
+
+def _batch_chunks(batch: RowBatch, key_prefix: str,
+                  occurrences: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """
+    Чанки строк пакета
+
+    Одинаковые строки получают один row_hash, но разные chunk_id: к повторам
+    добавляется номер повтора, чтобы они не схлопывались в одну точку индекса.
+    """
+    occurrences = {} if occurrences is None else occurrences
+    chunks = []
+    for row_number, values in batch.rows:
+        row_data = {
+            name: value
+            for name, value in zip(batch.header, values)
+            if value is not None and value != ""
+        }
+        if not row_data:
+            continue
+
+        row_hash = calculate_row_hash(row_data)
+        occurrence = occurrences.get(row_hash, 0)
+        occurrences[row_hash] = occurrence + 1
+        chunk_id = f"{key_prefix}:{row_hash[:32]}"
+        chunks.append({
+            "chunk_id": f"{chunk_id}:{occurrence}" if occurrence else chunk_id,
+            "chunk_type": "table",
+            "content": "; ".join(f"{name}: {value}" for name, value in row_data.items()),
+            "section": batch.sheet_name,
+            "row_number": row_number,
+            "row_data": row_data,
+            "row_hash": row_hash,
+            "numeric": {
+                name: {"value": value}
+                for name, value, column_type in zip(batch.header, values, batch.column_types)
+                if column_type == "number" and value is not None
+            }
+        })
+    return chunks
+
+
+def calculate_row_hash(row_data: Dict[str, Any]) -> str:
+    """SHA-256 содержимого строки (не зависит от порядка столбцов)"""
+    row_str = json.dumps(row_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(row_str.encode("utf-8")).hexdigest()
+
+
+def _clean(values: List[Any]) -> List[Any]:
+    """Пустые ячейки -> None"""
+    return [value.strip() or None if isinstance(value, str) else value for value in values]
+
+
+def _trim(values: List[Any]) -> List[Any]:
+    """Пустые ячейки -> None, хвост пустых ячеек отбрасывается"""
+    values = _clean(values)
+    while values and values[-1] is None:
+        values.pop()
+    return values
+
+
+def _make_header(values: List[Any]) -> List[str]:
+    header = []
+    seen: Dict[str, int] = {}
+    for index, value in enumerate(values):
+        name = " ".join(str(value).split()) if value is not None else f"col_{index + 1}"
+        seen[name] = seen.get(name, 0) + 1
+        header.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return header
+
+
+def _parse_number(value: Any) -> Optional[Any]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if isinstance(value, float) and value.is_integer() else value
+    # Коды с ведущим нулем ("007") остаются текстом
+    if isinstance(value, str) and NUMBER_PATTERN.match(value) and not re.match(r"^[+-]?0\d", value):
+        number = float(re.sub(r"[ \u00a0\u202f]", "", value).replace(",", "."))
+        return int(number) if number.is_integer() and not re.search(r"[.,]", value) else number
+    return None
+
+
+def _infer_column_types(rows: List[Tuple[int, List[Any]]], header: List[str]) -> List[str]:
+    width = max([len(header)] + [len(values) for _, values in rows])
+    header.extend(f"col_{index + 1}" for index in range(len(header), width))
+
+    column_types = []
+    for column in range(width):
+        cells = [values[column] for _, values in rows if column < len(values) and values[column] is not None]
+        if cells and all(isinstance(cell, bool) for cell in cells):
+            column_types.append("bool")
+        elif cells and all(isinstance(cell, (datetime, date, time)) for cell in cells):
+            column_types.append("date")
+        elif cells and all(_parse_number(cell) is not None for cell in cells):
+            column_types.append("number")
+        else:
+            column_types.append("text")
+    return column_types
+
+
+def _typed_batch(sheet_name: str, header: List[str], column_types: List[str],
+                 rows: List[Tuple[int, List[Any]]]) -> RowBatch:
+    # Строки шире первого пакета получают безымянные столбцы
+    width = max(len(values) for _, values in rows)
+    if width > len(header):
+        header.extend(f"col_{index + 1}" for index in range(len(header), width))
+        column_types.extend("text" for _ in range(len(column_types), width))
+
+    typed_rows = []
+    for row_number, values in rows:
+        typed_rows.append((row_number, [
+            _convert(values[column] if column < len(values) else None, column_types[column])
+            for column in range(len(header))
+        ]))
+    return RowBatch(sheet_name=sheet_name, header=header, column_types=column_types, rows=typed_rows)
+
+
+def _convert(value: Any, column_type: str) -> Any:
+    if value is None:
+        return None
+    if column_type == "number":
+        number = _parse_number(value)
+        return number if number is not None else str(value)
+    if column_type == "bool":
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
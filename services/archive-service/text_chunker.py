@@ -0,0 +1,280 @@
+"""
+Разбиение текста на чанки по смещениям токенов
+
+Общая библиотека чанкинга для всех сервисов. Текст документа хранится
+одним неизменяемым буфером, разбиение работает с массивами смещений
+токенов, а строка чанка вырезается из буфера один раз при выдаче.
+Границы выбираются с учетом структуры (заголовки, абзацы, строки таблиц,
+предложения, пункты), идентификаторы чанков детерминированы: зависят
+только от хеша документа и смещений, поэтому повторная загрузка того же
+документа дает те же ID и может выполняться через upsert.
+"""
+
+import hashlib
+import re
+import uuid
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Пространство имен UUIDv5 для идентификаторов чанков
+CHUNK_NAMESPACE = uuid.UUID("6f1c3a4e-2b7d-5e8f-9a0b-c1d2e3f4a5b6")
+
+# Приоритеты границ между токенами (чем больше, тем предпочтительнее разрыв)
+BOUNDARY_NONE = 0
+BOUNDARY_CLAUSE = 1
+BOUNDARY_LINE = 1
+BOUNDARY_SENTENCE = 2
+BOUNDARY_TABLE_ROW = 3
+BOUNDARY_PARAGRAPH = 4
+BOUNDARY_SECTION = 5  # Перед заголовком: чанк всегда разрывается
+
+_WORD_RE = re.compile(r'\S+')
+_HEADING_RE = re.compile(
+    r'(?:#{1,6}[^\S\n]+\S'
+    r'|\d+(?:\.\d+)*\.?[^\S\n]+[А-ЯЁA-Z]'
+    r'|(?:ГЛАВА|РАЗДЕЛ|ПРИЛОЖЕНИЕ|CHAPTER|SECTION|APPENDIX)[^\S\n]+\S)'
+)
+_HEADING_MAX_LENGTH = 120
+_SENTENCE_END = frozenset('.!?…')
+_CLAUSE_END = frozenset(';:')
+
+Span = Tuple[int, int]
+
+@dataclass
+class Chunk:
+    """Чанк текста: срез буфера документа"""
+    chunk_id: str
+    index: int
+    text: str
+    start: int
+    end: int
+    token_count: int
+    section: Optional[str] = None
+    page: Optional[int] = None
+
+def document_hash(text: str) -> str:
+    """SHA-256 текста документа"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def make_chunk_id(doc_hash: str, start: int, end: int) -> str:
+    """Детерминированный UUIDv5 чанка по хешу документа и смещениям"""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{doc_hash}:{start}:{end}"))
+
+def make_point_id(chunk_id: str, model: Optional[str] = None) -> str:
+    """
+    Идентификатор точки в векторной базе (Qdrant принимает только uint и UUID)
+
+    UUIDv5 от ID чанка и модели эмбеддингов: повторная загрузка дает тот же
+    ID (upsert вместо дубликата), а векторы разных моделей не смешиваются.
+    Без модели UUID чанка используется как есть.
+    """
+    if model is None:
+        try:
+            return str(uuid.UUID(str(chunk_id)))
+        except ValueError:
+            pass
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{chunk_id}:{model or ''}"))
+
+def word_spans(text: str) -> List[Span]:
+    """Смещения слов (токенизация по умолчанию: одно слово — один токен)"""
+    return [match.span() for match in _WORD_RE.finditer(text)]
+
+class TextChunker:
+    """
+    Структурный чанкер с бюджетом в токенах.
+
+    Токенизация подключается функцией tokenize(text) -> [(start, end), ...]:
+    по умолчанию слова, в сервисах с моделью — смещения токенов модели.
+    Токены с пустыми смещениями учитываются в весе следующего токена.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 480,
+        overlap_tokens: int = 64,
+        min_fill: float = 0.5,
+        tokenize: Optional[Callable[[str], Sequence[Span]]] = None
+    ):
+        """
+        Args:
+            max_tokens: Максимальный размер чанка в токенах
+            overlap_tokens: Перекрытие соседних чанков в токенах (не переходит через заголовки)
+            min_fill: Доля max_tokens, раньше которой структурная граница не используется
+            tokenize: Функция, возвращающая смещения токенов в тексте
+        """
+        if max_tokens <= 0:
+            raise ValueError("max_tokens должен быть положительным")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens должен быть меньше max_tokens")
+
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_fill = min_fill
+        self.tokenize = tokenize or word_spans
+
+    def _units(self, text: str) -> Tuple[List[Span], List[int]]:
+        """Токены с непустыми смещениями и накопленные веса"""
+        spans: List[Span] = []
+        weights: List[int] = []
+        pending = 0
+        for start, end in self.tokenize(text):
+            if end <= start:
+                pending += 1
+                continue
+            spans.append((start, end))
+            weights.append(1 + pending)
+            pending = 0
+        if pending and weights:
+            weights[-1] += pending
+        return spans, list(accumulate(weights, initial=0))
+
+    @staticmethod
+    def _line_at(text: str, position: int) -> str:
+        line_end = text.find('\n', position)
+        return text[position:line_end if line_end != -1 else len(text)].strip()
+
+    @staticmethod
+    def _is_heading(line: str) -> bool:
+        """Короткая строка с номером раздела или ключевым словом; пункты списков (с ; , в конце) не считаются"""
+        return (
+            len(line) <= _HEADING_MAX_LENGTH
+            and line[-1] not in ';,'
+            and _HEADING_RE.match(line) is not None
+        )
+
+    def _boundaries(self, text: str, spans: List[Span]) -> Tuple[List[int], List[Tuple[int, str]]]:
+        """
+        Приоритеты границ и заголовки
+
+        Returns:
+            boundaries[i] — приоритет разрыва перед токеном i (для i в 1..n-1),
+            список (индекс токена, заголовок) для строк-заголовков
+        """
+        count = len(spans)
+        boundaries = [BOUNDARY_NONE] * (count + 1)
+        headings: List[Tuple[int, str]] = []
+        boundaries[count] = BOUNDARY_SECTION
+
+        if count and self._is_heading(self._line_at(text, spans[0][0])):
+            headings.append((0, self._line_at(text, spans[0][0])))
+
+        for i in range(1, count):
+            previous_end = spans[i - 1][1]
+            start = spans[i][0]
+            newlines = text.count('\n', previous_end, start)
+
+            if newlines:
+                line = self._line_at(text, start)
+                if self._is_heading(line):
+                    boundaries[i] = BOUNDARY_SECTION
+                    headings.append((i, line))
+                    continue
+                if newlines > 1:
+                    boundaries[i] = BOUNDARY_PARAGRAPH
+                    continue
+                line_start = text.rfind('\n', 0, previous_end) + 1
+                previous_line = text[line_start:previous_end]
+                if '|' in previous_line or '\t' in previous_line:
+                    boundaries[i] = BOUNDARY_TABLE_ROW
+                    continue
+
+            last_char = text[previous_end - 1]
+            if last_char in _SENTENCE_END:
+                boundaries[i] = BOUNDARY_SENTENCE
+            elif newlines:
+                boundaries[i] = BOUNDARY_LINE
+            elif last_char in _CLAUSE_END:
+                boundaries[i] = BOUNDARY_CLAUSE
+
+        return boundaries, headings
+
+    def iter_chunks(self, text: str, doc_hash: Optional[str] = None) -> Iterator[Chunk]:
+        """
+        Потоковое разбиение текста на чанки
+
+        Args:
+            text: Текст документа (не копируется, чанки — его срезы)
+            doc_hash: Хеш источника для ID чанков (по умолчанию SHA-256 текста)
+
+        Yields:
+            Chunk по порядку следования в тексте
+        """
+        spans, cumulative = self._units(text)
+        count = len(spans)
+        if not count:
+            return
+
+        doc_hash = doc_hash or document_hash(text)
+        boundaries, headings = self._boundaries(text, spans)
+        heading_indexes = [index for index, _ in headings]
+
+        start = 0
+        chunk_index = 0
+        while start < count:
+            limit = cumulative[start] + self.max_tokens
+            furthest = max(bisect_right(cumulative, limit) - 1, start + 1)
+            furthest = min(furthest, count)
+
+            # Заголовок внутри окна — жесткая граница
+            next_heading = bisect_right(heading_indexes, start)
+            if next_heading < len(heading_indexes) and heading_indexes[next_heading] <= furthest:
+                end = heading_indexes[next_heading]
+            elif furthest == count:
+                end = count
+            else:
+                end = furthest
+                best = BOUNDARY_NONE
+                floor = bisect_left(cumulative, cumulative[start] + int(self.max_tokens * self.min_fill))
+                for candidate in range(furthest, max(floor, start + 1) - 1, -1):
+                    if boundaries[candidate] > best:
+                        best = boundaries[candidate]
+                        end = candidate
+
+            section_index = bisect_right(heading_indexes, start) - 1
+            char_start, char_end = spans[start][0], spans[end - 1][1]
+            yield Chunk(
+                chunk_id=make_chunk_id(doc_hash, char_start, char_end),
+                index=chunk_index,
+                text=text[char_start:char_end],
+                start=char_start,
+                end=char_end,
+                token_count=cumulative[end] - cumulative[start],
+                section=headings[section_index][1] if section_index >= 0 else None
+            )
+            chunk_index += 1
+
+            if end >= count:
+                break
+            if boundaries[end] == BOUNDARY_SECTION or not self.overlap_tokens:
+                start = end
+            else:
+                overlap_start = bisect_left(cumulative, cumulative[end] - self.overlap_tokens)
+                start = max(overlap_start, start + 1)
+
+    def chunk(self, text: str, doc_hash: Optional[str] = None) -> List[Chunk]:
+        """Все чанки текста списком"""
+        return list(self.iter_chunks(text, doc_hash))
+
+    def iter_page_chunks(self, pages: Iterable[Tuple[int, str]], doc_hash: str) -> Iterator[Chunk]:
+        """
+        Потоковое разбиение документа по страницам
+
+        Страницы читаются из итератора по одной, чанки не пересекают границу
+        страницы и несут ее номер. Смещения и ID считаются внутри страницы.
+
+        Args:
+            pages: Пары (номер страницы, текст) по порядку
+            doc_hash: Хеш источника для ID чанков
+
+        Yields:
+            Chunk с заполненным page, index сквозной по документу
+        """
+        index = 0
+        for page_number, page_text in pages:
+            for chunk in self.iter_chunks(page_text, f"{doc_hash}:{page_number}"):
+                chunk.index = index
+                chunk.page = page_number
+                index += 1
+                yield chunk
@@ -2,13 +2,14 @@
 Расширенный Chat Service с поддержкой файлов, OCR, настроек и экспорта
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
 import os
-import io
 import logging
 import traceback
 from typing import List, Optional, Dict, Any
@@ -17,12 +18,14 @@ import json
 import sys
 
 from services.file_processor import FileProcessor
-from services.document_exporter import DocumentExporter
+from services.document_exporter import DocumentExporter, EXPORT_MEDIA_TYPES
 from services.settings_service import SettingsService
 from services.llm_service import LLMService
 from services.smart_tokenizer import SmartTokenizer
 from services.rag_integration_service import RAGIntegrationService
-from services.keycloak_auth import keycloak_auth, get_current_user, get_current_user_optional, has_role, require_role
+from services.conversation_analyzer import ConversationAnalyzer
+from logging_utils import RequestLoggingMiddleware, setup_queue_logging
+from services.keycloak_auth import keycloak_auth, get_current_user, get_current_user_optional, has_role, require_role, AUTH_DISABLED
 
 # Настройка логирования
 logging.basicConfig(
@@ -42,11 +45,14 @@ try:
 except Exception as e:
     print(f"Не удалось создать файловый логгер: {e}")
 
+# Запись логов в фоновом потоке, чтобы файловый I/O не блокировал event loop
+setup_queue_logging()
+
 logger = logging.getLogger(__name__)
 
 # Инициализация сервисов
 file_processor = FileProcessor()
-document_exporter = DocumentExporter()
+document_exporter = DocumentExporter(pool=file_processor.extraction_pool)
 settings_service = SettingsService()
 llm_service = LLMService()
 smart_tokenizer = SmartTokenizer()
@@ -63,11 +69,21 @@ async def lifespan(app: FastAPI):
     logger.info("📄 Экспорт в DOCX/PDF с кириллицей")
     logger.info("🔐 Интеграция с Keycloak для авторизации")
     
-    # Инициализация Keycloak (ОТКЛЮЧЕНА)
-    logger.info("🔓 Авторизация отключена - работаем без Keycloak")
+    # Инициализация Keycloak: загрузка JWKS и фоновое обновление ключей
+    if AUTH_DISABLED:
+        logger.info("🔓 Авторизация отключена - работаем без Keycloak")
+    else:
+        await keycloak_auth.initialize()
+    
+    # Токенизатор модели эмбеддингов загружается заранее, а не на первом запросе
+    await asyncio.to_thread(lambda: smart_tokenizer.token_counter.is_exact)
     
     yield
     # Shutdown
+    await conversation_analyzer.shutdown()
+    await flush_sessions_save()
+    file_processor.extraction_pool.shutdown()
+    await keycloak_auth.close()
     logger.info("🛑 Chat Service остановлен")
 
 app = FastAPI(
@@ -79,29 +95,8 @@ app = FastAPI(
     max_request_size=100 * 1024 * 1024,  # 100MB
 )
 
-# Middleware для логирования запросов и обработки больших запросов
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = datetime.now()
-    logger.info(f"📥 Входящий запрос: {request.method} {request.url}")
-    logger.debug(f"Headers: {dict(request.headers)}")
-    
-    # Логируем размер контента если есть
-    content_length = request.headers.get("content-length")
-    if content_length:
-        size_mb = int(content_length) / (1024 * 1024)
-        logger.info(f"📊 Размер запроса: {size_mb:.2f} MB")
-    
-    try:
-        response = await call_next(request)
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"📤 Ответ отправлен: {response.status_code} за {process_time:.3f}s")
-        return response
-    except Exception as e:
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.error(f"❌ Ошибка обработки запроса: {str(e)} за {process_time:.3f}s")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        raise
+# Middleware для логирования запросов (ASGI, не буферизует потоковые ответы SSE)
+app.add_middleware(RequestLoggingMiddleware, logger=logger, request_id_prefix="chat_req_")
 
 app.add_middleware(
     CORSMiddleware,
@@ -126,23 +121,81 @@ app.add_middleware(
 # Глобальное хранилище чатов (в production использовать Redis/DB)
 chat_sessions = {}
 
+SESSIONS_FILE = "/app/data/chat_sessions.json"
+SESSIONS_SAVE_DELAY = 1.0  # Изменения за это время сохраняются одной записью
+
+_sessions_save_task: Optional[asyncio.Task] = None
+_sessions_write: Optional[asyncio.Future] = None
+_sessions_dirty = False  # Есть изменения, еще не попавшие в снимок для записи
+
 # Функции для работы с персистентным хранением сессий
+def _write_sessions_file(data: str):
+    """Атомарная запись файла сессий (через временный файл)"""
+    os.makedirs(os.path.dirname(SESSIONS_FILE), exist_ok=True)
+    tmp_file = f"{SESSIONS_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_file, SESSIONS_FILE)
+
 def save_sessions_to_file():
     """Сохраняет сессии в файл"""
     try:
-        sessions_file = "/app/data/chat_sessions.json"
-        os.makedirs(os.path.dirname(sessions_file), exist_ok=True)
-        
-        with open(sessions_file, 'w', encoding='utf-8') as f:
-            json.dump(chat_sessions, f, ensure_ascii=False, indent=2)
+        _write_sessions_file(json.dumps(chat_sessions, ensure_ascii=False, indent=2))
         logger.info(f"💾 Сохранено {len(chat_sessions)} сессий в файл")
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения сессий: {e}")
 
+def schedule_sessions_save():
+    """
+    Отложенное сохранение сессий
+    
+    Все изменения за SESSIONS_SAVE_DELAY записываются одной перезаписью файла,
+    сама запись выполняется в потоке и не блокирует event loop.
+    """
+    global _sessions_save_task, _sessions_dirty
+    _sessions_dirty = True
+    if _sessions_save_task is None or _sessions_save_task.done():
+        _sessions_save_task = asyncio.create_task(_save_sessions_later())
+
+async def _save_sessions_later():
+    global _sessions_write, _sessions_dirty
+    # Изменения, сделанные во время записи, сохраняются следующим проходом
+    while _sessions_dirty:
+        await asyncio.sleep(SESSIONS_SAVE_DELAY)
+        _sessions_dirty = False
+        try:
+            # Снимок делается в event loop, пока сессии никто не меняет
+            data = json.dumps(chat_sessions, ensure_ascii=False, indent=2)
+            _sessions_write = asyncio.ensure_future(asyncio.to_thread(_write_sessions_file, data))
+            # Запись доводится до конца, даже если задачу отменит flush_sessions_save
+            await asyncio.shield(_sessions_write)
+            logger.info(f"💾 Сохранено {len(chat_sessions)} сессий в файл")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _sessions_dirty = True
+            logger.error(f"❌ Ошибка сохранения сессий: {e}")
+            return
+
+async def flush_sessions_save():
+    """Немедленная запись отложенного сохранения (при остановке сервиса)"""
+    global _sessions_save_task, _sessions_dirty
+    if _sessions_save_task is not None and not _sessions_save_task.done():
+        _sessions_save_task.cancel()
+    _sessions_save_task = None
+    
+    # Начатая запись завершается до финальной, чтобы не перезаписать ее старым снимком
+    if _sessions_write is not None and not _sessions_write.done():
+        await asyncio.wait([_sessions_write])
+    
+    if _sessions_dirty:
+        _sessions_dirty = False
+        save_sessions_to_file()
+
 def load_sessions_from_file():
     """Загружает сессии из файла"""
     try:
-        sessions_file = "/app/data/chat_sessions.json"
+        sessions_file = SESSIONS_FILE
         if os.path.exists(sessions_file):
             with open(sessions_file, 'r', encoding='utf-8') as f:
                 global chat_sessions
@@ -187,11 +240,14 @@ def update_user_context(session_id: str, context_updates: Dict[str, Any]):
         session["user_context"] = {}
     
     session["user_context"].update(context_updates)
-    save_sessions_to_file()
+    schedule_sessions_save()
 
 # Загружаем сессии при старте приложения
 load_sessions_from_file()
 
+# Анализ тем разговора после каждого хода (в фоне, только новые сообщения)
+conversation_analyzer = ConversationAnalyzer(on_updated=schedule_sessions_save)
+
 @app.get("/")
 async def root():
     logger.info("🏠 Запрос к корневому эндпоинту")
@@ -379,32 +435,19 @@ async def analyze_document_with_rag(
         if not files:
             raise HTTPException(status_code=400, detail="Необходимо загрузить файл для анализа")
         
-        # Обрабатываем первый файл
-        file = files[0]
-        file_content = await file.read()
-        
-        # Извлекаем текст из файла
-        file_result = await file_processor.process_file(file_content, file.filename)
-        if not file_result["success"]:
-            raise HTTPException(status_code=400, detail=f"Ошибка обработки файла: {file_result.get('error', 'Неизвестная ошибка')}")
-        
-        # Получаем текст документа
-        document_text = ""
-        if file_result["content"].get("text"):
-            document_text = file_result["content"]["text"]
-        elif file_result["content"].get("sheets"):
-            # Для Excel файлов объединяем все листы
-            for sheet_name, sheet_data in file_result["content"]["sheets"].items():
-                document_text += f"\n--- Лист: {sheet_name} ---\n"
-                document_text += sheet_data.get("text", "")
+        # Извлекаем текст из всех файлов
+        documents = await _extract_uploaded_documents(files)
+        filenames = [filename for filename, _ in documents]
+        if len(documents) == 1:
+            document_text = documents[0][1]
         else:
-            raise HTTPException(status_code=400, detail="Не удалось извлечь текст из файла")
+            document_text = "".join(f"\n=== Файл: {filename} ===\n{text}" for filename, text in documents)
         
         # Выполняем комплексный анализ
         analysis_result = await rag_integration_service.get_comprehensive_analysis(
             document_text=document_text,
             user_query=message,
-            filename=file.filename
+            filename=", ".join(filenames)
         )
         
         # Сохраняем результат в сессию
@@ -422,7 +465,8 @@ async def analyze_document_with_rag(
             "success": True,
             "analysis_result": analysis_result,
             "session_id": session_id,
-            "filename": file.filename,
+            "filename": filenames[0],
+            "filenames": filenames,
             "analysis_type": analysis_type
         }
         
@@ -445,65 +489,52 @@ async def tokenize_document(
         if not files:
             raise HTTPException(status_code=400, detail="Необходимо загрузить файл для токенизации")
         
-        # Обрабатываем первый файл
-        file = files[0]
-        file_content = await file.read()
-        
-        # Извлекаем текст из файла
-        file_result = await file_processor.process_file(file_content, file.filename)
-        if not file_result["success"]:
-            raise HTTPException(status_code=400, detail=f"Ошибка обработки файла: {file_result.get('error', 'Неизвестная ошибка')}")
-        
-        # Получаем текст документа
-        document_text = ""
-        if file_result["content"].get("text"):
-            document_text = file_result["content"]["text"]
-        elif file_result["content"].get("sheets"):
-            # Для Excel файлов объединяем все листы
-            for sheet_name, sheet_data in file_result["content"]["sheets"].items():
-                document_text += f"\n--- Лист: {sheet_name} ---\n"
-                document_text += sheet_data.get("text", "")
-        else:
-            raise HTTPException(status_code=400, detail="Не удалось извлечь текст из файла")
-        
-        # Выполняем токенизацию
-        token_chunks, document_structure = await smart_tokenizer.tokenize_document(
-            document_text, file.filename
-        )
-        
-        # Получаем статистику
-        stats = smart_tokenizer.get_tokenization_stats(token_chunks, document_structure)
-        
-        # Преобразуем чанки в словари для JSON сериализации
-        chunks_data = []
-        for chunk in token_chunks:
-            chunks_data.append({
-                "chunk_id": chunk.chunk_id,
-                "text": chunk.text,
-                "token_count": chunk.token_count,
-                "chunk_type": chunk.chunk_type,
-                "metadata": chunk.metadata,
-                "start_position": chunk.start_position,
-                "end_position": chunk.end_position,
-                "parent_section": chunk.parent_section,
-                "importance_score": chunk.importance_score,
-                "context_keywords": chunk.context_keywords
+        # Извлекаем текст из всех файлов и токенизируем каждый
+        results = []
+        for filename, document_text in await _extract_uploaded_documents(files):
+            token_chunks, document_structure = await smart_tokenizer.tokenize_document(
+                document_text, filename
+            )
+            
+            # Получаем статистику
+            stats = smart_tokenizer.get_tokenization_stats(token_chunks, document_structure)
+            
+            # Преобразуем чанки в словари для JSON сериализации
+            chunks_data = []
+            for chunk in token_chunks:
+                chunks_data.append({
+                    "chunk_id": chunk.chunk_id,
+                    "text": chunk.text,
+                    "token_count": chunk.token_count,
+                    "chunk_type": chunk.chunk_type,
+                    "metadata": chunk.metadata,
+                    "start_position": chunk.start_position,
+                    "end_position": chunk.end_position,
+                    "parent_section": chunk.parent_section,
+                    "importance_score": chunk.importance_score,
+                    "context_keywords": chunk.context_keywords
+                })
+            
+            results.append({
+                "filename": filename,
+                "document_structure": {
+                    "title": document_structure.title,
+                    "sections": document_structure.sections,
+                    "total_tokens": document_structure.total_tokens,
+                    "chunk_count": document_structure.chunk_count,
+                    "document_type": document_structure.document_type,
+                    "language": document_structure.language,
+                    "metadata": document_structure.metadata
+                },
+                "token_chunks": chunks_data,
+                "statistics": stats
             })
         
+        # Поля верхнего уровня — первый файл (как раньше), все файлы — в documents
         return {
             "success": True,
-            "filename": file.filename,
-            "document_structure": {
-                "title": document_structure.title,
-                "sections": document_structure.sections,
-                "total_tokens": document_structure.total_tokens,
-                "chunk_count": document_structure.chunk_count,
-                "document_type": document_structure.document_type,
-                "language": document_structure.language,
-                "metadata": document_structure.metadata
-            },
-            "token_chunks": chunks_data,
-            "statistics": stats
+            **results[0],
+            "documents": results
         }
         
     except HTTPException as he:
@@ -551,14 +582,12 @@ async def chat_with_ai(
         
         session = chat_sessions[session_id]
         
-        # Обрабатываем загруженные файлы
-        processed_files = []
-        for file in files:
-            file_content = await file.read()
-            result = await file_processor.process_file(file_content, file.filename)
-            if result["success"]:
-                processed_files.append(result)
-                session["files"].append(result)
+        # Обрабатываем загруженные файлы (параллельно, повторные — из кэша по содержимому)
+        processed_files = [
+            result for result in await file_processor.process_uploads(files)
+            if result["success"]
+        ]
+        session["files"].extend(processed_files)
         
         # Добавляем сообщение пользователя
         user_message = {
@@ -596,8 +625,9 @@ async def chat_with_ai(
         }
         session["messages"].append(ai_message)
         
-        # Сохраняем сессию
-        save_sessions_to_file()
+        # Сохраняем сессию и обновляем анализ тем в фоне
+        schedule_sessions_save()
+        conversation_analyzer.schedule(session_id, session)
         
         return {
             "success": True,
@@ -636,14 +666,12 @@ async def chat_with_ai_streaming(
         
         session = chat_sessions[session_id]
         
-        # Обрабатываем загруженные файлы
-        processed_files = []
-        for file in files:
-            file_content = await file.read()
-            result = await file_processor.process_file(file_content, file.filename)
-            if result["success"]:
-                processed_files.append(result)
-                session["files"].append(result)
+        # Обрабатываем загруженные файлы (параллельно, повторные — из кэша по содержимому)
+        processed_files = [
+            result for result in await file_processor.process_uploads(files)
+            if result["success"]
+        ]
+        session["files"].extend(processed_files)
         
         # Добавляем сообщение пользователя
         user_message = {
@@ -684,6 +712,8 @@ async def chat_with_ai_streaming(
                 "timestamp": datetime.now().isoformat()
             }
             session["messages"].append(ai_message)
+            schedule_sessions_save()
+            conversation_analyzer.schedule(session_id, session)
             
             # Отправляем финальное сообщение
             yield f"data: {json.dumps({'done': True, 'session_id': session_id, 'full_response': full_response})}\n\n"
@@ -757,37 +787,11 @@ async def analyze_conversation_context(session_id: str):
                 "message": "Недостаточно сообщений для анализа"
             }
         
-        # Простой анализ контекста (в реальном проекте можно использовать LLM)
-        user_messages = [msg for msg in messages if msg["role"] == "user"]
-        topics = []
-        preferences = {}
-        
-        # Извлекаем ключевые темы из сообщений пользователя
-        for msg in user_messages:
-            content = msg["content"].lower()
-            if "расчет" in content or "вычислить" in content:
-                topics.append("инженерные расчеты")
-            if "документ" in content or "файл" in content:
-                topics.append("работа с документами")
-            if "проект" in content:
-                topics.append("управление проектами")
-            if "помощь" in content or "объясни" in content:
-                topics.append("консультации")
-        
-        # Убираем дубликаты
-        topics = list(set(topics))
-        
-        # Создаем резюме разговора
-        conversation_summary = f"Обсуждено {len(messages)} сообщений. Основные темы: {', '.join(topics) if topics else 'общие вопросы'}"
-        
-        # Обновляем контекст
-        context_updates = {
-            "conversation_summary": conversation_summary,
-            "key_topics": topics,
-            "last_analysis": datetime.now().isoformat()
-        }
-        
-        update_user_context(session_id, context_updates)
+        # Анализ только сообщений, появившихся после прошлого запуска
+        analysis = conversation_analyzer.analyze(session)
+        topics = analysis["key_topics"]
+        conversation_summary = analysis["conversation_summary"]
+        schedule_sessions_save()
         
         return {
             "success": True,
@@ -846,16 +850,20 @@ async def export_to_docx(
             "exported_at": datetime.now().isoformat()
         }
         
-        # Экспортируем в DOCX
-        docx_bytes = await document_exporter.export_to_docx(export_data, filename)
+        # Экспортируем в DOCX (в пуле процессов, с кэшем по состоянию сессии)
+        cache_key = document_exporter.cache_key(session_id, session, "docx", llm_settings)
+        export_path = await document_exporter.export_to_docx(export_data, filename, cache_key=cache_key)
         
-        # Возвращаем файл
-        return StreamingResponse(
-            io.BytesIO(docx_bytes),
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={"Content-Disposition": f"attachment; filename={filename or f'chat_{session_id}.docx'}"}
+        # Отдаем файл с диска потоком
+        return FileResponse(
+            export_path,
+            media_type=EXPORT_MEDIA_TYPES["docx"],
+            headers={"Content-Disposition": f"attachment; filename={filename or f'chat_{session_id}.docx'}"},
+            background=BackgroundTask(document_exporter.release, export_path)
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка экспорта в DOCX: {str(e)}")
 
@@ -881,21 +889,67 @@ async def export_to_pdf(
             "exported_at": datetime.now().isoformat()
         }
         
-        # Экспортируем в PDF
-        pdf_bytes = await document_exporter.export_to_pdf(export_data, filename)
+        # Экспортируем в PDF (в пуле процессов, с кэшем по состоянию сессии)
+        cache_key = document_exporter.cache_key(session_id, session, "pdf", llm_settings)
+        export_path = await document_exporter.export_to_pdf(export_data, filename, cache_key=cache_key)
         
-        # Возвращаем файл
-        return StreamingResponse(
-            io.BytesIO(pdf_bytes),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename={filename or f'chat_{session_id}.pdf'}"}
+        # Отдаем файл с диска потоком
+        return FileResponse(
+            export_path,
+            media_type=EXPORT_MEDIA_TYPES["pdf"],
+            headers={"Content-Disposition": f"attachment; filename={filename or f'chat_{session_id}.pdf'}"},
+            background=BackgroundTask(document_exporter.release, export_path)
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка экспорта в PDF: {str(e)}")
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
 
+def _document_text(file_result: Dict[str, Any]) -> str:
+    """Текст документа из результата обработки файла (листы Excel объединяются)"""
+    content = file_result["content"]
+    if content.get("text"):
+        return content["text"]
+    
+    document_text = ""
+    for sheet_name, sheet_data in (content.get("sheets") or {}).items():
+        document_text += f"\n--- Лист: {sheet_name} ---\n"
+        document_text += sheet_data.get("text", "")
+    return document_text
+
+async def _extract_uploaded_documents(files: List[UploadFile]) -> List[tuple]:
+    """
+    Параллельное извлечение текста из всех загруженных файлов
+    
+    Returns:
+        Список (имя файла, текст) для успешно обработанных файлов
+    
+    Raises:
+        HTTPException: Если ни из одного файла не удалось извлечь текст
+    """
+    documents = []
+    errors = []
+    for file_result in await file_processor.process_uploads(files):
+        if not file_result["success"]:
+            errors.append(f"{file_result['filename']}: {file_result.get('error', 'Неизвестная ошибка')}")
+            continue
+        
+        document_text = _document_text(file_result)
+        if document_text:
+            documents.append((file_result["filename"], document_text))
+        else:
+            errors.append(f"{file_result['filename']}: не удалось извлечь текст")
+    
+    if errors:
+        logger.warning(f"⚠️ Не все файлы обработаны: {'; '.join(errors)}")
+    if not documents:
+        raise HTTPException(status_code=400, detail=f"Ошибка обработки файлов: {'; '.join(errors)}")
+    
+    return documents
+
 def _build_llm_context(session: Dict[str, Any], llm_settings: Dict[str, Any]) -> str:
     """Строит контекст для LLM с учетом пользовательского контекста"""
     context = ""
@@ -0,0 +1,76 @@
+"""
+Временный in-memory индекс чанков для анализа одного документа
+"""
+
+import logging
+from typing import List, Tuple, Sequence
+
+import numpy as np
+
+from .smart_tokenizer import TokenChunk
+
+logger = logging.getLogger(__name__)
+
+class EphemeralAnalysisIndex:
+    """
+    Индекс чанков анализируемого документа, живущий только на время запроса.
+
+    Эмбеддинги хранятся одной нормализованной матрицей, поэтому косинусное
+    сходство сводится к одному матричному умножению, а top-k выбирается
+    через argpartition без полной сортировки.
+    """
+
+    def __init__(self, chunks: List[TokenChunk], embeddings: Sequence[Sequence[float]]):
+        if len(chunks) != len(embeddings):
+            raise ValueError(
+                f"Количество чанков ({len(chunks)}) не совпадает с количеством эмбеддингов ({len(embeddings)})"
+            )
+
+        self.chunks = chunks
+        self.matrix = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1))
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """L2-нормализация строк матрицы"""
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        limit: int = 10,
+        threshold: float = 0.0
+    ) -> List[Tuple[TokenChunk, float]]:
+        """
+        Поиск наиболее похожих чанков
+
+        Args:
+            query_embedding: Эмбеддинг запроса
+            limit: Максимальное количество результатов
+            threshold: Минимальное косинусное сходство
+
+        Returns:
+            Список пар (чанк, сходство), отсортированный по убыванию сходства
+        """
+        if not self.chunks or limit <= 0:
+            return []
+
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.matrix @ query
+
+        k = min(limit, len(scores))
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [
+            (self.chunks[i], float(scores[i]))
+            for i in top
+            if scores[i] >= threshold
+        ]
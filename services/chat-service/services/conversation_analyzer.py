@@ -0,0 +1,123 @@
+"""
+Инкрементальный анализ тем разговора
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .keyword_matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+# Темы разговора и ключевые слова (подстроки в нижнем регистре)
+TOPIC_KEYWORDS = {
+    "инженерные расчеты": ["расчет", "вычислить"],
+    "работа с документами": ["документ", "файл"],
+    "управление проектами": ["проект"],
+    "консультации": ["помощь", "объясни"],
+}
+
+class ConversationAnalyzer:
+    """
+    Анализ тем разговора по курсору последнего обработанного сообщения.
+
+    Счетчики тем и курсор хранятся в user_context сессии, поэтому каждый
+    запуск обрабатывает только новые сообщения. Ключевые слова всех тем
+    ищутся одним проходом KeywordMatcher. После хода анализ ставится в
+    очередь с задержкой: серия быстрых сообщений дает один запуск.
+    """
+
+    def __init__(
+        self,
+        topic_keywords: Optional[Dict[str, List[str]]] = None,
+        debounce_seconds: float = 2.0,
+        on_updated: Optional[Callable[[], None]] = None
+    ):
+        """
+        Args:
+            topic_keywords: Темы и их ключевые слова
+            debounce_seconds: Задержка фонового анализа после последнего хода
+            on_updated: Вызывается после фонового обновления контекста (например, сохранение сессий)
+        """
+        self.debounce_seconds = debounce_seconds
+        self.on_updated = on_updated
+        self._keyword_topics: Dict[str, List[str]] = {}
+        for topic, keywords in (topic_keywords or TOPIC_KEYWORDS).items():
+            for keyword in keywords:
+                self._keyword_topics.setdefault(keyword.lower(), []).append(topic)
+        self.matcher = KeywordMatcher(self._keyword_topics)
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def message_topics(self, content: str) -> set:
+        """Темы, упомянутые в тексте сообщения"""
+        return {
+            topic
+            for keyword in self.matcher.matched(content.lower())
+            for topic in self._keyword_topics[keyword]
+        }
+
+    def analyze(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Обработка сообщений, появившихся после прошлого анализа
+
+        Args:
+            session: Сессия чата (контекст обновляется на месте)
+
+        Returns:
+            Обновленные поля user_context
+        """
+        context = session.setdefault("user_context", {})
+        state = context.get("topic_analysis") or {}
+        messages = session.get("messages", [])
+        cursor = state.get("cursor", 0)
+        topic_counts = dict(state.get("topic_counts", {}))
+
+        # История сессии была заменена — считаем заново
+        if cursor > len(messages):
+            cursor, topic_counts = 0, {}
+
+        for message in messages[cursor:]:
+            if message.get("role") != "user":
+                continue
+            for topic in self.message_topics(message.get("content", "")):
+                topic_counts[topic] = topic_counts.get(topic, 0) + 1
+
+        # Темы по убыванию числа сообщений, в которых они встречались
+        topics = sorted(topic_counts, key=lambda topic: (-topic_counts[topic], topic))
+        updates = {
+            "conversation_summary": f"Обсуждено {len(messages)} сообщений. Основные темы: {', '.join(topics) if topics else 'общие вопросы'}",
+            "key_topics": topics,
+            "topic_analysis": {"cursor": len(messages), "topic_counts": topic_counts},
+            "last_analysis": datetime.now().isoformat()
+        }
+        context.update(updates)
+        return updates
+
+    def schedule(self, session_id: str, session: Dict[str, Any]):
+        """Отложенный анализ сессии (повторный вызов до запуска переносит его)"""
+        pending = self._pending.get(session_id)
+        if pending is not None and not pending.done():
+            pending.cancel()
+        self._pending[session_id] = asyncio.create_task(self._analyze_later(session_id, session))
+
+    async def _analyze_later(self, session_id: str, session: Dict[str, Any]):
+        await asyncio.sleep(self.debounce_seconds)
+        if self._pending.get(session_id) is asyncio.current_task():
+            del self._pending[session_id]
+
+        try:
+            self.analyze(session)
+            if self.on_updated:
+                self.on_updated()
+        except Exception as e:
+            logger.error(f"❌ Ошибка фонового анализа сессии {session_id}: {e}")
+
+    async def shutdown(self):
+        """Отмена запланированных запусков"""
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
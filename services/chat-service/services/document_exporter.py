@@ -2,8 +2,14 @@
 Сервис для экспорта результатов чата в документы
 """
 
-import io
-from typing import Dict, Any, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
 
@@ -23,20 +29,45 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
 
-class DocumentExporter:
-    """Сервис для экспорта результатов чата в документы"""
+from extraction_pool import ExtractionPool
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов извлеченного текста файла попадает в документ
+FILE_PREVIEW_LENGTH = 500
+
+EXPORT_MEDIA_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+}
+
+def _render_export(export_format: str, chat_data: Dict[str, Any], path: str):
+    """Построение документа в файл (выполняется в пуле процессов)"""
+    renderer = ChatDocumentRenderer()
+    if export_format == "docx":
+        renderer.render_docx(chat_data, path)
+    else:
+        renderer.render_pdf(chat_data, path)
+
+class ChatDocumentRenderer:
+    """Построение DOCX/PDF из данных чата с записью сразу в файл"""
+    
+    _fonts_registered = False
     
     def __init__(self):
         self.setup_fonts()
     
     def setup_fonts(self):
-        """Настройка шрифтов для поддержки кириллицы"""
+        """Настройка шрифтов для поддержки кириллицы (один раз на процесс)"""
+        if ChatDocumentRenderer._fonts_registered:
+            return
         try:
             # Регистрируем шрифты для поддержки кириллицы
             # В production нужно будет добавить файлы шрифтов
             self.register_cyrillic_fonts()
         except Exception as e:
             print(f"Предупреждение: Не удалось зарегистрировать кириллические шрифты: {e}")
+        ChatDocumentRenderer._fonts_registered = True
     
     def register_cyrillic_fonts(self):
         """Регистрирует кириллические шрифты"""
@@ -54,138 +85,113 @@ class DocumentExporter:
                 # Fallback на встроенные шрифты
                 pass
     
-    async def export_to_docx(
-        self, 
-        chat_data: Dict[str, Any], 
-        filename: Optional[str] = None
-    ) -> bytes:
+    def render_docx(self, chat_data: Dict[str, Any], path: str):
         """
-        Экспортирует данные чата в DOCX
+        Строит DOCX из данных чата
         
         Args:
             chat_data: Данные чата для экспорта
-            filename: Имя файла (опционально)
-            
-        Returns:
-            Байты DOCX файла
+            path: Файл, в который сохраняется документ
         """
-        try:
-            doc = Document()
-            
-            # Настройка стилей
-            self._setup_docx_styles(doc)
-            
-            # Заголовок документа
-            title = doc.add_heading('Результат работы ИИ', 0)
-            title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            # Метаданные
-            doc.add_paragraph(f"Дата создания: {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-            doc.add_paragraph(f"Тема: {chat_data.get('topic', 'Чат с ИИ')}")
-            
-            # Разделитель
-            doc.add_paragraph("=" * 50)
-            
-            # Сообщения чата
-            messages = chat_data.get('messages', [])
-            for i, message in enumerate(messages):
-                self._add_message_to_docx(doc, message, i + 1)
-            
-            # Файлы (если есть)
-            files = chat_data.get('files', [])
-            if files:
-                doc.add_heading('Прикрепленные файлы', level=1)
-                for file_info in files:
-                    self._add_file_info_to_docx(doc, file_info)
-            
-            # Настройки LLM (если есть)
-            settings = chat_data.get('llm_settings', {})
-            if settings:
-                doc.add_heading('Настройки LLM', level=1)
-                self._add_settings_to_docx(doc, settings)
-            
-            # Сохраняем в байты
-            doc_bytes = io.BytesIO()
-            doc.save(doc_bytes)
-            doc_bytes.seek(0)
-            
-            return doc_bytes.getvalue()
-            
-        except Exception as e:
-            raise Exception(f"Ошибка экспорта в DOCX: {str(e)}")
+        doc = Document()
+        
+        # Настройка стилей
+        self._setup_docx_styles(doc)
+        # python-docx ищет стиль по имени перебором всех стилей на каждый абзац,
+        # поэтому ID стилей сообщений определяются один раз на документ
+        self._docx_style_ids = {
+            name: doc.styles[name].style_id
+            for name in ('Heading 2', 'UserMessage', 'AIMessage')
+        }
+        
+        # Заголовок документа
+        title = doc.add_heading('Результат работы ИИ', 0)
+        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        
+        # Метаданные
+        doc.add_paragraph(f"Дата создания: {datetime.now().strftime('%d.%m.%Y %H:%M')}")
+        doc.add_paragraph(f"Тема: {chat_data.get('topic', 'Чат с ИИ')}")
+        
+        # Разделитель
+        doc.add_paragraph("=" * 50)
+        
+        # Сообщения чата
+        messages = chat_data.get('messages', [])
+        for i, message in enumerate(messages):
+            self._add_message_to_docx(doc, message, i + 1)
+        
+        # Файлы (если есть)
+        files = chat_data.get('files', [])
+        if files:
+            doc.add_heading('Прикрепленные файлы', level=1)
+            for file_info in files:
+                self._add_file_info_to_docx(doc, file_info)
+        
+        # Настройки LLM (если есть)
+        settings = chat_data.get('llm_settings', {})
+        if settings:
+            doc.add_heading('Настройки LLM', level=1)
+            self._add_settings_to_docx(doc, settings)
+        
+        doc.save(path)
     
-    async def export_to_pdf(
-        self, 
-        chat_data: Dict[str, Any], 
-        filename: Optional[str] = None
-    ) -> bytes:
+    def render_pdf(self, chat_data: Dict[str, Any], path: str):
         """
-        Экспортирует данные чата в PDF
+        Строит PDF из данных чата
         
         Args:
             chat_data: Данные чата для экспорта
-            filename: Имя файла (опционально)
-            
-        Returns:
-            Байты PDF файла
+            path: Файл, в который сохраняется документ
         """
-        try:
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=A4)
-            
-            # Настройка стилей
-            styles = self._setup_pdf_styles()
-            
-            # Содержимое документа
-            story = []
-            
-            # Заголовок
-            title = Paragraph("Результат работы ИИ", styles['Title'])
-            story.append(title)
+        doc = SimpleDocTemplate(path, pagesize=A4)
+        
+        # Настройка стилей
+        styles = self._setup_pdf_styles()
+        
+        # Содержимое документа
+        story = []
+        
+        # Заголовок
+        title = Paragraph("Результат работы ИИ", styles['ChatTitle'])
+        story.append(title)
+        story.append(Spacer(1, 12))
+        
+        # Метаданные
+        meta_data = [
+            f"Дата создания: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
+            f"Тема: {chat_data.get('topic', 'Чат с ИИ')}"
+        ]
+        
+        for meta in meta_data:
+            story.append(Paragraph(meta, styles['Normal']))
+        
+        story.append(Spacer(1, 12))
+        story.append(Paragraph("=" * 50, styles['Normal']))
+        story.append(Spacer(1, 12))
+        
+        # Сообщения чата
+        messages = chat_data.get('messages', [])
+        for i, message in enumerate(messages):
+            self._add_message_to_pdf(story, message, i + 1, styles)
+        
+        # Файлы (если есть)
+        files = chat_data.get('files', [])
+        if files:
+            story.append(Paragraph("Прикрепленные файлы", styles['Heading1']))
             story.append(Spacer(1, 12))
             
-            # Метаданные
-            meta_data = [
-                f"Дата создания: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-                f"Тема: {chat_data.get('topic', 'Чат с ИИ')}"
-            ]
-            
-            for meta in meta_data:
-                story.append(Paragraph(meta, styles['Normal']))
-            
-            story.append(Spacer(1, 12))
-            story.append(Paragraph("=" * 50, styles['Normal']))
+            for file_info in files:
+                self._add_file_info_to_pdf(story, file_info, styles)
+        
+        # Настройки LLM (если есть)
+        settings = chat_data.get('llm_settings', {})
+        if settings:
+            story.append(Paragraph("Настройки LLM", styles['Heading1']))
             story.append(Spacer(1, 12))
-            
-            # Сообщения чата
-            messages = chat_data.get('messages', [])
-            for i, message in enumerate(messages):
-                self._add_message_to_pdf(story, message, i + 1, styles)
-            
-            # Файлы (если есть)
-            files = chat_data.get('files', [])
-            if files:
-                story.append(Paragraph("Прикрепленные файлы", styles['Heading1']))
-                story.append(Spacer(1, 12))
-                
-                for file_info in files:
-                    self._add_file_info_to_pdf(story, file_info, styles)
-            
-            # Настройки LLM (если есть)
-            settings = chat_data.get('llm_settings', {})
-            if settings:
-                story.append(Paragraph("Настройки LLM", styles['Heading1']))
-                story.append(Spacer(1, 12))
-                self._add_settings_to_pdf(story, settings, styles)
-            
-            # Создаем PDF
-            doc.build(story)
-            buffer.seek(0)
-            
-            return buffer.getvalue()
-            
-        except Exception as e:
-            raise Exception(f"Ошибка экспорта в PDF: {str(e)}")
+            self._add_settings_to_pdf(story, settings, styles)
+        
+        # Создаем PDF
+        doc.build(story)
     
     def _setup_docx_styles(self, doc: Document):
         """Настраивает стили для DOCX"""
@@ -212,7 +218,7 @@ class DocumentExporter:
         
         # Стиль заголовка
         styles.add(ParagraphStyle(
-            name='Title',
+            name='ChatTitle',
             parent=styles['Title'],
             fontName='Helvetica-Bold',
             fontSize=16,
@@ -250,22 +256,25 @@ class DocumentExporter:
         
         # Заголовок сообщения
         if role == 'user':
-            heading = doc.add_heading(f"Пользователь ({timestamp})", level=2)
+            heading = self._add_docx_paragraph(doc, f"Пользователь ({timestamp})", 'Heading 2')
         else:
-            heading = doc.add_heading(f"ИИ ({timestamp})", level=2)
+            heading = self._add_docx_paragraph(doc, f"ИИ ({timestamp})", 'Heading 2')
         
-        # Содержимое сообщения
-        content_para = doc.add_paragraph(content)
-        
-        # Применяем стиль
+        # Содержимое сообщения с примененным стилем
         if role == 'user':
-            content_para.style = 'UserMessage'
+            self._add_docx_paragraph(doc, content, 'UserMessage')
         else:
-            content_para.style = 'AIMessage'
+            self._add_docx_paragraph(doc, content, 'AIMessage')
         
         # Разделитель
         doc.add_paragraph("-" * 30)
     
+    def _add_docx_paragraph(self, doc: Document, text: str, style_name: str):
+        """Абзац со стилем по заранее найденному ID (без поиска стиля по имени)"""
+        paragraph = doc.add_paragraph(text)
+        paragraph._p.style = self._docx_style_ids[style_name]
+        return paragraph
+    
     def _add_message_to_pdf(self, story: List, message: Dict[str, Any], index: int, styles: Dict[str, Any]):
         """Добавляет сообщение в PDF документ"""
         role = message.get('role', 'user')
@@ -304,7 +313,7 @@ class DocumentExporter:
         content = file_info.get('content', {})
         if content.get('text'):
             doc.add_paragraph("Содержимое:")
-            doc.add_paragraph(content['text'][:500] + "..." if len(content['text']) > 500 else content['text'])
+            doc.add_paragraph(content['text'][:FILE_PREVIEW_LENGTH] + "..." if len(content['text']) > FILE_PREVIEW_LENGTH else content['text'])
     
     def _add_file_info_to_pdf(self, story: List, file_info: Dict[str, Any], styles: Dict[str, Any]):
         """Добавляет информацию о файле в PDF"""
@@ -320,7 +329,7 @@ class DocumentExporter:
         content = file_info.get('content', {})
         if content.get('text'):
             story.append(Paragraph("Содержимое:", styles['Normal']))
-            text = content['text'][:500] + "..." if len(content['text']) > 500 else content['text']
+            text = content['text'][:FILE_PREVIEW_LENGTH] + "..." if len(content['text']) > FILE_PREVIEW_LENGTH else content['text']
             story.append(Paragraph(text, styles['Normal']))
         
         story.append(Spacer(1, 6))
@@ -335,3 +344,182 @@ class DocumentExporter:
         for key, value in settings.items():
             story.append(Paragraph(f"{key}: {value}", styles['Normal']))
         story.append(Spacer(1, 6))
+
+class DocumentExporter:
+    """
+    Сервис для экспорта результатов чата в документы
+    
+    Документ строится в пуле процессов и пишется сразу во временный файл,
+    поэтому event loop не блокируется, а сервис не держит документ в памяти.
+    Готовые файлы кэшируются по ключу состояния сессии: повторное скачивание
+    без новых сообщений отдает тот же файл без перестроения. После отдачи
+    файла вызывается release(): некэшированный экспорт удаляется, а файлы,
+    которые сейчас отдаются, не вытесняются из кэша.
+    """
+    
+    def __init__(
+        self,
+        pool: Optional[ExtractionPool] = None,
+        cache_dir: Optional[str] = None,
+        max_cached_exports: int = 64,
+        export_timeout: float = 300.0
+    ):
+        """
+        Args:
+            pool: Пул процессов (по умолчанию отдельный на 2 процесса)
+            cache_dir: Каталог готовых файлов
+            max_cached_exports: Сколько последних экспортов хранить
+            export_timeout: Таймаут построения документа в секундах
+        """
+        self.pool = pool or ExtractionPool(max_workers=2)
+        self.cache_dir = Path(cache_dir or os.path.join(tempfile.gettempdir(), "chat_exports"))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_cached_exports = max_cached_exports
+        self.export_timeout = export_timeout
+        self._cache: "OrderedDict[str, Path]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._serving: Dict[Path, int] = {}
+    
+    @staticmethod
+    def cache_key(
+        session_id: str,
+        session: Dict[str, Any],
+        export_format: str,
+        llm_settings: Optional[Dict[str, Any]] = None
+    ) -> Tuple:
+        """Ключ кэша: сессия, время последнего сообщения, формат (и счетчики/настройки для надежности)"""
+        messages = session.get("messages", [])
+        last_timestamp = messages[-1].get("timestamp") if messages else None
+        settings_hash = hashlib.sha256(
+            json.dumps(llm_settings or {}, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:16]
+        return (
+            session_id, last_timestamp, export_format,
+            len(messages), len(session.get("files", [])), settings_hash
+        )
+    
+    async def export_to_docx(
+        self, 
+        chat_data: Dict[str, Any], 
+        filename: Optional[str] = None,
+        cache_key: Optional[Tuple] = None
+    ) -> Path:
+        """
+        Экспортирует данные чата в DOCX
+        
+        Args:
+            chat_data: Данные чата для экспорта
+            filename: Имя файла (опционально)
+            cache_key: Ключ кэша (см. cache_key), None — без кэширования
+            
+        Returns:
+            Путь к DOCX файлу (после отдачи передается в release)
+        """
+        return await self._export("docx", chat_data, cache_key)
+    
+    async def export_to_pdf(
+        self, 
+        chat_data: Dict[str, Any], 
+        filename: Optional[str] = None,
+        cache_key: Optional[Tuple] = None
+    ) -> Path:
+        """
+        Экспортирует данные чата в PDF
+        
+        Args:
+            chat_data: Данные чата для экспорта
+            filename: Имя файла (опционально)
+            cache_key: Ключ кэша (см. cache_key), None — без кэширования
+            
+        Returns:
+            Путь к PDF файлу (после отдачи передается в release)
+        """
+        return await self._export("pdf", chat_data, cache_key)
+    
+    async def _export(self, export_format: str, chat_data: Dict[str, Any], cache_key: Optional[Tuple]) -> Path:
+        key = hashlib.sha256(repr(cache_key).encode("utf-8")).hexdigest() if cache_key else None
+        
+        if key is None:
+            path = await self._render(export_format, chat_data, self.cache_dir / f"export_{os.urandom(8).hex()}.{export_format}")
+            return self._acquire(path)
+        
+        # Одновременные запросы одного экспорта строят файл один раз
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                cached = self._cache.get(key)
+                if cached is not None and cached.exists():
+                    self._cache.move_to_end(key)
+                    logger.info(f"📄 Экспорт {export_format} взят из кэша")
+                    return self._acquire(cached)
+                
+                path = await self._render(export_format, chat_data, self.cache_dir / f"{key}.{export_format}")
+                self._cache[key] = path
+                self._acquire(path)
+                self._evict()
+                return path
+        finally:
+            # Блокировка нужна только пока ее кто-то держит или ждет
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+    
+    async def release(self, path: Path):
+        """Файл экспорта отдан клиенту: некэшированный файл удаляется"""
+        count = self._serving.get(path, 0) - 1
+        if count > 0:
+            self._serving[path] = count
+            return
+        self._serving.pop(path, None)
+        if path not in self._cache.values():
+            path.unlink(missing_ok=True)
+        self._evict()
+    
+    def _acquire(self, path: Path) -> Path:
+        self._serving[path] = self._serving.get(path, 0) + 1
+        return path
+    
+    async def _render(self, export_format: str, chat_data: Dict[str, Any], path: Path) -> Path:
+        """Построение документа в пуле процессов с атомарной заменой файла"""
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            await self.pool.run(
+                _render_export, export_format, self._compact_chat_data(chat_data), str(tmp_path),
+                timeout=self.export_timeout
+            )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            raise Exception(f"Ошибка экспорта в {export_format.upper()}: {str(e)}")
+        
+        logger.info(f"📄 Экспорт {export_format} построен: {path.stat().st_size / 1024:.1f} KB")
+        return path
+    
+    @staticmethod
+    def _compact_chat_data(chat_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Только то, что попадает в документ: полный текст файлов не передается в пул"""
+        files = []
+        for file_info in chat_data.get('files', []):
+            text = (file_info.get('content') or {}).get('text') or ''
+            files.append({
+                'filename': file_info.get('filename', 'Неизвестный файл'),
+                'file_type': file_info.get('file_type', ''),
+                'file_size': file_info.get('file_size', 0),
+                'content': {'text': text[:FILE_PREVIEW_LENGTH + 1]}
+            })
+        return {**chat_data, 'files': files}
+    
+    def _evict(self):
+        """Удаление самых старых экспортов сверх лимита (кроме отдаваемых сейчас)"""
+        excess = len(self._cache) - self.max_cached_exports
+        for key, path in list(self._cache.items()):
+            if excess <= 0:
+                break
+            if path in self._serving:
+                continue
+            del self._cache[key]
+            path.unlink(missing_ok=True)
+            excess -= 1
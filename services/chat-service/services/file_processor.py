@@ -4,24 +4,21 @@
 
 import os
 import io
+import hashlib
 import aiofiles
 import magic
 import logging
 import traceback
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Sequence
 from pathlib import Path
+from collections import OrderedDict
 import asyncio
+import tempfile
 from datetime import datetime
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-# Обработка PDF
-import PyPDF2
-import pdfplumber
-from pdf2image import convert_from_bytes
-import pytesseract
-
 # Обработка DOCX
 from docx import Document
 
@@ -32,13 +29,70 @@ import openpyxl
 # Обработка изображений
 from PIL import Image
 
-# OCR
-import pytesseract
+from extraction_pool import ExtractionPool
+from streaming_ocr import StreamingOCR
+from extraction_cache import ExtractionCache, iter_pdf_pages, render_pages, render_pdf_pages, sha256_bytes
+
+# === Функции извлечения, выполняемые в пуле процессов ===
+# Должны быть функциями уровня модуля, чтобы сериализоваться pickle
+
+def _extract_docx(file_content: bytes) -> Dict[str, Any]:
+    """Извлекает текст и таблицы из DOCX"""
+    doc = Document(io.BytesIO(file_content))
+    
+    # Извлекаем текст
+    text_content = "".join(
+        paragraph.text + "\n"
+        for paragraph in doc.paragraphs
+        if paragraph.text.strip()
+    )
+    
+    # Извлекаем таблицы
+    table_rows = []
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if row_text:
+                table_rows.append(" | ".join(row_text) + "\n")
+    
+    return {
+        "type": "docx",
+        "text": text_content,
+        "tables": "".join(table_rows),
+        "paragraphs_count": len(doc.paragraphs),
+        "tables_count": len(doc.tables),
+        "metadata": {
+            "title": doc.core_properties.title or "",
+            "author": doc.core_properties.author or "",
+            "created": doc.core_properties.created.isoformat() if doc.core_properties.created else "",
+        }
+    }
+
+def _extract_excel(file_content: bytes, file_type: str) -> Dict[str, Any]:
+    """Извлекает листы XLS/XLSX"""
+    df = pd.read_excel(io.BytesIO(file_content), sheet_name=None)
+    
+    content = {}
+    for sheet_name, sheet_df in df.items():
+        # Конвертируем DataFrame в текст
+        content[sheet_name] = {
+            "text": sheet_df.to_string(index=False),
+            "rows": len(sheet_df),
+            "columns": len(sheet_df.columns),
+            "columns_list": [str(column) for column in sheet_df.columns]
+        }
+    
+    return {
+        "type": file_type,
+        "sheets": content,
+        "sheets_count": len(df),
+        "sheets_names": list(df.keys())
+    }
 
 class FileProcessor:
     """Сервис для обработки различных типов файлов"""
     
-    def __init__(self):
+    def __init__(self, extraction_pool: Optional[ExtractionPool] = None):
         self.max_file_size = 100 * 1024 * 1024  # 100MB
         self.supported_formats = {
             'application/pdf': self._process_pdf,
@@ -54,6 +108,130 @@ class FileProcessor:
             'lang': 'rus+eng',  # Русский и английский
             'config': '--oem 3 --psm 6'
         }
+        
+        # Тяжелое извлечение выполняется в пуле процессов, а не в event loop
+        self.extraction_pool = extraction_pool or ExtractionPool()
+        self.extraction_timeout = 300.0  # Таймаут на разбор одного файла
+        
+        # Вложения одного запроса обрабатываются параллельно, не больше этого числа сразу
+        self.max_concurrent_uploads = 4
+        self.upload_read_chunk_size = 1024 * 1024
+        
+        # Результаты извлечения по SHA-256 содержимого: повторно прикрепленный файл не разбирается
+        self.extraction_cache_size = 128
+        self._extraction_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._extractions_in_progress: Dict[str, asyncio.Future] = {}
+        
+        # Общий с другими сервисами кэш извлечения PDF (текстовый слой и OCR) на диске или в MinIO
+        self.extraction_cache = ExtractionCache.from_env()
+        
+        # Постраничный OCR с адаптивным DPI в том же пуле процессов
+        self.ocr = StreamingOCR(
+            lang=self.ocr_config['lang'],
+            tesseract_config=self.ocr_config['config'],
+            max_workers=self.extraction_pool.max_workers,
+            runner=self.extraction_pool.run
+        )
+    
+    async def process_uploads(self, uploads: Sequence[Any]) -> List[Dict[str, Any]]:
+        """
+        Параллельная обработка вложений запроса
+        
+        Args:
+            uploads: Загруженные файлы (UploadFile)
+            
+        Returns:
+            Результаты в порядке вложений (как у process_file)
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+        
+        async def process(upload):
+            async with semaphore:
+                return await self.process_upload(upload)
+        
+        return list(await asyncio.gather(*(process(upload) for upload in uploads)))
+    
+    async def process_upload(self, upload: Any) -> Dict[str, Any]:
+        """
+        Обработка загруженного файла с дедупликацией по содержимому
+        
+        Файл сначала читается частями из временного файла загрузки только для
+        подсчета SHA-256, поэтому при попадании в кэш содержимое целиком в
+        память не загружается. Одновременные загрузки одного файла
+        разбираются один раз.
+        
+        Args:
+            upload: Загруженный файл (UploadFile)
+            
+        Returns:
+            Результат как у process_file, дополнительно file_hash и from_cache
+        """
+        filename = upload.filename
+        digest = hashlib.sha256()
+        size = 0
+        
+        while True:
+            chunk = await upload.read(self.upload_read_chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > self.max_file_size:
+                logger.warning(f"⚠️ Файл {filename} слишком большой: > {self.max_file_size}")
+                return {
+                    "success": False,
+                    "filename": filename,
+                    "error": f"Файл слишком большой. Максимальный размер: {self.max_file_size / (1024*1024):.0f}MB",
+                    "processed_at": datetime.now().isoformat()
+                }
+            digest.update(chunk)
+        
+        file_hash = digest.hexdigest()
+        
+        # После неудачного разбора ожидавшие загрузки проверяют заново: разбор мог начать другой из них
+        cached = self._get_cached_extraction(file_hash)
+        while cached is None:
+            in_progress = self._extractions_in_progress.get(file_hash)
+            if in_progress is None:
+                break
+            cached = await asyncio.shield(in_progress)
+        
+        if cached is not None:
+            logger.info(f"♻️ Файл {filename} уже обработан ранее, используем кэш")
+            return {
+                **cached,
+                "filename": filename,
+                "processed_at": datetime.now().isoformat(),
+                "from_cache": True
+            }
+        
+        future = asyncio.get_running_loop().create_future()
+        self._extractions_in_progress[file_hash] = future
+        try:
+            await upload.seek(0)
+            result = await self.process_file(await upload.read(), filename)
+            result["file_hash"] = file_hash
+            if result["success"]:
+                self._cache_extraction(file_hash, result)
+            future.set_result(result if result["success"] else None)
+            return {**result, "from_cache": False}
+        except BaseException:
+            future.set_result(None)
+            raise
+        finally:
+            if self._extractions_in_progress.get(file_hash) is future:
+                del self._extractions_in_progress[file_hash]
+    
+    def _get_cached_extraction(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        result = self._extraction_cache.get(file_hash)
+        if result is not None:
+            self._extraction_cache.move_to_end(file_hash)
+        return result
+    
+    def _cache_extraction(self, file_hash: str, result: Dict[str, Any]):
+        self._extraction_cache[file_hash] = result
+        self._extraction_cache.move_to_end(file_hash)
+        while len(self._extraction_cache) > self.extraction_cache_size:
+            self._extraction_cache.popitem(last=False)
     
     async def process_file(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """
@@ -109,118 +287,81 @@ class FileProcessor:
     async def _process_pdf(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """Обрабатывает PDF файл с использованием pdfplumber для лучшего качества"""
         try:
-            text_content = ""
-            
-            # Сначала пытаемся извлечь текст с помощью pdfplumber
-            try:
-                with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-                    for page_num, page in enumerate(pdf.pages):
-                        page_text = page.extract_text()
-                        if page_text:
-                            text_content += f"\n--- Страница {page_num + 1} ---\n"
-                            text_content += page_text
-            except Exception as pdfplumber_error:
-                logger.warning(f"pdfplumber не смог извлечь текст: {pdfplumber_error}, используем PyPDF2")
-                
-                # Fallback на PyPDF2
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-                
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text.strip():
-                            text_content += f"\n--- Страница {page_num + 1} ---\n"
-                            text_content += page_text
-                    except Exception as e:
-                        logger.error(f"Ошибка извлечения текста со страницы {page_num + 1}: {e}")
+            file_hash = await asyncio.to_thread(sha256_bytes, file_content)
+            record = await self.extraction_cache.load_pdf(
+                file_hash,
+                file_content,
+                runner=lambda func, *args: self.extraction_pool.run(func, *args, timeout=self.extraction_timeout)
+            )
+            text_layer = render_pages(record["pages"], "\n--- Страница {page} ---\n")
             
-            # Если текст не извлечен или мало текста, используем OCR
-            if not text_content.strip() or len(text_content.strip()) < 100:
+            # Если текст не извлечен или мало текста, используем OCR (если его еще не делал другой сервис)
+            if len(text_layer.strip()) < 100 and "ocr_pages" not in record:
                 logger.info("Применяем OCR для PDF...")
-                ocr_text = await self._ocr_pdf(file_content)
-                if ocr_text:
-                    text_content = ocr_text
+                ocr_pages = await self._ocr_pdf(file_content)
+                if ocr_pages:
+                    record["ocr_pages"] = ocr_pages
+                    await self.extraction_cache.update(file_hash, {"ocr_pages": ocr_pages})
+            
+            # Страницы без текстового слоя берутся из OCR, текст собирается одним join
+            pages = list(iter_pdf_pages(record))
+            text_content = render_pdf_pages(pages, "\n--- Страница {page} ---\n", "\n--- Страница {page} (OCR) ---\n")
+            has_ocr = any(page.ocr for page in pages)
             
             return {
                 "type": "pdf",
                 "text": text_content,
-                "pages_count": len(pdf_reader.pages),
-                "has_ocr": len(text_content.strip()) > 100 and "OCR" in text_content,
-                "metadata": {
-                    "title": pdf_reader.metadata.get("/Title", "") if pdf_reader.metadata else "",
-                    "author": pdf_reader.metadata.get("/Author", "") if pdf_reader.metadata else "",
-                    "creator": pdf_reader.metadata.get("/Creator", "") if pdf_reader.metadata else "",
-                }
+                "pages_count": record["page_count"],
+                "has_ocr": has_ocr,
+                "metadata": record["metadata"]
             }
             
         except Exception as e:
             raise Exception(f"Ошибка обработки PDF: {str(e)}")
     
+    async def _ocr_pdf(self, file_content: bytes) -> List[List[Any]]:
+        """Применяет OCR к PDF файлу, возвращает [[номер страницы, текст]]"""
+        return [
+            [page_number, page_text]
+            async for page_number, page_text in self.stream_ocr_pages(file_content)
+            if page_text.strip()
+        ]
     
-    async def _ocr_pdf(self, file_content: bytes) -> str:
-        """Применяет OCR к PDF файлу"""
-        try:
-            # Конвертируем PDF в изображения
-            images = convert_from_bytes(file_content, dpi=300)
-            
-            ocr_text = ""
-            for i, image in enumerate(images):
-                try:
-                    # Применяем OCR к изображению
-                    page_text = pytesseract.image_to_string(
-                        image, 
-                        lang=self.ocr_config['lang'],
-                        config=self.ocr_config['config']
-                    )
-                    
-                    if page_text.strip():
-                        ocr_text += f"\n--- Страница {i + 1} (OCR) ---\n"
-                        ocr_text += page_text
-                        
-                except Exception as e:
-                    print(f"Ошибка OCR для страницы {i + 1}: {e}")
-                    continue
+    async def stream_ocr_pages(self, file_content: bytes) -> AsyncIterator[Tuple[int, str]]:
+        """
+        Постраничный OCR PDF в пуле процессов
+        
+        Страницы растеризуются по одной с DPI по размеру листа, страницы
+        с текстовым слоем пропускаются. Результаты отдаются по порядку
+        страниц по мере готовности, закрытие генератора отменяет еще не
+        начатые страницы.
+        
+        Args:
+            file_content: Содержимое PDF
             
-            return ocr_text
+        Yields:
+            Пары (номер страницы, распознанный текст)
+        """
+        fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        
+        try:
+            async with aiofiles.open(pdf_path, "wb") as f:
+                await f.write(file_content)
             
-        except Exception as e:
-            print(f"Ошибка OCR: {e}")
-            return ""
+            async for page in self.ocr.iter_pages(pdf_path):
+                yield page.page_number, page.text
+        
+        finally:
+            try:
+                os.unlink(pdf_path)
+            except OSError:
+                pass
     
     async def _process_docx(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """Обрабатывает DOCX файл"""
         try:
-            doc = Document(io.BytesIO(file_content))
-            
-            # Извлекаем текст
-            text_content = ""
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text_content += paragraph.text + "\n"
-            
-            # Извлекаем таблицы
-            tables_content = ""
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        tables_content += " | ".join(row_text) + "\n"
-            
-            return {
-                "type": "docx",
-                "text": text_content,
-                "tables": tables_content,
-                "paragraphs_count": len(doc.paragraphs),
-                "tables_count": len(doc.tables),
-                "metadata": {
-                    "title": doc.core_properties.title or "",
-                    "author": doc.core_properties.author or "",
-                    "created": doc.core_properties.created.isoformat() if doc.core_properties.created else "",
-                }
-            }
+            return await self.extraction_pool.run(_extract_docx, file_content, timeout=self.extraction_timeout)
             
         except Exception as e:
             raise Exception(f"Ошибка обработки DOCX: {str(e)}")
@@ -228,26 +369,7 @@ class FileProcessor:
     async def _process_xls(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """Обрабатывает XLS файл"""
         try:
-            # Используем pandas для чтения XLS
-            df = pd.read_excel(io.BytesIO(file_content), sheet_name=None)
-            
-            content = {}
-            for sheet_name, sheet_df in df.items():
-                # Конвертируем DataFrame в текст
-                sheet_text = sheet_df.to_string(index=False)
-                content[sheet_name] = {
-                    "text": sheet_text,
-                    "rows": len(sheet_df),
-                    "columns": len(sheet_df.columns),
-                    "columns_list": list(sheet_df.columns)
-                }
-            
-            return {
-                "type": "xls",
-                "sheets": content,
-                "sheets_count": len(df),
-                "sheets_names": list(df.keys())
-            }
+            return await self.extraction_pool.run(_extract_excel, file_content, "xls", timeout=self.extraction_timeout)
             
         except Exception as e:
             raise Exception(f"Ошибка обработки XLS: {str(e)}")
@@ -255,26 +377,7 @@ class FileProcessor:
     async def _process_xlsx(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """Обрабатывает XLSX файл"""
         try:
-            # Используем pandas для чтения XLSX
-            df = pd.read_excel(io.BytesIO(file_content), sheet_name=None)
-            
-            content = {}
-            for sheet_name, sheet_df in df.items():
-                # Конвертируем DataFrame в текст
-                sheet_text = sheet_df.to_string(index=False)
-                content[sheet_name] = {
-                    "text": sheet_text,
-                    "rows": len(sheet_df),
-                    "columns": len(sheet_df.columns),
-                    "columns_list": list(sheet_df.columns)
-                }
-            
-            return {
-                "type": "xlsx",
-                "sheets": content,
-                "sheets_count": len(df),
-                "sheets_names": list(df.keys())
-            }
+            return await self.extraction_pool.run(_extract_excel, file_content, "xlsx", timeout=self.extraction_timeout)
             
         except Exception as e:
             raise Exception(f"Ошибка обработки XLSX: {str(e)}")
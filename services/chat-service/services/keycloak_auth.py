@@ -2,14 +2,19 @@
 Сервис аутентификации через Keycloak (ОТКЛЮЧЕН)
 """
 
+import asyncio
+import hashlib
 import logging
+import random
+import time
+from collections import OrderedDict
 import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
-import json
-import base64
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+from jose.exceptions import JWKError
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +24,12 @@ KEYCLOAK_REALM = "ai-engineering"
 KEYCLOAK_CLIENT_ID = "ai-backend"
 KEYCLOAK_CLIENT_SECRET = "ai-backend-secret"  # В production использовать переменную окружения
 
+# Кэш ключей и проверенных токенов
+JWKS_REFRESH_INTERVAL = 300.0  # Плановое обновление JWKS, секунды
+JWKS_REFRESH_JITTER = 0.1  # Разброс интервала, чтобы реплики не ходили в Keycloak одновременно
+JWKS_MIN_REFRESH_INTERVAL = 30.0  # Не чаще этого обновляем JWKS из-за неизвестного kid
+TOKEN_CACHE_SIZE = 1024  # Проверенных токенов в LRU кэше
+
 # HTTP Bearer схема (опциональная)
 security = HTTPBearer(auto_error=False)
 
@@ -26,35 +37,76 @@ security = HTTPBearer(auto_error=False)
 AUTH_DISABLED = True
 
 class KeycloakAuthService:
-    """Сервис аутентификации через Keycloak"""
+    """
+    Сервис аутентификации через Keycloak
+    
+    Ключи JWKS загружаются один раз, разбираются в объекты ключей по kid
+    и обновляются в фоне. Неизвестный kid (ротация ключей) вызывает
+    внеочередное обновление, но не чаще JWKS_MIN_REFRESH_INTERVAL.
+    Проверенные токены кэшируются по хешу до истечения exp.
+    """
     
     def __init__(self):
         self.keycloak_url = KEYCLOAK_URL
         self.realm = KEYCLOAK_REALM
         self.client_id = KEYCLOAK_CLIENT_ID
         self.client_secret = KEYCLOAK_CLIENT_SECRET
-        self.public_key = None
         self.jwks_uri = None
         
+        self.jwks_refresh_interval = JWKS_REFRESH_INTERVAL
+        self.jwks_refresh_jitter = JWKS_REFRESH_JITTER
+        self.jwks_min_refresh_interval = JWKS_MIN_REFRESH_INTERVAL
+        self.token_cache_size = TOKEN_CACHE_SIZE
+        
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._keys: Dict[str, Key] = {}
+        self._keys_fetched_at: Optional[float] = None  # time.monotonic()
+        self._keys_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._token_cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        
     async def initialize(self):
-        """Инициализация сервиса - получение публичного ключа"""
+        """Инициализация сервиса - получение JWKS и запуск фонового обновления"""
         try:
             # Получаем конфигурацию OpenID Connect
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.keycloak_url}/realms/{self.realm}/.well-known/openid_configuration"
-                )
-                response.raise_for_status()
-                config = response.json()
-                
-                self.jwks_uri = config.get("jwks_uri")
-                logger.info(f"Keycloak JWKS URI: {self.jwks_uri}")
+            response = await self._get_http_client().get(
+                f"{self.keycloak_url}/realms/{self.realm}/.well-known/openid-configuration"
+            )
+            response.raise_for_status()
+            config = response.json()
+            
+            self.jwks_uri = config.get("jwks_uri")
+            logger.info(f"Keycloak JWKS URI: {self.jwks_uri}")
+            
+            await self._refresh_keys()
+            if self._refresh_task is None:
+                self._refresh_task = asyncio.create_task(self._refresh_keys_loop())
                 
         except Exception as e:
             logger.error(f"Ошибка инициализации Keycloak: {e}")
             # В режиме разработки продолжаем без проверки токенов
             logger.warning("Продолжаем в режиме разработки без проверки токенов")
     
+    async def close(self):
+        """Остановка фонового обновления и закрытие HTTP клиента"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Общий HTTP клиент (соединения с Keycloak переиспользуются)"""
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=10.0)
+        return self._http_client
+    
     async def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Проверка JWT токена через Keycloak"""
         try:
@@ -63,6 +115,11 @@ class KeycloakAuthService:
                 logger.warning("JWKS URI не настроен, пропускаем проверку токена")
                 return self._create_mock_user()
             
+            token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+            cached = self._get_cached_claims(token_hash)
+            if cached is not None:
+                return cached
+            
             # Декодируем заголовок токена
             header = jwt.get_unverified_header(token)
             
@@ -81,6 +138,7 @@ class KeycloakAuthService:
                 issuer=f"{self.keycloak_url}/realms/{self.realm}"
             )
             
+            self._cache_claims(token_hash, payload)
             return payload
             
         except JWTError as e:
@@ -90,55 +148,88 @@ class KeycloakAuthService:
             logger.error(f"Неожиданная ошибка при проверке токена: {e}")
             return None
     
-    async def _get_public_key(self, kid: str) -> Optional[str]:
-        """Получение публичного ключа из JWKS"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(self.jwks_uri)
-                response.raise_for_status()
-                jwks = response.json()
-                
-                # Ищем ключ по kid
-                for key in jwks.get("keys", []):
-                    if key.get("kid") == kid:
-                        # Конвертируем JWK в PEM формат
-                        return self._jwk_to_pem(key)
-                
-                logger.error(f"Ключ с kid={kid} не найден")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Ошибка получения публичного ключа: {e}")
+    def _get_cached_claims(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        """Claims проверенного токена из кэша, если он еще не истек"""
+        entry = self._token_cache.get(token_hash)
+        if entry is None:
             return None
+        
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del self._token_cache[token_hash]
+            return None
+        
+        self._token_cache.move_to_end(token_hash)
+        return claims
     
-    def _jwk_to_pem(self, jwk: Dict[str, Any]) -> str:
-        """Конвертация JWK в PEM формат"""
-        try:
-            from cryptography.hazmat.primitives import serialization
-            from cryptography.hazmat.primitives.asymmetric import rsa
-            import base64
-            
-            # Извлекаем компоненты ключа
-            n = base64.urlsafe_b64decode(jwk["n"] + "==")
-            e = base64.urlsafe_b64decode(jwk["e"] + "==")
-            
-            # Создаем RSA ключ
-            public_key = rsa.RSAPublicNumbers(
-                int.from_bytes(e, byteorder='big'),
-                int.from_bytes(n, byteorder='big')
-            ).public_key()
+    def _cache_claims(self, token_hash: str, claims: Dict[str, Any]):
+        """Сохранение claims до exp токена (токены без exp не кэшируются)"""
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        
+        self._token_cache[token_hash] = (claims, float(expires_at))
+        self._token_cache.move_to_end(token_hash)
+        while len(self._token_cache) > self.token_cache_size:
+            self._token_cache.popitem(last=False)
+    
+    async def _get_public_key(self, kid: Optional[str]) -> Optional[Key]:
+        """Получение публичного ключа по kid (с обновлением JWKS, если ключ новый)"""
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+        
+        await self._refresh_keys(force=True)
+        key = self._keys.get(kid)
+        if key is None:
+            logger.error(f"Ключ с kid={kid} не найден")
+        return key
+    
+    async def _refresh_keys(self, force: bool = False):
+        """
+        Загрузка JWKS и разбор ключей
+        
+        Args:
+            force: Внеочередное обновление (неизвестный kid); выполняется
+                не чаще jwks_min_refresh_interval
+        """
+        async with self._keys_lock:
+            if (
+                force
+                and self._keys_fetched_at is not None
+                and time.monotonic() - self._keys_fetched_at < self.jwks_min_refresh_interval
+            ):
+                return
             
-            # Конвертируем в PEM
-            pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
+            try:
+                response = await self._get_http_client().get(self.jwks_uri)
+                response.raise_for_status()
+                jwks = response.json()
+            except Exception as e:
+                logger.error(f"Ошибка получения JWKS: {e}")
+                return
+            finally:
+                # Неудачная попытка тоже учитывается, чтобы не долбить недоступный Keycloak
+                self._keys_fetched_at = time.monotonic()
             
-            return pem.decode('utf-8')
+            keys = {}
+            for key_data in jwks.get("keys", []):
+                if key_data.get("use", "sig") != "sig" or "kid" not in key_data:
+                    continue
+                try:
+                    keys[key_data["kid"]] = jwk.construct(key_data, key_data.get("alg", "RS256"))
+                except JWKError as e:
+                    logger.warning(f"Пропущен ключ kid={key_data['kid']}: {e}")
             
-        except Exception as e:
-            logger.error(f"Ошибка конвертации JWK в PEM: {e}")
-            return None
+            self._keys = keys
+            logger.info(f"🔑 Загружено ключей JWKS: {len(keys)}")
+    
+    async def _refresh_keys_loop(self):
+        """Фоновое обновление JWKS с разбросом интервала"""
+        while True:
+            jitter = random.uniform(-self.jwks_refresh_jitter, self.jwks_refresh_jitter)
+            await asyncio.sleep(self.jwks_refresh_interval * (1 + jitter))
+            await self._refresh_keys()
     
     def _create_mock_user(self) -> Dict[str, Any]:
         """Создание мок-пользователя для режима разработки"""
@@ -0,0 +1,71 @@
+"""
+Поиск множества ключевых слов за один проход по тексту
+"""
+
+import re
+import logging
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Set, Tuple
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    logging.warning("pyahocorasick не установлен, используется поиск по регулярному выражению")
+    AHOCORASICK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+class KeywordMatcher:
+    """
+    Автомат Aho-Corasick для подстрочного поиска набора ключевых слов.
+
+    Строится один раз, после чего поиск всех ключевых слов выполняется за
+    один проход по тексту вместо проверки `keyword in text` для каждого слова.
+    Без pyahocorasick используется одно скомпилированное регулярное выражение
+    с lookahead, которое также находит перекрывающиеся вхождения.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = sorted({keyword.lower() for keyword in keywords if keyword}, key=len, reverse=True)
+
+        if AHOCORASICK_AVAILABLE:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            if self.keywords:
+                self._automaton.make_automaton()
+            self._regex = None
+        else:
+            self._automaton = None
+            self._regex = re.compile(
+                "(?=(" + "|".join(re.escape(keyword) for keyword in self.keywords) + "))"
+            ) if self.keywords else None
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """
+        Все вхождения ключевых слов
+
+        Args:
+            text: Текст в нижнем регистре
+
+        Yields:
+            Пары (позиция начала, ключевое слово)
+        """
+        if not self.keywords:
+            return
+
+        if self._automaton is not None:
+            for end, keyword in self._automaton.iter(text):
+                yield end - len(keyword) + 1, keyword
+        else:
+            for match in self._regex.finditer(text):
+                yield match.start(), match.group(1)
+
+    def matched(self, text: str) -> Set[str]:
+        """Множество ключевых слов, встречающихся в тексте"""
+        return {keyword for _, keyword in self.iter_matches(text)}
+
+    def count(self, text: str) -> Dict[str, int]:
+        """Количество вхождений каждого ключевого слова"""
+        return Counter(keyword for _, keyword in self.iter_matches(text))
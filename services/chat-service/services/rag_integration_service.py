@@ -6,11 +6,14 @@ import asyncio
 import logging
 import aiohttp
 from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 import json
+import uuid
 
 from .smart_tokenizer import TokenChunk, DocumentStructure, SmartTokenizer
+from .analysis_index import EphemeralAnalysisIndex
+from text_chunker import document_hash
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,7 @@ class RAGAnalysisResult:
     confidence_score: float
     analysis_time: float
     sources: List[Dict[str, Any]]
+    chunk_scores: Dict[str, float] = field(default_factory=dict)  # chunk_id -> сходство с запросом
 
 @dataclass
 class LLMAnalysisResult:
@@ -46,6 +50,13 @@ class RAGIntegrationService:
         self.max_chunks_for_analysis = 10
         self.min_confidence_threshold = 0.3
         self.analysis_timeout = 30.0
+        self.embedding_batch_size = 256
+        self.embedding_timeout = 120.0
+        self.rag_response_limit = 5
+        self.rag_response_threshold = 0.5
+        
+        # Сохранять ли чанки анализируемых документов в RAG (по умолчанию только in-memory)
+        self.persist_analysis_chunks = False
         
         # Типы анализа
         self.analysis_types = {
@@ -68,6 +79,9 @@ class RAGIntegrationService:
         """
         Анализ документа с использованием RAG
         
+        Чанки документа эмбеддятся одним пакетом и ищутся во временном
+        in-memory индексе, без создания коллекции и загрузки чанков по одному.
+        
         Args:
             document_text: Текст документа
             user_query: Запрос пользователя
@@ -85,18 +99,41 @@ class RAGIntegrationService:
             token_chunks, document_structure = await self.tokenizer.tokenize_document(document_text, filename)
             logger.info(f"📄 Документ разбит на {len(token_chunks)} чанков")
             
-            # 2. Загрузка чанков в RAG систему
-            collection_id = await self._upload_chunks_to_rag(token_chunks, document_structure)
-            logger.info(f"📤 Чанки загружены в RAG коллекцию: {collection_id}")
-            
-            # 3. Поиск релевантных чанков
-            relevant_chunks = await self._search_relevant_chunks(user_query, collection_id, analysis_type)
-            logger.info(f"🔍 Найдено {len(relevant_chunks)} релевантных чанков")
+            enhanced_query = self._enhance_query_for_analysis(user_query, analysis_type)
             
-            # 4. Получение ответа от RAG
-            rag_response = await self._get_rag_response(user_query, collection_id)
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.embedding_timeout)) as session:
+                # 2. Пакетное создание эмбеддингов чанков и запросов
+                texts = [chunk.text for chunk in token_chunks] + [enhanced_query, user_query]
+                embeddings = await self._embed_texts(session, texts)
+                
+                chunk_scores: Dict[str, float] = {}
+                if embeddings is None:
+                    relevant_chunks = self._rank_by_importance(token_chunks)
+                    rag_response = self._build_rag_response(user_query, [])
+                else:
+                    chunk_embeddings = embeddings[:len(token_chunks)]
+                    enhanced_query_embedding, query_embedding = embeddings[len(token_chunks):]
+                    
+                    # 3. Временный индекс документа
+                    index = EphemeralAnalysisIndex(token_chunks, chunk_embeddings)
+                    
+                    # 4. Поиск релевантных чанков
+                    matches = self._search_relevant_chunks(index, enhanced_query_embedding)
+                    relevant_chunks = [chunk for chunk, _ in matches]
+                    chunk_scores = {chunk.chunk_id: score for chunk, score in matches}
+                    logger.info(f"🔍 Найдено {len(relevant_chunks)} релевантных чанков")
+                    
+                    # 5. Ответ RAG по исходному запросу
+                    rag_response = self._build_rag_response(
+                        user_query,
+                        index.search(query_embedding, limit=self.rag_response_limit, threshold=self.rag_response_threshold)
+                    )
+                    
+                    # 6. Опциональное сохранение чанков в RAG одним запросом
+                    if self.persist_analysis_chunks:
+                        await self._persist_chunks_to_rag(session, token_chunks, chunk_embeddings, document_structure, document_text)
             
-            # 5. Формирование результата
+            # 7. Формирование результата
             analysis_time = (datetime.now() - start_time).total_seconds()
             
             result = RAGAnalysisResult(
@@ -105,7 +142,8 @@ class RAGIntegrationService:
                 rag_response=rag_response,
                 confidence_score=rag_response.get('confidence', 0.0),
                 analysis_time=analysis_time,
-                sources=rag_response.get('sources', [])
+                sources=rag_response.get('sources', []),
+                chunk_scores=chunk_scores
             )
             
             logger.info(f"✅ RAG анализ завершен за {analysis_time:.2f}s")
@@ -115,112 +153,53 @@ class RAGIntegrationService:
             logger.error(f"❌ Ошибка RAG анализа: {str(e)}")
             raise
     
-    async def _upload_chunks_to_rag(self, chunks: List[TokenChunk], structure: DocumentStructure) -> str:
-        """Загрузка чанков в RAG систему"""
+    async def _embed_texts(self, session: aiohttp.ClientSession, texts: List[str]) -> Optional[List[List[float]]]:
+        """Пакетное создание эмбеддингов через RAG сервис"""
+        embeddings = []
         try:
-            collection_id = f"document_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            
-            # Создаем коллекцию
-            async with aiohttp.ClientSession() as session:
-                collection_data = {
-                    "name": collection_id,
-                    "description": f"Коллекция для документа: {structure.title}",
-                    "type": "document_analysis"
-                }
-                
+            for start in range(0, len(texts), self.embedding_batch_size):
+                batch = texts[start:start + self.embedding_batch_size]
                 async with session.post(
-                    f"{self.rag_service_url}/collections/",
-                    json=collection_data
+                    f"{self.rag_service_url}/embeddings/",
+                    json={"text": batch}
                 ) as response:
                     if response.status != 200:
-                        logger.warning(f"Не удалось создать коллекцию: {response.status}")
+                        logger.error(f"Ошибка создания эмбеддингов: {response.status}")
+                        return None
+                    result = await response.json()
+                    embeddings.extend(result.get('embeddings', []))
             
-            # Загружаем чанки как документы
-            for i, chunk in enumerate(chunks):
-                try:
-                    # Создаем временный файл для чанка
-                    chunk_filename = f"chunk_{i}_{chunk.chunk_id}.txt"
-                    
-                    # Подготавливаем данные для загрузки
-                    form_data = aiohttp.FormData()
-                    form_data.add_field('file', chunk.text.encode('utf-8'), filename=chunk_filename, content_type='text/plain')
-                    form_data.add_field('collection_id', collection_id)
-                    form_data.add_field('project_id', 'document_analysis')
-                    
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            f"{self.rag_service_url}/documents/upload",
-                            data=form_data
-                        ) as response:
-                            if response.status == 200:
-                                logger.debug(f"Чанк {i} загружен в RAG")
-                            else:
-                                logger.warning(f"Ошибка загрузки чанка {i}: {response.status}")
-                
-                except Exception as e:
-                    logger.error(f"Ошибка загрузки чанка {i}: {str(e)}")
-                    continue
+            if len(embeddings) != len(texts):
+                logger.error(f"RAG сервис вернул {len(embeddings)} эмбеддингов вместо {len(texts)}")
+                return None
             
-            return collection_id
+            return embeddings
             
         except Exception as e:
-            logger.error(f"Ошибка загрузки чанков в RAG: {str(e)}")
-            raise
+            logger.error(f"Ошибка создания эмбеддингов: {str(e)}")
+            return None
+    
+    def _rank_by_importance(self, chunks: List[TokenChunk]) -> List[TokenChunk]:
+        """Запасной отбор чанков по важности, если эмбеддинги недоступны"""
+        logger.warning("⚠️ Эмбеддинги недоступны, отбираем чанки по важности")
+        return sorted(chunks, key=lambda x: x.importance_score, reverse=True)[:self.max_chunks_for_analysis]
     
-    async def _search_relevant_chunks(
+    def _search_relevant_chunks(
         self, 
-        query: str, 
-        collection_id: str, 
-        analysis_type: str
-    ) -> List[TokenChunk]:
-        """Поиск релевантных чанков"""
-        try:
-            # Формируем расширенный запрос на основе типа анализа
-            enhanced_query = self._enhance_query_for_analysis(query, analysis_type)
-            
-            search_request = {
-                "query": enhanced_query,
-                "collection_id": collection_id,
-                "limit": self.max_chunks_for_analysis,
-                "threshold": self.min_confidence_threshold
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.rag_service_url}/documents/search",
-                    json=search_request
-                ) as response:
-                    if response.status == 200:
-                        search_result = await response.json()
-                        
-                        # Преобразуем результаты в TokenChunk
-                        relevant_chunks = []
-                        for i, doc in enumerate(search_result.get('results', [])):
-                            chunk = TokenChunk(
-                                chunk_id=f"rag_chunk_{i}",
-                                text=doc.get('content', ''),
-                                token_count=len(doc.get('content', '').split()),
-                                chunk_type='rag_result',
-                                metadata={
-                                    'doc_id': doc.get('id'),
-                                    'title': doc.get('title'),
-                                    'score': search_result.get('scores', [0])[i] if i < len(search_result.get('scores', [])) else 0,
-                                    'source': 'rag_search'
-                                },
-                                start_position=0,
-                                end_position=len(doc.get('content', '')),
-                                importance_score=search_result.get('scores', [0])[i] if i < len(search_result.get('scores', [])) else 0
-                            )
-                            relevant_chunks.append(chunk)
-                        
-                        return relevant_chunks
-                    else:
-                        logger.error(f"Ошибка поиска в RAG: {response.status}")
-                        return []
-            
-        except Exception as e:
-            logger.error(f"Ошибка поиска релевантных чанков: {str(e)}")
-            return []
+        index: EphemeralAnalysisIndex, 
+        query_embedding: List[float]
+    ) -> List[Tuple[TokenChunk, float]]:
+        """
+        Поиск релевантных чанков во временном индексе
+        
+        Чанки индекса общие для всех запросов, поэтому оценка возвращается
+        рядом с чанком, а не записывается в его метаданные.
+        """
+        return index.search(
+            query_embedding,
+            limit=self.max_chunks_for_analysis,
+            threshold=self.min_confidence_threshold
+        )
     
     def _enhance_query_for_analysis(self, query: str, analysis_type: str) -> str:
         """Улучшение запроса для конкретного типа анализа"""
@@ -236,30 +215,79 @@ class RAGIntegrationService:
         
         return enhancements.get(analysis_type, query)
     
-    async def _get_rag_response(self, query: str, collection_id: str) -> Dict[str, Any]:
-        """Получение ответа от RAG системы"""
+    def _build_rag_response(self, query: str, matches: List[Tuple[TokenChunk, float]]) -> Dict[str, Any]:
+        """Формирование ответа RAG из результатов поиска по временному индексу"""
+        return {
+            "query": query,
+            "results": [
+                {
+                    "id": chunk.chunk_id,
+                    "title": chunk.parent_section,
+                    "content": chunk.text
+                }
+                for chunk, _ in matches
+            ],
+            "scores": [score for _, score in matches],
+            "total": len(matches),
+            "confidence": matches[0][1] if matches else 0.0,
+            "sources": [
+                {
+                    "chunk_id": chunk.chunk_id,
+                    "parent_section": chunk.parent_section,
+                    "chunk_type": chunk.chunk_type,
+                    "score": score
+                }
+                for chunk, score in matches
+            ]
+        }
+    
+    async def _persist_chunks_to_rag(
+        self,
+        session: aiohttp.ClientSession,
+        chunks: List[TokenChunk],
+        embeddings: List[List[float]],
+        structure: DocumentStructure,
+        document_text: str
+    ):
+        """Сохранение чанков с готовыми эмбеддингами в RAG одним запросом"""
         try:
-            search_request = {
-                "query": query,
-                "collection_id": collection_id,
-                "limit": 5,
-                "threshold": 0.5
+            payload = {
+                "document_id": str(uuid.uuid5(uuid.NAMESPACE_URL, structure.metadata.get('source_hash') or document_hash(document_text))),
+                "title": structure.title,
+                "metadata": {
+                    "document_type": structure.document_type,
+                    "language": structure.language,
+                    "source": "document_analysis"
+                },
+                "chunks": [
+                    {
+                        "chunk_index": i,
+                        "chunk_id": chunk.chunk_id,
+                        "start_position": chunk.start_position,
+                        "end_position": chunk.end_position,
+                        "text": chunk.text,
+                        "embedding": embedding,
+                        "metadata": {
+                            "chunk_type": chunk.chunk_type,
+                            "parent_section": chunk.parent_section,
+                            "importance_score": chunk.importance_score
+                        }
+                    }
+                    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+                ]
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.rag_service_url}/documents/search",
-                    json=search_request
-                ) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        logger.error(f"Ошибка получения RAG ответа: {response.status}")
-                        return {"error": f"RAG service error: {response.status}"}
-            
+            async with session.post(
+                f"{self.rag_service_url}/documents/bulk-chunks",
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    logger.info(f"📤 {len(chunks)} чанков сохранено в RAG")
+                else:
+                    logger.warning(f"Не удалось сохранить чанки в RAG: {response.status}")
+        
         except Exception as e:
-            logger.error(f"Ошибка получения RAG ответа: {str(e)}")
-            return {"error": str(e)}
+            logger.error(f"Ошибка сохранения чанков в RAG: {str(e)}")
     
     async def analyze_with_llm(
         self, 
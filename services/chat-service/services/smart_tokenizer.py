@@ -4,13 +4,33 @@
 
 import re
 import logging
+from bisect import bisect_right
+from collections import Counter
 from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 import asyncio
 
+from .keyword_matcher import KeywordMatcher
+from .token_counter import TokenCounter, DEFAULT_TOKENIZER_MODEL
+from text_chunker import TextChunker, document_hash, make_chunk_id
+
 logger = logging.getLogger(__name__)
 
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
+_INLINE_SPACES_RE = re.compile(r'[^\S\n]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+_CAPTURING_GROUP_RE = re.compile(r'(?<!\\)\((?!\?)')
+_ESCAPE_RE = re.compile(r'\\.')
+_UPPERCASE_RE = re.compile(r'[A-ZА-ЯЁ]')
+_KEYWORD_RE = re.compile(r'\b[а-яё]{3,}\b')
+_CYRILLIC_RE = re.compile(r'[а-яё]')
+_LATIN_RE = re.compile(r'[a-z]')
+_DIGIT_RE = re.compile(r'\d')
+
+# Объем текста, по которому определяется язык документа
+LANGUAGE_SAMPLE_SIZE = 200_000
+
 @dataclass
 class TokenChunk:
     """Класс для представления токенизированного фрагмента документа"""
@@ -39,10 +59,12 @@ class DocumentStructure:
 class SmartTokenizer:
     """Умная система токенизации с сохранением контекста"""
     
-    def __init__(self):
-        self.max_chunk_size = 1000  # Максимальное количество токенов в чанке
-        self.overlap_size = 200     # Размер перекрытия между чанками
-        self.min_chunk_size = 100   # Минимальный размер чанка
+    def __init__(self, model_name: str = DEFAULT_TOKENIZER_MODEL, token_counter: Optional[TokenCounter] = None):
+        # Размеры задаются в токенах модели эмбеддингов, а не в словах
+        self.token_counter = token_counter or TokenCounter(model_name)
+        self.max_chunk_size = 480   # Максимальное количество токенов в чанке (окно модели 512)
+        self.overlap_size = 64      # Размер перекрытия между чанками
+        self.min_chunk_size = 50    # Минимальный размер чанка
         
         # Паттерны для определения структуры документа
         self.section_patterns = [
@@ -100,6 +122,53 @@ class SmartTokenizer:
             'ru': ['и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда', 'даже', 'ну', 'вдруг', 'ли', 'если', 'уже', 'или', 'ни', 'быть', 'был', 'него', 'до', 'вас', 'нибудь', 'опять', 'уж', 'вам', 'ведь', 'там', 'потом', 'себя', 'ничего', 'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была', 'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе', 'под', 'будет', 'ж', 'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой', 'совсем', 'ним', 'здесь', 'этом', 'один', 'почти', 'мой', 'тем', 'чтобы', 'нее', 'сейчас', 'были', 'куда', 'зачем', 'всех', 'никогда', 'можно', 'при', 'наконец', 'два', 'об', 'другой', 'хоть', 'после', 'над', 'больше', 'тот', 'через', 'эти', 'нас', 'про', 'всего', 'них', 'какая', 'много', 'разве', 'три', 'эту', 'моя', 'впрочем', 'хорошо', 'свою', 'этой', 'перед', 'иногда', 'лучше', 'чуть', 'том', 'нельзя', 'такой', 'им', 'более', 'всегда', 'конечно', 'всю', 'между'],
             'en': ['the', 'be', 'to', 'of', 'and', 'a', 'in', 'that', 'have', 'i', 'it', 'for', 'not', 'on', 'with', 'he', 'as', 'you', 'do', 'at', 'this', 'but', 'his', 'by', 'from', 'they', 'we', 'say', 'her', 'she', 'or', 'an', 'will', 'my', 'one', 'all', 'would', 'there', 'their']
         }
+        
+        self._compile_patterns()
+    
+    def _compile_patterns(self):
+        """Компиляция паттернов в один регулярный автомат на каждый классификатор"""
+        # Заголовки разделов: одна альтернатива по всему тексту в режиме MULTILINE.
+        # \s заменяется на пробелы без переноса строки, чтобы заголовок не захватывал следующую строку
+        section_alternatives = '|'.join(
+            pattern.lstrip('^').replace(r'\s', r'[^\S\n]')
+            for pattern in self.section_patterns
+        )
+        self._section_regex = re.compile(
+            r'^[^\S\n]*(?:' + section_alternatives + ')',
+            re.MULTILINE | re.IGNORECASE
+        )
+        
+        # Типы контента: все паттерны объединены в одно выражение с именованной группой
+        # на тип, поиск идет за один проход. Классификация выполняется по тексту
+        # в нижнем регистре, поэтому паттерны с заглавными буквами (ГОСТ, [А-ЯЁ]...)
+        # совпасть не могут и не включаются
+        self._content_type_priority = {content_type: i for i, content_type in enumerate(self.content_patterns)}
+        anchored_alternatives = []
+        search_alternatives = []
+        for content_type, patterns in self.content_patterns.items():
+            for pattern in patterns:
+                if _UPPERCASE_RE.search(_ESCAPE_RE.sub('', pattern)):
+                    continue
+                body = _CAPTURING_GROUP_RE.sub('(?:', pattern.lstrip('^'))
+                group = f'(?P<{content_type}_{len(anchored_alternatives) + len(search_alternatives)}>{body})'
+                if pattern.startswith('^'):
+                    anchored_alternatives.append(group)
+                else:
+                    search_alternatives.append(group)
+        # Lookahead не поглощает текст, поэтому совпадения не скрывают друг друга
+        self._content_search_regex = re.compile('(?=' + '|'.join(search_alternatives) + ')')
+        self._content_anchored_regex = re.compile('|'.join(anchored_alternatives))
+        
+        # Ключевые слова важности: один автомат Aho-Corasick на все уровни
+        level_weights = {'high': 0.3, 'medium': 0.1, 'low': -0.1}
+        self._importance_weights = {
+            keyword: level_weights[level]
+            for level, keywords in self.importance_keywords.items()
+            for keyword in keywords
+        }
+        self._importance_matcher = KeywordMatcher(self._importance_weights)
+        
+        self._stop_words = frozenset(self.stop_words.get('ru', []))
     
     async def tokenize_document(self, text: str, filename: str = None) -> Tuple[List[TokenChunk], DocumentStructure]:
         """
@@ -117,12 +186,14 @@ class SmartTokenizer:
         try:
             # 1. Предварительная обработка текста
             cleaned_text = self._preprocess_text(text)
+            text_lower = cleaned_text.lower()
             
-            # 2. Анализ структуры документа
-            document_structure = await self._analyze_document_structure(cleaned_text, filename)
+            # 2. Определение языка
+            language = self._detect_language(text_lower)
             
-            # 3. Определение языка
-            language = self._detect_language(cleaned_text)
+            # 3. Анализ структуры документа
+            document_structure = await self._analyze_document_structure(cleaned_text, filename, text_lower, language)
+            document_structure.metadata['source_hash'] = document_hash(text)
             
             # 4. Разбиение на семантические блоки
             semantic_blocks = await self._extract_semantic_blocks(cleaned_text, document_structure)
@@ -130,11 +201,12 @@ class SmartTokenizer:
             # 5. Токенизация блоков с сохранением контекста
             token_chunks = await self._tokenize_blocks(semantic_blocks, language)
             
-            # 6. Обогащение метаданными
-            enriched_chunks = await self._enrich_chunks_metadata(token_chunks, document_structure)
+            # 6. Оптимизация размеров чанков
+            optimized_chunks = await self._optimize_chunk_sizes(token_chunks)
             
-            # 7. Оптимизация размеров чанков
-            optimized_chunks = await self._optimize_chunk_sizes(enriched_chunks)
+            # 7. Обогащение метаданными (после объединения, чтобы ссылки на соседей были актуальны)
+            optimized_chunks = await self._enrich_chunks_metadata(optimized_chunks, document_structure)
+            document_structure.chunk_count = len(optimized_chunks)
             
             logger.info(f"✅ Токенизация завершена: {len(optimized_chunks)} чанков, {document_structure.total_tokens} токенов")
             
@@ -146,63 +218,74 @@ class SmartTokenizer:
     
     def _preprocess_text(self, text: str) -> str:
         """Предварительная обработка текста"""
-        # Нормализация пробелов
-        text = re.sub(r'\s+', ' ', text)
+        # Нормализация пробелов внутри строк (переносы строк сохраняются для структуры)
+        text = _INLINE_SPACES_RE.sub(' ', text)
         
         # Удаление лишних символов
-        text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+        text = _CONTROL_CHARS_RE.sub('', text)
         
         # Нормализация переносов строк
-        text = re.sub(r'\n\s*\n', '\n\n', text)
+        text = _BLANK_LINES_RE.sub('\n\n', text)
         
         return text.strip()
     
-    async def _analyze_document_structure(self, text: str, filename: str = None) -> DocumentStructure:
-        """Анализ структуры документа"""
+    def _count_tokens(self, text: str) -> int:
+        """Количество токенов в тексте"""
+        return self.token_counter.count(text)
+    
+    def _chunk_token_budget(self) -> int:
+        """Максимальный размер чанка с учетом окна модели"""
+        max_input_tokens = self.token_counter.max_input_tokens
+        if max_input_tokens:
+            return min(self.max_chunk_size, max_input_tokens)
+        return self.max_chunk_size
+    
+    async def _analyze_document_structure(
+        self,
+        text: str,
+        filename: str = None,
+        text_lower: Optional[str] = None,
+        language: Optional[str] = None
+    ) -> DocumentStructure:
+        """Анализ структуры документа за один проход регулярного выражения"""
+        text_lower = text_lower if text_lower is not None else text.lower()
         sections = []
-        current_section = None
         
-        lines = text.split('\n')
-        
-        for line_num, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
+        line_num = 0
+        last_offset = 0
+        for match in self._section_regex.finditer(text):
+            line_num += text.count('\n', last_offset, match.start())
+            last_offset = match.start()
             
-            # Проверяем, является ли строка заголовком раздела
-            for pattern in self.section_patterns:
-                match = re.match(pattern, line, re.IGNORECASE)
-                if match:
-                    if current_section:
-                        sections.append(current_section)
-                    
-                    current_section = {
-                        'title': match.group(1),
-                        'start_line': line_num,
-                        'end_line': line_num,
-                        'level': self._get_section_level(line),
-                        'content': []
-                    }
-                    break
-            else:
-                if current_section:
-                    current_section['content'].append(line)
-                    current_section['end_line'] = line_num
+            title = match.group(match.lastindex)
+            sections.append({
+                'title': title,
+                'start_line': line_num,
+                'end_line': line_num,
+                'level': self._get_section_level(title),
+                'content': [],
+                'start_position': match.start(),
+                'end_position': len(text)
+            })
         
-        # Добавляем последний раздел
-        if current_section:
-            sections.append(current_section)
+        # Границы и содержимое разделов определяются по началу следующего раздела
+        for section, next_section in zip(sections, sections[1:] + [None]):
+            end = next_section['start_position'] if next_section else len(text)
+            section_text = text[section['start_position']:end].rstrip()
+            section['end_position'] = section['start_position'] + len(section_text)
+            section['end_line'] = section['start_line'] + section_text.count('\n')
+            section['content'] = [line.strip() for line in section_text.split('\n')[1:] if line.strip()]
         
         # Определяем тип документа
-        document_type = self._detect_document_type(text, filename)
+        document_type = self._detect_document_type(text_lower, filename)
         
         return DocumentStructure(
             title=self._extract_title(text, filename),
             sections=sections,
-            total_tokens=len(text.split()),
+            total_tokens=self.token_counter.estimate(text),
             chunk_count=0,  # Будет обновлено позже
             document_type=document_type,
-            language=self._detect_language(text),
+            language=language or self._detect_language(text_lower),
             metadata={
                 'filename': filename,
                 'sections_count': len(sections),
@@ -221,10 +304,8 @@ class SmartTokenizer:
         else:
             return 0
     
-    def _detect_document_type(self, text: str, filename: str = None) -> str:
+    def _detect_document_type(self, text_lower: str, filename: str = None) -> str:
         """Определение типа документа"""
-        text_lower = text.lower()
-        
         if any(keyword in text_lower for keyword in ['гост', 'стандарт', 'стандартизация']):
             return 'standard'
         elif any(keyword in text_lower for keyword in ['снип', 'строительные нормы']):
@@ -240,11 +321,17 @@ class SmartTokenizer:
     
     def _extract_title(self, text: str, filename: str = None) -> str:
         """Извлечение заголовка документа"""
-        lines = text.split('\n')
-        
-        # Ищем заголовок в первых строках
-        for line in lines[:10]:
-            line = line.strip()
+        # Ищем заголовок в первых строках, не разбивая весь документ
+        position = 0
+        for _ in range(10):
+            if position > len(text):
+                break
+            line_end = text.find('\n', position)
+            if line_end == -1:
+                line_end = len(text)
+            line = text[position:line_end].strip()
+            position = line_end + 1
+            
             if len(line) > 10 and len(line) < 200:
                 # Проверяем, что это не служебная информация
                 if not any(keyword in line.lower() for keyword in ['страница', 'page', 'дата', 'date']):
@@ -256,63 +343,93 @@ class SmartTokenizer:
         
         return "Документ"
     
-    def _detect_language(self, text: str) -> str:
+    def _detect_language(self, text_lower: str) -> str:
         """Определение языка документа"""
-        # Простая эвристика на основе кириллических символов
-        cyrillic_count = len(re.findall(r'[а-яё]', text.lower()))
-        latin_count = len(re.findall(r'[a-z]', text.lower()))
+        # Простая эвристика на основе кириллических символов по началу документа
+        sample = text_lower[:LANGUAGE_SAMPLE_SIZE]
+        cyrillic_count = len(_CYRILLIC_RE.findall(sample))
+        latin_count = len(_LATIN_RE.findall(sample))
         
         if cyrillic_count > latin_count:
             return 'ru'
         else:
             return 'en'
     
+    def _iter_paragraphs(self, text: str):
+        """Абзацы текста с их позициями: (индекс, начало, конец, текст)"""
+        index = 0
+        position = 0
+        text_length = len(text)
+        
+        while position <= text_length:
+            separator = text.find('\n\n', position)
+            end = separator if separator != -1 else text_length
+            raw = text[position:end]
+            paragraph = raw.strip()
+            
+            if paragraph:
+                start = position + (len(raw) - len(raw.lstrip()))
+                yield index, start, start + len(paragraph), paragraph
+                index += 1
+            
+            if separator == -1:
+                break
+            position = separator + 2
+    
     async def _extract_semantic_blocks(self, text: str, structure: DocumentStructure) -> List[Dict[str, Any]]:
         """Извлечение семантических блоков из текста"""
         blocks = []
+        section_starts = [section['start_position'] for section in structure.sections]
+        source_hash = structure.metadata.get('source_hash') or document_hash(text)
         
-        # Разбиваем текст на абзацы
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
+        # Пропускаем слишком короткие абзацы
+        paragraphs = [item for item in self._iter_paragraphs(text) if len(item[3]) >= 20]
         
-        for i, paragraph in enumerate(paragraphs):
-            if len(paragraph) < 20:  # Пропускаем слишком короткие абзацы
-                continue
-            
-            # Определяем тип контента
-            content_type = self._classify_content_type(paragraph)
-            
-            # Определяем важность
-            importance = self._calculate_importance(paragraph)
-            
-            # Извлекаем ключевые слова
-            keywords = self._extract_keywords(paragraph)
-            
-            # Определяем родительский раздел
-            parent_section = self._find_parent_section(paragraph, structure)
+        # Токены всех абзацев считаются одним пакетным вызовом токенизатора
+        token_counts = self.token_counter.count_batch([paragraph for _, _, _, paragraph in paragraphs])
+        
+        for (i, start, end, paragraph), token_count in zip(paragraphs, token_counts):
+            paragraph_lower = paragraph.lower()
             
             blocks.append({
                 'text': paragraph,
-                'type': content_type,
-                'importance': importance,
-                'keywords': keywords,
-                'parent_section': parent_section,
+                'type': self._classify_content_type(paragraph, paragraph_lower, token_count),
+                'importance': self._calculate_importance(paragraph, paragraph_lower),
+                'keywords': self._extract_keywords(paragraph_lower),
+                'parent_section': self._find_parent_section(start, structure, section_starts),
                 'position': i,
-                'length': len(paragraph)
+                'length': len(paragraph),
+                'start_position': start,
+                'end_position': end,
+                'token_count': token_count,
+                'source_hash': source_hash
             })
         
         return blocks
     
-    def _classify_content_type(self, text: str) -> str:
-        """Классификация типа контента"""
-        text_lower = text.lower()
+    def _classify_content_type(self, text: str, text_lower: Optional[str] = None, token_count: Optional[int] = None) -> str:
+        """Классификация типа контента за один проход регулярного выражения"""
+        text_lower = text_lower if text_lower is not None else text.lower()
+        
+        best_priority = len(self._content_type_priority)
+        match = self._content_anchored_regex.match(text_lower)
+        if match:
+            best_priority = self._content_type_priority[match.lastgroup.rsplit('_', 1)[0]]
+        
+        for match in self._content_search_regex.finditer(text_lower):
+            priority = self._content_type_priority[match.lastgroup.rsplit('_', 1)[0]]
+            if priority < best_priority:
+                best_priority = priority
+                if priority == 0:
+                    break
         
-        for content_type, patterns in self.content_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text_lower):
-                    return content_type
+        if best_priority < len(self._content_type_priority):
+            return list(self._content_type_priority)[best_priority]
         
         # Дополнительная логика для определения типа
-        if len(text.split()) < 20:
+        if token_count is None:
+            token_count = self._count_tokens(text)
+        if token_count < 20:
             return 'short_text'
         elif any(char in text for char in ['•', '-', '*', '1.', '2.']):
             return 'list'
@@ -321,21 +438,14 @@ class SmartTokenizer:
         else:
             return 'paragraph'
     
-    def _calculate_importance(self, text: str) -> float:
+    def _calculate_importance(self, text: str, text_lower: Optional[str] = None) -> float:
         """Расчет важности текста"""
-        text_lower = text.lower()
+        text_lower = text_lower if text_lower is not None else text.lower()
         importance_score = 0.5  # Базовый уровень
         
-        # Проверяем ключевые слова важности
-        for level, keywords in self.importance_keywords.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    if level == 'high':
-                        importance_score += 0.3
-                    elif level == 'medium':
-                        importance_score += 0.1
-                    else:
-                        importance_score -= 0.1
+        # Ключевые слова важности находятся за один проход автомата
+        for keyword in self._importance_matcher.matched(text_lower):
+            importance_score += self._importance_weights[keyword]
         
         # Учитываем длину текста
         if len(text) > 500:
@@ -344,155 +454,121 @@ class SmartTokenizer:
             importance_score -= 0.1
         
         # Учитываем наличие цифр и специальных символов
-        if re.search(r'\d+', text):
+        if _DIGIT_RE.search(text):
             importance_score += 0.1
         
         return max(0.0, min(1.0, importance_score))
     
-    def _extract_keywords(self, text: str) -> List[str]:
+    def _extract_keywords(self, text_lower: str) -> List[str]:
         """Извлечение ключевых слов из текста"""
-        # Простое извлечение ключевых слов
-        words = re.findall(r'\b[а-яё]{3,}\b', text.lower())
-        
-        # Фильтруем стоп-слова
-        stop_words = self.stop_words.get('ru', [])
-        keywords = [word for word in words if word not in stop_words]
-        
-        # Подсчитываем частоту
-        word_freq = {}
-        for word in keywords:
-            word_freq[word] = word_freq.get(word, 0) + 1
+        word_freq = Counter(
+            word for word in _KEYWORD_RE.findall(text_lower)
+            if word not in self._stop_words
+        )
         
         # Возвращаем наиболее частые слова
-        return sorted(word_freq.keys(), key=lambda x: word_freq[x], reverse=True)[:10]
+        return [word for word, _ in word_freq.most_common(10)]
+    
+    def _find_parent_section(
+        self,
+        position: int,
+        structure: DocumentStructure,
+        section_starts: Optional[List[int]] = None
+    ) -> Optional[str]:
+        """Поиск ближайшего раздела, начинающегося не позже позиции блока"""
+        if section_starts is None:
+            section_starts = [section['start_position'] for section in structure.sections]
+        
+        index = bisect_right(section_starts, position) - 1
+        if index < 0:
+            return None
+        
+        return structure.sections[index]['title']
     
-    def _find_parent_section(self, text: str, structure: DocumentStructure) -> Optional[str]:
-        """Поиск родительского раздела для текста"""
-        # Простая логика - ищем ближайший раздел выше
-        for section in reversed(structure.sections):
-            if any(keyword in text.lower() for keyword in section['title'].lower().split()):
-                return section['title']
-        
-        return None
+    def _make_chunk(
+        self,
+        text: str,
+        token_count: int,
+        block: Dict[str, Any],
+        start_position: int,
+        metadata: Dict[str, Any]
+    ) -> TokenChunk:
+        """Создание чанка из блока с детерминированным ID (хеш документа и смещения)"""
+        return TokenChunk(
+            chunk_id=make_chunk_id(block['source_hash'], start_position, start_position + len(text)),
+            text=text,
+            token_count=token_count,
+            chunk_type=block['type'],
+            metadata={
+                'importance': block['importance'],
+                'keywords': block['keywords'],
+                'parent_section': block['parent_section'],
+                'position': block['position'],
+                'source_hash': block['source_hash'],
+                **metadata
+            },
+            start_position=start_position,
+            end_position=start_position + len(text),
+            parent_section=block['parent_section'],
+            importance_score=block['importance'],
+            context_keywords=block['keywords']
+        )
     
     async def _tokenize_blocks(self, blocks: List[Dict[str, Any]], language: str) -> List[TokenChunk]:
         """Токенизация блоков с сохранением контекста"""
         chunks = []
+        max_tokens = self._chunk_token_budget()
         
-        for i, block in enumerate(blocks):
-            text = block['text']
-            
+        for block in blocks:
             # Если блок слишком большой, разбиваем его
-            if len(text.split()) > self.max_chunk_size:
-                sub_chunks = await self._split_large_block(text, block)
+            if block['token_count'] > max_tokens:
+                sub_chunks = await self._split_large_block(block['text'], block)
+                for sub_chunk in sub_chunks:
+                    sub_chunk.metadata['language'] = language
                 chunks.extend(sub_chunks)
             else:
                 # Создаем чанк из блока
-                chunk = TokenChunk(
-                    chunk_id=f"chunk_{i}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                    text=text,
-                    token_count=len(text.split()),
-                    chunk_type=block['type'],
-                    metadata={
-                        'importance': block['importance'],
-                        'keywords': block['keywords'],
-                        'parent_section': block['parent_section'],
-                        'position': block['position'],
-                        'language': language
-                    },
-                    start_position=0,  # Будет обновлено позже
-                    end_position=len(text),
-                    parent_section=block['parent_section'],
-                    importance_score=block['importance'],
-                    context_keywords=block['keywords']
-                )
-                chunks.append(chunk)
+                chunks.append(self._make_chunk(
+                    text=block['text'],
+                    token_count=block['token_count'],
+                    block=block,
+                    start_position=block['start_position'],
+                    metadata={'language': language}
+                ))
         
         return chunks
     
     async def _split_large_block(self, text: str, block: Dict[str, Any]) -> List[TokenChunk]:
-        """Разбиение большого блока на меньшие чанки"""
-        chunks = []
-        sentences = re.split(r'[.!?]+', text)
+        """
+        Разбиение большого блока на меньшие чанки
         
-        current_chunk = ""
-        current_tokens = 0
-        chunk_index = 0
+        Используется общий TextChunker по смещениям токенов модели: чанк — это
+        срез блока, граница выбирается по структуре текста (строки таблиц,
+        предложения, пункты), перекрытие — последние overlap_size токенов.
+        """
+        block_start = block.get('start_position', 0)
+        max_tokens = self._chunk_token_budget()
+        chunker = TextChunker(
+            max_tokens=max_tokens,
+            overlap_tokens=min(self.overlap_size, max_tokens // 2),
+            tokenize=self.token_counter.token_spans
+        )
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            sentence_tokens = len(sentence.split())
-            
-            # Если добавление предложения превысит лимит, создаем новый чанк
-            if current_tokens + sentence_tokens > self.max_chunk_size and current_chunk:
-                chunk = TokenChunk(
-                    chunk_id=f"chunk_{block['position']}_{chunk_index}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                    text=current_chunk.strip(),
-                    token_count=current_tokens,
-                    chunk_type=block['type'],
-                    metadata={
-                        'importance': block['importance'],
-                        'keywords': block['keywords'],
-                        'parent_section': block['parent_section'],
-                        'position': block['position'],
-                        'chunk_index': chunk_index,
-                        'is_split': True
-                    },
-                    start_position=0,
-                    end_position=len(current_chunk),
-                    parent_section=block['parent_section'],
-                    importance_score=block['importance'],
-                    context_keywords=block['keywords']
-                )
-                chunks.append(chunk)
-                
-                # Начинаем новый чанк с перекрытием
-                overlap_text = self._get_overlap_text(current_chunk)
-                current_chunk = overlap_text + " " + sentence
-                current_tokens = len(current_chunk.split())
-                chunk_index += 1
-            else:
-                current_chunk += " " + sentence if current_chunk else sentence
-                current_tokens += sentence_tokens
-        
-        # Добавляем последний чанк
-        if current_chunk:
-            chunk = TokenChunk(
-                chunk_id=f"chunk_{block['position']}_{chunk_index}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                text=current_chunk.strip(),
-                token_count=current_tokens,
-                chunk_type=block['type'],
-                metadata={
-                    'importance': block['importance'],
-                    'keywords': block['keywords'],
-                    'parent_section': block['parent_section'],
-                    'position': block['position'],
-                    'chunk_index': chunk_index,
-                    'is_split': True
-                },
-                start_position=0,
-                end_position=len(current_chunk),
-                parent_section=block['parent_section'],
-                importance_score=block['importance'],
-                context_keywords=block['keywords']
+        return [
+            self._make_chunk(
+                text=chunk.text,
+                token_count=chunk.token_count,
+                block=block,
+                start_position=block_start + chunk.start,
+                metadata={'chunk_index': chunk.index, 'is_split': True}
             )
-            chunks.append(chunk)
-        
-        return chunks
-    
-    def _get_overlap_text(self, text: str) -> str:
-        """Получение текста для перекрытия между чанками"""
-        words = text.split()
-        if len(words) <= self.overlap_size:
-            return text
-        
-        return " ".join(words[-self.overlap_size:])
+            for chunk in chunker.iter_chunks(text)
+        ]
     
     async def _enrich_chunks_metadata(self, chunks: List[TokenChunk], structure: DocumentStructure) -> List[TokenChunk]:
         """Обогащение чанков дополнительными метаданными"""
+        created_at = datetime.now().isoformat()
+        
         for i, chunk in enumerate(chunks):
             # Добавляем информацию о позиции в документе
             chunk.metadata['document_position'] = i
@@ -506,17 +582,16 @@ class SmartTokenizer:
                 chunk.metadata['next_chunk_id'] = chunks[i+1].chunk_id
             
             # Добавляем временные метки
-            chunk.metadata['created_at'] = datetime.now().isoformat()
-            
-            # Обновляем позиции
-            chunk.start_position = sum(len(c.text) for c in chunks[:i])
-            chunk.end_position = chunk.start_position + len(chunk.text)
+            chunk.metadata['created_at'] = created_at
         
         return chunks
     
     async def _optimize_chunk_sizes(self, chunks: List[TokenChunk]) -> List[TokenChunk]:
         """Оптимизация размеров чанков"""
+        source_hash = chunks[0].metadata['source_hash'] if chunks else None
         optimized_chunks = []
+        merged_texts = []
+        max_tokens = self._chunk_token_budget()
         
         for chunk in chunks:
             # Если чанк слишком маленький, пытаемся объединить с соседними
@@ -524,19 +599,25 @@ class SmartTokenizer:
                 last_chunk = optimized_chunks[-1]
                 
                 # Проверяем, можно ли объединить
-                if (last_chunk.token_count + chunk.token_count <= self.max_chunk_size and
+                if (last_chunk.token_count + chunk.token_count <= max_tokens and
                     last_chunk.chunk_type == chunk.chunk_type and
                     last_chunk.parent_section == chunk.parent_section):
                     
-                    # Объединяем чанки
-                    last_chunk.text += " " + chunk.text
+                    # Объединяем чанки (тексты склеиваются один раз в конце)
+                    merged_texts[-1].append(chunk.text)
                     last_chunk.token_count += chunk.token_count
                     last_chunk.end_position = chunk.end_position
                     last_chunk.metadata['merged_chunks'] = last_chunk.metadata.get('merged_chunks', 1) + 1
-                    last_chunk.metadata['merged_chunk_ids'] = last_chunk.metadata.get('merged_chunk_ids', [last_chunk.chunk_id]) + [chunk.chunk_id]
+                    last_chunk.metadata.setdefault('merged_chunk_ids', [last_chunk.chunk_id]).append(chunk.chunk_id)
                     continue
             
             optimized_chunks.append(chunk)
+            merged_texts.append([chunk.text])
+        
+        for chunk, texts in zip(optimized_chunks, merged_texts):
+            if len(texts) > 1:
+                chunk.text = " ".join(texts)
+                chunk.chunk_id = make_chunk_id(source_hash, chunk.start_position, chunk.end_position)
         
         return optimized_chunks
     
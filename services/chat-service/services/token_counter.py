@@ -0,0 +1,178 @@
+"""
+Подсчет токенов токенизатором модели эмбеддингов
+"""
+
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence, Tuple
+
+try:
+    from transformers import AutoTokenizer
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    logging.warning("transformers не установлен, количество токенов будет оцениваться по длине текста")
+    TRANSFORMERS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Модель эмбеддингов RAG Service (EMBEDDING_MODEL по умолчанию)
+DEFAULT_TOKENIZER_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+_WORD_RE = re.compile(r'\S+')
+
+# Значения model_max_length выше этого порога означают "не задано"
+_UNBOUNDED_MAX_LENGTH = 1_000_000
+
+# Доля измеренного коэффициента символов на токен, используемая в оценке:
+# средний коэффициент по корпусу завышен для плотных текстов (числа, шифры,
+# таблицы), поэтому оценка берется с запасом
+_ESTIMATE_MARGIN = 0.8
+
+@lru_cache(maxsize=8)
+def load_tokenizer(model_name: str) -> Optional[Any]:
+    """
+    Загрузка быстрого (Rust) токенизатора модели
+
+    Словарь загружается один раз на процесс и переиспользуется всеми
+    экземплярами TokenCounter. Если токенизатор недоступен, возвращается None.
+    """
+    if not TRANSFORMERS_AVAILABLE:
+        return None
+
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось загрузить токенизатор {model_name}: {str(e)}. Используется оценка")
+        return None
+
+    if not tokenizer.is_fast:
+        logger.warning(f"⚠️ Для {model_name} нет быстрого токенизатора, подсчет будет медленнее")
+
+    logger.info(f"✅ Загружен токенизатор {model_name} (max_length={tokenizer.model_max_length})")
+    return tokenizer
+
+class TokenCounter:
+    """
+    Подсчет токенов так, как их видит модель эмбеддингов.
+
+    Точные значения дает токенизатор модели (пакетно, за один вызов на
+    список текстов). Для мест, где точность не нужна, есть оценка по длине
+    текста: коэффициент символов на токен калибруется по каждому точному
+    подсчету и берется с запасом ниже измеренного среднего. Без токенизатора
+    все значения — оценки.
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = DEFAULT_TOKENIZER_MODEL,
+        chars_per_token: float = 3.0,
+        tokenizer: Optional[Any] = None
+    ):
+        """
+        Args:
+            model_name: Модель Hugging Face, чей токенизатор используется (None — только оценка)
+            chars_per_token: Начальный коэффициент оценки (занижен, чтобы оценка была с запасом)
+            tokenizer: Готовый токенизатор вместо загрузки по model_name
+        """
+        self.model_name = model_name
+        self.chars_per_token = chars_per_token
+        self._tokenizer = tokenizer
+        self._tokenizer_loaded = tokenizer is not None or not model_name
+        self._calibration_chars = 0
+        self._calibration_tokens = 0
+
+    @property
+    def tokenizer(self) -> Optional[Any]:
+        if not self._tokenizer_loaded:
+            self._tokenizer = load_tokenizer(self.model_name)
+            self._tokenizer_loaded = True
+        return self._tokenizer
+
+    @property
+    def is_exact(self) -> bool:
+        """Считаются ли токены токенизатором модели"""
+        return self.tokenizer is not None
+
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        """Сколько токенов текста помещается в окно модели (без служебных токенов)"""
+        tokenizer = self.tokenizer
+        if tokenizer is None or not tokenizer.model_max_length or tokenizer.model_max_length > _UNBOUNDED_MAX_LENGTH:
+            return None
+        return tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+
+    def estimate(self, text: str) -> int:
+        """Быстрая оценка количества токенов по длине текста"""
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count(self, text: str) -> int:
+        """Количество токенов в тексте"""
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """Количество токенов в каждом тексте, один вызов токенизатора на весь список"""
+        if not texts:
+            return []
+
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            return [self.estimate(text) for text in texts]
+
+        input_ids = tokenizer(
+            list(texts),
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False
+        )['input_ids']
+        counts = [len(ids) for ids in input_ids]
+        self._calibrate(texts, counts)
+        return counts
+
+    def token_spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Позиции токенов в тексте
+
+        Без быстрого токенизатора слова делятся на части длиной
+        chars_per_token, так что количество позиций совпадает с оценкой.
+
+        Returns:
+            Список (начало, конец) для каждого токена (у служебных частей
+            слова он может быть пустым)
+        """
+        tokenizer = self.tokenizer
+        if tokenizer is None or not tokenizer.is_fast:
+            return self._estimated_spans(text)
+
+        offsets = tokenizer(
+            text,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            return_offsets_mapping=True,
+            verbose=False
+        )['offset_mapping']
+        return [(start, end) for start, end in offsets]
+
+    def _estimated_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Оценочные позиции токенов: слова, поделенные на части по chars_per_token"""
+        spans = []
+        for match in _WORD_RE.finditer(text):
+            start, end = match.span()
+            pieces = max(1, math.ceil((end - start) / self.chars_per_token))
+            step = (end - start) / pieces
+            for piece in range(pieces):
+                spans.append((start + round(piece * step), start + round((piece + 1) * step)))
+        return spans
+
+    def _calibrate(self, texts: Sequence[str], counts: List[int]):
+        """Уточнение коэффициента оценки по точному подсчету (с запасом ниже среднего)"""
+        self._calibration_chars += sum(len(text) for text in texts)
+        self._calibration_tokens += sum(counts)
+        if self._calibration_tokens:
+            measured = self._calibration_chars / self._calibration_tokens
+            self.chars_per_token = max(1.0, measured * _ESTIMATE_MARGIN)
@@ -2,14 +2,30 @@
 Единая система логирования для всего проекта AI Engineering
 """
 
+import atexit
 import logging
 import logging.handlers
+import queue
+import random
 import sys
 import os
 import json
+import time
+import uuid
 from datetime import datetime
-from typing import Dict, Any, Optional
-from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+# Дополнительные поля записи, попадающие в JSON
+_STRUCTURED_EXTRA_FIELDS = (
+    'user_id', 'request_id', 'service', 'duration', 'error_type',
+    'method', 'path', 'status_code'
+)
+
+# Заголовки, значения которых не пишутся в лог
+_REDACTED_HEADERS = frozenset({b'authorization', b'cookie', b'set-cookie', b'x-api-key'})
+
+# Слушатели очередей логирования (останавливаются при выходе)
+_queue_listeners: List[logging.handlers.QueueListener] = []
 
 
 class StructuredFormatter(logging.Formatter):
@@ -27,16 +43,10 @@ class StructuredFormatter(logging.Formatter):
         }
         
         # Добавляем дополнительные поля если есть
-        if hasattr(record, 'user_id'):
-            log_entry['user_id'] = record.user_id
-        if hasattr(record, 'request_id'):
-            log_entry['request_id'] = record.request_id
-        if hasattr(record, 'service'):
-            log_entry['service'] = record.service
-        if hasattr(record, 'duration'):
-            log_entry['duration'] = record.duration
-        if hasattr(record, 'error_type'):
-            log_entry['error_type'] = record.error_type
+        record_fields = record.__dict__
+        for field in _STRUCTURED_EXTRA_FIELDS:
+            if field in record_fields:
+                log_entry[field] = record_fields[field]
             
         # Добавляем исключение если есть
         if record.exc_info:
@@ -83,7 +93,8 @@ def setup_logging(
     enable_console_logging: bool = True,
     enable_json_logging: bool = False,
     max_file_size: int = 10 * 1024 * 1024,  # 10MB
-    backup_count: int = 5
+    backup_count: int = 5,
+    enable_queue_logging: bool = True
 ) -> logging.Logger:
     """
     Настройка логирования для сервиса
@@ -97,6 +108,7 @@ def setup_logging(
         enable_json_logging: Включить JSON логирование
         max_file_size: Максимальный размер файла лога
         backup_count: Количество файлов для ротации
+        enable_queue_logging: Форматирование и запись в фоновом потоке (см. setup_queue_logging)
     
     Returns:
         Настроенный логгер
@@ -158,6 +170,9 @@ def setup_logging(
         ))
         logger.addHandler(error_handler)
     
+    if enable_queue_logging:
+        setup_queue_logging(logger)
+    
     # Настройка уровней для внешних библиотек
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -173,6 +188,57 @@ def setup_logging(
     return logger
 
 
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке
+
+    Стандартный prepare() форматирует запись и убирает exc_info, тогда
+    StructuredFormatter в потоке слушателя уже не видит исключения. Записи
+    передаются в очередь как есть.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_queue_logging(logger: Optional[logging.Logger] = None) -> Optional[logging.handlers.QueueListener]:
+    """
+    Перевод хендлеров логгера на очередь
+    
+    Вызывающий поток только кладет запись в очередь, а форматирование
+    (в том числе JSON) и запись в файлы и консоль выполняются в отдельном
+    потоке QueueListener. Уровни хендлеров сохраняются.
+    
+    Args:
+        logger: Логгер (по умолчанию корневой)
+    
+    Returns:
+        Запущенный QueueListener или None, если хендлеров нет
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+    if not handlers:
+        return None
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if not _queue_listeners:
+        atexit.register(stop_queue_logging)
+    _queue_listeners.append(listener)
+    return listener
+
+
+def stop_queue_logging():
+    """Остановка слушателей очередей с записью оставшихся сообщений"""
+    while _queue_listeners:
+        _queue_listeners.pop().stop()
+
+
 def get_logger(service_name: str) -> logging.Logger:
     """Получить логгер для сервиса"""
     return logging.getLogger(service_name)
@@ -180,8 +246,8 @@ def get_logger(service_name: str) -> logging.Logger:
 
 def log_request(logger: logging.Logger, method: str, path: str, 
                 status_code: int, duration: float, request_id: str = None, 
-                user_id: str = None, **kwargs):
-    """Логирование HTTP запроса"""
+                user_id: str = None, level: int = logging.INFO, **kwargs):
+    """Логирование HTTP запроса (ответы с ошибкой — не ниже WARNING)"""
     extra = {
         'request_id': request_id,
         'user_id': user_id,
@@ -193,9 +259,8 @@ def log_request(logger: logging.Logger, method: str, path: str,
     }
     
     if status_code >= 400:
-        logger.warning(f"HTTP {method} {path} -> {status_code} ({duration:.3f}s)", extra=extra)
-    else:
-        logger.info(f"HTTP {method} {path} -> {status_code} ({duration:.3f}s)", extra=extra)
+        level = max(level, logging.WARNING)
+    logger.log(level, "HTTP %s %s -> %s (%.3fs)", method, path, status_code, duration, extra=extra)
 
 
 def log_error(logger: logging.Logger, error: Exception, context: str = "", 
@@ -238,6 +303,116 @@ def log_business_event(logger: logging.Logger, event: str, **kwargs):
     logger.info(f"📊 Бизнес-событие: {event}", extra=extra)
 
 
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware для логирования и замера времени HTTP запросов
+    
+    Работает на уровне ASGI, а не через BaseHTTPMiddleware: тело ответа не
+    оборачивается и не буферизуется, поэтому потоковые ответы (SSE) идут
+    клиенту без задержки. Время считается по монотонным часам до отправки
+    последней части ответа. На каждый запрос пишется одна строка INFO;
+    подробности (заголовки без секретов, query) пишутся на уровне DEBUG
+    только для доли запросов debug_sample_rate.
+    """
+    
+    def __init__(
+        self,
+        app,
+        logger: Optional[logging.Logger] = None,
+        request_id_prefix: str = "req_",
+        debug_sample_rate: Optional[float] = None,
+        quiet_paths: Sequence[str] = ("/health", "/metrics"),
+        on_complete: Optional[Callable[[str, str, int, float, Optional[Exception]], None]] = None
+    ):
+        """
+        Args:
+            app: ASGI приложение
+            logger: Логгер сервиса
+            request_id_prefix: Префикс генерируемого ID запроса (если нет X-Request-ID)
+            debug_sample_rate: Доля запросов с подробным DEBUG логом (по умолчанию REQUEST_LOG_SAMPLE_RATE или 0.01)
+            quiet_paths: Пути, которые логируются только на уровне DEBUG (health checks)
+            on_complete: Вызывается после ответа: (method, path, status_code, duration, error)
+        """
+        self.app = app
+        self.logger = logger or logging.getLogger(__name__)
+        self.request_id_prefix = request_id_prefix
+        self.debug_sample_rate = (
+            debug_sample_rate if debug_sample_rate is not None
+            else float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "0.01"))
+        )
+        self.quiet_paths = frozenset(quiet_paths)
+        self.on_complete = on_complete
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter()
+        method = scope["method"]
+        path = scope["path"]
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None:
+            request_id = f"{self.request_id_prefix}{uuid.uuid4().hex[:16]}"
+        
+        if self.logger.isEnabledFor(logging.DEBUG) and random.random() < self.debug_sample_rate:
+            self._log_request_details(scope, request_id)
+        
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            duration = time.perf_counter() - start_time
+            log_error(
+                logger=self.logger,
+                error=e,
+                context=f"HTTP {method} {path}",
+                request_id=request_id,
+                duration=duration
+            )
+            if self.on_complete:
+                self.on_complete(method, path, status_code, duration, e)
+            raise
+        
+        duration = time.perf_counter() - start_time
+        level = logging.DEBUG if path in self.quiet_paths and status_code < 400 else logging.INFO
+        if self.logger.isEnabledFor(level):
+            log_request(
+                logger=self.logger,
+                method=method,
+                path=path,
+                status_code=status_code,
+                duration=duration,
+                request_id=request_id,
+                level=level
+            )
+        if self.on_complete:
+            self.on_complete(method, path, status_code, duration, None)
+    
+    def _log_request_details(self, scope, request_id: str):
+        """Подробности запроса для DEBUG (секретные заголовки скрыты)"""
+        headers = {
+            name.decode("latin-1"): "***" if name in _REDACTED_HEADERS else value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        self.logger.debug(
+            "📥 %s %s query=%s headers=%s",
+            scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), headers,
+            extra={"request_id": request_id, "method": scope["method"], "path": scope["path"]}
+        )
+
+
 # Конфигурации для разных сервисов
 LOGGING_CONFIGS = {
     "chat-service": {
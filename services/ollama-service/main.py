@@ -3,7 +3,7 @@ Ollama Management Service
 Сервис для управления моделями Ollama
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import os
@@ -16,7 +16,7 @@ from datetime import datetime
 from contextlib import asynccontextmanager
 
 # Импорт утилит логирования
-from logging_utils import setup_service_logging, log_request, log_error, log_performance, log_business_event
+from logging_utils import setup_service_logging, log_error, log_performance, log_business_event, RequestLoggingMiddleware
 
 # Настройка логирования
 logger = setup_service_logging("ollama-service")
@@ -46,43 +46,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware для логирования запросов
-@app.middleware("http")
-async def logging_middleware(request: Request, call_next):
-    start_time = datetime.now()
-    request_id = f"ollama_req_{start_time.strftime('%Y%m%d_%H%M%S_%f')}"
-    
-    logger.info(f"📥 Входящий запрос: {request.method} {request.url.path}", extra={
-        "request_id": request_id,
-        "method": request.method,
-        "path": request.url.path,
-        "query_params": str(request.query_params)
-    })
-    
-    try:
-        response = await call_next(request)
-        process_time = (datetime.now() - start_time).total_seconds()
-        
-        log_request(
-            logger=logger,
-            method=request.method,
-            path=request.url.path,
-            status_code=response.status_code,
-            duration=process_time,
-            request_id=request_id
-        )
-        
-        return response
-        
-    except Exception as e:
-        process_time = (datetime.now() - start_time).total_seconds()
-        log_error(
-            logger=logger,
-            error=e,
-            context=f"HTTP {request.method} {request.url.path}",
-            request_id=request_id
-        )
-        raise
+# Middleware для логирования запросов (ASGI, не буферизует потоковые ответы)
+app.add_middleware(RequestLoggingMiddleware, logger=logger, request_id_prefix="ollama_req_")
 
 # Конфигурация
 OLLAMA_BASE_URL = os.getenv("OLLAMA_URL", "http://host.docker.internal:11434")
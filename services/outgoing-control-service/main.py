@@ -10,6 +10,7 @@ import uuid
 import os
 import tempfile
 import logging
+from contextlib import asynccontextmanager
 
 from database import get_db, engine
 from models import Base, OutgoingDocument, DocumentCheck, SpellCheckResult, StyleAnalysisResult, EthicsCheckResult, TerminologyCheckResult, FinalReview
@@ -40,11 +41,18 @@ logger = logging.getLogger(__name__)
 # Создание таблиц
 Base.metadata.create_all(bind=engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Shutdown: пул процессов OCR останавливается вместе с сервисом
+    document_processor.shutdown()
+
 # Инициализация FastAPI
 app = FastAPI(
     title="Outgoing Control Service",
     description="Сервис выходного контроля исходящей переписки",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Настройка CORS
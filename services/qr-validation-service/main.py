@@ -2,7 +2,7 @@
 QR валидация РД - Сервис для генерации и валидации QR-кодов рабочей документации
 """
 
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
 from contextlib import asynccontextmanager
@@ -17,7 +17,7 @@ import traceback
 from datetime import datetime
 
 # Импорт утилит логирования
-from logging_utils import setup_service_logging, log_request, log_error, log_performance, log_business_event
+from logging_utils import setup_service_logging, log_error, log_performance, log_business_event, RequestLoggingMiddleware
 
 from database import init_db
 from models import QRDocument, DocumentStatus
@@ -61,43 +61,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware для логирования запросов
-@app.middleware("http")
-async def logging_middleware(request: Request, call_next):
-    start_time = datetime.now()
-    request_id = f"qr_req_{start_time.strftime('%Y%m%d_%H%M%S_%f')}"
-    
-    logger.info(f"📥 Входящий запрос: {request.method} {request.url.path}", extra={
-        "request_id": request_id,
-        "method": request.method,
-        "path": request.url.path,
-        "query_params": str(request.query_params)
-    })
-    
-    try:
-        response = await call_next(request)
-        process_time = (datetime.now() - start_time).total_seconds()
-        
-        log_request(
-            logger=logger,
-            method=request.method,
-            path=request.url.path,
-            status_code=response.status_code,
-            duration=process_time,
-            request_id=request_id
-        )
-        
-        return response
-        
-    except Exception as e:
-        process_time = (datetime.now() - start_time).total_seconds()
-        log_error(
-            logger=logger,
-            error=e,
-            context=f"HTTP {request.method} {request.url.path}",
-            request_id=request_id
-        )
-        raise
+# Middleware для логирования запросов (ASGI, не буферизует потоковые ответы)
+app.add_middleware(RequestLoggingMiddleware, logger=logger, request_id_prefix="qr_req_")
 
 # Инициализация сервисов
 qr_service = QRService()
@@ -15,10 +15,11 @@ from models import Base
 from schemas import (
     DocumentCreate, DocumentResponse, DocumentSearchRequest, 
     DocumentSearchResponse, CollectionCreate, CollectionResponse,
-    EmbeddingRequest, EmbeddingResponse
+    EmbeddingRequest, EmbeddingResponse, BulkChunksRequest, BulkChunksResponse
 )
 from services.document_service import DocumentService
 from services.embedding_service import EmbeddingService
+from model_registry import model_status, warm_up
 from services.vector_service import VectorService
 from services.minio_service import MinIOService
 from auth import get_current_user, get_current_user_optional
@@ -57,12 +58,14 @@ async def startup_event():
     logger.info("Запуск RAG Service...")
     await vector_service.initialize()
     await minio_service.initialize()
+    # Модели загружаются в фоне, сервис отвечает на /health сразу
+    warm_up()
     logger.info("RAG Service готов к работе")
 
 @app.get("/health")
 async def health_check():
     """Проверка здоровья сервиса"""
-    return {"status": "healthy", "service": "rag-service"}
+    return {"status": "healthy", "service": "rag-service", "models": model_status()}
 
 @app.post("/collections/", response_model=CollectionResponse)
 async def create_collection(
@@ -143,15 +146,15 @@ async def process_document_for_rag(document_id: str, file_path: str, collection_
         # Извлечение текста из документа
         text_content = await minio_service.extract_text(file_path)
         
-        # Создание эмбеддингов
-        embeddings = await embedding_service.create_embeddings(text_content)
+        # Разбиение на чанки и создание эмбеддингов
+        chunks = await embedding_service.create_chunk_embeddings(text_content)
         
-        # Сохранение в векторную базу данных
-        await vector_service.store_embeddings(
-            document_id=document_id,
+        # Сохранение в векторную базу данных (ID чанков детерминированы)
+        await vector_service.store_chunk_embeddings(
+            document_id=str(document_id),
             collection_id=collection_id,
-            text=text_content,
-            embeddings=embeddings
+            chunks=chunks,
+            model_name=embedding_service.model_name
         )
         
         logger.info(f"Документ {document_id} успешно обработан для RAG")
@@ -193,6 +196,74 @@ async def search_documents(
         logger.error(f"Ошибка поиска документов: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/documents/bulk-chunks", response_model=BulkChunksResponse)
+async def store_bulk_chunks(
+    request: BulkChunksRequest,
+    current_user = Depends(get_current_user_optional)
+):
+    """
+    Массовое сохранение чанков документа одним запросом
+    
+    ID точек детерминированы, поэтому повторная загрузка документа сохраняет
+    только новые чанки, обновляет метаданные уже сохраненных и удаляет
+    исчезнувшие, не создавая дубликатов.
+    """
+    try:
+        model_name = embedding_service.model_name
+        chunks = [chunk.model_dump() for chunk in request.chunks]
+        point_ids = [
+            vector_service.chunk_point_id(request.document_id, chunk, model_name)
+            for chunk in chunks
+        ]
+        existing_ids = await vector_service.get_document_point_ids(request.document_id, request.collection_id)
+        
+        # Уже сохраненные чанки не переэмбеддятся, у них обновляются только метаданные
+        changed = [chunk for chunk, point_id in zip(chunks, point_ids) if point_id not in existing_ids]
+        unchanged = [chunk for chunk, point_id in zip(chunks, point_ids) if point_id in existing_ids]
+        
+        # Эмбеддинги создаются одним пакетом только для чанков без готовых векторов
+        missing = [chunk for chunk in changed if chunk['embedding'] is None]
+        if missing:
+            embeddings = await embedding_service.create_embeddings([chunk['text'] for chunk in missing])
+            for chunk, embedding in zip(missing, embeddings):
+                chunk['embedding'] = embedding
+        
+        metadata = dict(request.metadata or {})
+        if request.title:
+            metadata["title"] = request.title
+        
+        if changed:
+            await vector_service.store_chunk_embeddings(
+                document_id=request.document_id,
+                collection_id=request.collection_id,
+                chunks=changed,
+                metadata=metadata,
+                model_name=model_name
+            )
+        if unchanged:
+            await vector_service.update_chunk_payloads(
+                document_id=request.document_id,
+                collection_id=request.collection_id,
+                chunks=unchanged,
+                metadata=metadata,
+                model_name=model_name
+            )
+        
+        deleted = 0
+        if request.replace_existing:
+            deleted = await vector_service.delete_points(existing_ids - set(point_ids), request.collection_id)
+        
+        return BulkChunksResponse(
+            document_id=request.document_id,
+            stored_chunks=len(changed),
+            embedded_chunks=len(missing),
+            unchanged_chunks=len(unchanged),
+            deleted_chunks=deleted
+        )
+    except Exception as e:
+        logger.error(f"Ошибка массового сохранения чанков: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/embeddings/", response_model=EmbeddingResponse)
 async def create_embeddings(
     request: EmbeddingRequest,
@@ -205,7 +276,11 @@ async def create_embeddings(
         else:
             embeddings = await embedding_service.create_embeddings(request.text)
         
-        return EmbeddingResponse(embeddings=embeddings)
+        return EmbeddingResponse(
+            embeddings=embeddings,
+            model=embedding_service.model_name,
+            dimensions=embedding_service.dimensions
+        )
     except Exception as e:
         logger.error(f"Ошибка создания эмбеддингов: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -99,6 +99,33 @@ class DocumentChunk(BaseModel):
     document_id: UUID
     embedding: Optional[List[float]] = None
 
+class BulkChunkItem(BaseModel):
+    """Схема чанка для массового сохранения"""
+    chunk_index: int = Field(..., ge=0, description="Порядковый номер чанка в документе")
+    chunk_id: Optional[str] = Field(None, description="Детерминированный ID чанка (хеш источника и смещения)")
+    start_position: Optional[int] = Field(None, ge=0, description="Начало чанка в тексте документа")
+    end_position: Optional[int] = Field(None, ge=0, description="Конец чанка в тексте документа")
+    text: str = Field(..., description="Текст чанка")
+    embedding: Optional[List[float]] = Field(None, description="Готовый эмбеддинг (если не указан, будет создан)")
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Метаданные чанка")
+
+class BulkChunksRequest(BaseModel):
+    """Схема запроса массового сохранения чанков документа"""
+    document_id: str = Field(..., description="ID документа")
+    title: Optional[str] = Field(None, description="Название документа")
+    collection_id: Optional[str] = Field(None, description="ID коллекции")
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Общие метаданные чанков")
+    chunks: List[BulkChunkItem] = Field(..., min_length=1, description="Чанки документа")
+    replace_existing: bool = Field(True, description="Удалить чанки документа, которых нет в запросе")
+
+class BulkChunksResponse(BaseModel):
+    """Схема ответа массового сохранения чанков"""
+    document_id: str
+    stored_chunks: int
+    embedded_chunks: int = Field(0, description="Количество чанков, для которых эмбеддинги созданы сервисом")
+    unchanged_chunks: int = Field(0, description="Количество чанков, уже сохраненных ранее (обновлены только метаданные)")
+    deleted_chunks: int = Field(0, description="Количество удаленных устаревших чанков")
+
 class VectorSearchResult(BaseModel):
     """Схема результата векторного поиска"""
     document_id: UUID
@@ -2,13 +2,16 @@
 Сервис для создания эмбеддингов текста
 """
 
+import asyncio
 import logging
-from typing import List, Union
+from typing import List, Tuple, Union
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import os
 from dotenv import load_dotenv
 
+from model_registry import sentence_transformer
+from text_chunker import TextChunker, word_spans
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -18,14 +21,17 @@ class EmbeddingService:
     
     def __init__(self):
         self.model_name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-        self.model = None
+        # Модель общая для процесса и загружается при первом обращении
+        self.model = sentence_transformer(self.model_name)
         self.dimensions = 384  # Размерность для выбранной модели
         
     async def initialize(self):
-        """Инициализация модели эмбеддингов"""
+        """Загрузка модели эмбеддингов (вне цикла событий)"""
+        if self.model.loaded:
+            return
         try:
             logger.info(f"Загрузка модели эмбеддингов: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            await asyncio.to_thread(self.model.get)
             logger.info("Модель эмбеддингов успешно загружена")
         except Exception as e:
             logger.error(f"Ошибка загрузки модели эмбеддингов: {e}")
@@ -33,7 +39,7 @@ class EmbeddingService:
     
     async def create_embedding(self, text: str) -> List[float]:
         """Создание эмбеддинга для одного текста"""
-        if not self.model:
+        if not self.model.loaded:
             await self.initialize()
         
         try:
@@ -51,7 +57,7 @@ class EmbeddingService:
     
     async def create_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Создание эмбеддингов для списка текстов"""
-        if not self.model:
+        if not self.model.loaded:
             await self.initialize()
         
         try:
@@ -67,31 +73,59 @@ class EmbeddingService:
             logger.error(f"Ошибка создания эмбеддингов: {e}")
             raise
     
-    async def create_chunk_embeddings(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[dict]:
-        """Создание эмбеддингов для чанков текста"""
-        if not self.model:
+    async def create_chunk_embeddings(self, text: str, chunk_size: int = 480, overlap: int = 64) -> List[dict]:
+        """
+        Создание эмбеддингов для чанков текста
+        
+        Args:
+            text: Текст документа
+            chunk_size: Максимальный размер чанка в токенах модели
+            overlap: Перекрытие чанков в токенах модели
+        """
+        if not self.model.loaded:
             await self.initialize()
         
         try:
-            # Разбиение текста на чанки
-            chunks = self._split_text_into_chunks(text, chunk_size, overlap)
+            # Разбиение текста на чанки по токенам модели
+            chunker = TextChunker(max_tokens=chunk_size, overlap_tokens=overlap, tokenize=self._token_spans)
+            chunks = chunker.chunk(text)
+            if not chunks:
+                return []
             
-            # Создание эмбеддингов для каждого чанка
-            chunk_embeddings = []
-            for i, chunk in enumerate(chunks):
-                embedding = await self.create_embedding(chunk)
-                chunk_embeddings.append({
-                    'chunk_id': f"chunk_{i}",
-                    'text': chunk,
-                    'embedding': embedding,
-                    'chunk_index': i
-                })
+            # Эмбеддинги всех чанков одним пакетом
+            embeddings = self.model.encode([chunk.text for chunk in chunks], convert_to_tensor=False)
             
-            return chunk_embeddings
+            return [
+                {
+                    'chunk_id': chunk.chunk_id,
+                    'text': chunk.text,
+                    'embedding': embedding.tolist(),
+                    'chunk_index': chunk.index,
+                    'start_position': chunk.start,
+                    'end_position': chunk.end,
+                    'token_count': chunk.token_count,
+                    'section': chunk.section
+                }
+                for chunk, embedding in zip(chunks, embeddings)
+            ]
         except Exception as e:
             logger.error(f"Ошибка создания эмбеддингов чанков: {e}")
             raise
     
+    def _token_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Смещения токенов модели в тексте (по словам, если токенизатор их не отдает)"""
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is None or not getattr(tokenizer, 'is_fast', False):
+            return word_spans(text)
+        
+        return tokenizer(
+            text,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_offsets_mapping=True,
+            verbose=False
+        )['offset_mapping']
+    
     def _clean_text(self, text: str) -> str:
         """Очистка и нормализация текста"""
         if not text:
@@ -106,36 +140,6 @@ class EmbeddingService:
         
         return cleaned
     
-    def _split_text_into_chunks(self, text: str, chunk_size: int, overlap: int) -> List[str]:
-        """Разбиение текста на чанки с перекрытием"""
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Если это не последний чанк, ищем хорошее место для разрыва
-            if end < len(text):
-                # Ищем ближайший пробел или знак препинания
-                for i in range(end, max(start + chunk_size - 100, start), -1):
-                    if text[i] in ' \n\t.,;:!?':
-                        end = i
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            # Следующий чанк начинается с учетом перекрытия
-            start = end - overlap
-            if start >= len(text):
-                break
-        
-        return chunks
-    
     def get_model_info(self) -> dict:
         """Получение информации о модели"""
         return {
@@ -10,13 +10,13 @@ from datetime import datetime
 import json
 
 import numpy as np
-from sentence_transformers import SentenceTransformer, CrossEncoder
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
     Filter, FieldCondition, MatchValue, Range, 
     SearchRequest, VectorParams, Distance
 )
 
+from model_registry import cross_encoder, sentence_transformer
 from models.schemas import (
     QueryIntent, SearchResult, RAGResponse, DocumentChunk,
     QueryRewrite, IntentClassification
@@ -31,9 +31,9 @@ class EnhancedRAGService:
         self.qdrant = qdrant_client
         self.collection_name = "normative_documents"
         
-        # Модели для эмбеддингов и re-ranking
-        self.embedding_model = SentenceTransformer('intfloat/multilingual-e5-large')
-        self.rerank_model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        # Модели для эмбеддингов и re-ranking (общие для процесса, загружаются при первом обращении)
+        self.embedding_model = sentence_transformer('intfloat/multilingual-e5-large')
+        self.rerank_model = cross_encoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
         
         # Настройки поиска
         self.hybrid_weights = {"vector": 0.6, "bm25": 0.4}
@@ -2,6 +2,7 @@
 Сервис для работы с MinIO (объектное хранилище)
 """
 
+import asyncio
 import logging
 from typing import Optional, BinaryIO
 import os
@@ -16,11 +17,11 @@ import mimetypes
 from pathlib import Path
 
 # Импорты для извлечения текста
-import PyPDF2
-import pdfplumber
 from docx import Document as DocxDocument
 import json
 
+from extraction_cache import ExtractionCache, iter_pdf_pages, render_pdf_pages, sha256_bytes
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -35,6 +36,8 @@ class MinIOService:
         self.secure = os.getenv("MINIO_SECURE", "false").lower() == "true"
         self.bucket_name = os.getenv("MINIO_BUCKET", "ai-engineering")
         self.client = None
+        # Общий с другими сервисами кэш извлечения текста по содержимому файла
+        self.extraction_cache = ExtractionCache.from_env()
         
     async def initialize(self):
         """Инициализация MinIO клиента"""
@@ -176,43 +179,19 @@ class MinIOService:
     async def _extract_text_from_pdf(self, file_data: bytes) -> str:
         """Извлечение текста из PDF с использованием pdfplumber для лучшего качества"""
         try:
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-                temp_file.write(file_data)
-                temp_file.flush()
-                
-                text = ""
-                
-                # Используем pdfplumber для лучшего извлечения текста
-                try:
-                    with pdfplumber.open(temp_file.name) as pdf:
-                        for page_num, page in enumerate(pdf.pages):
-                            page_text = page.extract_text()
-                            if page_text:
-                                text += f"\n--- Страница {page_num + 1} ---\n"
-                                text += page_text
-                except Exception as pdfplumber_error:
-                    logger.warning(f"pdfplumber не смог извлечь текст: {pdfplumber_error}, используем PyPDF2")
-                    
-                    # Fallback на PyPDF2
-                    with open(temp_file.name, 'rb') as pdf_file:
-                        pdf_reader = PyPDF2.PdfReader(pdf_file)
-                        
-                        for page_num, page in enumerate(pdf_reader.pages):
-                            page_text = page.extract_text()
-                            if page_text:
-                                text += f"\n--- Страница {page_num + 1} ---\n"
-                                text += page_text
-                
-                # Удаление временного файла
-                os.unlink(temp_file.name)
-                
-                return text
+            # Хэш крупного PDF считается в потоке, не блокируя event loop
+            file_hash = await asyncio.to_thread(sha256_bytes, file_data)
+            record = await self.extraction_cache.load_pdf(file_hash, file_data)
+            
+            # Страницы сканов берутся из OCR, выполненного другими сервисами
+            return render_pdf_pages(
+                iter_pdf_pages(record), "\n--- Страница {page} ---\n", "\n--- Страница {page} (OCR) ---\n"
+            )
                 
         except Exception as e:
             logger.error(f"Ошибка извлечения текста из PDF: {e}")
             return ""
     
-    
     async def _extract_text_from_docx(self, file_data: bytes) -> str:
         """Извлечение текста из DOCX"""
         try:
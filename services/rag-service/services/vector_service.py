@@ -3,13 +3,17 @@
 """
 
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Set
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
-import uuid
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, FilterSelector, PointIdsList,
+    SetPayload, SetPayloadOperation
+)
 import os
 from dotenv import load_dotenv
 
+from text_chunker import document_hash, make_point_id
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -21,6 +25,9 @@ class VectorService:
         self.qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
         self.client = None
         self.collections = {}
+        self.scroll_batch_size = 1000
+        self.delete_batch_size = 1000
+        self.update_batch_size = 1000
         
     async def initialize(self):
         """Инициализация Qdrant клиента"""
@@ -78,7 +85,8 @@ class VectorService:
         collection_id: str, 
         text: str, 
         embeddings: List[float],
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None
     ):
         """Сохранение эмбеддингов в векторную базу данных"""
         try:
@@ -94,8 +102,8 @@ class VectorService:
                 **(metadata or {})
             }
             
-            # Генерация уникального ID для чанка
-            chunk_id = f"{document_id}_{uuid.uuid4().hex[:8]}"
+            # Детерминированный ID: повторное сохранение того же текста перезаписывает точку
+            chunk_id = make_point_id(f"{document_id}:{document_hash(text)}", model_name)
             
             # Создание точки для Qdrant
             point = PointStruct(
@@ -121,7 +129,8 @@ class VectorService:
         document_id: str,
         collection_id: str,
         chunks: List[Dict[str, Any]],
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None
     ):
         """Сохранение эмбеддингов чанков"""
         try:
@@ -131,21 +140,10 @@ class VectorService:
             points = []
             
             for chunk in chunks:
-                chunk_id = f"{document_id}_{chunk['chunk_index']}"
-                
-                chunk_metadata = {
-                    "document_id": document_id,
-                    "collection_id": collection_id,
-                    "chunk_index": chunk['chunk_index'],
-                    "text_length": len(chunk['text']),
-                    "text": chunk['text'],
-                    **(metadata or {})
-                }
-                
                 point = PointStruct(
-                    id=chunk_id,
+                    id=self.chunk_point_id(document_id, chunk, model_name),
                     vector=chunk['embedding'],
-                    payload=chunk_metadata
+                    payload=self._chunk_payload(document_id, collection_id, chunk, metadata, model_name)
                 )
                 points.append(point)
             
@@ -161,6 +159,120 @@ class VectorService:
             logger.error(f"Ошибка сохранения чанков: {e}")
             raise
     
+    async def update_chunk_payloads(
+        self,
+        document_id: str,
+        collection_id: str,
+        chunks: List[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None
+    ) -> int:
+        """
+        Обновление метаданных уже сохраненных чанков без перезаписи векторов
+        
+        Returns:
+            Количество обновленных точек
+        """
+        collection_name = self._get_collection_name(collection_id)
+        operations = [
+            SetPayloadOperation(set_payload=SetPayload(
+                payload=self._chunk_payload(document_id, collection_id, chunk, metadata, model_name),
+                points=[self.chunk_point_id(document_id, chunk, model_name)]
+            ))
+            for chunk in chunks
+        ]
+        
+        for start in range(0, len(operations), self.update_batch_size):
+            self.client.batch_update_points(
+                collection_name=collection_name,
+                update_operations=operations[start:start + self.update_batch_size]
+            )
+        
+        logger.info(f"Обновлены метаданные {len(operations)} чанков документа {document_id}")
+        return len(operations)
+    
+    def _chunk_payload(
+        self,
+        document_id: str,
+        collection_id: str,
+        chunk: Dict[str, Any],
+        metadata: Optional[Dict[str, Any]],
+        model_name: Optional[str]
+    ) -> Dict[str, Any]:
+        """Payload точки чанка (метаданные клиента не перезаписывают служебные поля)"""
+        return {
+            **(metadata or {}),
+            **(chunk.get('metadata') or {}),
+            "document_id": document_id,
+            "collection_id": collection_id,
+            "chunk_id": chunk.get('chunk_id'),
+            "chunk_index": chunk['chunk_index'],
+            "start_position": chunk.get('start_position'),
+            "end_position": chunk.get('end_position'),
+            "model": model_name,
+            "text_length": len(chunk['text']),
+            "text": chunk['text']
+        }
+    
+    def chunk_point_id(self, document_id: str, chunk: Dict[str, Any], model_name: Optional[str] = None) -> str:
+        """
+        Детерминированный ID точки чанка
+        
+        Строится из ID чанка (хеш источника и смещения), а если его нет —
+        из смещений или номера чанка в документе, и модели эмбеддингов.
+        """
+        chunk_key = chunk.get('chunk_id')
+        if not chunk_key:
+            if chunk.get('start_position') is not None and chunk.get('end_position') is not None:
+                chunk_key = f"{document_id}:{chunk['start_position']}:{chunk['end_position']}"
+            else:
+                chunk_key = f"{document_id}:{chunk['chunk_index']}"
+        return make_point_id(chunk_key, model_name)
+    
+    def _document_filter(self, document_id: str) -> Filter:
+        return Filter(
+            must=[
+                FieldCondition(
+                    key="document_id",
+                    match=MatchValue(value=document_id)
+                )
+            ]
+        )
+    
+    async def get_document_point_ids(self, document_id: str, collection_id: Optional[str] = None) -> Set[str]:
+        """ID всех точек документа в коллекции (постранично, без payload и векторов)"""
+        collection_name = self._get_collection_name(collection_id)
+        point_ids: Set[str] = set()
+        offset = None
+        
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=self._document_filter(document_id),
+                limit=self.scroll_batch_size,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            point_ids.update(str(point.id) for point in points)
+            if offset is None:
+                break
+        
+        return point_ids
+    
+    async def delete_points(self, point_ids: Iterable[str], collection_id: Optional[str] = None) -> int:
+        """Массовое удаление точек пакетами"""
+        collection_name = self._get_collection_name(collection_id)
+        point_ids = list(point_ids)
+        
+        for start in range(0, len(point_ids), self.delete_batch_size):
+            self.client.delete(
+                collection_name=collection_name,
+                points_selector=PointIdsList(points=point_ids[start:start + self.delete_batch_size])
+            )
+        
+        return len(point_ids)
+    
     async def search_similar(
         self,
         query_embedding: List[float],
@@ -252,28 +364,12 @@ class VectorService:
             
             for collection in collections.collections:
                 try:
-                    # Поиск и удаление всех чанков документа
-                    points = self.client.scroll(
+                    # Удаление всех чанков документа одним запросом по фильтру
+                    self.client.delete(
                         collection_name=collection.name,
-                        scroll_filter=Filter(
-                            must=[
-                                FieldCondition(
-                                    key="document_id",
-                                    match=MatchValue(value=document_id)
-                                )
-                            ]
-                        ),
-                        limit=10000,  # Большое число для получения всех точек
-                        with_payload=False
-                    )[0]
-                    
-                    if points:
-                        point_ids = [point.id for point in points]
-                        self.client.delete(
-                            collection_name=collection.name,
-                            points_selector=point_ids
-                        )
-                        logger.info(f"Удалено {len(point_ids)} чанков документа {document_id} из коллекции {collection.name}")
+                        points_selector=FilterSelector(filter=self._document_filter(document_id))
+                    )
+                    logger.info(f"Удалены чанки документа {document_id} из коллекции {collection.name}")
                         
                 except Exception as e:
                     logger.warning(f"Ошибка удаления из коллекции {collection.name}: {e}")
@@ -0,0 +1,465 @@
+"""
+Единая система логирования для всего проекта AI Engineering
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+
+# Дополнительные поля записи, попадающие в JSON
+_STRUCTURED_EXTRA_FIELDS = (
+    'user_id', 'request_id', 'service', 'duration', 'error_type',
+    'method', 'path', 'status_code'
+)
+
+# Заголовки, значения которых не пишутся в лог
+_REDACTED_HEADERS = frozenset({b'authorization', b'cookie', b'set-cookie', b'x-api-key'})
+
+# Слушатели очередей логирования (останавливаются при выходе)
+_queue_listeners: List[logging.handlers.QueueListener] = []
+
+
+class StructuredFormatter(logging.Formatter):
+    """Форматтер для структурированного логирования в JSON"""
+    
+    def format(self, record):
+        log_entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno
+        }
+        
+        # Добавляем дополнительные поля если есть
+        record_fields = record.__dict__
+        for field in _STRUCTURED_EXTRA_FIELDS:
+            if field in record_fields:
+                log_entry[field] = record_fields[field]
+            
+        # Добавляем исключение если есть
+        if record.exc_info:
+            log_entry['exception'] = self.formatException(record.exc_info)
+            
+        return json.dumps(log_entry, ensure_ascii=False)
+
+
+class ColoredFormatter(logging.Formatter):
+    """Цветной форматтер для консоли"""
+    
+    COLORS = {
+        'DEBUG': '\033[36m',    # Cyan
+        'INFO': '\033[32m',     # Green
+        'WARNING': '\033[33m',  # Yellow
+        'ERROR': '\033[31m',    # Red
+        'CRITICAL': '\033[35m', # Magenta
+        'RESET': '\033[0m'      # Reset
+    }
+    
+    def format(self, record):
+        color = self.COLORS.get(record.levelname, self.COLORS['RESET'])
+        reset = self.COLORS['RESET']
+        
+        # Добавляем эмодзи для разных уровней
+        emoji_map = {
+            'DEBUG': '🔍',
+            'INFO': 'ℹ️',
+            'WARNING': '⚠️',
+            'ERROR': '❌',
+            'CRITICAL': '🚨'
+        }
+        emoji = emoji_map.get(record.levelname, '📝')
+        
+        record.levelname = f"{color}{emoji} {record.levelname}{reset}"
+        return super().format(record)
+
+
+def setup_logging(
+    service_name: str,
+    log_level: str = "INFO",
+    log_dir: str = "/app/logs",
+    enable_file_logging: bool = True,
+    enable_console_logging: bool = True,
+    enable_json_logging: bool = False,
+    max_file_size: int = 10 * 1024 * 1024,  # 10MB
+    backup_count: int = 5,
+    enable_queue_logging: bool = True
+) -> logging.Logger:
+    """
+    Настройка логирования для сервиса
+    
+    Args:
+        service_name: Имя сервиса
+        log_level: Уровень логирования (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+        log_dir: Директория для логов
+        enable_file_logging: Включить файловое логирование
+        enable_console_logging: Включить консольное логирование
+        enable_json_logging: Включить JSON логирование
+        max_file_size: Максимальный размер файла лога
+        backup_count: Количество файлов для ротации
+        enable_queue_logging: Форматирование и запись в фоновом потоке (см. setup_queue_logging)
+    
+    Returns:
+        Настроенный логгер
+    """
+    
+    # Создаем директорию для логов
+    if enable_file_logging:
+        os.makedirs(log_dir, exist_ok=True)
+    
+    # Создаем логгер
+    logger = logging.getLogger(service_name)
+    logger.setLevel(getattr(logging, log_level.upper()))
+    
+    # Очищаем существующие хендлеры
+    logger.handlers.clear()
+    
+    # Консольный хендлер
+    if enable_console_logging:
+        console_handler = logging.StreamHandler(sys.stdout)
+        if enable_json_logging:
+            console_handler.setFormatter(StructuredFormatter())
+        else:
+            console_handler.setFormatter(ColoredFormatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            ))
+        logger.addHandler(console_handler)
+    
+    # Файловый хендлер с ротацией
+    if enable_file_logging:
+        log_file = os.path.join(log_dir, f"{service_name}.log")
+        
+        # Обычный файловый хендлер
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=max_file_size,
+            backupCount=backup_count,
+            encoding='utf-8'
+        )
+        
+        if enable_json_logging:
+            file_handler.setFormatter(StructuredFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            ))
+        logger.addHandler(file_handler)
+        
+        # Отдельный файл для ошибок
+        error_log_file = os.path.join(log_dir, f"{service_name}_errors.log")
+        error_handler = logging.handlers.RotatingFileHandler(
+            error_log_file,
+            maxBytes=max_file_size,
+            backupCount=backup_count,
+            encoding='utf-8'
+        )
+        error_handler.setLevel(logging.ERROR)
+        error_handler.setFormatter(StructuredFormatter() if enable_json_logging else logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+        logger.addHandler(error_handler)
+    
+    if enable_queue_logging:
+        setup_queue_logging(logger)
+    
+    # Настройка уровней для внешних библиотек
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+    logging.getLogger("fastapi").setLevel(logging.INFO)
+    
+    # Логируем успешную настройку
+    logger.info(f"🚀 Логирование настроено для сервиса {service_name}")
+    logger.info(f"📁 Директория логов: {log_dir}")
+    logger.info(f"📊 Уровень логирования: {log_level}")
+    
+    return logger
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке
+
+    Стандартный prepare() форматирует запись и убирает exc_info, тогда
+    StructuredFormatter в потоке слушателя уже не видит исключения. Записи
+    передаются в очередь как есть.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_queue_logging(logger: Optional[logging.Logger] = None) -> Optional[logging.handlers.QueueListener]:
+    """
+    Перевод хендлеров логгера на очередь
+    
+    Вызывающий поток только кладет запись в очередь, а форматирование
+    (в том числе JSON) и запись в файлы и консоль выполняются в отдельном
+    потоке QueueListener. Уровни хендлеров сохраняются.
+    
+    Args:
+        logger: Логгер (по умолчанию корневой)
+    
+    Returns:
+        Запущенный QueueListener или None, если хендлеров нет
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+    if not handlers:
+        return None
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if not _queue_listeners:
+        atexit.register(stop_queue_logging)
+    _queue_listeners.append(listener)
+    return listener
+
+
+def stop_queue_logging():
+    """Остановка слушателей очередей с записью оставшихся сообщений"""
+    while _queue_listeners:
+        _queue_listeners.pop().stop()
+
+
+def get_logger(service_name: str) -> logging.Logger:
+    """Получить логгер для сервиса"""
+    return logging.getLogger(service_name)
+
+
+def log_request(logger: logging.Logger, method: str, path: str, 
+                status_code: int, duration: float, request_id: str = None, 
+                user_id: str = None, level: int = logging.INFO, **kwargs):
+    """Логирование HTTP запроса (ответы с ошибкой — не ниже WARNING)"""
+    extra = {
+        'request_id': request_id,
+        'user_id': user_id,
+        'duration': duration,
+        'method': method,
+        'path': path,
+        'status_code': status_code,
+        **kwargs
+    }
+    
+    if status_code >= 400:
+        level = max(level, logging.WARNING)
+    logger.log(level, "HTTP %s %s -> %s (%.3fs)", method, path, status_code, duration, extra=extra)
+
+
+def log_error(logger: logging.Logger, error: Exception, context: str = "", 
+              request_id: str = None, user_id: str = None, **kwargs):
+    """Логирование ошибки"""
+    extra = {
+        'request_id': request_id,
+        'user_id': user_id,
+        'error_type': type(error).__name__,
+        'context': context,
+        **kwargs
+    }
+    
+    logger.error(f"❌ Ошибка в {context}: {str(error)}", extra=extra, exc_info=True)
+
+
+def log_performance(logger: logging.Logger, operation: str, duration: float, 
+                   success: bool = True, **kwargs):
+    """Логирование производительности"""
+    extra = {
+        'operation': operation,
+        'duration': duration,
+        'success': success,
+        **kwargs
+    }
+    
+    if success:
+        logger.info(f"⚡ {operation} выполнено за {duration:.3f}s", extra=extra)
+    else:
+        logger.warning(f"⚡ {operation} не выполнено за {duration:.3f}s", extra=extra)
+
+
+def log_business_event(logger: logging.Logger, event: str, **kwargs):
+    """Логирование бизнес-событий"""
+    extra = {
+        'event': event,
+        **kwargs
+    }
+    
+    logger.info(f"📊 Бизнес-событие: {event}", extra=extra)
+
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware для логирования и замера времени HTTP запросов
+    
+    Работает на уровне ASGI, а не через BaseHTTPMiddleware: тело ответа не
+    оборачивается и не буферизуется, поэтому потоковые ответы (SSE) идут
+    клиенту без задержки. Время считается по монотонным часам до отправки
+    последней части ответа. На каждый запрос пишется одна строка INFO;
+    подробности (заголовки без секретов, query) пишутся на уровне DEBUG
+    только для доли запросов debug_sample_rate.
+    """
+    
+    def __init__(
+        self,
+        app,
+        logger: Optional[logging.Logger] = None,
+        request_id_prefix: str = "req_",
+        debug_sample_rate: Optional[float] = None,
+        quiet_paths: Sequence[str] = ("/health", "/metrics"),
+        on_complete: Optional[Callable[[str, str, int, float, Optional[Exception]], None]] = None
+    ):
+        """
+        Args:
+            app: ASGI приложение
+            logger: Логгер сервиса
+            request_id_prefix: Префикс генерируемого ID запроса (если нет X-Request-ID)
+            debug_sample_rate: Доля запросов с подробным DEBUG логом (по умолчанию REQUEST_LOG_SAMPLE_RATE или 0.01)
+            quiet_paths: Пути, которые логируются только на уровне DEBUG (health checks)
+            on_complete: Вызывается после ответа: (method, path, status_code, duration, error)
+        """
+        self.app = app
+        self.logger = logger or logging.getLogger(__name__)
+        self.request_id_prefix = request_id_prefix
+        self.debug_sample_rate = (
+            debug_sample_rate if debug_sample_rate is not None
+            else float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "0.01"))
+        )
+        self.quiet_paths = frozenset(quiet_paths)
+        self.on_complete = on_complete
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter()
+        method = scope["method"]
+        path = scope["path"]
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None:
+            request_id = f"{self.request_id_prefix}{uuid.uuid4().hex[:16]}"
+        
+        if self.logger.isEnabledFor(logging.DEBUG) and random.random() < self.debug_sample_rate:
+            self._log_request_details(scope, request_id)
+        
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            duration = time.perf_counter() - start_time
+            log_error(
+                logger=self.logger,
+                error=e,
+                context=f"HTTP {method} {path}",
+                request_id=request_id,
+                duration=duration
+            )
+            if self.on_complete:
+                self.on_complete(method, path, status_code, duration, e)
+            raise
+        
+        duration = time.perf_counter() - start_time
+        level = logging.DEBUG if path in self.quiet_paths and status_code < 400 else logging.INFO
+        if self.logger.isEnabledFor(level):
+            log_request(
+                logger=self.logger,
+                method=method,
+                path=path,
+                status_code=status_code,
+                duration=duration,
+                request_id=request_id,
+                level=level
+            )
+        if self.on_complete:
+            self.on_complete(method, path, status_code, duration, None)
+    
+    def _log_request_details(self, scope, request_id: str):
+        """Подробности запроса для DEBUG (секретные заголовки скрыты)"""
+        headers = {
+            name.decode("latin-1"): "***" if name in _REDACTED_HEADERS else value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        self.logger.debug(
+            "📥 %s %s query=%s headers=%s",
+            scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), headers,
+            extra={"request_id": request_id, "method": scope["method"], "path": scope["path"]}
+        )
+
+
+# Конфигурации для разных сервисов
+LOGGING_CONFIGS = {
+    "chat-service": {
+        "log_level": "INFO",
+        "enable_json_logging": False,
+        "max_file_size": 20 * 1024 * 1024,  # 20MB для чата
+        "backup_count": 10
+    },
+    "qr-validation-service": {
+        "log_level": "INFO", 
+        "enable_json_logging": True,
+        "max_file_size": 10 * 1024 * 1024,
+        "backup_count": 5
+    },
+    "techexpert-connector": {
+        "log_level": "INFO",
+        "enable_json_logging": True,
+        "max_file_size": 15 * 1024 * 1024,
+        "backup_count": 7
+    },
+    "rag-service": {
+        "log_level": "DEBUG",
+        "enable_json_logging": True,
+        "max_file_size": 25 * 1024 * 1024,  # Больше для RAG
+        "backup_count": 10
+    },
+    "ollama-service": {
+        "log_level": "INFO",
+        "enable_json_logging": False,
+        "max_file_size": 10 * 1024 * 1024,
+        "backup_count": 5
+    },
+    "outgoing-control-service": {
+        "log_level": "INFO",
+        "enable_json_logging": True,
+        "max_file_size": 15 * 1024 * 1024,
+        "backup_count": 7
+    }
+}
+
+
+def setup_service_logging(service_name: str, **overrides) -> logging.Logger:
+    """Настройка логирования для конкретного сервиса с предустановленной конфигурацией"""
+    config = LOGGING_CONFIGS.get(service_name, {})
+    config.update(overrides)
+    
+    return setup_logging(
+        service_name=service_name,
+        **config
+    )
@@ -27,6 +27,7 @@ from models.schemas import (
     SyncStatus, SyncRequest, SyncResponse, ErrorResponse
 )
 from utils.logging_config import setup_logging
+from logging_utils import RequestLoggingMiddleware
 from utils.metrics import MetricsCollector
 
 # Настройка логирования
@@ -83,53 +84,14 @@ app.add_middleware(
 )
 
 # Middleware для логирования и метрик
-@app.middleware("http")
-async def logging_middleware(request: Request, call_next):
-    start_time = datetime.now()
-    request_id = f"req_{start_time.strftime('%Y%m%d_%H%M%S_%f')}"
-    
-    logger.info(f"📥 {request.method} {request.url.path}", extra={
-        "request_id": request_id,
-        "method": request.method,
-        "path": request.url.path,
-        "query_params": str(request.query_params)
-    })
-    
-    try:
-        response = await call_next(request)
-        process_time = (datetime.now() - start_time).total_seconds()
-        
-        logger.info(f"📤 {response.status_code} за {process_time:.3f}s", extra={
-            "request_id": request_id,
-            "status_code": response.status_code,
-            "process_time": process_time
-        })
-        
-        # Метрики
-        metrics.record_request(
-            method=request.method,
-            path=request.url.path,
-            status_code=response.status_code,
-            duration=process_time
-        )
-        
-        return response
-        
-    except Exception as e:
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.error(f"❌ Ошибка: {str(e)} за {process_time:.3f}s", extra={
-            "request_id": request_id,
-            "error": str(e),
-            "process_time": process_time
-        })
-        
-        metrics.record_error(
-            method=request.method,
-            path=request.url.path,
-            error_type=type(e).__name__
-        )
-        
-        raise
+def record_request_metrics(method: str, path: str, status_code: int, duration: float, error: Optional[Exception]):
+    """Метрики запроса по данным RequestLoggingMiddleware"""
+    if error is not None:
+        metrics.record_error(method=method, path=path, error_type=type(error).__name__)
+    else:
+        metrics.record_request(method=method, path=path, status_code=status_code, duration=duration)
+
+app.add_middleware(RequestLoggingMiddleware, logger=logger, on_complete=record_request_metrics)
 
 # Dependency для аутентификации
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -202,41 +164,35 @@ async def search_documents(
 ):
     """Поиск документов по текстовому запросу"""
     try:
-        # Проверяем кэш
-        cache_key = f"search:{hash(str(search_request))}"
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            logger.info("Результат найден в кэше")
-            return SearchResponse(**cached_result)
-        
-        # Выполняем поиск
-        start_time = datetime.now()
-        
-        # Пробуем онлайн поиск через circuit breaker
-        try:
-            with circuit_breaker:
-                results = await techexpert_client.search_documents(search_request)
-                source = "online"
-        except Exception as e:
-            logger.warning(f"Онлайн поиск недоступен: {str(e)}, используем локальный")
-            results = await sync_service.search_local(search_request)
-            source = "local"
-        
-        query_time = (datetime.now() - start_time).total_seconds() * 1000
-        
-        response = SearchResponse(
-            results=results,
-            total_count=len(results),
-            page=search_request.offset // search_request.limit + 1,
-            per_page=search_request.limit,
-            query_time_ms=query_time,
-            source=source
-        )
-        
-        # Кэшируем результат
-        await cache_service.set(cache_key, response.dict(), ttl=300)
-        
-        return response
+        # Ключ из канонической сериализации запроса: одинаков во всех репликах
+        cache_key = cache_service.make_key("search", search_request.dict())
+        
+        async def search():
+            start_time = datetime.now()
+            
+            # Пробуем онлайн поиск через circuit breaker
+            try:
+                with circuit_breaker:
+                    results = await techexpert_client.search_documents(search_request)
+                    source = "online"
+            except Exception as e:
+                logger.warning(f"Онлайн поиск недоступен: {str(e)}, используем локальный")
+                results = await sync_service.search_local(search_request)
+                source = "local"
+            
+            query_time = (datetime.now() - start_time).total_seconds() * 1000
+            
+            return SearchResponse(
+                results=results,
+                total_count=len(results),
+                page=search_request.offset // search_request.limit + 1,
+                per_page=search_request.limit,
+                query_time_ms=query_time,
+                source=source
+            ).dict()
+        
+        # Одновременные одинаковые запросы выполняют один поиск
+        return SearchResponse(**await cache_service.get_or_set(cache_key, search, ttl=300))
         
     except Exception as e:
         logger.error(f"Ошибка поиска: {str(e)}")
@@ -254,35 +210,28 @@ async def get_document_meta(
 ):
     """Получение метаданных документа"""
     try:
-        # Проверяем кэш
         cache_key = f"meta:{doc_id}:{edition_id or 'latest'}"
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return DocumentMeta(**cached_result)
-        
-        # Получаем метаданные
-        try:
-            with circuit_breaker:
-                meta = await techexpert_client.get_document_meta(doc_id, edition_id)
-                source = "techexpert"
-        except Exception as e:
-            logger.warning(f"Онлайн получение метаданных недоступно: {str(e)}")
-            meta = await sync_service.get_local_document_meta(doc_id, edition_id)
-            source = "local"
-        
-        if not meta:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Документ не найден"
-            )
-        
-        meta["source"] = source
-        response = DocumentMeta(**meta)
         
-        # Кэшируем результат
-        await cache_service.set(cache_key, response.dict(), ttl=3600)
+        async def load_meta():
+            try:
+                with circuit_breaker:
+                    meta = await techexpert_client.get_document_meta(doc_id, edition_id)
+                    source = "techexpert"
+            except Exception as e:
+                logger.warning(f"Онлайн получение метаданных недоступно: {str(e)}")
+                meta = await sync_service.get_local_document_meta(doc_id, edition_id)
+                source = "local"
+            
+            if not meta:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Документ не найден"
+                )
+            
+            meta["source"] = source
+            return DocumentMeta(**meta).dict()
         
-        return response
+        return DocumentMeta(**await cache_service.get_or_set(cache_key, load_meta, ttl=3600))
         
     except HTTPException:
         raise
@@ -335,32 +284,25 @@ async def get_document_sections(
 ):
     """Получение списка разделов документа"""
     try:
-        # Проверяем кэш
         cache_key = f"sections:{doc_id}:{edition_id or 'latest'}"
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return SectionsResponse(**cached_result)
-        
-        # Получаем разделы
-        try:
-            with circuit_breaker:
-                sections = await techexpert_client.get_document_sections(doc_id, edition_id)
-        except Exception as e:
-            logger.warning(f"Онлайн получение разделов недоступно: {str(e)}")
-            sections = await sync_service.get_local_document_sections(doc_id, edition_id)
-        
-        if not sections:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Документ не найден"
-            )
         
-        response = SectionsResponse(**sections)
-        
-        # Кэшируем результат
-        await cache_service.set(cache_key, response.dict(), ttl=1800)
+        async def load_sections():
+            try:
+                with circuit_breaker:
+                    sections = await techexpert_client.get_document_sections(doc_id, edition_id)
+            except Exception as e:
+                logger.warning(f"Онлайн получение разделов недоступно: {str(e)}")
+                sections = await sync_service.get_local_document_sections(doc_id, edition_id)
+            
+            if not sections:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Документ не найден"
+                )
+            
+            return SectionsResponse(**sections).dict()
         
-        return response
+        return SectionsResponse(**await cache_service.get_or_set(cache_key, load_sections, ttl=1800))
         
     except HTTPException:
         raise
@@ -382,36 +324,30 @@ async def get_section_content(
 ):
     """Получение содержимого конкретного раздела"""
     try:
-        # Проверяем кэш
-        cache_key = f"content:{doc_id}:{section_id}:{edition_id or 'latest'}"
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return SectionContent(**cached_result)
-        
-        # Получаем содержимое
-        try:
-            with circuit_breaker:
-                content = await techexpert_client.get_section_content(
+        # include_metadata меняет ответ, поэтому входит в ключ
+        cache_key = f"content:{doc_id}:{section_id}:{edition_id or 'latest'}:{int(include_metadata)}"
+        
+        async def load_content():
+            try:
+                with circuit_breaker:
+                    content = await techexpert_client.get_section_content(
+                        doc_id, section_id, edition_id, include_metadata
+                    )
+            except Exception as e:
+                logger.warning(f"Онлайн получение содержимого недоступно: {str(e)}")
+                content = await sync_service.get_local_section_content(
                     doc_id, section_id, edition_id, include_metadata
                 )
-        except Exception as e:
-            logger.warning(f"Онлайн получение содержимого недоступно: {str(e)}")
-            content = await sync_service.get_local_section_content(
-                doc_id, section_id, edition_id, include_metadata
-            )
-        
-        if not content:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Раздел не найден"
-            )
-        
-        response = SectionContent(**content)
-        
-        # Кэшируем результат
-        await cache_service.set(cache_key, response.dict(), ttl=3600)
+            
+            if not content:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Раздел не найден"
+                )
+            
+            return SectionContent(**content).dict()
         
-        return response
+        return SectionContent(**await cache_service.get_or_set(cache_key, load_content, ttl=3600))
         
     except HTTPException:
         raise
@@ -432,30 +368,23 @@ async def get_document_citations(
 ):
     """Получение списка документов, ссылающихся на данный"""
     try:
-        # Проверяем кэш
         cache_key = f"citations:{doc_id}:{edition_id or 'latest'}:{limit}"
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return CitationsResponse(**cached_result)
         
-        # Получаем ссылки
-        try:
-            with circuit_breaker:
-                citations = await techexpert_client.get_document_citations(
+        async def load_citations():
+            try:
+                with circuit_breaker:
+                    citations = await techexpert_client.get_document_citations(
+                        doc_id, edition_id, limit
+                    )
+            except Exception as e:
+                logger.warning(f"Онлайн получение ссылок недоступно: {str(e)}")
+                citations = await sync_service.get_local_document_citations(
                     doc_id, edition_id, limit
                 )
-        except Exception as e:
-            logger.warning(f"Онлайн получение ссылок недоступно: {str(e)}")
-            citations = await sync_service.get_local_document_citations(
-                doc_id, edition_id, limit
-            )
-        
-        response = CitationsResponse(**citations)
-        
-        # Кэшируем результат
-        await cache_service.set(cache_key, response.dict(), ttl=7200)
+            
+            return CitationsResponse(**citations).dict()
         
-        return response
+        return CitationsResponse(**await cache_service.get_or_set(cache_key, load_citations, ttl=7200))
         
     except Exception as e:
         logger.error(f"Ошибка получения ссылок: {str(e)}")
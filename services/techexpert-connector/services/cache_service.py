@@ -1,12 +1,32 @@
 """
 Сервис кэширования для TechExpert Connector
+
+Два уровня: ограниченный LRU в памяти процесса (L1) перед Redis (L2), общим
+для всех реплик. Без Redis работает только L1.
+
+get_or_set защищает API TechExpert от лавины одинаковых запросов:
+- одновременные промахи по ключу внутри процесса ждут одну загрузку,
+  между репликами загрузку выполняет владелец блокировки в Redis, остальные
+  ждут появления значения;
+- после истечения TTL значение еще stale_ttl секунд отдается устаревшим,
+  а обновляется одной фоновой загрузкой.
+
+Значения кодируются msgpack (без него - JSON) с сохранением типов datetime,
+date, Decimal и UUID. Ключи запросов строятся make_key из канонической
+сериализации и совпадают во всех процессах.
 """
 
+import asyncio
+import hashlib
 import json
 import logging
-from typing import Any, Optional, Dict
-from datetime import datetime, timedelta
-import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
 try:
     import redis.asyncio as redis
@@ -15,19 +35,61 @@ except ImportError:
     REDIS_AVAILABLE = False
     redis = None
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    msgpack = None
+
 logger = logging.getLogger(__name__)
 
+# Первый байт значения в Redis - формат кодирования
+MSGPACK_FORMAT = b"m"
+JSON_FORMAT = b"j"
+
+# Типы msgpack ExtType
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_DECIMAL = 3
+EXT_UUID = 4
+
+# Снятие блокировки только ее владельцем
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
 class CacheService:
-    """Сервис кэширования с поддержкой Redis и in-memory fallback"""
-    
+    """Двухуровневый кэш: LRU в памяти процесса + Redis"""
+
     def __init__(self):
         self.redis_client = None
-        self.memory_cache = {}
         self.use_redis = False
         self.default_ttl = 3600  # 1 час
-        
+
+        # L1: ключ -> (значение, свежее до, устаревшее до), время по time.time()
+        self.memory_cache: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict()
+        self.memory_max_entries = int(os.getenv("TECHEXPERT_CACHE_L1_SIZE", "1024"))
+        # При наличии Redis L1 хранит значения недолго, чтобы реплики не расходились
+        self.memory_ttl = int(os.getenv("TECHEXPERT_CACHE_L1_TTL", "30"))
+
+        # Сколько секунд после истечения TTL значение отдается, пока идет обновление
+        self.default_stale_ttl = int(os.getenv("TECHEXPERT_CACHE_STALE_TTL", "300"))
+
+        # Блокировка загрузки в Redis и ожидание значения от другой реплики
+        self.lock_timeout = float(os.getenv("TECHEXPERT_CACHE_LOCK_TIMEOUT", "15"))
+        self.lock_poll_interval = 0.05
+
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._instance_id = uuid.uuid4().hex
+        self._stats = {"l1_hits": 0, "l2_hits": 0, "stale_hits": 0, "misses": 0, "loads": 0}
+
         logger.info("CacheService инициализирован")
-    
+
     async def initialize(self):
         """Инициализация сервиса кэширования"""
         try:
@@ -37,228 +99,190 @@ class CacheService:
                     host='redis',
                     port=6379,
                     db=0,
-                    decode_responses=True,
                     socket_connect_timeout=5,
                     socket_timeout=5
                 )
-                
+
                 # Проверяем подключение
                 await self.redis_client.ping()
                 self.use_redis = True
                 logger.info("Подключение к Redis установлено")
-                
+
             else:
                 logger.warning("Redis недоступен, используется in-memory кэш")
-                
+
         except Exception as e:
             logger.warning(f"Не удалось подключиться к Redis: {str(e)}, используется in-memory кэш")
             self.use_redis = False
-    
+
+        if not MSGPACK_AVAILABLE:
+            logger.warning("msgpack не установлен, значения кэша кодируются в JSON")
+
+    @staticmethod
+    def make_key(prefix: str, params: Any) -> str:
+        """Ключ запроса из канонической сериализации параметров (одинаков во всех процессах)"""
+        canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+        return f"{prefix}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]}"
+
+    async def get_or_set(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[int] = None,
+                         stale_ttl: Optional[int] = None) -> Any:
+        """
+        Значение из кэша или результат loader(), сохраненный в кэш
+
+        Args:
+            key: Ключ
+            loader: Загрузка значения при промахе (None не кэшируется)
+            ttl: Время свежести значения, секунды
+            stale_ttl: Сколько секунд после ttl отдавать устаревшее значение, обновляя его в фоне
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        stale_ttl = self.default_stale_ttl if stale_ttl is None else stale_ttl
+
+        cached = await self._lookup(key, allow_stale=True)
+        if cached is not None:
+            value, fresh = cached
+            if not fresh:
+                self._stats["stale_hits"] += 1
+                self._start_load(key, loader, ttl, stale_ttl, wait=False)
+            return value
+
+        self._stats["misses"] += 1
+        # Загрузку не отменяет отключившийся клиент: ее результат ждут другие запросы
+        return await asyncio.shield(self._start_load(key, loader, ttl, stale_ttl, wait=True))
+
     async def get(self, key: str) -> Optional[Any]:
         """Получение значения из кэша"""
-        try:
-            if self.use_redis and self.redis_client:
-                value = await self.redis_client.get(key)
-                if value:
-                    return json.loads(value)
-            else:
-                # In-memory кэш
-                if key in self.memory_cache:
-                    entry = self.memory_cache[key]
-                    if entry["expires_at"] > datetime.now():
-                        return entry["value"]
-                    else:
-                        # Удаляем истекшую запись
-                        del self.memory_cache[key]
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения из кэша: {str(e)}")
-            return None
-    
-    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        cached = await self._lookup(key, allow_stale=False)
+        return cached[0] if cached is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None, stale_ttl: int = 0) -> bool:
         """Сохранение значения в кэш"""
         try:
             if ttl is None:
                 ttl = self.default_ttl
-            
-            if self.use_redis and self.redis_client:
-                serialized_value = json.dumps(value, default=str)
-                await self.redis_client.setex(key, ttl, serialized_value)
-            else:
-                # In-memory кэш
-                expires_at = datetime.now() + timedelta(seconds=ttl)
-                self.memory_cache[key] = {
-                    "value": value,
-                    "expires_at": expires_at
-                }
-                
-                # Очищаем старые записи
-                await self._cleanup_memory_cache()
-            
+
+            now = time.time()
+            fresh_until = now + ttl
+            stale_until = fresh_until + stale_ttl
+
+            if self._redis_ready():
+                await self.redis_client.set(
+                    key, encode_value({"v": value, "f": fresh_until}), ex=max(1, int(ttl + stale_ttl))
+                )
+                # L1 перед Redis держит значение не дольше memory_ttl
+                fresh_until = min(fresh_until, now + self.memory_ttl)
+                stale_until = min(stale_until, now + self.memory_ttl)
+
+            self._remember(key, value, fresh_until, stale_until)
             return True
-            
+
         except Exception as e:
             logger.error(f"Ошибка сохранения в кэш: {str(e)}")
             return False
-    
+
     async def delete(self, key: str) -> bool:
         """Удаление значения из кэша"""
         try:
-            if self.use_redis and self.redis_client:
+            self.memory_cache.pop(key, None)
+            if self._redis_ready():
                 await self.redis_client.delete(key)
-            else:
-                # In-memory кэш
-                if key in self.memory_cache:
-                    del self.memory_cache[key]
-            
+
             return True
-            
+
         except Exception as e:
             logger.error(f"Ошибка удаления из кэша: {str(e)}")
             return False
-    
+
     async def exists(self, key: str) -> bool:
         """Проверка существования ключа в кэше"""
-        try:
-            if self.use_redis and self.redis_client:
-                return await self.redis_client.exists(key) > 0
-            else:
-                # In-memory кэш
-                if key in self.memory_cache:
-                    entry = self.memory_cache[key]
-                    if entry["expires_at"] > datetime.now():
-                        return True
-                    else:
-                        # Удаляем истекшую запись
-                        del self.memory_cache[key]
-                
-                return False
-                
-        except Exception as e:
-            logger.error(f"Ошибка проверки существования ключа: {str(e)}")
-            return False
-    
+        return await self._lookup(key, allow_stale=False) is not None
+
     async def get_ttl(self, key: str) -> Optional[int]:
         """Получение TTL ключа"""
         try:
-            if self.use_redis and self.redis_client:
+            if self._redis_ready():
                 ttl = await self.redis_client.ttl(key)
                 return ttl if ttl > 0 else None
-            else:
-                # In-memory кэш
-                if key in self.memory_cache:
-                    entry = self.memory_cache[key]
-                    if entry["expires_at"] > datetime.now():
-                        remaining = (entry["expires_at"] - datetime.now()).total_seconds()
-                        return int(remaining) if remaining > 0 else None
-                    else:
-                        # Удаляем истекшую запись
-                        del self.memory_cache[key]
-                
-                return None
-                
+
+            entry = self.memory_cache.get(key)
+            if entry is not None:
+                remaining = entry[2] - time.time()
+                return int(remaining) if remaining > 0 else None
+            return None
+
         except Exception as e:
             logger.error(f"Ошибка получения TTL: {str(e)}")
             return None
-    
+
     async def increment(self, key: str, amount: int = 1) -> Optional[int]:
         """Увеличение числового значения в кэше"""
         try:
-            if self.use_redis and self.redis_client:
+            if self._redis_ready():
+                # Счетчик живет только в Redis: копия в L1 устарела бы сразу
+                self.memory_cache.pop(key, None)
                 return await self.redis_client.incrby(key, amount)
-            else:
-                # In-memory кэш
-                current_value = await self.get(key)
-                if current_value is None:
-                    new_value = amount
-                else:
-                    new_value = current_value + amount
-                
-                await self.set(key, new_value)
-                return new_value
-                
+
+            current_value = await self.get(key)
+            new_value = amount if current_value is None else current_value + amount
+            await self.set(key, new_value)
+            return new_value
+
         except Exception as e:
             logger.error(f"Ошибка увеличения значения: {str(e)}")
             return None
-    
+
     async def get_stats(self) -> Dict[str, Any]:
         """Получение статистики кэша"""
         try:
-            if self.use_redis and self.redis_client:
+            stats = {
+                "type": "memory+redis" if self._redis_ready() else "memory",
+                "memory_keys": len(self.memory_cache),
+                "memory_max_keys": self.memory_max_entries,
+                "inflight_loads": len(self._inflight),
+                **self._stats
+            }
+
+            if self._redis_ready():
                 info = await self.redis_client.info()
-                return {
-                    "type": "redis",
+                stats.update({
                     "connected_clients": info.get("connected_clients", 0),
                     "used_memory": info.get("used_memory_human", "0B"),
                     "keyspace_hits": info.get("keyspace_hits", 0),
                     "keyspace_misses": info.get("keyspace_misses", 0),
                     "total_commands_processed": info.get("total_commands_processed", 0)
-                }
-            else:
-                # In-memory кэш
-                total_keys = len(self.memory_cache)
-                expired_keys = 0
-                
-                for key, entry in self.memory_cache.items():
-                    if entry["expires_at"] <= datetime.now():
-                        expired_keys += 1
-                
-                return {
-                    "type": "memory",
-                    "total_keys": total_keys,
-                    "expired_keys": expired_keys,
-                    "active_keys": total_keys - expired_keys
-                }
-                
+                })
+
+            return stats
+
         except Exception as e:
             logger.error(f"Ошибка получения статистики кэша: {str(e)}")
             return {"error": str(e)}
-    
+
     async def clear(self) -> bool:
         """Очистка всего кэша"""
         try:
-            if self.use_redis and self.redis_client:
+            self.memory_cache.clear()
+            if self._redis_ready():
                 await self.redis_client.flushdb()
-            else:
-                # In-memory кэш
-                self.memory_cache.clear()
-            
+
             logger.info("Кэш очищен")
             return True
-            
+
         except Exception as e:
             logger.error(f"Ошибка очистки кэша: {str(e)}")
             return False
-    
-    async def _cleanup_memory_cache(self):
-        """Очистка истекших записей в in-memory кэше"""
-        try:
-            current_time = datetime.now()
-            expired_keys = [
-                key for key, entry in self.memory_cache.items()
-                if entry["expires_at"] <= current_time
-            ]
-            
-            for key in expired_keys:
-                del self.memory_cache[key]
-            
-            if expired_keys:
-                logger.debug(f"Удалено {len(expired_keys)} истекших записей из кэша")
-                
-        except Exception as e:
-            logger.error(f"Ошибка очистки in-memory кэша: {str(e)}")
-    
+
     async def health_check(self) -> Dict[str, Any]:
         """Проверка состояния кэша"""
         try:
-            if self.use_redis and self.redis_client:
+            if self._redis_ready():
+                started = time.perf_counter()
                 await self.redis_client.ping()
                 return {
                     "status": "up",
-                    "type": "redis",
-                    "response_time_ms": 0  # В реальной системе можно измерить
+                    "type": "memory+redis",
+                    "keys_count": len(self.memory_cache),
+                    "response_time_ms": round((time.perf_counter() - started) * 1000, 2)
                 }
             else:
                 return {
@@ -266,14 +290,14 @@ class CacheService:
                     "type": "memory",
                     "keys_count": len(self.memory_cache)
                 }
-                
+
         except Exception as e:
             logger.error(f"Ошибка health check кэша: {str(e)}")
             return {
                 "status": "down",
                 "error": str(e)
             }
-    
+
     async def close(self):
         """Закрытие соединения с кэшем"""
         try:
@@ -282,3 +306,210 @@ class CacheService:
                 logger.info("Соединение с Redis закрыто")
         except Exception as e:
             logger.error(f"Ошибка закрытия соединения с Redis: {str(e)}")
+
+    # === Внутренние методы ===
+
+    def _redis_ready(self) -> bool:
+        return self.use_redis and self.redis_client is not None
+
+    def _remember(self, key: str, value: Any, fresh_until: float, stale_until: float):
+        """Запись в L1 с вытеснением давно не использованных ключей"""
+        self.memory_cache[key] = (value, fresh_until, stale_until)
+        self.memory_cache.move_to_end(key)
+        while len(self.memory_cache) > self.memory_max_entries:
+            self.memory_cache.popitem(last=False)
+
+    async def _lookup(self, key: str, allow_stale: bool) -> Optional[Tuple[Any, bool]]:
+        """(значение, свежее ли) из L1, затем из L2; None - промах"""
+        now = time.time()
+
+        entry = self.memory_cache.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until or (allow_stale and now < stale_until):
+                self.memory_cache.move_to_end(key)
+                self._stats["l1_hits"] += 1
+                return value, now < fresh_until
+            if now >= stale_until:
+                del self.memory_cache[key]
+
+        if not self._redis_ready():
+            return None
+
+        try:
+            raw = await self.redis_client.get(key)
+        except Exception as e:
+            logger.error(f"Ошибка получения из кэша: {str(e)}")
+            return None
+        if raw is None:
+            return None
+
+        try:
+            envelope = decode_value(raw)
+        except Exception as e:
+            logger.warning(f"Не удалось декодировать значение кэша {key}: {str(e)}")
+            return None
+
+        # Значения, записанные не через set (increment, старый формат), считаются свежими
+        if isinstance(envelope, dict) and envelope.keys() == {"v", "f"}:
+            value, fresh_until = envelope["v"], envelope["f"]
+        else:
+            value, fresh_until = envelope, now + self.memory_ttl
+
+        fresh = now < fresh_until
+        if not fresh and not allow_stale:
+            return None
+
+        self._stats["l2_hits"] += 1
+        self._remember(key, value, min(fresh_until, now + self.memory_ttl), now + self.memory_ttl)
+        return value, fresh
+
+    def _start_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: int, stale_ttl: int,
+                    wait: bool) -> asyncio.Future:
+        """Одна загрузка ключа на процесс; повторные вызовы получают уже идущую"""
+        # Фоновое обновление может уступить другой реплике и вернуть None, промах его не ждет
+        inflight_key = key if wait else f"refresh:{key}"
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader, ttl, stale_ttl, wait))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self._finish_load(inflight_key, done))
+        return task
+
+    def _finish_load(self, inflight_key: str, task: asyncio.Future):
+        if self._inflight.get(inflight_key) is task:
+            del self._inflight[inflight_key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не удалось загрузить значение кэша {inflight_key}: {task.exception()}")
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: int, stale_ttl: int,
+                    wait: bool) -> Any:
+        """
+        Загрузка значения под блокировкой в Redis
+
+        Блокировку держит одна реплика. Остальные при промахе (wait=True) ждут
+        ее значение в Redis, а при фоновом обновлении ничего не делают.
+        """
+        lock_key = f"lock:{key}"
+        locked = False
+
+        if self._redis_ready():
+            try:
+                locked = bool(await self.redis_client.set(
+                    lock_key, self._instance_id, nx=True, px=int(self.lock_timeout * 1000)
+                ))
+            except Exception as e:
+                logger.warning(f"Не удалось взять блокировку {lock_key}: {str(e)}")
+
+            if not locked:
+                if not wait:
+                    return None
+                cached = await self._wait_for_value(key)
+                if cached is not None:
+                    return cached
+
+        try:
+            self._stats["loads"] += 1
+            value = await loader()
+            if value is not None:
+                await self.set(key, value, ttl, stale_ttl)
+            return value
+        finally:
+            if locked:
+                try:
+                    await self.redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, self._instance_id)
+                except Exception as e:
+                    logger.warning(f"Не удалось снять блокировку {lock_key}: {str(e)}")
+
+    async def _wait_for_value(self, key: str) -> Optional[Any]:
+        """Ожидание свежего значения, которое загружает другая реплика"""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.lock_poll_interval)
+            cached = await self._lookup(key, allow_stale=False)
+            if cached is not None:
+                return cached[0]
+
+        logger.warning(f"Не дождались значения кэша {key} от другой реплики, загружаем сами")
+        return None
+
+
+def encode_value(value: Any) -> bytes:
+    """Значение для Redis: байт формата + msgpack (или JSON) с сохранением типов"""
+    if MSGPACK_AVAILABLE:
+        return MSGPACK_FORMAT + msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+    return JSON_FORMAT + json.dumps(value, default=_tagged_json_default, ensure_ascii=False).encode("utf-8")
+
+
+def decode_value(raw: bytes) -> Any:
+    """Обратное к encode_value; строки без байта формата читаются как JSON"""
+    if raw[:1] == MSGPACK_FORMAT:
+        if not MSGPACK_AVAILABLE:
+            raise ValueError("значение закодировано msgpack, а msgpack не установлен")
+        return msgpack.unpackb(raw[1:], ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+    if raw[:1] == JSON_FORMAT:
+        raw = raw[1:]
+    return json.loads(raw, object_hook=_tagged_json_hook)
+
+
+def _msgpack_default(value: Any):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(EXT_DATETIME, value.isoformat().encode())
+    if isinstance(value, date):
+        return msgpack.ExtType(EXT_DATE, value.isoformat().encode())
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(value).encode())
+    if isinstance(value, uuid.UUID):
+        return msgpack.ExtType(EXT_UUID, value.bytes)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается кэшем")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == EXT_UUID:
+        return uuid.UUID(bytes=data)
+    return msgpack.ExtType(code, data)
+
+
+def _tagged_json_default(value: Any):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    if isinstance(value, uuid.UUID):
+        return {"__uuid__": str(value)}
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается кэшем")
+
+
+def _tagged_json_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        (tag, value), = obj.items()
+        if tag == "__datetime__":
+            return datetime.fromisoformat(value)
+        if tag == "__date__":
+            return date.fromisoformat(value)
+        if tag == "__decimal__":
+            return Decimal(value)
+        if tag == "__uuid__":
+            return uuid.UUID(value)
+    return obj
+
+
+def _json_default(value: Any):
+    """Канонические значения для ключей кэша"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
@@ -8,6 +8,8 @@ import os
 from datetime import datetime
 import structlog
 
+from logging_utils import setup_queue_logging
+
 def setup_logging():
     """Настройка структурированного логирования"""
     
@@ -44,6 +46,9 @@ def setup_logging():
         ]
     )
     
+    # Запись в файл и консоль в фоновом потоке
+    setup_queue_logging()
+    
     # Настройка уровней для разных модулей
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -0,0 +1,32 @@
+"""
+Unit тесты для растеризации и нарезки листов чертежей
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+from services.drawing_renderer import split_page
+
+
+class TestDrawingRenderer:
+    """Unit тесты для drawing_renderer"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_blank_tiles_are_skipped_and_hash_is_stable(self):
+        """Пустые фрагменты сетки пропускаются, одинаковый растр дает одинаковый хеш"""
+        image = Image.new("RGB", (2000, 1000), "white")
+        ImageDraw.Draw(image).line((1200, 100, 1800, 900), fill="black", width=5)
+
+        page = split_page(3, image, tile_size=1000)
+
+        # Обзорный фрагмент листа целиком + правая половина с линией
+        assert [tile.box for tile in page.tiles] == [None, [1000, 0, 2000, 1000]]
+        assert page.page_number == 3
+        assert page.thumbnail[:2] == b"\xff\xd8"
+        assert split_page(3, image.copy(), tile_size=1000).page_hash == page.page_hash
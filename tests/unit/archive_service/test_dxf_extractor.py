@@ -0,0 +1,47 @@
+"""
+Unit тесты для извлечения текста DXF по участкам
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+
+class TestDXFExtractor:
+    """Unit тесты для dxf_extractor"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    @pytest.mark.parametrize("stream_threshold_mb", [20, 0])
+    def test_block_attributes_are_grouped_by_tile(self, tmp_path, monkeypatch, stream_threshold_mb):
+        """Атрибуты вставок блоков попадают в чанк своего участка с bbox, надписи листов - в отдельные чанки"""
+        ezdxf = pytest.importorskip("ezdxf")
+        import dxf_extractor
+        monkeypatch.setattr(dxf_extractor, "STREAM_THRESHOLD_MB", stream_threshold_mb)
+        monkeypatch.setattr(dxf_extractor, "TARGET_ITEMS_PER_TILE", 1)
+
+        doc = ezdxf.new()
+        doc.blocks.new("PUMP").add_attdef("TAG", (0, 2))
+        msp = doc.modelspace()
+        for index, point in enumerate([(0, 100), (100, 100), (0, 0), (100, 0)]):
+            msp.add_blockref("PUMP", point, dxfattribs={"layer": "EQUIP"}).add_auto_attribs({"TAG": f"P-10{index}"})
+        doc.layouts.new("Sheet1").add_text("AI-ENG-PID-001").set_placement((10, 10))
+        path = tmp_path / "pid.dxf"
+        doc.saveas(path)
+
+        drawing = dxf_extractor.extract_dxf_tiles(str(path), "dxf_PID-1_A")
+        model_tiles = {tile["chunk_id"]: tile for tile in drawing["tiles"] if tile["layout"] == "Model"}
+
+        # 4 надписи -> сетка 2x2, участки нумеруются сверху вниз
+        assert model_tiles["dxf_PID-1_A:Model:0_1"]["content"].endswith("EQUIP: PUMP: TAG=P-101")
+        assert model_tiles["dxf_PID-1_A:Model:1_0"]["bbox"] == [0.0, 0.0, 0.0, 0.0]
+        if stream_threshold_mb:
+            assert drawing["extraction_method"] == "readfile"
+            assert any("AI-ENG-PID-001" in tile["content"] for tile in drawing["tiles"] if tile["layout"] == "Sheet1")
+        else:
+            # Поток читает только пространство модели
+            assert drawing["extraction_method"] == "iterdxf"
+            assert drawing["layouts"] == ["Model"]
@@ -0,0 +1,56 @@
+"""
+Unit тесты для потокового извлечения объектов IFC
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+
+class TestIFCExtractor:
+    """Unit тесты для ifc_extractor"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_schema_is_read_from_header(self, tmp_path):
+        """Схема читается из заголовка без загрузки модели"""
+        from ifc_extractor import read_ifc_schema
+
+        path = tmp_path / "model.ifc"
+        path.write_text("ISO-10303-21;\nHEADER;\nFILE_SCHEMA(('IFC2X3'));\nENDSEC;\nDATA;\n#1=IFCPUMP();\n")
+
+        assert read_ifc_schema(str(path)) == "IFC2X3"
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_one_chunk_per_element_with_type_and_own_properties(self, tmp_path):
+        """Свойства типа и объекта собираются по обратному индексу, по чанку на объект"""
+        ifcopenshell = pytest.importorskip("ifcopenshell")
+        import ifcopenshell.guid
+        from ifc_extractor import iter_ifc_elements
+
+        model = ifcopenshell.file(schema="IFC4")
+
+        def property_set(name, prop_name, value):
+            prop = model.createIfcPropertySingleValue(prop_name, None, model.createIfcLabel(value), None)
+            return model.createIfcPropertySet(ifcopenshell.guid.new(), None, name, None, [prop])
+
+        pumps = [model.createIfcPump(ifcopenshell.guid.new(), None, f"P-10{index}") for index in range(2)]
+        pump_type = model.createIfcPumpType(ifcopenshell.guid.new(), None, "API 610", None, None,
+                                            [property_set("Pset_PumpTypeCommon", "Vendor", "Sulzer")])
+        model.createIfcRelDefinesByType(ifcopenshell.guid.new(), None, None, None, pumps, pump_type)
+        model.createIfcRelDefinesByProperties(ifcopenshell.guid.new(), None, None, None, [pumps[0]],
+                                              property_set("Pset_Tag", "Tag", "P-101A"))
+        path = tmp_path / "plant.ifc"
+        model.write(str(path))
+
+        chunks = [chunk for batch in iter_ifc_elements(str(path), "ifc_M-1_A", batch_size=1) for chunk in batch]
+
+        by_name = {chunk["name"]: chunk for chunk in chunks}
+        assert set(by_name) == {"P-100", "P-101"}
+        assert by_name["P-100"]["properties"] == {"Pset_PumpTypeCommon.Vendor": "Sulzer", "Pset_Tag.Tag": "P-101A"}
+        assert by_name["P-101"]["properties"] == {"Pset_PumpTypeCommon.Vendor": "Sulzer"}
+        assert by_name["P-100"]["chunk_id"] == f"ifc_M-1_A:{pumps[0].GlobalId}"
@@ -0,0 +1,255 @@
+"""
+Unit тесты для движка загрузки архивов
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+
+class FakeMinIOService:
+    """Архивы из локальной папки вместо MinIO"""
+
+    def object_source(self):
+        from services.archive_reader import LocalObjectSource
+        return LocalObjectSource()
+
+
+class FakeArchiveService:
+    """Метаданные файлов без обращения к БД"""
+
+    def __init__(self, temp_dir):
+        self.temp_dir = str(temp_dir)
+        self.minio_service = FakeMinIOService()
+
+    def parse_manifest(self, data):
+        from schemas.archive import Manifest
+        return Manifest(**json.loads(data))
+
+    def describe_file(self, relative_path, manifest):
+        return {
+            "doc_no": Path(relative_path).stem,
+            "rev": "A",
+            "doc_type": "SPEC",
+            "discipline": "process",
+            "source_path": relative_path,
+            "confidentiality": "internal",
+            "project_id": manifest.project_id,
+            "object_id": manifest.object_id,
+        }
+
+    def _get_mime_type(self, file_path):
+        return "text/plain" if file_path.endswith(".txt") else "application/octet-stream"
+
+
+class FakeVectorizationService:
+    """Запоминает векторизованные документы"""
+
+    clip_model = None
+
+    def __init__(self):
+        self.sources = []
+
+    async def vectorize_chunks(self, request):
+        self.sources.extend(chunk.metadata.source_path for chunk in request.chunks)
+        return {"points_count": len(request.chunks)}
+
+
+def crashing_parse_member(object_name, member_name, *args):
+    """Разбор в воркере, который один раз завершает процесс посреди файла crash.txt"""
+    from services.ingestion_engine import _parse_member
+
+    marker = Path(os.environ["CRASH_MARKER"])
+    if member_name.endswith("crash.txt") and not marker.exists():
+        marker.touch()
+        os._exit(1)
+    return _parse_member(object_name, member_name, *args)
+
+
+class TestIngestionEngine:
+    """Unit тесты для IngestionEngine"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_crashed_job_resumes_from_checkpoints(self, tmp_path, monkeypatch):
+        """Задание с просроченной арендой продолжается без повторной обработки готовых файлов"""
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'archive.db'}")
+        monkeypatch.setenv("EXTRACTION_CACHE_BACKEND", "none")
+        for name in [name for name in sys.modules if name == "models" or name.startswith("models.")]:
+            monkeypatch.delitem(sys.modules, name)
+        monkeypatch.delitem(sys.modules, "services.ingestion_engine", raising=False)
+
+        from models.database import FileCheckpoint, ProcessingJob, SessionLocal, init_db
+        IngestionEngine = pytest.importorskip("services.ingestion_engine").IngestionEngine
+
+        archive_path = tmp_path / "archive.zip"
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            archive.writestr("manifest.json", json.dumps({
+                "project_id": "P-1", "object_id": "O-1", "phase": "PD", "customer": "Заказчик"
+            }))
+            for index in range(3):
+                archive.writestr(f"spec/doc{index}.txt", f"Насос P-10{index}. Производительность {index} м3/ч.")
+            archive.writestr("spec/big.txt", "Трубопровод DN100. " * 20)
+            archive.writestr("misc/readme.bin", b"\x00\x01")
+
+        init_db()
+        with SessionLocal() as db:
+            # Задание упавшего пода: аренда истекла, первый файл уже обработан
+            db.add(ProcessingJob(
+                job_id="job-1",
+                project_id="P-1",
+                object_id="O-1",
+                job_type="archive_ingest",
+                status="processing",
+                parameters={"archive_path": str(archive_path)},
+                lease_owner="crashed-pod:1",
+                lease_expires_at=datetime.utcnow() - timedelta(minutes=5)
+            ))
+            db.add(FileCheckpoint(job_id="job-1", relative_path="spec/doc0.txt",
+                                  status="done", chunks=1, vectors=1, attempts=1))
+            db.commit()
+
+        vectorization_service = FakeVectorizationService()
+        engine = IngestionEngine(FakeArchiveService(tmp_path / "work"), vectorization_service,
+                                 parse_workers=1, member_memory_limit=100)
+
+        async def scenario():
+            try:
+                assert await engine.resume_pending_jobs() == ["job-1"]
+                await asyncio.gather(*engine._jobs.values())
+            finally:
+                await engine.shutdown()
+
+        asyncio.run(scenario())
+
+        with SessionLocal() as db:
+            job = db.query(ProcessingJob).filter(ProcessingJob.job_id == "job-1").one()
+            statuses = {row.relative_path: row.status for row in db.query(FileCheckpoint).all()}
+
+        # big.txt больше member_memory_limit и разбирается через временный файл
+        assert sorted(vectorization_service.sources) == ["spec/big.txt", "spec/doc1.txt", "spec/doc2.txt"]
+        assert job.status == "completed"
+        assert job.lease_owner is None
+        assert (job.total_files, job.processed_files, job.skipped_files, job.total_vectors) == (5, 4, 1, 4)
+        assert job.progress["files_this_run"] == 3
+        assert job.progress["embed_queue_depth"] == 0 and job.progress["queued_files"] == 0
+        assert statuses["misc/readme.bin"] == "skipped"
+        assert not any((tmp_path / "work" / "spool").iterdir())
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_killed_worker_requeues_files_without_attempt(self, tmp_path, monkeypatch):
+        """Файлы упавшего воркера разбираются в новом пуле, попытка им не засчитывается"""
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'archive.db'}")
+        monkeypatch.setenv("EXTRACTION_CACHE_BACKEND", "none")
+        monkeypatch.setenv("CRASH_MARKER", str(tmp_path / "crashed"))
+        for name in [name for name in sys.modules if name == "models" or name.startswith("models.")]:
+            monkeypatch.delitem(sys.modules, name)
+        monkeypatch.delitem(sys.modules, "services.ingestion_engine", raising=False)
+
+        from models.database import FileCheckpoint, ProcessingJob, SessionLocal, init_db
+        engine_module = pytest.importorskip("services.ingestion_engine")
+        monkeypatch.setattr(engine_module, "_parse_member", crashing_parse_member)
+
+        archive_path = tmp_path / "archive.zip"
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            archive.writestr("manifest.json", json.dumps({
+                "project_id": "P-1", "object_id": "O-1", "phase": "PD", "customer": "Заказчик"
+            }))
+            archive.writestr("spec/crash.txt", "Компрессор K-201. Давление нагнетания 2.5 МПа.")
+            archive.writestr("spec/pump.txt", "Насос P-101. Производительность 100 м3/ч.")
+
+        init_db()
+        with SessionLocal() as db:
+            db.add(ProcessingJob(
+                job_id="job-1",
+                project_id="P-1",
+                object_id="O-1",
+                job_type="archive_ingest",
+                status="pending",
+                parameters={"archive_path": str(archive_path)}
+            ))
+            db.commit()
+
+        # Файл, оставшийся от прерванного процесса, удаляется при создании движка
+        spool = tmp_path / "work" / "spool"
+        (spool / "stale").mkdir(parents=True)
+        (spool / "stale" / "batches.chunks").write_bytes(b"\x00" * 16)
+
+        vectorization_service = FakeVectorizationService()
+        engine = engine_module.IngestionEngine(FakeArchiveService(tmp_path / "work"), vectorization_service,
+                                               parse_workers=1)
+
+        async def scenario():
+            try:
+                return await engine.run_job("job-1")
+            finally:
+                await engine.shutdown()
+
+        result = asyncio.run(scenario())
+
+        with SessionLocal() as db:
+            rows = {row.relative_path: (row.status, row.attempts) for row in db.query(FileCheckpoint).all()}
+
+        assert (tmp_path / "crashed").exists()
+        assert result["failed_files"] == 0
+        assert rows == {"spec/crash.txt": ("done", 1), "spec/pump.txt": ("done", 1)}
+        assert sorted(vectorization_service.sources) == ["spec/crash.txt", "spec/pump.txt"]
+        assert not any(spool.iterdir())
+
+
+class FakeRangedClient:
+    """Объект MinIO в памяти с учетом запрошенных байтов"""
+
+    def __init__(self, data):
+        self.data = data
+        self.requested = 0
+
+    def stat_object(self, bucket_name, object_name):
+        return type("Stat", (), {"size": len(self.data)})()
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0):
+        self.requested += length
+        return FakeResponse(self.data[offset:offset + length])
+
+
+class FakeResponse(io.BytesIO):
+    def release_conn(self):
+        pass
+
+
+class TestArchiveReader:
+    """Unit тесты для потокового чтения архивов"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_member_is_read_by_ranges_and_hashed(self):
+        """Файл архива читается диапазонами без скачивания всего архива, хеш совпадает с содержимым"""
+        archive_reader = pytest.importorskip("services.archive_reader")
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("manifest.json", "{}")
+            archive.writestr("spec/pump.txt", "Насос P-101")
+            archive.writestr("ifc/model.ifc", os.urandom(1024 * 1024), compress_type=zipfile.ZIP_STORED)
+
+        client = FakeRangedClient(buffer.getvalue())
+        reader = archive_reader.RangedObjectReader(client, "archive-documents", "archive.zip")
+        with zipfile.ZipFile(io.BufferedReader(reader, buffer_size=64 * 1024)) as archive:
+            file_hash, content = archive_reader.stream_member(archive, archive.getinfo("spec/pump.txt"))
+
+        assert content == "Насос P-101".encode("utf-8")
+        assert file_hash == hashlib.sha256(content).hexdigest()
+        assert client.requested < len(client.data) / 4
@@ -0,0 +1,77 @@
+"""
+Unit тесты для общего реестра моделей
+"""
+
+import gc
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+from model_registry import ModelRegistry
+
+
+class FakeModel:
+    def encode(self, texts):
+        return [len(text) for text in texts]
+
+
+class TestModelRegistry:
+    """Unit тесты для model_registry"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_model_is_loaded_lazily_once_and_unloaded_with_last_reference(self):
+        """Модель грузится при первом обращении, разделяется ссылками и выгружается с последней"""
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return FakeModel()
+
+        registry = ModelRegistry()
+        first = registry.acquire("bge-m3", loader)
+        second = registry.acquire("bge-m3", loader)
+        assert registry.status() == {"bge-m3": "pending"}
+
+        assert first.encode(["abc"]) == [3]
+        assert second.get() is first.get()
+        assert loads == [1]
+
+        first.release()
+        assert registry.status() == {"bge-m3": "loaded"}
+        del second
+        gc.collect()
+        assert registry.status() == {}
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_warm_up_and_failed_load(self):
+        """Фоновая загрузка заполняет состояние моделей, после ошибки загрузка повторяется не сразу"""
+        calls = []
+
+        def broken():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OSError("нет файла модели")
+            return FakeModel()
+
+        registry = ModelRegistry(retry_seconds=3600)
+        model = registry.acquire("ok", FakeModel)
+        failing = registry.acquire("broken", broken)
+
+        registry.warm_up().join()
+
+        assert registry.status() == {"ok": "loaded", "broken": "failed"}
+        assert model.loaded
+        with pytest.raises(RuntimeError, match="нет файла модели"):
+            failing.get()
+        assert calls == [1]
+
+        # Временная ошибка: по истечении паузы модель загружается заново
+        registry.retry_seconds = 0
+        assert failing.encode(["ab"]) == [2]
+        assert registry.status()["broken"] == "loaded"
+        assert calls == [1, 1]
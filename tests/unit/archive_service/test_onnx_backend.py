@@ -0,0 +1,39 @@
+"""
+Unit тесты для ONNX бэкенда эмбеддингов
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+from onnx_backend import pool, rank_correlation, read_sentence_config
+
+
+class TestOnnxBackend:
+    """Unit тесты для onnx_backend"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_pooling_follows_sentence_transformers_config(self, tmp_path):
+        """CLS пулинг и нормализация читаются из конфигурации модели, паддинг не влияет на mean пулинг"""
+        (tmp_path / "1_Pooling").mkdir()
+        (tmp_path / "1_Pooling" / "config.json").write_text(json.dumps({"pooling_mode_cls_token": True}))
+        (tmp_path / "modules.json").write_text(json.dumps([
+            {"path": "", "type": "sentence_transformers.models.Transformer"},
+            {"path": "1_Pooling", "type": "sentence_transformers.models.Pooling"},
+            {"path": "2_Normalize", "type": "sentence_transformers.models.Normalize"}
+        ]))
+        (tmp_path / "sentence_bert_config.json").write_text(json.dumps({"max_seq_length": 8192}))
+
+        assert read_sentence_config(str(tmp_path)) == ("cls", True, 8192)
+
+        hidden = np.array([[[1.0, 2.0], [3.0, 4.0], [100.0, 100.0]]])
+        mask = np.array([[1, 1, 0]])
+        assert pool(hidden, mask, "cls").tolist() == [[1.0, 2.0]]
+        assert pool(hidden, mask, "mean").tolist() == [[2.0, 3.0]]
+        assert rank_correlation(np.array([0.1, 0.5, 0.9]), np.array([0.2, 0.4, 0.8])) == pytest.approx(1.0)
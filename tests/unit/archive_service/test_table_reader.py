@@ -0,0 +1,70 @@
+"""
+Unit тесты для построчного разбиения таблиц
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "archive-service"))
+
+
+class TestTableRowChunks:
+    """Unit тесты для table_row_chunks"""
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_multilevel_header_is_folded_into_each_row(self):
+        """Двухуровневая шапка с объединенной ячейкой подставляется в каждую строку, по чанку на строку"""
+        table_reader = pytest.importorskip("table_reader")
+
+        table = [
+            ["Поз.", "Наименование", "Характеристики", None, "Кол-во"],
+            [None, None, "Q, м3/ч", "H, м", None],
+            ["P-101", "Насос центробежный", "1 000", "50", "2"],
+            ["P-102", "Насос дозировочный", "0,5", "120", "1"],
+            ["", "", "", "", ""],
+        ]
+
+        chunks = table_reader.table_row_chunks(table, key_prefix="table_BOM-1_A_1_1")
+
+        assert [chunk["row_number"] for chunk in chunks] == [3, 4]
+        assert chunks[0]["content"] == (
+            "Поз.: P-101; Наименование: Насос центробежный; "
+            "Характеристики / Q, м3/ч: 1000; Характеристики / H, м: 50; Кол-во: 2"
+        )
+        assert chunks[1]["numeric"]["Характеристики / Q, м3/ч"] == {"value": 0.5}
+        assert chunks[0]["chunk_id"] == f"table_BOM-1_A_1_1:{chunks[0]['row_hash'][:32]}"
+
+        # Хеш строки не зависит от ее положения в таблице
+        reordered = table_reader.table_row_chunks([table[0], table[1], table[3], table[2]], key_prefix="table_BOM-1_A_1_1")
+        assert {chunk["chunk_id"] for chunk in reordered} == {chunk["chunk_id"] for chunk in chunks}
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_table_without_header_gets_column_names(self):
+        """Если числа есть уже в первой строке, шапки нет и столбцы получают имена col_N"""
+        table_reader = pytest.importorskip("table_reader")
+
+        chunks = table_reader.table_row_chunks([["P-101", "2"], ["P-102", "007"]])
+
+        assert table_reader.detect_header_rows([["P-101", "2"], ["P-102", "007"]]) == 0
+        assert [chunk["row_data"] for chunk in chunks] == [
+            {"col_1": "P-101", "col_2": "2"},
+            {"col_1": "P-102", "col_2": "007"},
+        ]
+
+    @pytest.mark.unit
+    @pytest.mark.archive_service
+    def test_duplicate_rows_keep_separate_chunk_ids(self):
+        """Одинаковые строки дают один row_hash, но разные chunk_id"""
+        table_reader = pytest.importorskip("table_reader")
+
+        table = [["Поз.", "Кол-во"], ["Болт М12", "4"], ["Болт М12", "4"], ["Гайка М12", "4"]]
+        chunks = table_reader.table_row_chunks(table, key_prefix="t")
+
+        assert chunks[0]["row_hash"] == chunks[1]["row_hash"]
+        assert chunks[0]["chunk_id"] == f"t:{chunks[0]['row_hash'][:32]}"
+        assert chunks[1]["chunk_id"] == f"{chunks[0]['chunk_id']}:1"
+        assert len({chunk["chunk_id"] for chunk in chunks}) == 3
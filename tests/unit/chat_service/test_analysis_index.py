@@ -0,0 +1,62 @@
+"""
+Unit тесты для временного индекса анализа документов Chat Service
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+np = pytest.importorskip("numpy")
+
+from services.analysis_index import EphemeralAnalysisIndex
+from services.smart_tokenizer import TokenChunk
+
+
+def _chunk(i: int) -> TokenChunk:
+    return TokenChunk(
+        chunk_id=f"chunk_{i}",
+        text=f"Фрагмент {i}",
+        token_count=2,
+        chunk_type="paragraph",
+        metadata={},
+        start_position=0,
+        end_position=0
+    )
+
+
+class TestEphemeralAnalysisIndex:
+    """Unit тесты для EphemeralAnalysisIndex"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_search_returns_top_k_by_cosine(self):
+        """Результаты упорядочены по косинусному сходству"""
+        chunks = [_chunk(i) for i in range(4)]
+        embeddings = [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7], [-1.0, 0.0]]
+        index = EphemeralAnalysisIndex(chunks, embeddings)
+
+        results = index.search([2.0, 0.1], limit=2)
+
+        assert [chunk.chunk_id for chunk, _ in results] == ["chunk_0", "chunk_2"]
+        assert results[0][1] > results[1][1]
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_search_applies_threshold(self):
+        """Чанки ниже порога сходства отбрасываются"""
+        chunks = [_chunk(i) for i in range(3)]
+        index = EphemeralAnalysisIndex(chunks, [[1.0, 0.0], [0.0, 1.0], [-1.0, 0.0]])
+
+        results = index.search([1.0, 0.0], limit=10, threshold=0.5)
+
+        assert [chunk.chunk_id for chunk, _ in results] == ["chunk_0"]
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_mismatched_embeddings_rejected(self):
+        """Количество эмбеддингов должно совпадать с количеством чанков"""
+        with pytest.raises(ValueError):
+            EphemeralAnalysisIndex([_chunk(0)], [[1.0], [0.0]])
@@ -0,0 +1,45 @@
+"""
+Unit тесты для инкрементального анализа тем разговора
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+from services.conversation_analyzer import ConversationAnalyzer
+
+
+class TestConversationAnalyzer:
+    """Unit тесты для ConversationAnalyzer"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_only_new_messages_are_analyzed(self):
+        """Повторный анализ учитывает только сообщения после курсора"""
+        analyzer = ConversationAnalyzer()
+        session = {"messages": [
+            {"role": "user", "content": "Нужен расчет нагрузки для проекта"},
+            {"role": "assistant", "content": "Загрузите документ с расчетом"},
+        ]}
+
+        first = analyzer.analyze(session)
+        session["messages"] += [
+            {"role": "user", "content": "Теперь проверь файл проекта"},
+            {"role": "assistant", "content": "Готово"},
+        ]
+        second = analyzer.analyze(session)
+
+        assert first["key_topics"] == ["инженерные расчеты", "управление проектами"]
+        assert second["topic_analysis"] == {
+            "cursor": 4,
+            "topic_counts": {
+                "инженерные расчеты": 1,
+                "управление проектами": 2,
+                "работа с документами": 1,
+            },
+        }
+        assert second["key_topics"][0] == "управление проектами"
+        assert session["user_context"]["key_topics"] == second["key_topics"]
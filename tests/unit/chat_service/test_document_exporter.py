@@ -0,0 +1,70 @@
+"""
+Unit тесты для кэша экспорта DocumentExporter
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+from services.document_exporter import DocumentExporter
+
+
+class InlinePool:
+    """Пул, выполняющий построение документа в текущем процессе"""
+
+    def __init__(self):
+        self.renders = 0
+
+    async def run(self, func, *args, timeout=None):
+        self.renders += 1
+        return func(*args)
+
+
+def _session(*contents):
+    return {
+        "messages": [
+            {"role": "user", "content": content, "timestamp": f"2025-01-01T00:0{i}:00Z"}
+            for i, content in enumerate(contents)
+        ],
+        "files": [],
+    }
+
+
+class TestDocumentExporterCache:
+    """Unit тесты для кэширования экспортов"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_cache_hit_and_invalidation(self, tmp_path):
+        """Повторный экспорт берется из кэша, новое сообщение перестраивает документ"""
+        pool = InlinePool()
+        exporter = DocumentExporter(pool=pool, cache_dir=str(tmp_path), max_cached_exports=1)
+        session = _session("Привет!")
+
+        async def scenario():
+            key = exporter.cache_key("s1", session, "docx")
+            first = await exporter.export_to_docx(session, cache_key=key)
+            again = await exporter.export_to_docx(session, cache_key=key)
+            assert again == first and pool.renders == 1
+
+            updated = _session("Привет!", "Расчет насоса")
+            new_key = exporter.cache_key("s1", updated, "docx")
+            rebuilt = await exporter.export_to_docx(updated, cache_key=new_key)
+            assert rebuilt != first and pool.renders == 2
+
+            # Старый файл еще отдается, поэтому не вытесняется сверх лимита
+            assert first.exists()
+            await exporter.release(first)
+            await exporter.release(first)
+            await exporter.release(rebuilt)
+            return first, rebuilt
+
+        first, rebuilt = asyncio.run(scenario())
+
+        assert not first.exists()
+        assert rebuilt.exists()
+        assert not exporter._locks
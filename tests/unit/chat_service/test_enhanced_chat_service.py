@@ -426,9 +426,13 @@ class TestDocumentExporter:
             }
         }
         
-        docx_bytes = await document_exporter.export_to_docx(chat_data)
-        assert isinstance(docx_bytes, bytes)
-        assert len(docx_bytes) > 0
+        docx_path = await document_exporter.export_to_docx(chat_data)
+        assert docx_path.suffix == ".docx"
+        assert docx_path.stat().st_size > 0
+        
+        # Некэшированный экспорт удаляется после отдачи
+        await document_exporter.release(docx_path)
+        assert not docx_path.exists()
     
     @pytest.mark.unit
     @pytest.mark.chat_service
@@ -455,9 +459,13 @@ class TestDocumentExporter:
             }
         }
         
-        pdf_bytes = await document_exporter.export_to_pdf(chat_data)
-        assert isinstance(pdf_bytes, bytes)
-        assert len(pdf_bytes) > 0
+        pdf_path = await document_exporter.export_to_pdf(chat_data)
+        assert pdf_path.suffix == ".pdf"
+        assert pdf_path.stat().st_size > 0
+        
+        # Некэшированный экспорт удаляется после отдачи
+        await document_exporter.release(pdf_path)
+        assert not pdf_path.exists()
 
 class TestSettingsService:
     """Тесты для SettingsService"""
@@ -0,0 +1,103 @@
+"""
+Unit тесты для общего кэша извлечения текста
+"""
+
+import asyncio
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+from extraction_cache import DiskCacheBackend, ExtractionCache, iter_pdf_pages, sha256_bytes
+from text_chunker import TextChunker
+from services.file_processor import FileProcessor
+
+
+class TestExtractionCache:
+    """Unit тесты для ExtractionCache"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_ocr_from_another_service_is_reused(self, tmp_path):
+        """OCR скана, сохраненный другим сервисом, не выполняется повторно"""
+        canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer)
+        pdf.showPage()
+        pdf.save()
+        scan = buffer.getvalue()
+
+        processor = FileProcessor()
+        processor.extraction_cache = ExtractionCache(DiskCacheBackend(tmp_path, max_bytes=1024 * 1024))
+
+        async def no_ocr(file_content):
+            raise AssertionError("OCR не должен выполняться")
+
+        processor._ocr_pdf = no_ocr
+
+        async def scenario():
+            await processor.extraction_cache.put(sha256_bytes(scan), {
+                "pages": [],
+                "page_count": 1,
+                "text_method": "none",
+                "metadata": {"title": "", "author": "", "creator": ""},
+                "tables": [],
+                "ocr_pages": [[1, "Спецификация насосного оборудования"]],
+            })
+            return await processor.process_file(scan, "scan.pdf")
+
+        result = asyncio.run(scenario())
+
+        assert result["success"]
+        assert result["content"]["has_ocr"]
+        assert "Спецификация насосного оборудования" in result["content"]["text"]
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_size_limit_evicts_least_recently_used(self, tmp_path):
+        """При превышении лимита удаляются давно не читавшиеся записи"""
+        cache = ExtractionCache(DiskCacheBackend(tmp_path, max_bytes=3000))
+        hashes = [f"{index:064x}" for index in range(6)]
+
+        async def scenario():
+            for content_hash in hashes[:3]:
+                await cache.put(content_hash, {"text": os.urandom(600).hex()})
+            await asyncio.sleep(0.01)
+            assert await cache.get(hashes[0]) is not None
+            for content_hash in hashes[3:]:
+                await asyncio.sleep(0.01)
+                await cache.put(content_hash, {"text": os.urandom(600).hex()})
+            return [await cache.get(content_hash) is not None for content_hash in hashes]
+
+        present = asyncio.run(scenario())
+        total = sum(path.stat().st_size for path in tmp_path.rglob("*") if path.is_file())
+
+        assert total <= 3000
+        assert present[0] and present[-1]
+        assert not present[1]
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_pages_keep_numbers_through_chunking(self):
+        """Страницы сканов берутся из OCR, номера страниц доходят до чанков"""
+        record = {
+            "pages": [[1, "Насос центробежный. " * 40]],
+            "page_count": 3,
+            "page_sizes": [[595.0, 842.0]] * 3,
+            "tables": [{"page": 2, "table": 1, "data": [["Поз", "Кол"]], "bbox": [10.0, 20.0, 300.0, 60.0]}],
+            "ocr_pages": [[3, "Штамп чертежа"]],
+        }
+
+        pages = list(iter_pdf_pages(record))
+        chunks = list(TextChunker(max_tokens=50, overlap_tokens=0).iter_page_chunks(
+            ((page.page_number, page.text) for page in pages if page.text), "doc"
+        ))
+
+        assert [(page.page_number, page.ocr, len(page.tables)) for page in pages] == [(1, False, 0), (2, False, 1), (3, True, 0)]
+        assert pages[0].bbox == [0.0, 0.0, 595.0, 842.0]
+        assert {chunk.page for chunk in chunks} == {1, 3}
+        assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
@@ -0,0 +1,78 @@
+"""
+Unit тесты для параллельной обработки вложений FileProcessor
+"""
+
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+from starlette.datastructures import UploadFile
+
+from services.file_processor import FileProcessor
+
+
+class TestFileProcessorUploads:
+    """Unit тесты для FileProcessor.process_uploads"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_duplicate_uploads_are_extracted_once(self):
+        """Одинаковые по содержимому файлы разбираются один раз, порядок результатов сохраняется"""
+        processor = FileProcessor()
+        extracted = []
+        process_file = processor.process_file
+
+        async def counting_process_file(content, filename):
+            extracted.append(filename)
+            return await process_file(content, filename)
+
+        processor.process_file = counting_process_file
+        spec = "Спецификация насосного оборудования. ".encode() * 20
+        uploads = [
+            UploadFile(io.BytesIO(spec), filename="spec.txt"),
+            UploadFile(io.BytesIO(b"Other content " * 20), filename="other.txt"),
+            UploadFile(io.BytesIO(spec), filename="spec_copy.txt"),
+        ]
+
+        async def scenario():
+            first = await processor.process_uploads(uploads)
+            again = await processor.process_uploads([UploadFile(io.BytesIO(spec), filename="spec_again.txt")])
+            return first, again
+
+        first, again = asyncio.run(scenario())
+
+        assert [result["filename"] for result in first] == ["spec.txt", "other.txt", "spec_copy.txt"]
+        assert all(result["success"] for result in first)
+        # Какая из двух копий разбирается первой, зависит от порядка чтения загрузок
+        assert len(extracted) == 2 and "other.txt" in extracted
+        assert first[0]["from_cache"] != first[2]["from_cache"]
+        assert again[0]["from_cache"]
+        assert again[0]["file_hash"] == first[0]["file_hash"]
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_failed_extraction_is_retried_by_waiting_uploads(self):
+        """После неудачного разбора ожидавшие загрузки разбирают файл сами, без KeyError"""
+        processor = FileProcessor()
+        attempts = []
+
+        async def failing_process_file(content, filename):
+            attempts.append(filename)
+            await asyncio.sleep(0.01)
+            return {"success": False, "filename": filename, "error": "Ошибка разбора"}
+
+        processor.process_file = failing_process_file
+        spec = "Спецификация насосного оборудования. ".encode() * 20
+        uploads = [UploadFile(io.BytesIO(spec), filename=f"spec_{i}.txt") for i in range(3)]
+
+        results = asyncio.run(processor.process_uploads(uploads))
+
+        assert [result["filename"] for result in results] == ["spec_0.txt", "spec_1.txt", "spec_2.txt"]
+        assert not any(result["success"] for result in results)
+        assert sorted(attempts) == ["spec_0.txt", "spec_1.txt", "spec_2.txt"]
+        assert not processor._extractions_in_progress
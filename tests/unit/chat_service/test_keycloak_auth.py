@@ -0,0 +1,67 @@
+"""
+Unit тесты для кэша ключей и токенов KeycloakAuthService
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("jose")
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from services.keycloak_auth import KeycloakAuthService
+
+
+class TestKeycloakAuthService:
+    """Unit тесты для KeycloakAuthService"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_keys_and_tokens_are_cached(self):
+        """JWKS загружается один раз, неизвестный kid не вызывает шквал запросов"""
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        public_jwk = jwk.construct(private_key, "RS256").public_key().to_dict()
+        public_jwk.update(kid="key-1", use="sig")
+        requests = []
+
+        def handler(request):
+            requests.append(request.url.path)
+            if request.url.path.endswith("openid-configuration"):
+                return httpx.Response(200, json={"jwks_uri": "http://keycloak/certs"})
+            return httpx.Response(200, json={"keys": [public_jwk]})
+
+        async def scenario():
+            service = KeycloakAuthService()
+            service._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            await service.initialize()
+            claims = {
+                "sub": "user-1",
+                "aud": service.client_id,
+                "iss": f"{service.keycloak_url}/realms/{service.realm}",
+                "exp": int(time.time()) + 60,
+            }
+            token = jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "key-1"})
+            unknown = jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "key-2"})
+
+            results = [await service.verify_token(token) for _ in range(3)]
+            rejected = [await service.verify_token(unknown) for _ in range(3)]
+            await service.close()
+            return results, rejected
+
+        results, rejected = asyncio.run(scenario())
+
+        assert all(result["sub"] == "user-1" for result in results)
+        assert rejected == [None, None, None]
+        assert requests.count("/certs") == 1
@@ -0,0 +1,135 @@
+"""
+Unit тесты для умного токенизатора Chat Service
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / "services" / "chat-service"))
+
+from services import keyword_matcher
+from services.keyword_matcher import KeywordMatcher
+from services.smart_tokenizer import SmartTokenizer
+from services.token_counter import TokenCounter
+
+
+DOCUMENT = """СП 48.13330 Организация строительства
+
+1. Общие положения
+Настоящий свод правил   должен применяться при строительстве зданий и сооружений.
+
+2. Термины и определения
+Под строительством понимается процесс возведения зданий и сооружений.
+"""
+
+
+class TestSmartTokenizer:
+    """Unit тесты для SmartTokenizer"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_sections_and_chunk_positions(self):
+        """Разделы находятся по строкам, позиции чанков указывают на их текст"""
+        tokenizer = SmartTokenizer(token_counter=TokenCounter(model_name=None))
+        chunks, structure = asyncio.run(tokenizer.tokenize_document(DOCUMENT, "sp.pdf"))
+
+        assert [section['title'] for section in structure.sections] == [
+            "1. Общие положения",
+            "2. Термины и определения",
+        ]
+        assert structure.sections[0]['start_line'] == 2
+
+        cleaned = tokenizer._preprocess_text(DOCUMENT)
+        for chunk in chunks:
+            assert cleaned[chunk.start_position:chunk.end_position] == chunk.text
+
+        types = {chunk.parent_section: chunk.chunk_type for chunk in chunks}
+        assert types["1. Общие положения"] == "requirement"
+        assert types["2. Термины и определения"] == "definition"
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_large_block_split_with_overlap(self):
+        """Большой блок режется по предложениям с перекрытием и без потери текста"""
+        tokenizer = SmartTokenizer(token_counter=TokenCounter(model_name=None))
+        tokenizer.max_chunk_size = 50
+        tokenizer.overlap_size = 5
+        text = " ".join(f"Предложение номер {i} про монтаж." for i in range(60))
+
+        chunks, _ = asyncio.run(tokenizer.tokenize_document(text))
+
+        assert len(chunks) > 1
+        assert all(chunk.token_count <= 50 for chunk in chunks)
+        assert chunks[0].start_position == 0
+        assert chunks[-1].end_position == len(text)
+        for previous, current in zip(chunks, chunks[1:]):
+            assert current.start_position < previous.end_position
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_chunks_fit_model_window(self):
+        """Размер чанков считается токенизатором модели и не превышает ее окно"""
+        tokenizers = pytest.importorskip("tokenizers")
+        transformers = pytest.importorskip("transformers")
+
+        words = [f"слово{i}" for i in range(100)] + ["."]
+        backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(
+            {word: i for i, word in enumerate(["[UNK]"] + words)}, unk_token="[UNK]"
+        ))
+        backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+        model_tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, model_max_length=40)
+        counter = TokenCounter(tokenizer=model_tokenizer)
+        tokenizer = SmartTokenizer(token_counter=counter)
+        text = " ".join(f"слово{i}." if i % 7 == 6 else f"слово{i}" for i in range(100))
+
+        chunks, _ = asyncio.run(tokenizer.tokenize_document(text))
+
+        assert len(chunks) > 1
+        for chunk in chunks:
+            assert chunk.token_count == counter.count(chunk.text) <= 40
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_chunk_ids_are_deterministic(self):
+        """Повторная токенизация того же текста дает те же ID чанков"""
+        first, _ = asyncio.run(SmartTokenizer(token_counter=TokenCounter(model_name=None)).tokenize_document(DOCUMENT))
+        second, _ = asyncio.run(SmartTokenizer(token_counter=TokenCounter(model_name=None)).tokenize_document(DOCUMENT))
+        changed, _ = asyncio.run(SmartTokenizer(token_counter=TokenCounter(model_name=None)).tokenize_document(DOCUMENT + "\nДополнение."))
+
+        ids = [chunk.chunk_id for chunk in first]
+        assert ids == [chunk.chunk_id for chunk in second]
+        assert len(set(ids)) == len(ids)
+        assert not set(ids) & {chunk.chunk_id for chunk in changed}
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_calibrated_estimate_keeps_margin(self):
+        """После калибровки оценка остается не ниже точного подсчета"""
+        def word_tokenizer(texts, **kwargs):
+            return {'input_ids': [text.split() for text in texts]}
+
+        counter = TokenCounter(tokenizer=word_tokenizer)
+        text = " ".join(f"слово{i}" for i in range(50))
+
+        exact = counter.count(text)
+
+        assert counter.chars_per_token < len(text) / exact
+        assert counter.estimate(text) >= exact
+
+
+class TestKeywordMatcher:
+    """Unit тесты для KeywordMatcher"""
+
+    @pytest.mark.unit
+    @pytest.mark.chat_service
+    def test_regex_fallback_matches_overlapping_keywords(self, monkeypatch):
+        """Без pyahocorasick находятся все, в том числе перекрывающиеся, вхождения"""
+        monkeypatch.setattr(keyword_matcher, "AHOCORASICK_AVAILABLE", False)
+        matcher = KeywordMatcher(["требование", "требования", "ования", "норма"])
+
+        counts = matcher.count("требования и нормативы")
+
+        assert counts == {"требования": 1, "ования": 1, "норма": 1}
@@ -0,0 +1,69 @@
+"""
+Unit тесты для двухуровневого кэша TechExpert Connector
+"""
+
+import asyncio
+import importlib.util
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+MODULE_PATH = Path(__file__).parent.parent.parent.parent / "services" / "techexpert-connector" / "services" / "cache_service.py"
+spec = importlib.util.spec_from_file_location("techexpert_cache_service", MODULE_PATH)
+cache_service = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cache_service)
+
+
+class TestCacheService:
+    """Unit тесты для CacheService (без Redis - только L1)"""
+
+    @pytest.mark.unit
+    def test_concurrent_misses_share_one_load_and_stale_value_is_refreshed_in_background(self):
+        """Одновременные промахи ждут одну загрузку; устаревшее значение отдается сразу и обновляется один раз"""
+        cache = cache_service.CacheService()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"version": len(calls)}
+
+        async def scenario():
+            results = await asyncio.gather(*[cache.get_or_set("search:x", load, ttl=60, stale_ttl=60) for _ in range(20)])
+            assert results == [{"version": 1}] * 20
+
+            # TTL истек, окно устаревания - нет
+            value, fresh_until, stale_until = cache.memory_cache["search:x"]
+            cache.memory_cache["search:x"] = (value, 0, stale_until)
+            stale = await asyncio.gather(*[cache.get_or_set("search:x", load, ttl=60, stale_ttl=60) for _ in range(5)])
+            assert stale == [{"version": 1}] * 5
+            await asyncio.sleep(0.05)
+            return await cache.get("search:x")
+
+        assert asyncio.run(scenario()) == {"version": 2}
+        assert len(calls) == 2
+
+    @pytest.mark.unit
+    def test_keys_are_canonical_memory_is_bounded_and_types_survive_encoding(self, monkeypatch):
+        """Ключ не зависит от порядка полей, L1 вытесняет старые ключи, типы сохраняются при кодировании"""
+        make_key = cache_service.CacheService.make_key
+        assert make_key("search", {"query": "ГОСТ", "limit": 10}) == make_key("search", {"limit": 10, "query": "ГОСТ"})
+        assert make_key("search", {"query": "ГОСТ"}) != make_key("search", {"query": "СП"})
+
+        monkeypatch.setenv("TECHEXPERT_CACHE_L1_SIZE", "2")
+        cache = cache_service.CacheService()
+
+        async def fill():
+            for key in ("a", "b", "c"):
+                await cache.set(key, key)
+            return [await cache.get(key) for key in ("a", "b", "c")]
+
+        assert asyncio.run(fill()) == [None, "b", "c"]
+
+        value = {"issued_at": datetime(2024, 5, 1, 12, 30), "price": Decimal("12.50"), "tags": ["a"]}
+        assert cache_service.decode_value(cache_service.encode_value(value)) == value
+        monkeypatch.setattr(cache_service, "MSGPACK_AVAILABLE", False)
+        assert cache_service.decode_value(cache_service.encode_value(value)) == value
+        assert cache_service.decode_value(b'{"legacy": 1}') == {"legacy": 1}
@@ -0,0 +1,54 @@
+"""
+Unit тесты для логирования через очередь
+"""
+
+import importlib.util
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+MODULE_PATH = Path(__file__).parent.parent.parent.parent / "services" / "techexpert-connector" / "logging_utils.py"
+spec = importlib.util.spec_from_file_location("techexpert_logging_utils", MODULE_PATH)
+logging_utils = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(logging_utils)
+
+
+class ListHandler(logging.Handler):
+    """Сохраняет отформатированные записи"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class TestQueueLogging:
+    """Unit тесты для setup_queue_logging"""
+
+    @pytest.mark.unit
+    def test_exception_field_survives_queue(self):
+        """JSON запись, прошедшая очередь, содержит поле exception, а message - только текст"""
+        logger = logging.getLogger("test_queue_logging")
+        logger.propagate = False
+        handler = ListHandler()
+        handler.setFormatter(logging_utils.StructuredFormatter())
+        logger.addHandler(handler)
+
+        listener = logging_utils.setup_queue_logging(logger)
+        try:
+            try:
+                raise ValueError("сбой")
+            except ValueError:
+                logger.error("boom %s", "ошибка", exc_info=True)
+        finally:
+            listener.stop()
+            logging_utils._queue_listeners.remove(listener)
+            logger.handlers.clear()
+
+        entry = json.loads(handler.lines[0])
+        assert entry["message"] == "boom ошибка"
+        assert "ValueError: сбой" in entry["exception"]
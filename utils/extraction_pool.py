@@ -0,0 +1,122 @@
+"""
+Ограниченный пул процессов для CPU-ёмкого извлечения (парсинг файлов, OCR)
+
+Задачи выполняются вне event loop, количество задач в работе ограничено
+семафором. Зависший воркер нельзя прервать иначе, чем вместе с пулом:
+пул с зависшим воркером выводится из работы, новые задачи идут в новый
+пул, а старый останавливается, когда завершатся остальные его задачи.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class ExtractionTimeoutError(TimeoutError):
+    """Задача извлечения не уложилась в отведенное время"""
+    pass
+
+class ExtractionPool:
+    """Ограниченный пул процессов с перезапуском при зависании или падении воркера"""
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None, name: str = "извлечения"):
+        """
+        Args:
+            max_workers: Количество процессов (по умолчанию CPU - 1)
+            max_pending: Предельное количество задач в работе (по умолчанию 2 на процесс)
+            name: Назначение пула для журнала
+        """
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_pending = max_pending or self.max_workers * 2
+        self.name = name
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Задачи в работе по пулам и выведенные из работы пулы
+        self._futures: Dict[ProcessPoolExecutor, Set[asyncio.Future]] = {}
+        self._retired: Set[ProcessPoolExecutor] = set()
+        self._drain_tasks: Set[asyncio.Task] = set()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"⚙️ Запущен пул {self.name} на {self.max_workers} процессов")
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._semaphore
+
+    def _retire(self, executor: ProcessPoolExecutor, timeout: float):
+        """Вывод пула с зависшим воркером из работы без прерывания чужих задач"""
+        if self._executor is executor:
+            self._executor = None
+        if executor in self._retired:
+            return
+        self._retired.add(executor)
+
+        pending = [future for future in self._futures.pop(executor, set()) if not future.done()]
+        task = asyncio.get_running_loop().create_task(self._drain(executor, pending, timeout))
+        self._drain_tasks.add(task)
+        task.add_done_callback(self._drain_tasks.discard)
+        logger.warning(f"♻️ Пул {self.name} перезапускается, задач в старом пуле: {len(pending)}")
+
+    async def _drain(self, executor: ProcessPoolExecutor, pending: List[asyncio.Future], timeout: float):
+        """Остановка выведенного пула после завершения его задач (не дольше таймаута задачи)"""
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        _terminate(executor)
+        self._retired.discard(executor)
+
+    async def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """
+        Выполнение функции в пуле процессов
+
+        Args:
+            func: Функция уровня модуля (должна сериализоваться pickle)
+            *args: Аргументы функции
+            timeout: Таймаут выполнения в секундах
+
+        Returns:
+            Результат функции
+        """
+        async with self._get_semaphore():
+            for attempt in range(2):
+                loop = asyncio.get_running_loop()
+                executor = self._get_executor()
+                future = loop.run_in_executor(executor, func, *args)
+                futures = self._futures.setdefault(executor, set())
+                futures.add(future)
+                future.add_done_callback(futures.discard)
+                try:
+                    return await asyncio.wait_for(future, timeout=timeout)
+                except asyncio.TimeoutError:
+                    self._retire(executor, timeout)
+                    raise ExtractionTimeoutError(f"Превышено время {self.name} ({timeout:g}s)")
+                except BrokenProcessPool:
+                    # Пул сломан (воркер упал) — повторяем один раз в новом пуле
+                    if self._executor is executor:
+                        self._executor = None
+                    if attempt:
+                        raise
+
+    def shutdown(self):
+        """Остановка пула вместе с зависшими процессами"""
+        if self._executor is not None:
+            _terminate(self._executor)
+            self._executor = None
+        for executor in list(self._retired):
+            _terminate(executor)
+        self._retired.clear()
+
+def _terminate(executor: ProcessPoolExecutor):
+    """Остановка пула с принудительной остановкой зависших процессов"""
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
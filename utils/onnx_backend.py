@@ -0,0 +1,330 @@
+"""
+Инференс эмбеддингов и реранкеров на CPU через ONNX Runtime с int8 квантованием
+
+Модель один раз экспортируется в ONNX (optimum) и квантуется динамически:
+веса хранятся в int8, активации квантуются на лету. Результат кешируется в
+ONNX_CACHE_DIR и переиспользуется всеми процессами. OnnxSentenceEncoder и
+OnnxCrossEncoder повторяют интерфейс SentenceTransformer.encode и
+CrossEncoder.predict, сервисы переключаются через MODEL_VARIANT=onnx
+(см. model_registry) без изменений кода. Пулинг, нормализация и длина
+последовательности берутся из конфигурации sentence-transformers модели.
+
+Сравнение точности и скорости с torch на вопросах golden датасета
+(из корня репозитория):
+
+    python utils/onnx_backend.py --model BAAI/bge-m3 --fixtures tests/golden_questions_rag.json
+    python utils/onnx_backend.py --model BAAI/bge-reranker-v2-m3 --cross-encoder --fixtures tests/golden_questions_rag.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+    logging.warning("onnxruntime или optimum не установлены, ONNX бэкенд недоступен")
+
+logger = logging.getLogger(__name__)
+
+# Каталог экспортированных и квантованных моделей
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join(Path.home(), ".cache", "onnx-models"))
+
+# Потоков ONNX Runtime на один вызов модели, 0 - по числу ядер
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+QUANTIZED_FILE = "model_quantized.onnx"
+
+FEATURE_EXTRACTION = "feature-extraction"
+TEXT_CLASSIFICATION = "text-classification"
+
+
+class OnnxSentenceEncoder:
+    """Квантованная модель эмбеддингов с интерфейсом SentenceTransformer.encode"""
+
+    def __init__(self, name: str, threads: int = ONNX_THREADS):
+        source = _model_path(name)
+        target = export_quantized(name, FEATURE_EXTRACTION)
+        self.name = name
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            target, file_name=QUANTIZED_FILE, session_options=_session_options(threads)
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(target)
+        self.pooling, self.normalize, self.max_seq_length = read_sentence_config(source, self.tokenizer.model_max_length)
+
+    def encode(self, sentences: Union[str, Sequence[str]], batch_size: int = 32,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Эмбеддинги текстов (для одной строки - вектор); convert_to_tensor и прочие опции torch игнорируются"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        # Пакеты из текстов близкой длины: меньше паддинга
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            features = self.tokenizer(
+                [texts[i] for i in indexes], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            hidden = self.model(**features).last_hidden_state
+            pooled = pool(np.asarray(hidden), features["attention_mask"], self.pooling)
+            if self.normalize or normalize_embeddings:
+                pooled = pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(min=1e-12)
+            for i, embedding in zip(indexes, pooled):
+                embeddings[i] = embedding
+
+        result = np.stack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        return result[0] if single else result
+
+
+class OnnxCrossEncoder:
+    """Квантованный реранкер с интерфейсом CrossEncoder.predict"""
+
+    def __init__(self, name: str, threads: int = ONNX_THREADS):
+        target = export_quantized(name, TEXT_CLASSIFICATION)
+        self.name = name
+        self.model = ORTModelForSequenceClassification.from_pretrained(
+            target, file_name=QUANTIZED_FILE, session_options=_session_options(threads)
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(target)
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+
+    def predict(self, sentences: Sequence[Sequence[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """Оценки пар (запрос, текст); при одной метке - сигмоида, как у CrossEncoder"""
+        pairs = list(sentences)
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            features = self.tokenizer(
+                [pair[0] for pair in batch], [pair[1] for pair in batch], padding=True,
+                truncation="longest_first", max_length=self.max_length, return_tensors="np"
+            )
+            logits = np.asarray(self.model(**features).logits)
+            scores.append(1 / (1 + np.exp(-logits[:, 0])) if logits.shape[1] == 1 else logits)
+
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+def export_quantized(name: str, task: str) -> str:
+    """
+    Каталог модели, экспортированной в ONNX и квантованной в int8
+
+    Экспорт выполняется один раз: во временный каталог, затем переименованием,
+    поэтому параллельно стартующие процессы не видят недописанную модель.
+    """
+    target = Path(ONNX_CACHE_DIR) / name.replace("/", "--") / task
+    if (target / QUANTIZED_FILE).exists():
+        return str(target)
+
+    started = time.monotonic()
+    source = _model_path(name)
+    model_class = ORTModelForFeatureExtraction if task == FEATURE_EXTRACTION else ORTModelForSequenceClassification
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(prefix=f".{task}-", dir=target.parent))
+    try:
+        model_class.from_pretrained(source, export=True).save_pretrained(work_dir)
+        AutoTokenizer.from_pretrained(source).save_pretrained(work_dir)
+        ORTQuantizer.from_pretrained(work_dir).quantize(
+            save_dir=work_dir,
+            quantization_config=_quantization_config(),
+            # Модели больше 2 ГБ (bge-m3) хранят веса отдельно от графа
+            use_external_data_format=any(work_dir.glob("*.onnx_data"))
+        )
+        try:
+            work_dir.rename(target)
+        except OSError:
+            # Модель уже экспортировал другой процесс
+            if not (target / QUANTIZED_FILE).exists():
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.info(f"Модель {name} экспортирована в ONNX int8 за {time.monotonic() - started:.0f} с: {target}")
+    return str(target)
+
+
+def read_sentence_config(model_path: str, model_max_length: int = 512) -> Tuple[str, bool, int]:
+    """Пулинг ("cls" или "mean"), нормализация и максимальная длина из конфигурации sentence-transformers"""
+    path = Path(model_path)
+    pooling = "mean"
+    normalize = False
+    max_seq_length = min(model_max_length, 512)
+
+    modules_file = path / "modules.json"
+    if modules_file.exists():
+        modules = json.loads(modules_file.read_text(encoding="utf-8"))
+        normalize = any(module.get("type", "").endswith("Normalize") for module in modules)
+        for module in modules:
+            if module.get("type", "").endswith("Pooling"):
+                pooling_file = path / module.get("path", "") / "config.json"
+                if pooling_file.exists():
+                    config = json.loads(pooling_file.read_text(encoding="utf-8"))
+                    if config.get("pooling_mode_cls_token"):
+                        pooling = "cls"
+
+    config_file = path / "sentence_bert_config.json"
+    if config_file.exists():
+        max_seq_length = json.loads(config_file.read_text(encoding="utf-8")).get("max_seq_length") or max_seq_length
+
+    return pooling, normalize, max_seq_length
+
+
+def pool(hidden: np.ndarray, attention_mask: np.ndarray, pooling: str) -> np.ndarray:
+    """Вектор текста из выходов последнего слоя"""
+    if pooling == "cls":
+        return hidden[:, 0]
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    return (hidden * mask).sum(axis=1) / mask.sum(axis=1).clip(min=1e-9)
+
+
+def benchmark(name: str, texts: Sequence[str], cross_encoder: bool = False,
+              batch_size: int = 32, repeat: int = 3) -> Dict[str, Any]:
+    """
+    Сравнение ONNX int8 с torch: скорость и расхождение результатов
+
+    Для эмбеддингов - косинус между векторами двух бэкендов и совпадение
+    5 ближайших соседей каждого текста; для реранкера - ранговая корреляция
+    оценок и максимальное расхождение.
+    """
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+
+    if cross_encoder:
+        # Каждый текст как запрос с 16 кандидатами, как при реранкинге выдачи
+        inputs = [[texts[i], texts[(i + j) % len(texts)]] for i in range(len(texts)) for j in range(1, min(len(texts), 17))]
+        backends = {"torch": CrossEncoder(name), "onnx": OnnxCrossEncoder(name)}
+        run = {key: (lambda model: lambda: np.asarray(model.predict(inputs, batch_size=batch_size)))(model)
+               for key, model in backends.items()}
+    else:
+        inputs = list(texts)
+        backends = {"torch": SentenceTransformer(name), "onnx": OnnxSentenceEncoder(name)}
+        run = {key: (lambda model: lambda: np.asarray(model.encode(inputs, batch_size=batch_size)))(model)
+               for key, model in backends.items()}
+
+    outputs = {}
+    report: Dict[str, Any] = {"model": name, "inputs": len(inputs)}
+    for key, call in run.items():
+        outputs[key] = call()  # прогрев
+        started = time.perf_counter()
+        for _ in range(repeat):
+            call()
+        seconds = (time.perf_counter() - started) / repeat
+        report[f"{key}_seconds"] = round(seconds, 3)
+        report[f"{key}_per_second"] = round(len(inputs) / seconds, 1) if seconds else None
+    report["speedup"] = round(report["torch_seconds"] / report["onnx_seconds"], 2) if report["onnx_seconds"] else None
+
+    reference, quantized = outputs["torch"], outputs["onnx"]
+    if cross_encoder:
+        report["spearman"] = round(rank_correlation(reference, quantized), 4)
+        report["max_abs_diff"] = round(float(np.abs(reference - quantized).max()), 4)
+    else:
+        reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+        quantized = quantized / np.linalg.norm(quantized, axis=1, keepdims=True)
+        cosine = (reference * quantized).sum(axis=1)
+        report["cosine_mean"] = round(float(cosine.mean()), 4)
+        report["cosine_min"] = round(float(cosine.min()), 4)
+        report["top5_overlap"] = round(_neighbour_overlap(reference, quantized, 5), 4)
+
+    return report
+
+
+def load_fixture_texts(path: str) -> List[str]:
+    """Вопросы golden датасета RAG, их ключевые слова и ожидаемые источники"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    texts = []
+    for category in data.get("categories", {}).values():
+        for question in category.get("questions", []):
+            texts.append(question["question"])
+            texts.append(", ".join(question.get("expected_keywords", [])))
+            texts.extend(question.get("expected_sources", []))
+    return list(dict.fromkeys(text for text in texts if text))
+
+
+def rank_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """Ранговая корреляция Спирмена (без учета связанных рангов)"""
+    ranks_a = np.argsort(np.argsort(a)).astype(float)
+    ranks_b = np.argsort(np.argsort(b)).astype(float)
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def _neighbour_overlap(reference: np.ndarray, quantized: np.ndarray, k: int) -> float:
+    k = min(k, len(reference) - 1)
+    if k <= 0:
+        return 1.0
+
+    def neighbours(vectors):
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, -np.inf)
+        return np.argsort(-similarity, axis=1)[:, :k]
+
+    overlaps = [len(set(x) & set(y)) / k for x, y in zip(neighbours(reference), neighbours(quantized))]
+    return float(np.mean(overlaps))
+
+
+def _model_path(name: str) -> str:
+    """Локальный каталог модели (скачивается с Hugging Face Hub при необходимости)"""
+    if os.path.isdir(name):
+        return name
+    from huggingface_hub import snapshot_download
+    return snapshot_download(name)
+
+
+def _session_options(threads: int):
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+    return options
+
+
+def _quantization_config():
+    """Динамическое int8 квантование под набор инструкций процессора"""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        flags = ""
+    if "avx512_vnni" in flags:
+        return AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    return AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Сравнение ONNX int8 и torch бэкендов")
+    parser.add_argument("--model", required=True, help="Имя модели Hugging Face или локальный каталог")
+    parser.add_argument("--cross-encoder", action="store_true", help="Модель - реранкер CrossEncoder")
+    parser.add_argument("--fixtures", required=True, help="Golden датасет RAG (tests/golden_questions_rag.json)")
+    parser.add_argument("--texts", help="Дополнительные тексты, по одному в строке")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fixture_texts = load_fixture_texts(args.fixtures)
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            fixture_texts.extend(line.strip() for line in f if line.strip())
+
+    print(json.dumps(
+        benchmark(args.model, fixture_texts, args.cross_encoder, args.batch_size, args.repeat),
+        ensure_ascii=False, indent=2
+    ))